@@ -0,0 +1,279 @@
+"""
+API Key Authentication Cache for the External ERP API
+- TTL cache of hashed API key -> company auth snapshot (no DB query per request)
+- Coalesced api_last_used / api_calls_today writes, flushed to the database periodically
+"""
+import os
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, date
+from typing import Awaitable, Dict, Optional, Callable, Tuple
+
+from sqlalchemy import update, case, func
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache, detached_copy
+from ip_allowlist import CompiledAllowlist, compile_allowlist
+from database.models import Company
+
+logger = logging.getLogger("efris_api")
+
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "60"))  # seconds
+API_USAGE_FLUSH_SECONDS = float(os.getenv("API_USAGE_FLUSH_SECONDS", "30"))
+
+
+def hash_api_key(api_key: str) -> str:
+    """Cache key for an API key - raw keys are never used as dict keys"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class ApiKeyAuth:
+    """Everything the external API needs to authenticate a request"""
+    company_id: int
+    tin: str
+    device_no: Optional[str]
+    api_enabled: bool
+    is_active: bool
+    allowed_ips: Optional[str]
+    api_rate_limit: int
+    ip_allowlist: CompiledAllowlist = field(repr=False, compare=False)
+    company: Company = field(repr=False, compare=False)
+
+    @classmethod
+    def from_company(cls, company: Company) -> "ApiKeyAuth":
+        return cls(
+            company_id=company.id,
+            tin=company.tin,
+            device_no=company.device_no,
+            api_enabled=bool(company.api_enabled),
+            is_active=bool(company.is_active),
+            allowed_ips=company.allowed_ips,
+            api_rate_limit=company.api_rate_limit or 1000,
+            ip_allowlist=compile_allowlist(company.allowed_ips),
+            company=detached_copy(company),
+        )
+
+    def attach(self, db: Session) -> Company:
+        """Company instance bound to the request session - no SELECT is emitted"""
+        return db.merge(self.company, load=False)
+
+
+class ApiKeyAuthCache:
+    """Hashed API key -> ApiKeyAuth, with invalidation by company id"""
+
+    def __init__(self, ttl_seconds: float = API_KEY_CACHE_TTL):
+        self._cache = TTLCache(ttl_seconds)
+        self._keys_by_company: Dict[int, set] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, api_key: str, loader: Callable[[], Optional[Company]]) -> Optional[ApiKeyAuth]:
+        """Return the auth snapshot for an API key, calling loader() on a cache miss"""
+        key_hash = hash_api_key(api_key)
+
+        def load():
+            company = loader()
+            if company is None:
+                return None
+            auth = ApiKeyAuth.from_company(company)
+            with self._lock:
+                self._keys_by_company.setdefault(auth.company_id, set()).add(key_hash)
+            return auth
+
+        return self._cache.get_or_load(key_hash, load)
+
+    async def aget_or_load(self, api_key: str,
+                           loader: Callable[[], Awaitable[Optional[Company]]]) -> Optional[ApiKeyAuth]:
+        """get_or_load() for async endpoints - loader is a coroutine function"""
+        key_hash = hash_api_key(api_key)
+
+        async def load():
+            company = await loader()
+            if company is None:
+                return None
+            auth = ApiKeyAuth.from_company(company)
+            with self._lock:
+                self._keys_by_company.setdefault(auth.company_id, set()).add(key_hash)
+            return auth
+
+        return await self._cache.aget_or_load(key_hash, load)
+
+    def invalidate_company(self, company_id: int):
+        """Forget every cached key for a company (key regenerated, whitelist/limit changed, suspended...)"""
+        with self._lock:
+            key_hashes = self._keys_by_company.pop(company_id, set())
+        for key_hash in key_hashes:
+            self._cache.pop(key_hash)
+
+    def clear(self):
+        with self._lock:
+            self._keys_by_company.clear()
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class ApiUsageRecorder:
+    """
+    Coalesces per-request usage writes (api_last_used, ...) into periodic bulk UPDATEs
+
+    record() and add_calls() only touch memory; a background thread flushes the latest
+    values and the summed call counts for each company every API_USAGE_FLUSH_SECONDS.
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None,
+                 interval: float = API_USAGE_FLUSH_SECONDS):
+        self._session_factory = session_factory
+        self.interval = interval
+        self._pending: Dict[int, dict] = {}
+        self._pending_calls: Dict[Tuple[int, date], int] = {}  # (company_id, day) -> calls
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushed_rows = 0
+
+    def record(self, company_id: int, **values):
+        """Remember the latest column values for a company (last write wins)"""
+        with self._lock:
+            self._pending.setdefault(company_id, {}).update(values)
+        self._ensure_started()
+
+    def mark_used(self, company_id: int, when: Optional[datetime] = None):
+        self.record(company_id, api_last_used=when or datetime.utcnow())
+
+    def add_calls(self, company_id: int, calls: int = 1):
+        """Count API calls towards companies.api_calls_today (added, not overwritten, on flush)"""
+        key = (company_id, date.today())
+        with self._lock:
+            self._pending_calls[key] = self._pending_calls.get(key, 0) + calls
+        self._ensure_started()
+
+    def pending_count(self) -> int:
+        return len(self._pending.keys() | {company_id for company_id, _ in self._pending_calls})
+
+    def flush(self) -> int:
+        """Write all pending values and call counts to the database, returns number of row updates"""
+        flushed = self._flush_values()
+        flushed += self._flush_calls()
+        return flushed
+
+    def _flush_calls(self) -> int:
+        """Add counted calls to api_calls_today, restarting the counter on a new day"""
+        with self._lock:
+            pending, self._pending_calls = self._pending_calls, {}
+        today = date.today()
+        # Counts from a day that has already rolled over are obsolete
+        pending = {company_id: calls for (company_id, day), calls in pending.items() if day == today}
+        if not pending:
+            return 0
+
+        day_start = datetime.combine(today, datetime.min.time())
+        same_day = Company.api_last_reset >= day_start
+        db = self._get_session()
+        try:
+            for company_id, calls in pending.items():
+                db.execute(
+                    update(Company)
+                    .where(Company.id == company_id)
+                    .values(
+                        api_calls_today=case((same_day, func.coalesce(Company.api_calls_today, 0) + calls),
+                                             else_=calls),
+                        api_last_reset=case((same_day, Company.api_last_reset), else_=datetime.now()),
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+            return len(pending)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"[API USAGE] Call count flush failed, will retry: {e}")
+            with self._lock:
+                for company_id, calls in pending.items():
+                    key = (company_id, today)
+                    self._pending_calls[key] = self._pending_calls.get(key, 0) + calls
+            return 0
+        finally:
+            db.close()
+
+    def _flush_values(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        # Group rows by column set so each group is a single executemany UPDATE
+        groups: Dict[tuple, list] = {}
+        for company_id, values in pending.items():
+            groups.setdefault(tuple(sorted(values)), []).append({"id": company_id, **values})
+
+        db = self._get_session()
+        try:
+            for rows in groups.values():
+                db.execute(update(Company), rows)
+            db.commit()
+            self.flushed_rows += len(pending)
+            return len(pending)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"[API USAGE] Flush failed, will retry: {e}")
+            # Put values back unless newer ones arrived meanwhile
+            with self._lock:
+                for company_id, values in pending.items():
+                    merged = dict(values)
+                    merged.update(self._pending.get(company_id, {}))
+                    self._pending[company_id] = merged
+            return 0
+        finally:
+            db.close()
+
+    def start(self):
+        self._ensure_started()
+
+    def stop(self):
+        """Stop the background thread and flush whatever is left"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        self._stop.clear()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="api-usage-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"[API USAGE] Background flush error: {e}")
+
+    def _get_session(self) -> Session:
+        if self._session_factory is None:
+            from database.connection import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+
+# Shared instances
+api_key_cache = ApiKeyAuthCache()
+api_usage_recorder = ApiUsageRecorder()
+
+
+__all__ = [
+    'hash_api_key',
+    'ApiKeyAuth',
+    'ApiKeyAuthCache',
+    'ApiUsageRecorder',
+    'api_key_cache',
+    'api_usage_recorder'
+]
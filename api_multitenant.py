@@ -16,8 +16,9 @@ from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from sqlalchemy.orm import Session, undefer, defer, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, func, or_, select
 from typing import List, Optional, Dict
 import json
 import secrets
@@ -31,16 +32,45 @@ _log_level = os.environ.get("EFRIS_LOG_LEVEL", "INFO").upper()
 logging.basicConfig(level=getattr(logging, _log_level, logging.INFO), format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("efris_api")
 
-from database.connection import get_db, init_db
+from database.connection import (
+    async_engine, engine, get_async_db, get_db, get_read_db, replica_engines, replica_router, sqlite_writer_queue
+)
+from database.migrator import ensure_schema
 from database.models import (
     User, Company, CompanyUser, Product, Invoice, PurchaseOrder, CreditMemo,
-    EFRISGood, EFRISInvoice, ExciseCode, ClientReferral, AuditLog, SystemSettings
+    EFRISGood, EFRISInvoice, ExciseCode, ClientReferral, AuditLog, SystemSettings, BackgroundJob
 )
+from database.bulk import upsert
+from database.pagination import InvalidCursor, KeysetPage, keyset_paginate, estimate_count
+from database.payload_archive import archived_payloads, efris_response_of
+from database.search import SEARCH_RESULT_LIMIT, search_keys, search_query
+from database.daily_stats import platform_day_totals, reseller_fiscalized_totals
+from database.log_retention import LOG_TABLES, feed_since, rollup_summary
+# Per-request query count / DB time / N+1 detection
+from database import query_stats
 # Security utilities
 from security_utils import (
     generate_totp_secret, get_totp_uri, generate_qr_code, verify_totp_code,
     get_client_ip, enforce_api_security
 )
+# Cached API-key auth snapshots + coalesced api_last_used writes
+from api_key_cache import api_key_cache, api_usage_recorder
+from log_writer import log_writer
+from rate_limiter import api_rate_limiter
+from ip_allowlist import invalid_entries
+from principal_cache import principal_cache
+from executors import password_executor, outbound_executor, ExecutorSaturated, bulk_call
+# Per environment / TIN circuit breakers and adaptive concurrency limits for EFRIS
+from efris_guard import EfrisUnavailable, efris_guard
+# Durable background jobs for long imports / registrations
+from jobs import (
+    JOBS_IN_PROCESS_WORKER, JobContext, job_handler, enqueue, run_inline, cancel, job_summary,
+    queue_stats, job_worker
+)
+# Local T109 validation against the cached EFRIS catalogue
+from invoice_preflight import (
+    preflight_invoice, invalidate_catalogue, remember_t115_dictionary, preflight_stats
+)
 # Import auth functions from standalone auth.py file
 from passlib.context import CryptContext
 from jose import jwt
@@ -48,7 +78,15 @@ from datetime import datetime, timedelta
 import os
 
 # Initialize password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# PASSWORD_REHASH_ON_LOGIN=true upgrades hashes below BCRYPT_ROUNDS when the user next logs in
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_REHASH_ON_LOGIN = os.getenv("PASSWORD_REHASH_ON_LOGIN", "false").lower() == "true"
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS if PASSWORD_REHASH_ON_LOGIN else 4
+)
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
@@ -64,6 +102,23 @@ def get_password_hash(password: str) -> str:
     """Hash password"""
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify password hash in the password worker pool (bcrypt never runs on the event loop)"""
+    return await password_executor.run(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash password in the password worker pool"""
+    return await password_executor.run(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Verify a password and, if rehash-on-login is enabled and the hash is below
+    BCRYPT_ROUNDS, return a replacement hash. Returns (is_valid, new_hash_or_None)
+    """
+    if not PASSWORD_REHASH_ON_LOGIN:
+        return await verify_password_async(plain_password, hashed_password), None
+    return await password_executor.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -87,9 +142,13 @@ def get_current_active_user(token: str = Depends(oauth2_scheme), db: Session = D
     except Exception:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+    # User snapshot + accessible company ids, cached per token subject
+    principal = principal_cache.get_or_load(
+        email, lambda: db.query(User).filter(User.email == email).first(), db
+    )
+    if principal is None:
         raise credentials_exception
+    user = principal.attach(db)
     if not user.is_active:
         raise HTTPException(status_code=403, detail="Account is inactive")
     if user.status == 'suspended':
@@ -110,36 +169,84 @@ def get_company_from_api_key(
             headers={"WWW-Authenticate": "ApiKey"},
         )
     
-    company = db.query(Company).filter(
+    # Auth snapshot is cached per hashed key (invalidated on key/whitelist/limit/status changes)
+    auth = api_key_cache.get_or_load(x_api_key, lambda: db.query(Company).filter(
         Company.api_key == x_api_key,
         Company.api_enabled == True,
         Company.is_active == True
-    ).first()
+    ).first())
     
-    if not company:
+    if not auth or not auth.api_enabled or not auth.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key or API access disabled",
             headers={"WWW-Authenticate": "ApiKey"},
         )
     
-    # Update last used timestamp
-    company.api_last_used = datetime.utcnow()
+    # Bind the cached company to this request's session without a SELECT
+    company = auth.attach(db)
+    query_stats.attribute_company(company.id)
     
     # SECURITY: IP Whitelisting + Rate Limiting
-    enforce_api_security(request, company, db)
+    enforce_api_security(request, company, db, auth.ip_allowlist)
     
-    db.commit()
+    # Update last used timestamp (coalesced, flushed in the background)
+    api_usage_recorder.mark_used(company.id)
     
     return company
 
+async def get_company_from_api_key_async(
+    request: Request,
+    x_api_key: str = Header(..., alias="X-API-Key"),
+    db: AsyncSession = Depends(get_async_db)
+) -> Company:
+    """get_company_from_api_key for endpoints on the async session (no blocking DB calls)"""
+    if not x_api_key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API key is required",
+            headers={"WWW-Authenticate": "ApiKey"},
+        )
+
+    async def load_company():
+        return (await db.execute(select(Company).where(
+            Company.api_key == x_api_key,
+            Company.api_enabled == True,
+            Company.is_active == True
+        ).limit(1))).scalars().first()
+
+    auth = await api_key_cache.aget_or_load(x_api_key, load_company)
+
+    if not auth or not auth.api_enabled or not auth.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid API key or API access disabled",
+            headers={"WWW-Authenticate": "ApiKey"},
+        )
+
+    company = await db.run_sync(auth.attach)
+    query_stats.attribute_company(company.id)
+
+    # IP whitelist / rate limit - rejections are audited by the background log writer
+    enforce_api_security(request, company, None, auth.ip_allowlist)
+
+    api_usage_recorder.mark_used(company.id)
+
+    return company
+
 # Helper function to verify company access
 def verify_company_access(current_user: User, company_id: int, db: Session) -> bool:
     """Verify user has access to the specified company"""
+    query_stats.attribute_company(company_id)
     if current_user.role in ["owner", "admin"]:
         # Owners and admins can access all companies
         return True
     
+    # Precomputed accessible company ids from the principal cache
+    principal = principal_cache.get_by_user_id(current_user.id)
+    if principal is not None:
+        return principal.can_access(company_id)
+    
     # Check if company belongs to this user (for clients)
     if current_user.role == "client":
         company = db.query(Company).filter(Company.id == company_id).first()
@@ -290,13 +397,24 @@ from contextlib import asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
     # Startup
-    init_db()
+    # Schema changes are applied at deploy time (run_migrations.py) - workers only check the version
+    schema_version = ensure_schema(engine)
     load_product_metadata()
-    print("[OK] Database tables created")
+    print(f"[OK] Database schema version {schema_version}")
     print("[OK] Multi-tenant EFRIS API started")
+    api_usage_recorder.start()
+    log_writer.start()
+    if JOBS_IN_PROCESS_WORKER:
+        job_worker.start()
     yield
-    # Shutdown (if needed)
-    pass
+    # Shutdown - persist coalesced API usage and queued audit/activity rows
+    job_worker.stop()
+    api_usage_recorder.stop()
+    log_writer.stop()
+    password_executor.shutdown(wait=False)
+    outbound_executor.shutdown(wait=False)
+    if async_engine is not None:
+        await async_engine.dispose()
 
 app = FastAPI(
     title=os.getenv("API_TITLE", "EFRIS Multi-Tenant API"),
@@ -382,6 +500,108 @@ class RequestSizeLimiter(BaseHTTPMiddleware):
 
 app.add_middleware(RequestSizeLimiter, max_size=10 * 1024 * 1024)
 
+class RateLimitHeaders(BaseHTTPMiddleware):
+    """Copy X-RateLimit-* headers set by the external API key check onto the response"""
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        headers = getattr(request.state, "rate_limit_headers", None)
+        if headers:
+            response.headers.update(headers)
+        return response
+
+app.add_middleware(RateLimitHeaders)
+
+for stats_engine in [engine] + replica_engines:
+    query_stats.install(stats_engine)
+if async_engine is not None:
+    query_stats.install(async_engine.sync_engine)
+SQL_STATS_HEADERS = os.getenv("SQL_STATS_HEADERS", "true").lower() == "true"
+
+class QueryStatsMiddleware(BaseHTTPMiddleware):
+    """Attribute SQL statements to the request (and company) being served; report N+1 patterns
+    by route and expose the totals as X-DB-Query-Count / Server-Timing headers"""
+    async def dispatch(self, request: Request, call_next):
+        with query_stats.request_scope(request.url.path) as stats:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            if route is not None:
+                stats.route = f"{request.method} {route.path}"
+        if SQL_STATS_HEADERS:
+            response.headers.update(stats.headers())
+        return response
+
+app.add_middleware(QueryStatsMiddleware)
+
+# Worker pool full (e.g. login storm) - shed load instead of queueing without bound
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, please retry shortly"},
+        headers={"Retry-After": "1"}
+    )
+
+# EFRIS breaker open or concurrency limit reached - fail fast instead of a 30s timeout
+@app.exception_handler(EfrisUnavailable)
+async def efris_unavailable_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after))}
+    )
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request, exc):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+def _page_total(query, include_total: bool) -> dict:
+    """Optional total for paginated list responses (planner estimate on big PostgreSQL tables)"""
+    if not include_total:
+        return {}
+    total, estimated = estimate_count(query)
+    return {"total": total, "total_is_estimate": estimated}
+
+
+def _set_page_headers(response: Response, page: KeysetPage, query=None):
+    """Pagination info for endpoints that return a bare JSON array"""
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if query is not None:
+        total, estimated = estimate_count(query)
+        response.headers["X-Total-Count"] = str(total)
+        if estimated:
+            response.headers["X-Total-Count-Estimated"] = "true"
+
+
+# Date each list is sorted by, newest first (QB transaction date, EFRIS issue date or last
+# update); created_at stands in while it is unset. Backed by the ix_*_company_listed indexes
+LIST_SORT_DATES = {
+    Product: Product.updated_at,
+    Invoice: Invoice.qb_txn_date,
+    PurchaseOrder: PurchaseOrder.qb_txn_date,
+    CreditMemo: CreditMemo.updated_at,
+    EFRISGood: EFRISGood.updated_at,
+    EFRISInvoice: EFRISInvoice.issued_date,
+}
+
+
+def _list_order(model) -> list:
+    """Keyset sort keys for a list endpoint: (list date, id)"""
+    return [func.coalesce(LIST_SORT_DATES[model], model.created_at), model.id]
+
+
+def _list_page(query, model, search: Optional[str], cursor: Optional[str], limit: Optional[int]):
+    """
+    (query, page) for a list endpoint: the keyset page after cursor - best search
+    matches first when searching (SEARCH_RESULT_LIMIT per page without a limit),
+    otherwise newest first
+    """
+    if search:
+        query, keys = search_keys(query, model, search)
+        return query, keyset_paginate(query, keys, cursor, limit or SEARCH_RESULT_LIMIT)
+    return query, keyset_paginate(query, _list_order(model), cursor, limit)
+
 # Add validation error handler to see detailed errors
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -498,6 +718,17 @@ async def get_metrics(request: Request, db: Session = Depends(get_db)):
         return {
             "active_users": active_users,
             "total_companies": total_companies,
+            "invoice_preflight": preflight_stats.snapshot(),
+            "api_key_cache": api_key_cache.stats(),
+            "api_rate_limiter": api_rate_limiter.stats(),
+            "principal_cache": principal_cache.stats(),
+            "password_executor": password_executor.stats(),
+            "outbound_executor": outbound_executor.stats(),
+            "efris_guard": efris_guard.stats(),
+            "background_jobs": {**queue_stats(db), "in_process_worker": job_worker.stats()},
+            "log_writer": log_writer.stats(),
+            "read_replicas": replica_router.stats(),
+            "sqlite_writer_queue": sqlite_writer_queue.stats() if sqlite_writer_queue else None,
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -676,12 +907,12 @@ async def public_test_t103():
         )
         
         # Call real EFRIS - perform handshake and get registration
-        efris.ensure_authenticated()
+        await outbound_executor.run("public-demo", efris.ensure_authenticated)
         
         if hasattr(efris, 'registration_details') and efris.registration_details:
             result = efris.registration_details
         else:
-            result = efris.get_registration_details()
+            result = await outbound_executor.run("public-demo", efris.get_registration_details)
         
         return {
             "status": "success",
@@ -717,7 +948,7 @@ async def public_test_t111():
         )
 
         # Single call first so we can inspect the raw response structure
-        result = efris.get_goods_and_services(page_no=1, page_size=99)
+        result = await outbound_executor.run("public-demo", efris.get_goods_and_services, page_no=1, page_size=99)
 
         if not isinstance(result, dict):
             return {"status": "error", "message": "Non-dict response from EFRIS", "raw": str(result)[:500]}
@@ -756,7 +987,7 @@ async def public_test_t111():
         total_pages = int(records_source.get('page', {}).get('pageCount', 1))
 
         for page_no in range(2, min(total_pages + 1, 51)):
-            r = efris.get_goods_and_services(page_no=page_no, page_size=99)
+            r = await outbound_executor.run("public-demo", efris.get_goods_and_services, page_no=page_no, page_size=99)
             if not isinstance(r, dict) or 'data' not in r:
                 break
             d = r['data'].get('decrypted_content') or r['data'].get('content')
@@ -836,7 +1067,7 @@ async def public_test_t125():
         )
         
         # Get excise duty codes (alcohol, tobacco, etc.)
-        result = efris.query_excise_duty()
+        result = await outbound_executor.run("public-demo", efris.query_excise_duty)
         return {
             "status": "success",
             "interface": "T125",
@@ -879,7 +1110,7 @@ async def public_test_t115():
         )
         
         # Get system dictionary including units of measure
-        result = efris.get_code_list(None)
+        result = await outbound_executor.run("public-demo", efris.get_code_list, None)
         
         # Extract units of measure from EFRIS response
         decrypted_content = result.get('data', {}).get('decrypted_content', {})
@@ -946,7 +1177,7 @@ async def public_test_t106():
         )
         
         # Query a known taxpayer from EFRIS
-        result = efris.query_taxpayer_by_tin(tin="1000168319")
+        result = await outbound_executor.run("public-demo", efris.query_taxpayer_by_tin, tin="1000168319")
         return {
             "status": "success",
             "interface": "T106",
@@ -996,7 +1227,7 @@ async def public_test_query_invoices():
             "pageSize": "10"
         }
         
-        result = efris.query_invoice(query_params)
+        result = await outbound_executor.run("public-demo", efris.query_invoice, query_params)
         return {
             "status": "success",
             "interface": "T106 - Query Invoices",
@@ -1037,7 +1268,7 @@ async def public_test_invoice_details():
         
         # Try to get invoice details (will fail gracefully if no invoice exists)
         # This is just to show the endpoint - in real use, client would provide invoice number
-        result = efris.get_invoice_by_number("SAMPLE-INV-001")
+        result = await outbound_executor.run("public-demo", efris.get_invoice_by_number, "SAMPLE-INV-001")
         return {
             "status": "success",
             "interface": "T108 - Get Invoice Details",
@@ -1395,7 +1626,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     
     db_user = User(
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await get_password_hash_async(user_data.password),
         full_name=user_data.full_name,
         phone=user_data.phone if user_data.phone else None,
         role=user_data.role if user_data.role else 'reseller',
@@ -1427,7 +1658,9 @@ async def login(
     """Login and get access token (with optional 2FA)"""
     user = db.query(User).filter(User.email == form_data.username).first()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    is_valid, new_hash = (await verify_and_update_password(form_data.password, user.hashed_password)
+                          if user else (False, None))
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -1461,6 +1694,10 @@ async def login(
                 headers={"WWW-Authenticate": "Bearer"},
             )
     
+    # Upgrade the stored hash to the current bcrypt cost (opt-in)
+    if new_hash:
+        user.hashed_password = new_hash
+    
     # Log successful login
     audit = AuditLog(
         company_id=None,
@@ -1560,7 +1797,7 @@ async def disable_2fa(
     db: Session = Depends(get_db)
 ):
     """Disable 2FA (requires password confirmation)"""
-    if not verify_password(password, current_user.hashed_password):
+    if not await verify_password_async(password, current_user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
     # Disable 2FA
@@ -1583,10 +1820,18 @@ async def disable_2fa(
 
 # ========== RESELLER PORTAL ENDPOINTS ==========
 
+def _companies_by_owner(db: Session, owner_ids) -> dict:
+    """owner user id -> their first company, for every owner in owner_ids (a list or subquery)"""
+    companies = {}
+    for company in db.query(Company).filter(Company.owner_id.in_(owner_ids)).order_by(Company.id):
+        companies.setdefault(company.owner_id, company)
+    return companies
+
+
 @app.get("/api/reseller/clients")
 async def get_reseller_clients(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all clients and referrals managed by this reseller"""
     if current_user.role not in ['reseller', 'admin']:
@@ -1615,39 +1860,41 @@ async def get_reseller_clients(
             "created_at": referral.created_at.isoformat() if referral.created_at else None
         })
     
-    # 2. Get approved referrals (converted to clients)
-    approved_referrals = db.query(ClientReferral).filter(
+    # 2. Get approved referrals (converted to clients), with the client and company in the same query
+    approved_referrals = db.query(ClientReferral, User, Company).join(
+        User, User.id == ClientReferral.created_client_id
+    ).outerjoin(
+        Company, Company.id == ClientReferral.created_company_id
+    ).filter(
         ClientReferral.reseller_id == current_user.id,
         ClientReferral.status == 'approved'
     ).all()
     
-    for referral in approved_referrals:
-        if referral.created_client_id:
-            client = db.query(User).filter(User.id == referral.created_client_id).first()
-            company = db.query(Company).filter(Company.id == referral.created_company_id).first() if referral.created_company_id else None
-            
-            if client:
-                result.append({
-                    "id": client.id,
-                    "referral_id": referral.id,
-                    "email": client.email,
-                    "full_name": client.full_name,
-                    "phone": client.phone,
-                    "company_name": company.name if company else referral.company_name,
-                    "tin": company.tin if company else referral.tin,
-                    "device_no": company.device_no if company else referral.device_no,
-                    "is_active": client.is_active,
-                    "status": "approved",
-                    "created_at": referral.reviewed_at.isoformat() if referral.reviewed_at else None
-                })
+    approved_ids = set()
+    for referral, client, company in approved_referrals:
+        approved_ids.add(client.id)
+        result.append({
+            "id": client.id,
+            "referral_id": referral.id,
+            "email": client.email,
+            "full_name": client.full_name,
+            "phone": client.phone,
+            "company_name": company.name if company else referral.company_name,
+            "tin": company.tin if company else referral.tin,
+            "device_no": company.device_no if company else referral.device_no,
+            "is_active": client.is_active,
+            "status": "approved",
+            "created_at": referral.reviewed_at.isoformat() if referral.reviewed_at else None
+        })
     
     # 3. Get any clients directly under this reseller (parent_id = reseller_id)
     direct_clients = db.query(User).filter(User.parent_id == current_user.id).all()
+    companies = _companies_by_owner(db, select(User.id).where(User.parent_id == current_user.id))
     
     for client in direct_clients:
         # Check if already included via referral
-        if not any(r['id'] == client.id and r.get('status') == 'approved' for r in result):
-            company = db.query(Company).filter(Company.owner_id == client.id).first()
+        if client.id not in approved_ids:
+            company = companies.get(client.id)
             
             result.append({
                 "id": client.id,
@@ -1745,7 +1992,7 @@ async def submit_client_referral(
 @app.get("/api/reseller/referrals")
 async def get_reseller_referrals(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all referrals submitted by this reseller"""
     if current_user.role != 'reseller':
@@ -1776,15 +2023,13 @@ async def get_reseller_referrals(
 @app.get("/api/reseller/client-activity")
 async def get_reseller_client_activity(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get invoice activity from all clients referred by this reseller"""
     if current_user.role != 'reseller':
         raise HTTPException(status_code=403, detail="Resellers only")
     
     from database.models import ActivityLog
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
     
     # Get all client IDs that belong to this reseller
     client_ids = db.query(User.id).filter(User.parent_id == current_user.id).all()
@@ -1799,41 +2044,24 @@ async def get_reseller_client_activity(
             "activities": []
         }
     
-    # Get activity logs for these clients
-    activities = db.query(ActivityLog).filter(
+    # Get activity logs for these clients, with the company name joined in
+    activities = db.query(ActivityLog, Company.name).outerjoin(
+        Company, Company.id == ActivityLog.company_id
+    ).options(defer(ActivityLog.efris_response)).filter(
         ActivityLog.user_id.in_(client_ids),
-        ActivityLog.activity_type.in_(['invoice_created', 'invoice_fiscalized'])
+        ActivityLog.activity_type.in_(['invoice_created', 'invoice_fiscalized']),
+        ActivityLog.created_at >= feed_since()
     ).order_by(ActivityLog.created_at.desc()).limit(50).all()
     
-    # Calculate stats
-    now = datetime.utcnow()
-    today_start = datetime(now.year, now.month, now.day)
-    month_start = datetime(now.year, now.month, 1)
-    
-    today_count = db.query(func.count(ActivityLog.id)).filter(
-        ActivityLog.user_id.in_(client_ids),
-        ActivityLog.activity_type == 'invoice_fiscalized',
-        ActivityLog.created_at >= today_start
-    ).scalar() or 0
-    
-    month_count = db.query(func.count(ActivityLog.id)).filter(
-        ActivityLog.user_id.in_(client_ids),
-        ActivityLog.activity_type == 'invoice_fiscalized',
-        ActivityLog.created_at >= month_start
-    ).scalar() or 0
-    
-    total_count = db.query(func.count(ActivityLog.id)).filter(
-        ActivityLog.user_id.in_(client_ids),
-        ActivityLog.activity_type == 'invoice_fiscalized'
-    ).scalar() or 0
+    # Stats from the precomputed daily counters (database/daily_stats.py)
+    totals = reseller_fiscalized_totals(db, current_user.id)
     
     # Format activities
     activity_list = []
-    for activity in activities:
-        company = db.query(Company).filter(Company.id == activity.company_id).first()
+    for activity, company_name in activities:
         activity_list.append({
             "id": activity.id,
-            "company_name": company.name if company else "Unknown",
+            "company_name": company_name or "Unknown",
             "invoice_number": activity.document_number,
             "total_amount": activity.details.get('total_amount') if activity.details else None,
             "efris_status": activity.efris_status,
@@ -1842,9 +2070,9 @@ async def get_reseller_client_activity(
     
     return {
         "success": True,
-        "total": total_count,
-        "this_month": month_count,
-        "today": today_count,
+        "total": totals["total"],
+        "this_month": totals["this_month"],
+        "today": totals["today"],
         "activities": activity_list
     }
 
@@ -1858,26 +2086,26 @@ async def get_reseller_client_activity(
 @app.get("/api/owner/stats")
 async def get_owner_stats(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get platform statistics for owner dashboard"""
     # Check if user is owner/admin
     if current_user.role not in ['owner', 'admin']:
         raise HTTPException(status_code=403, detail="Only platform owners can access this")
     
-    from sqlalchemy import func, and_
-    from datetime import date
-    
-    total_resellers = db.query(User).filter(User.role == 'reseller').count()
-    pending_clients = db.query(User).filter(and_(User.role == 'client', User.status == 'pending')).count()
-    active_clients = db.query(User).filter(and_(User.role == 'client', User.status == 'active')).count()
-    invoices_today = db.query(Invoice).filter(func.date(Invoice.created_at) == date.today()).count()
+    # One grouped count over users, today's invoice counters from daily_company_stats
+    user_counts = dict(((role, status), count) for role, status, count in db.query(
+        User.role, User.status, func.count(User.id)
+    ).filter(User.role.in_(['reseller', 'client'])).group_by(User.role, User.status))
+    today = platform_day_totals(db)
     
     return {
-        "total_resellers": total_resellers,
-        "pending_clients": pending_clients,
-        "active_clients": active_clients,
-        "invoices_today": invoices_today,
+        "total_resellers": sum(count for (role, _), count in user_counts.items() if role == 'reseller'),
+        "pending_clients": user_counts.get(('client', 'pending'), 0),
+        "active_clients": user_counts.get(('client', 'active'), 0),
+        "invoices_today": today["invoices_created"],
+        "fiscalized_today": today["invoices_fiscalized"],
+        "failed_today": today["invoices_failed"],
         "owner_name": current_user.full_name or current_user.email
     }
 
@@ -1885,7 +2113,7 @@ async def get_owner_stats(
 @app.get("/api/owner/pending-clients")
 async def get_pending_clients(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all clients pending approval"""
     if current_user.role not in ['owner', 'admin']:
@@ -1893,18 +2121,16 @@ async def get_pending_clients(
     
     from sqlalchemy import and_
     
-    pending = db.query(User).filter(and_(
-        User.role == 'client',
-        User.status == 'pending'
-    )).all()
+    pending_filter = and_(User.role == 'client', User.status == 'pending')
+    parent = aliased(User)
+    pending = db.query(User, parent).outerjoin(
+        parent, parent.id == User.parent_id
+    ).filter(pending_filter).all()
+    companies = _companies_by_owner(db, select(User.id).where(pending_filter))
     
     result = []
-    for client in pending:
-        # Get company info
-        company = db.query(Company).filter(Company.owner_id == client.id).first()
-        
-        # Get reseller info
-        reseller = db.query(User).filter(User.id == client.parent_id).first()
+    for client, reseller in pending:
+        company = companies.get(client.id)
         
         result.append({
             "id": client.id,
@@ -1921,17 +2147,20 @@ async def get_pending_clients(
 @app.get("/api/owner/resellers")
 async def get_all_resellers(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all resellers"""
     if current_user.role not in ['owner', 'admin']:
         raise HTTPException(status_code=403, detail="Only platform owners can access this")
     
     resellers = db.query(User).filter(User.role == 'reseller').all()
+    client_counts = dict(db.query(User.parent_id, func.count(User.id)).filter(
+        User.parent_id.in_(select(User.id).where(User.role == 'reseller'))
+    ).group_by(User.parent_id).all())
     
     result = []
     for reseller in resellers:
-        client_count = db.query(User).filter(User.parent_id == reseller.id).count()
+        client_count = client_counts.get(reseller.id, 0)
         
         result.append({
             "id": reseller.id,
@@ -1950,18 +2179,21 @@ async def get_all_resellers(
 @app.get("/api/owner/clients")
 async def get_all_clients(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all clients across all resellers"""
     if current_user.role not in ['owner', 'admin']:
         raise HTTPException(status_code=403, detail="Only platform owners can access this")
     
-    clients = db.query(User).filter(User.role == 'client').all()
+    parent = aliased(User)
+    clients = db.query(User, parent).outerjoin(
+        parent, parent.id == User.parent_id
+    ).filter(User.role == 'client').all()
+    companies = _companies_by_owner(db, select(User.id).where(User.role == 'client'))
     
     result = []
-    for client in clients:
-        company = db.query(Company).filter(Company.owner_id == client.id).first()
-        reseller = db.query(User).filter(User.id == client.parent_id).first()
+    for client, reseller in clients:
+        company = companies.get(client.id)
         
         client_data = {
             "id": client.id,
@@ -2004,7 +2236,7 @@ async def get_all_clients(
 @app.get("/api/owner/activity")
 async def get_activity_feed(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get recent activity feed"""
     if current_user.role not in ['owner', 'admin']:
@@ -2012,15 +2244,17 @@ async def get_activity_feed(
     
     from database.models import ActivityLog
     
-    activities = db.query(ActivityLog).order_by(ActivityLog.created_at.desc()).limit(50).all()
+    activities = db.query(ActivityLog, Company.name).outerjoin(
+        Company, Company.id == ActivityLog.company_id
+    ).options(defer(ActivityLog.efris_response), defer(ActivityLog.details)).filter(
+        ActivityLog.created_at >= feed_since()
+    ).order_by(ActivityLog.created_at.desc()).limit(50).all()
     
     result = []
-    for activity in activities:
-        company = db.query(Company).filter(Company.id == activity.company_id).first()
-        
+    for activity, company_name in activities:
         result.append({
             "id": activity.id,
-            "company_name": company.name if company else "Unknown",
+            "company_name": company_name or "Unknown",
             "activity_type": activity.activity_type,
             "document_number": activity.document_number,
             "efris_request_type": activity.efris_request_type,
@@ -2281,6 +2515,8 @@ async def suspend_client(
             company.is_active = False
         
         db.commit()
+        if company:
+            api_key_cache.invalidate_company(company.id)
         
         return {"success": True, "message": f"Client {client.email} suspended"}
     except Exception as e:
@@ -2316,6 +2552,8 @@ async def activate_client(
             company.is_active = True
         
         db.commit()
+        if company:
+            api_key_cache.invalidate_company(company.id)
         
         return {"success": True, "message": f"Client {client.email} activated"}
     except Exception as e:
@@ -2403,6 +2641,8 @@ async def delete_client(
         db.delete(client)
         
         db.commit()
+        if company:
+            api_key_cache.invalidate_company(company.id)
         
         return {
             "success": True, 
@@ -2467,6 +2707,8 @@ async def edit_client(
             company.efris_test_mode = efris_test_mode.lower() in ['true', '1', 'yes']
     
     db.commit()
+    if company:
+        api_key_cache.invalidate_company(company.id)
     
     return {
         "success": True,
@@ -2680,7 +2922,7 @@ async def owner_add_client(
     # Create client user (active immediately, no parent_id)
     client_user = User(
         email=email,
-        hashed_password=get_password_hash(password),
+        hashed_password=await get_password_hash_async(password),
         full_name=company_name,
         phone=phone,
         role='client',
@@ -2882,6 +3124,7 @@ async def update_client_erp(
     # This allows switching back without needing new credentials
     
     db.commit()
+    api_key_cache.invalidate_company(company.id)
     
     # Create audit log
     audit_log = AuditLog(
@@ -2921,7 +3164,7 @@ async def update_client_erp(
 @app.get("/api/owner/pending-referrals")
 async def get_pending_referrals(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all pending client referrals for owner review"""
     if current_user.role not in ['owner', 'admin']:
@@ -3024,7 +3267,7 @@ async def approve_referral(
         # Create client user
         client_user = User(
             email=referral.client_email,
-            hashed_password=get_password_hash(password),
+            hashed_password=await get_password_hash_async(password),
             full_name=referral.client_name,
             phone=referral.client_phone,
             role="client",
@@ -3248,6 +3491,7 @@ async def regenerate_api_key(
     )
     db.add(audit)
     db.commit()
+    api_key_cache.invalidate_company(company.id)
     db.refresh(company)
     
     base_url = os.getenv("APP_BASE_URL", "https://efrisintegration.nafacademy.com")
@@ -3278,6 +3522,14 @@ async def update_ip_whitelist(
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
+    invalid = invalid_entries(allowed_ips)
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid IP whitelist entries: {', '.join(invalid)}. "
+                   "Use an IP address, CIDR range (10.0.0.0/24, 2001:db8::/32) or wildcard (192.168.1.*)"
+        )
+    
     # Store as JSON array
     import json
     company.allowed_ips = json.dumps(allowed_ips) if allowed_ips else None
@@ -3291,6 +3543,7 @@ async def update_ip_whitelist(
     )
     db.add(audit)
     db.commit()
+    api_key_cache.invalidate_company(company_id)
     
     return {
         "success": True,
@@ -3329,6 +3582,7 @@ async def update_rate_limit(
     )
     db.add(audit)
     db.commit()
+    api_key_cache.invalidate_company(company_id)
     
     return {
         "success": True,
@@ -3344,11 +3598,12 @@ async def get_audit_logs(
     company_id: int = None,
     start_date: str = None,
     end_date: str = None,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get security audit logs (who did what, when)"""
+    """Get security audit logs (who did what, when), newest first (keyset paginated)"""
     if current_user.role not in ['owner', 'admin']:
         raise HTTPException(status_code=403, detail="Only platform owners can view audit logs")
     
@@ -3363,13 +3618,17 @@ async def get_audit_logs(
         from datetime import datetime
         start = datetime.fromisoformat(start_date)
         query = query.filter(AuditLog.created_at >= start)
+    else:
+        # recent partitions only - older history is in /api/owner/log-rollups
+        query = query.filter(AuditLog.created_at >= feed_since())
     if end_date:
         from datetime import datetime
         end = datetime.fromisoformat(end_date)
         query = query.filter(AuditLog.created_at <= end)
     
     # Get logs with user/company details
-    logs = query.order_by(AuditLog.created_at.desc()).limit(limit).all()
+    page = keyset_paginate(query, [AuditLog.id], cursor, limit)
+    logs = page.items
     
     result = []
     for log in logs:
@@ -3387,7 +3646,29 @@ async def get_audit_logs(
     
     return {
         "logs": result,
-        "total": len(result)
+        "total": len(result),
+        "next_cursor": page.next_cursor
+    }
+
+
+@app.get("/api/owner/log-rollups")
+async def get_log_rollups(
+    table: str = Query("audit_logs", description="audit_logs or activity_logs"),
+    company_id: int = None,
+    since: str = None,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_read_db)
+):
+    """Counts per action / activity type for log rows compacted past retention"""
+    if current_user.role not in ['owner', 'admin']:
+        raise HTTPException(status_code=403, detail="Only platform owners can view audit logs")
+    if table not in LOG_TABLES:
+        raise HTTPException(status_code=400, detail=f"table must be one of {', '.join(LOG_TABLES)}")
+
+    from datetime import date
+    return {
+        "table": table,
+        "totals": rollup_summary(db, table, date.fromisoformat(since) if since else None, company_id)
     }
 
 
@@ -3554,6 +3835,7 @@ async def update_company(
     
     try:
         db.commit()
+        api_key_cache.invalidate_company(company.id)
         db.refresh(company)
         
         # Success message with ERP change notification
@@ -3613,7 +3895,7 @@ async def get_company_products(
     company_id: int,
     search: Optional[str] = Query(None),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all products for a company with optional search"""
     if not verify_company_access(current_user, company_id, db):
@@ -3622,12 +3904,7 @@ async def get_company_products(
     query = db.query(Product).filter(Product.company_id == company_id)
     
     if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (Product.qb_name.ilike(search_pattern)) |
-            (Product.qb_sku.ilike(search_pattern)) |
-            (Product.qb_description.ilike(search_pattern))
-        )
+        query = search_query(query, Product, search)
     
     products = query.order_by(Product.updated_at.desc()).all()
     return products
@@ -3640,7 +3917,7 @@ async def get_company_invoices(
     company_id: int,
     search: Optional[str] = Query(None),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all invoices for a company with optional search"""
     if not verify_company_access(current_user, company_id, db):
@@ -3649,11 +3926,7 @@ async def get_company_invoices(
     query = db.query(Invoice).filter(Invoice.company_id == company_id)
     
     if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (Invoice.qb_doc_number.ilike(search_pattern)) |
-            (Invoice.qb_customer_name.ilike(search_pattern))
-        )
+        query = search_query(query, Invoice, search)
     
     invoices = query.order_by(Invoice.qb_txn_date.desc()).all()
     return invoices
@@ -3713,7 +3986,7 @@ async def get_registration_details(
     manager = get_efris_manager(company)
     
     try:
-        details = manager.get_registration_details()
+        details = await outbound_executor.run(company_id, manager.get_registration_details)
         return {
             "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
             "data": details
@@ -3737,7 +4010,9 @@ async def get_code_list(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.get_code_list(code_type)
+        result = await outbound_executor.run(company_id, manager.get_code_list, code_type)
+        if isinstance(result, dict):
+            remember_t115_dictionary(company.efris_test_mode, result.get('data', {}).get('decrypted_content', {}))
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3770,7 +4045,7 @@ async def get_goods_and_services(
             if goods_name:
                 kwargs["goods_name"] = goods_name
             
-            result = manager.get_goods_and_services(**kwargs)
+            result = await outbound_executor.run(company_id, manager.get_goods_and_services, **kwargs)
             
             if not isinstance(result, dict) or 'data' not in result:
                 break
@@ -3807,70 +4082,98 @@ async def get_goods_and_services(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _efris_good_row(company_id: int, record: dict) -> dict:
+    """efris_goods row for bulk upsert from a T127 goods record"""
+    return {
+        "company_id": company_id,
+        "goods_code": record.get('goodsCode') or None,
+        "goods_name": record.get('goodsName'),
+        "commodity_category_code": record.get('commodityCategoryCode'),
+        "commodity_category_name": record.get('commodityCategoryName'),
+        "unit_price": float(record.get('unitPrice') or 0),
+        "currency": record.get('currency'),
+        "tax_rate": float(record.get('taxRate') or 0),
+        "have_excise_tax": record.get('haveExciseTax'),
+        "stock": float(record.get('stock') or 0),
+        "efris_data": record,
+        "updated_at": datetime.now()
+    }
+
+
+@bulk_call
+def _save_efris_goods_page(db: Session, company_id: int, manager: EfrisManager, page_no: int, page_size: int):
+    """
+    One T127 page into efris_goods (blocking). Returns (records, saved_count, page info);
+    records is None when EFRIS sent no data.
+    """
+    result = manager.get_goods_and_services(page_no=page_no, page_size=page_size)
+    if not (isinstance(result, dict) and 'data' in result and 'decrypted_content' in result['data']):
+        return None, 0, {}
+    data = result['data']['decrypted_content']
+    records = data.get('records', [])
+    
+    # Save to database - one INSERT ... ON CONFLICT per chunk instead of a SELECT per record
+    saved_count = upsert(
+        db, EFRISGood, [_efris_good_row(company_id, record) for record in records],
+        conflict_columns=["company_id", "goods_code"]
+    )
+    return records, saved_count, data.get('page', {})
+
+
+@job_handler("efris_goods_import")
+def _import_efris_goods_job(ctx: JobContext) -> dict:
+    """Every T127 page into efris_goods, checkpoint after each page"""
+    company = ctx.db.query(Company).filter(Company.id == ctx.company_id).first()
+    manager = get_efris_manager(company)
+    page_size = ctx.params.get("page_size", 99)
+    page_no = ctx.checkpoint.get("page_no", 1)
+    saved = ctx.checkpoint.get("saved", 0)
+    
+    while True:
+        records, saved_count, page = _save_efris_goods_page(ctx.db, ctx.company_id, manager, page_no, page_size)
+        if not records:
+            break
+        saved += saved_count
+        page_count = int(page.get('pageCount') or 1)
+        page_no += 1
+        ctx.progress(saved, int(page.get('totalSize') or 0) or None,
+                     message=f"Imported {saved} goods (page {page_no - 1} of {page_count})",
+                     checkpoint={"page_no": page_no, "saved": saved})
+        if page_no > page_count:
+            break
+    
+    invalidate_catalogue(ctx.company_id)
+    return {"message": f"Imported {saved} goods from EFRIS", "count": saved}
+
+
 @app.post("/api/companies/{company_id}/efris-goods/import")
 async def import_efris_goods(
     company_id: int,
     page_size: int = Query(50, ge=1, le=100),
+    background: bool = Query(False, description="Import every page as a background job and return it"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Import goods from EFRIS and save to database"""
+    """Import goods from EFRIS and save to database (first page, or all pages in the background)"""
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
+    if background:
+        return _job_accepted(db, company_id, "efris_goods_import", current_user, {"page_size": page_size})
+    
     company = db.query(Company).filter(Company.id == company_id).first()
     manager = get_efris_manager(company)
     
     try:
-        result = manager.get_goods_and_services(page_no=1, page_size=page_size)
-        
-        if isinstance(result, dict) and 'data' in result and 'decrypted_content' in result['data']:
-            data = result['data']['decrypted_content']
-            records = data.get('records', [])
-            
-            # Save to database
-            saved_count = 0
-            for record in records:
-                # Check if already exists
-                existing = db.query(EFRISGood).filter(
-                    EFRISGood.company_id == company_id,
-                    EFRISGood.goods_code == record.get('goodsCode')
-                ).first()
-                
-                if existing:
-                    # Update existing
-                    existing.goods_name = record.get('goodsName')
-                    existing.commodity_category_code = record.get('commodityCategoryCode')
-                    existing.commodity_category_name = record.get('commodityCategoryName')
-                    existing.unit_price = float(record.get('unitPrice', 0))
-                    existing.currency = record.get('currency')
-                    existing.tax_rate = float(record.get('taxRate', 0))
-                    existing.have_excise_tax = record.get('haveExciseTax')
-                    existing.stock = float(record.get('stock', 0))
-                    existing.efris_data = record
-                    existing.updated_at = datetime.now()
-                else:
-                    # Create new
-                    good = EFRISGood(
-                        company_id=company_id,
-                        goods_code=record.get('goodsCode'),
-                        goods_name=record.get('goodsName'),
-                        commodity_category_code=record.get('commodityCategoryCode'),
-                        commodity_category_name=record.get('commodityCategoryName'),
-                        unit_price=float(record.get('unitPrice', 0)),
-                        currency=record.get('currency'),
-                        tax_rate=float(record.get('taxRate', 0)),
-                        have_excise_tax=record.get('haveExciseTax'),
-                        stock=float(record.get('stock', 0)),
-                        efris_data=record
-                    )
-                    db.add(good)
-                saved_count += 1
-            
-            db.commit()
-            return {"message": f"Imported {saved_count} goods from EFRIS", "records": records}
+        records, saved_count, _page = await outbound_executor.run(
+            company_id, _save_efris_goods_page, db, company_id, manager, 1, page_size
+        )
+        if records is None:
+            return {"message": "No data received from EFRIS", "records": []}
         
-        return {"message": "No data received from EFRIS", "records": []}
+        db.commit()
+        invalidate_catalogue(company_id)
+        return {"message": f"Imported {saved_count} goods from EFRIS", "records": records}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -3879,24 +4182,23 @@ async def import_efris_goods(
 @app.get("/api/companies/{company_id}/efris-goods")
 async def get_efris_goods(
     company_id: int,
+    response: Response,
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size (omit for all rows)"),
+    include_total: bool = Query(False, description="Send X-Total-Count (approximate for large tenants)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get EFRIS goods from database with optional search"""
+    """Get EFRIS goods from database with optional search, newest first (keyset paginated)"""
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
     query = db.query(EFRISGood).filter(EFRISGood.company_id == company_id)
     
-    if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (EFRISGood.goods_code.ilike(search_pattern)) |
-            (EFRISGood.goods_name.ilike(search_pattern))
-        )
-    
-    goods = query.order_by(EFRISGood.updated_at.desc()).all()
+    query, page = _list_page(query, EFRISGood, search, cursor, limit)
+    _set_page_headers(response, page, query if include_total else None)
+    goods = page.items
     
     return [
         {
@@ -3931,7 +4233,7 @@ async def upload_goods(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.upload_goods(products)
+        result = await outbound_executor.run(company_id, manager.upload_goods, products)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3952,7 +4254,7 @@ async def stock_increase(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.stock_increase(stock_data)
+        result = await outbound_executor.run(company_id, manager.stock_increase, stock_data)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3973,7 +4275,7 @@ async def stock_decrease(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.stock_decrease(stock_data)
+        result = await outbound_executor.run(company_id, manager.stock_decrease, stock_data)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3994,7 +4296,7 @@ async def upload_invoice(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.upload_invoice(invoice_data)
+        result = await outbound_executor.run(company_id, manager.upload_invoice, invoice_data)
         
         # Log activity for owner dashboard
         try:
@@ -4068,7 +4370,7 @@ async def create_credit_note(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.submit_credit_note_application(credit_note_data)
+        result = await outbound_executor.run(company_id, manager.submit_credit_note_application, credit_note_data)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -4089,7 +4391,7 @@ async def query_invoices(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.query_invoices(query_params)
+        result = await outbound_executor.run(company_id, manager.query_invoices, query_params)
         
         # Extract decrypted content if available
         if isinstance(result, dict) and 'data' in result:
@@ -4101,136 +4403,182 @@ async def query_invoices(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _parse_efris_datetime(value: Optional[str]) -> Optional[datetime]:
+    """EFRIS dates come as dd/mm/YYYY HH:MM:SS"""
+    try:
+        return datetime.strptime(value, '%d/%m/%Y %H:%M:%S') if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _efris_invoice_row(company_id: int, record: dict) -> dict:
+    """efris_invoices row for bulk upsert from a T106 invoice record"""
+    return {
+        "company_id": company_id,
+        "invoice_no": record.get('invoiceNo') or None,
+        "invoice_kind": record.get('invoiceKind'),
+        "invoice_type": record.get('invoiceType'),
+        "invoice_industry_code": record.get('invoiceIndustryCode'),
+        "buyer_legal_name": record.get('buyerLegalName'),
+        "buyer_business_name": record.get('buyerBusinessName'),
+        "buyer_tin": record.get('buyerTin'),
+        "currency": record.get('currency'),
+        "gross_amount": float(record.get('grossAmount') or 0),
+        "tax_amount": float(record.get('taxAmount') or 0),
+        "net_amount": float(record.get('netAmount')) if record.get('netAmount') else None,
+        "issued_date_str": record.get('issuedDateStr'),
+        "issued_date": _parse_efris_datetime(record.get('issuedDate')),
+        "uploading_time": record.get('uploadingTime'),
+        "is_invalid": record.get('isInvalid'),
+        "is_refund": record.get('isRefund'),
+        "reference_no": record.get('referenceNo'),
+        "device_no": record.get('deviceNo'),
+        "efris_data": record,
+        "updated_at": datetime.now()
+    }
+
+
+def _release_import_copies(db: Session, company_id: int, fdns: List[str]):
+    """
+    Drop plain T106 import rows for FDNs a QB/external invoice is about to claim,
+    so (company_id, invoice_no) stays unique
+    """
+    if fdns:
+        db.query(EFRISInvoice).filter(
+            EFRISInvoice.company_id == company_id,
+            EFRISInvoice.invoice_no.in_(fdns),
+            EFRISInvoice.qb_invoice_id.is_(None),
+            EFRISInvoice.status.is_(None)
+        ).delete(synchronize_session=False)
+
+
+def _reconcile_qb_invoices(db: Session, company_id: int, records: List[dict]) -> int:
+    """Mark QB invoices still waiting for an FDN as fiscalized when EFRIS already has them"""
+    references = {r.get('referenceNo') for r in records if r.get('invoiceNo') and r.get('referenceNo')}
+    # One query for every candidate instead of two per record
+    candidates = db.query(EFRISInvoice).filter(
+        EFRISInvoice.company_id == company_id,
+        EFRISInvoice.fdn.is_(None),
+        or_(EFRISInvoice.qb_invoice_number.in_(list(references)), EFRISInvoice.status == 'failed')
+    ).order_by(EFRISInvoice.id).all()
+    if not candidates:
+        return 0
+    
+    claims = []
+    for record in records:
+        fdn = record.get('invoiceNo')
+        reference_no = record.get('referenceNo')  # This should be the QB DocNumber
+        if not fdn:
+            continue
+        # Try to find QB invoice by reference number first (most reliable),
+        # then by error message containing the FDN
+        qb_invoice = None
+        if reference_no:
+            qb_invoice = next((c for c in candidates if c.qb_invoice_number == reference_no), None)
+        if not qb_invoice:
+            qb_invoice = next((c for c in candidates if c.status == 'failed'
+                               and fdn.lower() in (c.error_message or '').lower()), None)
+        if qb_invoice:
+            candidates.remove(qb_invoice)
+            claims.append((qb_invoice, fdn))
+    
+    _release_import_copies(db, company_id, [fdn for _, fdn in claims])
+    for qb_invoice, fdn in claims:
+        qb_invoice.status = 'success'
+        qb_invoice.fdn = fdn
+        qb_invoice.invoice_no = fdn
+        qb_invoice.error_message = None
+    return len(claims)
+
+
+@bulk_call
+def _save_efris_invoices_page(db: Session, company_id: int, manager: EfrisManager, query_params: dict):
+    """
+    One T106 page into efris_invoices (blocking). Returns (records, saved_count,
+    updated_count, page info); records is None when EFRIS sent no data.
+    """
+    result = manager.query_invoices(query_params)
+    if not (isinstance(result, dict) and 'data' in result and 'decrypted_content' in result['data']):
+        return None, 0, 0, {}
+    data = result['data']['decrypted_content']
+    records = data.get('records', [])
+    
+    # Update any QB invoices that match EFRIS invoices first, so the upsert below
+    # merges the EFRIS data into the QB row that now owns each FDN
+    updated_count = _reconcile_qb_invoices(db, company_id, records)
+    db.flush()
+    
+    # Save to database - one INSERT ... ON CONFLICT per chunk instead of a SELECT per record
+    saved_count = upsert(
+        db, EFRISInvoice, [_efris_invoice_row(company_id, record) for record in records],
+        conflict_columns=["company_id", "invoice_no"]
+    )
+    return records, saved_count, updated_count, data.get('page', {})
+
+
+@job_handler("efris_invoices_import")
+def _import_efris_invoices_job(ctx: JobContext) -> dict:
+    """Every T106 page matching query_params into efris_invoices, checkpoint after each page"""
+    company = ctx.db.query(Company).filter(Company.id == ctx.company_id).first()
+    manager = get_efris_manager(company)
+    query_params = dict(ctx.params.get("query_params") or {})
+    page_no = ctx.checkpoint.get("page_no", int(query_params.get("pageNo") or 1))
+    saved = ctx.checkpoint.get("saved", 0)
+    updated = ctx.checkpoint.get("updated", 0)
+    
+    while True:
+        query_params["pageNo"] = str(page_no)
+        records, saved_count, updated_count, page = _save_efris_invoices_page(
+            ctx.db, ctx.company_id, manager, query_params
+        )
+        if not records:
+            break
+        saved += saved_count
+        updated += updated_count
+        page_count = int(page.get('pageCount') or 1)
+        page_no += 1
+        ctx.progress(saved, int(page.get('totalSize') or 0) or None,
+                     message=f"Imported {saved} invoices (page {page_no - 1} of {page_count})",
+                     checkpoint={"page_no": page_no, "saved": saved, "updated": updated})
+        if page_no > page_count:
+            break
+    
+    return {
+        "message": f"Imported {saved} invoices from EFRIS, updated {updated} QB invoice statuses",
+        "count": saved
+    }
+
+
 @app.post("/api/companies/{company_id}/efris-invoices/import")
 async def import_efris_invoices(
     company_id: int,
     query_params: dict = Body(...),
+    background: bool = Query(False, description="Import every page as a background job and return it"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Import invoices from EFRIS and save to database"""
+    """Import invoices from EFRIS and save to database (requested page, or all pages in the background)"""
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
+    if background:
+        return _job_accepted(db, company_id, "efris_invoices_import", current_user, {"query_params": query_params})
+    
     company = db.query(Company).filter(Company.id == company_id).first()
     manager = get_efris_manager(company)
     
     try:
-        result = manager.query_invoices(query_params)
-        
-        if isinstance(result, dict) and 'data' in result and 'decrypted_content' in result['data']:
-            data = result['data']['decrypted_content']
-            records = data.get('records', [])
-            
-            # Save to database
-            saved_count = 0
-            for record in records:
-                # Check if already exists
-                existing = db.query(EFRISInvoice).filter(
-                    EFRISInvoice.company_id == company_id,
-                    EFRISInvoice.invoice_no == record.get('invoiceNo')
-                ).first()
-                
-                # Parse issued date
-                issued_date = None
-                try:
-                    if record.get('issuedDate'):
-                        issued_date = datetime.strptime(record.get('issuedDate'), '%d/%m/%Y %H:%M:%S')
-                except:
-                    pass
-                
-                if existing:
-                    # Update existing
-                    existing.invoice_kind = record.get('invoiceKind')
-                    existing.invoice_type = record.get('invoiceType')
-                    existing.invoice_industry_code = record.get('invoiceIndustryCode')
-                    existing.buyer_legal_name = record.get('buyerLegalName')
-                    existing.buyer_business_name = record.get('buyerBusinessName')
-                    existing.buyer_tin = record.get('buyerTin')
-                    existing.currency = record.get('currency')
-                    existing.gross_amount = float(record.get('grossAmount', 0))
-                    existing.tax_amount = float(record.get('taxAmount', 0))
-                    existing.net_amount = float(record.get('netAmount', 0)) if record.get('netAmount') else None
-                    existing.issued_date_str = record.get('issuedDateStr')
-                    existing.issued_date = issued_date
-                    existing.uploading_time = record.get('uploadingTime')
-                    existing.is_invalid = record.get('isInvalid')
-                    existing.is_refund = record.get('isRefund')
-                    existing.reference_no = record.get('referenceNo')
-                    existing.device_no = record.get('deviceNo')
-                    existing.efris_data = record
-                    existing.updated_at = datetime.now()
-                else:
-                    # Create new
-                    invoice = EFRISInvoice(
-                        company_id=company_id,
-                        invoice_no=record.get('invoiceNo'),
-                        invoice_kind=record.get('invoiceKind'),
-                        invoice_type=record.get('invoiceType'),
-                        invoice_industry_code=record.get('invoiceIndustryCode'),
-                        buyer_legal_name=record.get('buyerLegalName'),
-                        buyer_business_name=record.get('buyerBusinessName'),
-                        buyer_tin=record.get('buyerTin'),
-                        currency=record.get('currency'),
-                        gross_amount=float(record.get('grossAmount', 0)),
-                        tax_amount=float(record.get('taxAmount', 0)),
-                        net_amount=float(record.get('netAmount', 0)) if record.get('netAmount') else None,
-                        issued_date_str=record.get('issuedDateStr'),
-                        issued_date=issued_date,
-                        uploading_time=record.get('uploadingTime'),
-                        is_invalid=record.get('isInvalid'),
-                        is_refund=record.get('isRefund'),
-                        reference_no=record.get('referenceNo'),
-                        device_no=record.get('deviceNo'),
-                        efris_data=record
-                    )
-                    db.add(invoice)
-                saved_count += 1
-            
-            db.commit()
-            
-            # Update any QB invoices that match EFRIS invoices
-            updated_count = 0
-            for record in records:
-                fdn = record.get('invoiceNo')
-                reference_no = record.get('referenceNo')  # This should be the QB DocNumber
-                
-                if fdn:
-                    # Try to find QB invoice by reference number first (most reliable)
-                    qb_invoice = None
-                    if reference_no:
-                        qb_invoice = db.query(EFRISInvoice).filter(
-                            EFRISInvoice.company_id == company_id,
-                            EFRISInvoice.qb_invoice_number == reference_no,
-                            EFRISInvoice.fdn.is_(None)
-                        ).first()
-                    
-                    # If not found, try by error message containing the FDN
-                    if not qb_invoice:
-                        qb_invoice = db.query(EFRISInvoice).filter(
-                            EFRISInvoice.company_id == company_id,
-                            EFRISInvoice.fdn.is_(None),
-                            EFRISInvoice.status == 'failed'
-                        ).filter(
-                            EFRISInvoice.error_message.ilike(f'%{fdn}%')
-                        ).first()
-                    
-                    if qb_invoice:
-                        qb_invoice.status = 'success'
-                        qb_invoice.fdn = fdn
-                        qb_invoice.invoice_no = fdn
-                        qb_invoice.error_message = None
-                        updated_count += 1
-            
-            if updated_count > 0:
-                db.commit()
-            
-            return {
-                "message": f"Imported {saved_count} invoices from EFRIS, updated {updated_count} QB invoice statuses",
-                "records": records
-            }
+        records, saved_count, updated_count, _page = await outbound_executor.run(
+            company_id, _save_efris_invoices_page, db, company_id, manager, query_params
+        )
+        if records is None:
+            return {"message": "No data received from EFRIS", "records": []}
         
-        return {"message": "No data received from EFRIS", "records": []}
+        db.commit()
+        return {
+            "message": f"Imported {saved_count} invoices from EFRIS, updated {updated_count} QB invoice statuses",
+            "records": records
+        }
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -4239,25 +4587,23 @@ async def import_efris_invoices(
 @app.get("/api/companies/{company_id}/efris-invoices")
 async def get_efris_invoices(
     company_id: int,
+    response: Response,
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size (omit for all rows)"),
+    include_total: bool = Query(False, description="Send X-Total-Count (approximate for large tenants)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get EFRIS invoices from database with optional search"""
+    """Get EFRIS invoices from database with optional search, newest first (keyset paginated)"""
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
     query = db.query(EFRISInvoice).filter(EFRISInvoice.company_id == company_id)
     
-    if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (EFRISInvoice.invoice_no.ilike(search_pattern)) |
-            (EFRISInvoice.buyer_legal_name.ilike(search_pattern)) |
-            (EFRISInvoice.buyer_business_name.ilike(search_pattern))
-        )
-    
-    invoices = query.order_by(EFRISInvoice.issued_date.desc()).all()
+    query, page = _list_page(query, EFRISInvoice, search, cursor, limit)
+    _set_page_headers(response, page, query if include_total else None)
+    invoices = page.items
     
     return [
         {
@@ -4294,7 +4640,7 @@ async def get_invoice(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.get_invoice(invoice_no)
+        result = await outbound_executor.run(company_id, manager.get_invoice, invoice_no)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -4314,7 +4660,7 @@ async def get_excise_duty(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.query_excise_duty()
+        result = await outbound_executor.run(company_id, manager.query_excise_duty)
         
         # Extract excise list from response
         excise_list = result.get('data', {}).get('decrypted_content', {}).get('exciseDutyList', [])
@@ -4445,7 +4791,7 @@ async def query_credit_notes(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.query_credit_notes(query_params)
+        result = await outbound_executor.run(company_id, manager.query_credit_notes, query_params)
         
         # Extract decrypted content if available
         if isinstance(result, dict) and 'data' in result:
@@ -4472,7 +4818,7 @@ async def generate_fiscal_invoice(
     manager = get_efris_manager(company)
     
     try:
-        invoice = manager.generate_invoice(invoice_data)
+        invoice = await outbound_executor.run(company_id, manager.generate_invoice, invoice_data)
         return {
             "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
             "data": invoice
@@ -4496,7 +4842,7 @@ async def generate_fiscal_receipt(
     manager = get_efris_manager(company)
     
     try:
-        receipt = manager.generate_invoice(receipt_data)  # Or add separate method
+        receipt = await outbound_executor.run(company_id, manager.generate_invoice, receipt_data)  # Or add separate method
         return {
             "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
             "data": receipt
@@ -4521,7 +4867,7 @@ async def query_taxpayer(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.query_taxpayer_by_tin(tin, ninBrn)
+        result = await outbound_executor.run(company_id, manager.query_taxpayer_by_tin, tin, ninBrn)
         return {
             "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
             "data": result
@@ -4544,7 +4890,7 @@ async def get_server_time_api(
     manager = get_efris_manager(company)
     
     try:
-        result = manager.get_server_time()
+        result = await outbound_executor.run(company_id, manager.get_server_time)
         return {
             "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
             "data": result
@@ -4564,7 +4910,7 @@ async def quickbooks_status():
         
         # Try to actually call QuickBooks API to verify token works
         try:
-            company_info = qb_client.get_company_info()
+            company_info = await outbound_executor.run("quickbooks", qb_client.get_company_info)
             
             return {
                 "connected": True,
@@ -4602,7 +4948,7 @@ async def refresh_quickbooks_token():
         if not qb_client.refresh_token:
             raise HTTPException(status_code=400, detail="No refresh token available. Please reconnect QuickBooks.")
         
-        result = qb_client.refresh_access_token()
+        result = await outbound_executor.run("quickbooks", qb_client.refresh_access_token)
         return {
             "success": True,
             "message": "Token refreshed successfully",
@@ -4630,12 +4976,12 @@ async def quickbooks_callback(
         return RedirectResponse(url="/dashboard?error=Missing authorization code or realm ID")
     
     try:
-        tokens = qb_client.exchange_code_for_tokens(code)
+        tokens = await outbound_executor.run("quickbooks", qb_client.exchange_code_for_tokens, code)
         qb_client.realm_id = realmId
         
         # Detect QB region from company info
-        qb_region = qb_client.detect_region()
-        company_info = qb_client.get_company_info()
+        qb_region = await outbound_executor.run("quickbooks", qb_client.detect_region)
+        company_info = await outbound_executor.run("quickbooks", qb_client.get_company_info)
         qb_company_name = company_info.get('CompanyName', 'Unknown')
         
         # state contains company_id
@@ -4833,14 +5179,14 @@ async def get_quickbooks_items(
         
         print(f"[QB] Fetching items for company {company_id}")
         # Fetch QuickBooks items
-        items = qb_client.get_all_items()
+        items = await outbound_executor.run(company_id, qb_client.get_all_items)
         print(f"[QB] Fetched {len(items)} items")
         
         # Enrich with full details
         for item in items:
             item_id = item.get('Id')
             if item_id:
-                full_item = qb_client.get_item_by_id(item_id)
+                full_item = await outbound_executor.run(company_id, qb_client.get_item_by_id, item_id)
                 if full_item:
                     item.update(full_item)
         
@@ -4848,7 +5194,7 @@ async def get_quickbooks_items(
         efris_products = []
         page = 1
         while True:
-            result = manager.get_goods_and_services(page_no=page, page_size=10)
+            result = await outbound_executor.run(company_id, manager.get_goods_and_services, page_no=page, page_size=10)
             if result.get('returnStateInfo', {}).get('returnCode') == '00':
                 goods_list = result.get('data', {}).get('goodsInfoList', [])
                 if not goods_list:
@@ -4949,7 +5295,7 @@ async def sync_products_to_efris(
             
             efris_products.append(efris_product)
         
-        result = manager.upload_goods(efris_products)
+        result = await outbound_executor.run(company_id, manager.upload_goods, efris_products)
         
         return {
             "synced_count": len(efris_products),
@@ -4971,7 +5317,9 @@ async def get_efris_invoice_details(
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    efris_inv = db.query(EFRISInvoice).filter(
+    efris_inv = db.query(EFRISInvoice).options(
+        undefer(EFRISInvoice.efris_response), undefer(EFRISInvoice.efris_data)
+    ).filter(
         EFRISInvoice.company_id == company_id,
         EFRISInvoice.qb_invoice_id == qb_invoice_id
     ).first()
@@ -4983,8 +5331,9 @@ async def get_efris_invoice_details(
     efris_invoice = None
     antifake_code = None
     
-    if efris_inv.efris_response:
-        decrypted = efris_inv.efris_response.get('data', {}).get('decrypted_content', {})
+    efris_response = efris_response_of(db, efris_inv)
+    if efris_response:
+        decrypted = efris_response.get('data', {}).get('decrypted_content', {})
         if decrypted:
             # Check if we have full invoice details or just existInvoiceList
             if 'basicInformation' in decrypted:
@@ -5044,7 +5393,7 @@ async def get_quickbooks_invoices(
         # First, auto-fix any successful invoices with missing FDN
         fix_missing_fdns(db, company_id)
         
-        invoices = qb_client.get_invoices(start_date=start_date, end_date=end_date)
+        invoices = await outbound_executor.run(company_id, qb_client.get_invoices, start_date=start_date, end_date=end_date)
         
         # Enrich with EFRIS status and FDN
         for invoice in invoices:
@@ -5077,7 +5426,7 @@ async def get_quickbooks_invoices(
 def fix_missing_fdns(db: Session, company_id: int):
     """Auto-fix successful invoices that have missing FDN by extracting from stored response"""
     try:
-        invoices = db.query(EFRISInvoice).filter(
+        invoices = db.query(EFRISInvoice).options(undefer(EFRISInvoice.efris_response)).filter(
             EFRISInvoice.company_id == company_id,
             EFRISInvoice.status == 'success',
             (EFRISInvoice.fdn == None) | (EFRISInvoice.fdn == '')
@@ -5085,8 +5434,9 @@ def fix_missing_fdns(db: Session, company_id: int):
         
         fixed = 0
         for inv in invoices:
-            if inv.efris_response:
-                decrypted = inv.efris_response.get('data', {}).get('decrypted_content', {})
+            efris_response = efris_response_of(db, inv)
+            if efris_response:
+                decrypted = efris_response.get('data', {}).get('decrypted_content', {})
                 basic_info = decrypted.get('basicInformation', {})
                 fdn = basic_info.get('invoiceNo', '')
                 invoice_id = basic_info.get('invoiceId', '')
@@ -5119,10 +5469,10 @@ async def sync_invoice_to_efris(
     manager = get_efris_manager(company)
     
     try:
-        qb_invoice = qb_client.get_invoice_by_id(invoice_id)
+        qb_invoice = await outbound_executor.run(company_id, qb_client.get_invoice_by_id, invoice_id)
         customer_ref = qb_invoice.get('CustomerRef', {})
-        qb_customer = qb_client.get_customer_by_id(customer_ref.get('value'))
-        company_info = qb_client.get_company_info()
+        qb_customer = await outbound_executor.run(company_id, qb_client.get_customer_by_id, customer_ref.get('value'))
+        company_info = await outbound_executor.run(company_id, qb_client.get_company_info)
         
         # Use QuickBooksEfrisMapper to convert
         mapper = QuickBooksEfrisMapper()
@@ -5134,7 +5484,7 @@ async def sync_invoice_to_efris(
         )
         
         # Submit to EFRIS
-        result = manager.upload_invoice(efris_invoice)
+        result = await outbound_executor.run(company_id, manager.upload_invoice, efris_invoice)
         
         return {
             "message": "Invoice synced successfully",
@@ -5158,14 +5508,14 @@ async def get_qb_invoice_details(
     
     try:
         # Get invoice from QuickBooks
-        qb_invoice = qb_client.get_invoice_by_id(invoice_id)
+        qb_invoice = await outbound_executor.run(company_id, qb_client.get_invoice_by_id, invoice_id)
         
         # Fetch TaxCode definitions from QuickBooks to get actual names
         print(f"[INVOICE] Fetching TaxCode definitions from QuickBooks...")
         tax_code_names = {}  # Maps TaxCode ID to name
         try:
             # Query all TaxCodes
-            tax_codes = qb_client.get_tax_codes()
+            tax_codes = await outbound_executor.run(company_id, qb_client.get_tax_codes)
             for tax_code in tax_codes:
                 tax_code_id = tax_code.get('Id')
                 tax_code_name = tax_code.get('Name', '')
@@ -5388,7 +5738,7 @@ async def submit_invoice_to_efris(
         if customer_id:
             try:
                 print(f"[SUBMIT] Fetching customer {customer_id} from QuickBooks...")
-                qb_customer = qb_client.get_customer_by_id(customer_id)
+                qb_customer = await outbound_executor.run(company_id, qb_client.get_customer_by_id, customer_id)
                 print(f"[SUBMIT] Customer fetched successfully: {qb_customer.get('DisplayName', 'N/A')}")
             except Exception as e:
                 print(f"[SUBMIT] Warning: Could not fetch customer from QuickBooks: {e}")
@@ -5432,8 +5782,18 @@ async def submit_invoice_to_efris(
             line_item_tax_categories=line_item_tax_categories  # Pass tax categories (optional)
         )
         
+        # Pre-flight: reject locally what EFRIS would reject after a full round-trip
+        preflight_errors = preflight_invoice(db, company, efris_invoice.get('goodsDetails', []))
+        if preflight_errors:
+            return {
+                "success": False,
+                "error": "Invoice failed pre-flight validation - not sent to EFRIS",
+                "return_code": "PREFLIGHT",
+                "preflight_errors": preflight_errors
+            }
+        
         # Submit to EFRIS via T109
-        result = manager.upload_invoice(efris_invoice)
+        result = await outbound_executor.run(company_id, manager.upload_invoice, efris_invoice)
         
         # Parse response
         return_code = result.get('returnStateInfo', {}).get('returnCode')
@@ -5477,6 +5837,7 @@ async def submit_invoice_to_efris(
                 EFRISInvoice.company_id == company_id,
                 EFRISInvoice.qb_invoice_id == invoice_id
             ).first()
+            _release_import_copies(db, company_id, [fdn] if fdn else [])
             
             # Convert invoice_date to date object if it's a string
             invoice_date = invoice_data.get('TxnDate')
@@ -5521,7 +5882,7 @@ async def submit_invoice_to_efris(
                     total_amount=float(invoice_data.get('TotalAmt', 0)),
                     status='success',
                     fdn=fdn,
-                    invoice_no=fdn,
+                    invoice_no=fdn or None,
                     efris_invoice_id=efris_invoice_id,
                     buyer_legal_name=buyer_legal_name or qb_customer.get('DisplayName', ''),
                     buyer_business_name=buyer_business_name or qb_customer.get('CompanyName', ''),
@@ -5530,18 +5891,17 @@ async def submit_invoice_to_efris(
                     gross_amount=gross_amount or float(invoice_data.get('TotalAmt', 0)),
                     tax_amount=tax_amount,
                     net_amount=net_amount,
-                    efris_payload=efris_invoice,
-                    efris_response=result
+                    **archived_payloads(db, efris_invoice, result)
                 )
                 db.add(efris_inv)
             else:
                 efris_inv.status = 'success'
                 efris_inv.fdn = fdn
                 efris_inv.efris_invoice_id = efris_invoice_id
-                efris_inv.efris_payload = efris_invoice
-                efris_inv.efris_response = result
+                for column, value in archived_payloads(db, efris_invoice, result).items():
+                    setattr(efris_inv, column, value)
                 efris_inv.error_message = None
-                efris_inv.invoice_no = fdn
+                efris_inv.invoice_no = fdn or None
                 
                 # Update details if available
                 if buyer_legal_name:
@@ -5596,15 +5956,14 @@ async def submit_invoice_to_efris(
                     total_amount=float(invoice_data.get('TotalAmt', 0)),
                     status='failed',
                     error_message=error_msg,
-                    efris_payload=efris_invoice,
-                    efris_response=result
+                    **archived_payloads(db, efris_invoice, result)
                 )
                 db.add(efris_inv)
             else:
                 efris_inv.status = 'failed'
                 efris_inv.error_message = error_msg
-                efris_inv.efris_payload = efris_invoice
-                efris_inv.efris_response = result
+                for column, value in archived_payloads(db, efris_invoice, result).items():
+                    setattr(efris_inv, column, value)
             
             db.commit()
             
@@ -5635,7 +5994,7 @@ async def get_quickbooks_credit_memos(
         raise HTTPException(status_code=403, detail="Access denied")
     
     try:
-        credit_memos = qb_client.get_credit_memos(start_date=start_date, end_date=end_date)
+        credit_memos = await outbound_executor.run(company_id, qb_client.get_credit_memos, start_date=start_date, end_date=end_date)
         return {
             "count": len(credit_memos),
             "creditMemos": credit_memos
@@ -5657,7 +6016,7 @@ async def get_quickbooks_purchase_orders(
         raise HTTPException(status_code=403, detail="Access denied")
     
     try:
-        purchase_orders = qb_client.get_purchase_orders(start_date=start_date, end_date=end_date)
+        purchase_orders = await outbound_executor.run(company_id, qb_client.get_purchase_orders, start_date=start_date, end_date=end_date)
         return {
             "count": len(purchase_orders),
             "purchase_orders": purchase_orders
@@ -5694,7 +6053,7 @@ async def sync_purchase_orders_to_efris(
                 vendor = {}
                 if 'VendorRef' in po_data:
                     try:
-                        vendor = qb_client.get_vendor_by_id(po_data['VendorRef']['value'])
+                        vendor = await outbound_executor.run(company_id, qb_client.get_vendor_by_id, po_data['VendorRef']['value'])
                     except:
                         vendor = {'DisplayName': po_data['VendorRef'].get('name', 'Unknown')}
                 
@@ -5723,7 +6082,7 @@ async def sync_purchase_orders_to_efris(
                         })
                 
                 if stock_data["goodsStockInItem"]:
-                    result = manager.stock_increase(stock_data)
+                    result = await outbound_executor.run(company_id, manager.stock_increase, stock_data)
                     if result.get('returnStateInfo', {}).get('returnCode') == '00':
                         synced_count += 1
                     else:
@@ -5762,7 +6121,7 @@ async def import_qb_purchase_orders_to_db(
     
     try:
         # Fetch from QuickBooks
-        pos = qb_client.get_purchase_orders(start_date=start_date, end_date=end_date)
+        pos = await outbound_executor.run(company_id, qb_client.get_purchase_orders, start_date=start_date, end_date=end_date)
         
         saved_count = 0
         for po in pos:
@@ -5819,7 +6178,7 @@ async def get_saved_qb_purchase_orders(
     company_id: int,
     search: Optional[str] = Query(None),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get QB purchase orders saved in database with optional search"""
     if not verify_company_access(current_user, company_id, db):
@@ -5828,13 +6187,10 @@ async def get_saved_qb_purchase_orders(
     query = db.query(PurchaseOrder).filter(PurchaseOrder.company_id == company_id)
     
     if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (PurchaseOrder.qb_doc_number.ilike(search_pattern)) |
-            (PurchaseOrder.qb_vendor_name.ilike(search_pattern))
-        )
+        query = search_query(query, PurchaseOrder, search)
     
-    pos = query.order_by(PurchaseOrder.qb_txn_date.desc()).all()
+    # qb_data is part of this response, so load it with the rows instead of once per PO
+    pos = query.options(undefer(PurchaseOrder.qb_data)).order_by(PurchaseOrder.qb_txn_date.desc()).all()
     
     result = []
     for po in pos:
@@ -5875,7 +6231,7 @@ async def sync_selected_purchase_orders_to_efris(
             raise HTTPException(status_code=400, detail="No purchase order IDs provided")
         
         # Get the selected purchase orders from database
-        pos = db.query(PurchaseOrder).filter(
+        pos = db.query(PurchaseOrder).options(undefer(PurchaseOrder.qb_data)).filter(
             PurchaseOrder.company_id == company_id,
             PurchaseOrder.id.in_(po_ids)
         ).all()
@@ -5895,7 +6251,7 @@ async def sync_selected_purchase_orders_to_efris(
                 vendor_ref = po_data.get('VendorRef', {})
                 if vendor_ref and vendor_ref.get('value'):
                     try:
-                        vendor = qb_client.get_vendor_by_id(vendor_ref['value'])
+                        vendor = await outbound_executor.run(company_id, qb_client.get_vendor_by_id, vendor_ref['value'])
                     except:
                         vendor = {'DisplayName': vendor_ref.get('name', 'Unknown')}
                 else:
@@ -5942,7 +6298,7 @@ async def sync_selected_purchase_orders_to_efris(
                             else:
                                 # If not in database, try fetching from QuickBooks
                                 try:
-                                    qb_item = qb_client.get_item_by_id(item_id)
+                                    qb_item = await outbound_executor.run(company_id, qb_client.get_item_by_id, item_id)
                                     # Use Description field as product code
                                     if qb_item.get('Description'):
                                         goods_code = qb_item['Description']
@@ -5960,7 +6316,7 @@ async def sync_selected_purchase_orders_to_efris(
                             price_str = str(int(unit_price)) if unit_price == int(unit_price) else str(unit_price)
                             
                             # Look up EFRIS good to get commodityGoodsId and measureUnit
-                            efris_good = db.query(EFRISGood).filter(
+                            efris_good = db.query(EFRISGood).options(undefer(EFRISGood.efris_data)).filter(
                                 EFRISGood.company_id == company_id,
                                 EFRISGood.goods_code == goods_code
                             ).first()
@@ -5991,7 +6347,7 @@ async def sync_selected_purchase_orders_to_efris(
                     print(f"[T131] Sending stock increase to EFRIS...")
                     print(f"[T131] Full payload: {json.dumps(stock_data, indent=2)}")
                     
-                    result = manager.stock_increase(stock_data)
+                    result = await outbound_executor.run(company_id, manager.stock_increase, stock_data)
                     
                     return_code = result.get('returnStateInfo', {}).get('returnCode')
                     return_msg = result.get('returnStateInfo', {}).get('returnMessage', '')
@@ -6052,58 +6408,160 @@ async def sync_selected_purchase_orders_to_efris(
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/companies/{company_id}/qb-items/import")
-async def import_qb_items_to_db(
+# ========== BACKGROUND JOBS (jobs.py) ==========
+
+QB_IMPORT_PAGE_SIZE = int(os.getenv("QB_IMPORT_PAGE_SIZE", "100"))  # QuickBooks MAXRESULTS per page / checkpoint
+QB_REGISTER_BATCH_SIZE = int(os.getenv("QB_REGISTER_BATCH_SIZE", "50"))  # items per T130 call in a background job
+
+
+def _job_accepted(db: Session, company_id: int, job_type: str, current_user: User,
+                  params: Optional[dict] = None) -> JSONResponse:
+    """202 with the queued (or identical, already active) job - poll /jobs/{job_id} for progress"""
+    job = enqueue(db, company_id, job_type, params, user_id=current_user.id)
+    return JSONResponse(status_code=202, content=job_summary(job))
+
+
+def _qb_txn_date(record: dict) -> Optional[datetime]:
+    """QuickBooks TxnDate (YYYY-MM-DD), None if missing or malformed"""
+    try:
+        return datetime.strptime(record['TxnDate'], '%Y-%m-%d')
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _import_qb_pages(ctx: JobContext, fetch_page, model, id_column: str, label: str,
+                     fields, new_defaults: Optional[dict] = None) -> dict:
+    """
+    Page through a QuickBooks list (STARTPOSITION / MAXRESULTS) into model rows keyed by
+    (company_id, id_column): existing rows get fields(record), new rows are inserted.
+    Each page is committed with its checkpoint, so a restarted job continues from there.
+    """
+    start = ctx.checkpoint.get("start_position", 1)
+    new = ctx.checkpoint.get("new", 0)
+    updated = ctx.checkpoint.get("updated", 0)
+    key = getattr(model, id_column)
+    
+    while True:
+        records = fetch_page(max_results=QB_IMPORT_PAGE_SIZE, start_position=start)
+        ids = [record.get('Id') for record in records]
+        existing = {getattr(row, id_column): row for row in ctx.db.query(model).filter(
+            model.company_id == ctx.company_id, key.in_(ids)
+        )} if ids else {}
+        
+        for record in records:
+            row = existing.get(record.get('Id'))
+            if row is not None:
+                for column, value in fields(record).items():
+                    setattr(row, column, value)
+                row.updated_at = datetime.now()
+                updated += 1
+            else:
+                row = model(company_id=ctx.company_id, **{id_column: record.get('Id')},
+                            **fields(record), **(new_defaults or {}))
+                ctx.db.add(row)
+                existing[record.get('Id')] = row
+                new += 1
+        
+        start += len(records)
+        ctx.progress(new + updated, message=f"Imported {new + updated} {label}",
+                     checkpoint={"start_position": start, "new": new, "updated": updated})
+        if len(records) < QB_IMPORT_PAGE_SIZE:
+            break
+    
+    return {
+        "success": True,
+        "message": f"Imported {new + updated} {label} ({new} new, {updated} updated)",
+        "count": new + updated
+    }
+
+
+@app.get("/api/companies/{company_id}/jobs")
+async def list_jobs(
     company_id: int,
+    status: Optional[str] = Query(None, description="queued, running, succeeded, failed or cancelled"),
+    limit: int = Query(20, ge=1, le=100),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Fetch QB items and save to database"""
+    """Recent background jobs for a company, newest first"""
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    try:
-        # Fetch from QuickBooks
-        items = qb_client.get_all_items()
-        
-        saved_count = 0
-        for item in items:
-            # Check if already exists
-            existing = db.query(Product).filter(
-                Product.company_id == company_id,
-                Product.qb_item_id == item.get('Id')
-            ).first()
-            
-            if existing:
-                # Update existing
-                existing.qb_name = item.get('Name')
-                existing.qb_sku = item.get('Sku')
-                existing.qb_description = item.get('Description')
-                existing.qb_unit_price = float(item.get('UnitPrice', 0))
-                existing.qb_type = item.get('Type')
-                existing.updated_at = datetime.now()
-            else:
-                # Create new
-                product = Product(
-                    company_id=company_id,
-                    qb_item_id=item.get('Id'),
-                    qb_name=item.get('Name'),
-                    qb_sku=item.get('Sku'),
-                    qb_description=item.get('Description'),
-                    qb_unit_price=float(item.get('UnitPrice', 0)),
-                    qb_type=item.get('Type'),
-                    efris_status='Pending Registration'
-                )
-                db.add(product)
-                saved_count += 1
-        
-        db.commit()
-        
-        return {
-            "success": True,
-            "message": f"Imported {len(items)} items ({saved_count} new, {len(items)-saved_count} updated)",
-            "count": len(items)
-        }
+    query = db.query(BackgroundJob).filter(BackgroundJob.company_id == company_id)
+    if status:
+        query = query.filter(BackgroundJob.status == status)
+    jobs = query.order_by(BackgroundJob.created_at.desc(), BackgroundJob.id.desc()).limit(limit).all()
+    return [job_summary(job) for job in jobs]
+
+
+def _company_job(db: Session, company_id: int, job_id: int) -> BackgroundJob:
+    job = db.query(BackgroundJob).filter(
+        BackgroundJob.id == job_id,
+        BackgroundJob.company_id == company_id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/companies/{company_id}/jobs/{job_id}")
+async def get_job(
+    company_id: int,
+    job_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Status and progress of a background job (primary database - replicas may lag behind)"""
+    if not verify_company_access(current_user, company_id, db):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return job_summary(_company_job(db, company_id, job_id))
+
+
+@app.post("/api/companies/{company_id}/jobs/{job_id}/cancel")
+async def cancel_job(
+    company_id: int,
+    job_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Cancel a queued or running job (a running job stops after its current page)"""
+    if not verify_company_access(current_user, company_id, db):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    job = _company_job(db, company_id, job_id)
+    if not cancel(db, job):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job_summary(job)
+
+
+@job_handler("qb_items_import")
+def _import_qb_items_job(ctx: JobContext) -> dict:
+    return _import_qb_pages(ctx, qb_client.get_items, Product, "qb_item_id", "items", lambda item: {
+        "qb_name": item.get('Name'),
+        "qb_sku": item.get('Sku'),
+        "qb_description": item.get('Description'),
+        "qb_unit_price": float(item.get('UnitPrice', 0)),
+        "qb_type": item.get('Type')
+    }, new_defaults={"efris_status": 'Pending Registration'})
+
+
+@app.post("/api/companies/{company_id}/qb-items/import")
+async def import_qb_items_to_db(
+    company_id: int,
+    background: bool = Query(False, description="Run as a background job and return it (poll /jobs/{job_id})"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Fetch QB items and save to database"""
+    if not verify_company_access(current_user, company_id, db):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if background:
+        return _job_accepted(db, company_id, "qb_items_import", current_user)
+    
+    try:
+        return await outbound_executor.run(company_id, run_inline, "qb_items_import", db, company_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -6113,8 +6571,11 @@ async def import_qb_items_to_db(
 async def get_saved_qb_items(
     company_id: int,
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size (omit for all rows)"),
+    include_total: bool = Query(False, description="Include total (approximate for large tenants)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get QB items saved in database with EFRIS registration status and optional search"""
     if not verify_company_access(current_user, company_id, db):
@@ -6122,15 +6583,8 @@ async def get_saved_qb_items(
     
     query = db.query(Product).filter(Product.company_id == company_id)
     
-    if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (Product.qb_name.ilike(search_pattern)) |
-            (Product.qb_sku.ilike(search_pattern)) |
-            (Product.qb_description.ilike(search_pattern))
-        )
-    
-    products = query.order_by(Product.updated_at.desc()).all()
+    query, page = _list_page(query, Product, search, cursor, limit)
+    products = page.items
     
     # Get all EFRIS goods for this company to check registration status
     efris_goods = db.query(EFRISGood).filter(EFRISGood.company_id == company_id).all()
@@ -6169,7 +6623,9 @@ async def get_saved_qb_items(
         "count": len(products),
         "registered_count": sum(1 for item in items_with_status if item["EfrisStatus"] == "Registered"),
         "pending_count": sum(1 for item in items_with_status if item["EfrisStatus"] == "Pending"),
-        "items": items_with_status
+        "items": items_with_status,
+        "next_cursor": page.next_cursor,
+        **_page_total(query, include_total)
     }
 
 
@@ -6232,150 +6688,178 @@ async def update_item_efris_metadata(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/companies/{company_id}/qb-items/register-to-efris")
-async def register_qb_items_to_efris(
-    company_id: int,
-    item_ids: List[str] = Body(..., embed=True),
-    default_category_id: str = Body("50202306"),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Register selected QB items to EFRIS"""
-    if not verify_company_access(current_user, company_id, db):
-        raise HTTPException(status_code=403, detail="Access denied")
+@bulk_call
+def _register_qb_items(db: Session, company: Company, manager: EfrisManager, item_ids: List[str],
+                       default_category_id: str) -> dict:
+    """T130 registration of the given QB items (blocking - run in outbound_executor or a job)"""
+    company_id = company.id
+    # Get the selected products from database
+    products = db.query(Product).filter(
+        Product.company_id == company_id,
+        Product.qb_item_id.in_(item_ids)
+    ).all()
     
-    company = db.query(Company).filter(Company.id == company_id).first()
-    manager = get_efris_manager(company)
+    if not products:
+        raise HTTPException(status_code=404, detail="No products found")
     
-    try:
-        # Get the selected products from database
-        products = db.query(Product).filter(
-            Product.company_id == company_id,
-            Product.qb_item_id.in_(item_ids)
-        ).all()
+    # Convert to EFRIS format
+    efris_products = []
+    for p in products:
+        # Use efris_product_code if set, otherwise Description, fallback to Name
+        goods_code = p.efris_product_code or p.qb_description or p.qb_name or ""
+        is_service = p.qb_type == "Service"
+        unit_price = p.qb_unit_price or 0
+        
+        # Use saved EFRIS metadata if available
+        measure_unit = p.efris_unit_of_measure or ("102" if is_service else "101")
+        commodity_code = p.efris_commodity_code or p.qb_sku or default_category_id
+        
+        # Determine tax category based on product settings (used as DEFAULT during registration)
+        # Note: During invoice fiscalization, user can override this per line item
+        # 01 = Standard rated (18% VAT)
+        # 02 = Zero-rated (0% VAT)
+        # 03 = Tax exempt (No VAT)
+        if p.is_zero_rated:
+            tax_category = "02"
+        elif p.is_exempt:
+            tax_category = "03"
+        else:
+            tax_category = "01"  # Default to standard rate
+        
+        # For excise items, get the required unit from excise duty reference
+        piece_measure_unit = measure_unit
+        if p.has_excise and p.excise_duty_code:
+            excise_unit = get_excise_unit(p.excise_duty_code, company_id, db)
+            if excise_unit:  # Use excise unit if available
+                piece_measure_unit = excise_unit
+                print(f"[T130] Excise item: {p.qb_name} - using excise unit: {excise_unit} for pieceMeasureUnit")
+        
+        # Check if item already exists in EFRIS by checking EFRISGood table
+        existing_efris_good = db.query(EFRISGood).filter(
+            EFRISGood.company_id == company_id,
+            EFRISGood.goods_code == goods_code
+        ).first()
         
-        if not products:
-            raise HTTPException(status_code=404, detail="No products found")
+        # Use operationType 102 (update) if exists, 101 (new) if not
+        operation_type = "102" if existing_efris_good else "101"
         
-        # Convert to EFRIS format
-        efris_products = []
-        for p in products:
-            # Use efris_product_code if set, otherwise Description, fallback to Name
-            goods_code = p.efris_product_code or p.qb_description or p.qb_name or ""
-            is_service = p.qb_type == "Service"
-            unit_price = p.qb_unit_price or 0
-            
-            # Use saved EFRIS metadata if available
-            measure_unit = p.efris_unit_of_measure or ("102" if is_service else "101")
-            commodity_code = p.efris_commodity_code or p.qb_sku or default_category_id
-            
-            # Determine tax category based on product settings (used as DEFAULT during registration)
-            # Note: During invoice fiscalization, user can override this per line item
-            # 01 = Standard rated (18% VAT)
-            # 02 = Zero-rated (0% VAT)
-            # 03 = Tax exempt (No VAT)
-            if p.is_zero_rated:
-                tax_category = "02"
-            elif p.is_exempt:
-                tax_category = "03"
-            else:
-                tax_category = "01"  # Default to standard rate
-            
-            # For excise items, get the required unit from excise duty reference
-            piece_measure_unit = measure_unit
-            if p.has_excise and p.excise_duty_code:
-                excise_unit = get_excise_unit(p.excise_duty_code, company_id, db)
-                if excise_unit:  # Use excise unit if available
-                    piece_measure_unit = excise_unit
-                    print(f"[T130] Excise item: {p.qb_name} - using excise unit: {excise_unit} for pieceMeasureUnit")
-            
-            # Check if item already exists in EFRIS by checking EFRISGood table
-            existing_efris_good = db.query(EFRISGood).filter(
-                EFRISGood.company_id == company_id,
-                EFRISGood.goods_code == goods_code
-            ).first()
-            
-            # Use operationType 102 (update) if exists, 101 (new) if not
-            operation_type = "102" if existing_efris_good else "101"
-            
-            efris_product = {
-                "operationType": operation_type,
-                "goodsName": p.qb_name or "",
-                "goodsCode": goods_code,
-                "measureUnit": measure_unit,
-                "unitPrice": str(unit_price),
-                "currency": "101",  # UGX
-                "commodityCategoryId": commodity_code,
-                "haveExciseTax": "101" if p.has_excise else "102",
-                "taxCategoryCode": tax_category,  # 01=Standard, 02=Zero-rated, 03=Exempt
-                "goodsTypeCode": "101",  # Always 101 for goods/services (102 is for fuel)
-                "serviceMark": "101" if is_service else "102",  # 101=Service, 102=Goods
-                "description": goods_code,
-                "havePieceUnit": "101",
-                "pieceMeasureUnit": piece_measure_unit,  # Use excise unit if excise item
-                "pieceUnitPrice": str(unit_price),
-                "packageScaledValue": "1",
-                "pieceScaledValue": "1"
-            }
-            
-            # Stock settings
-            # Note: T130 doesn't allow opening stock (must be set via T131 after registration)
-            opening_stock = 0
-            if is_service:
-                efris_product["stockPrewarning"] = "0"
-                efris_product["stockPrequantity"] = "0"  # Services don't have stock
-            else:
-                efris_product["stockPrewarning"] = "10"
-                # Note: EFRIS doesn't allow opening stock in T130, must use T131 after registration
-                efris_product["stockPrequantity"] = "0"  # Always 0 for T130
-            
-            # Excise duty
-            if p.has_excise and p.excise_duty_code:
-                efris_product["exciseDutyCode"] = p.excise_duty_code
-            
-            efris_products.append(efris_product)
+        efris_product = {
+            "operationType": operation_type,
+            "goodsName": p.qb_name or "",
+            "goodsCode": goods_code,
+            "measureUnit": measure_unit,
+            "unitPrice": str(unit_price),
+            "currency": "101",  # UGX
+            "commodityCategoryId": commodity_code,
+            "haveExciseTax": "101" if p.has_excise else "102",
+            "taxCategoryCode": tax_category,  # 01=Standard, 02=Zero-rated, 03=Exempt
+            "goodsTypeCode": "101",  # Always 101 for goods/services (102 is for fuel)
+            "serviceMark": "101" if is_service else "102",  # 101=Service, 102=Goods
+            "description": goods_code,
+            "havePieceUnit": "101",
+            "pieceMeasureUnit": piece_measure_unit,  # Use excise unit if excise item
+            "pieceUnitPrice": str(unit_price),
+            "packageScaledValue": "1",
+            "pieceScaledValue": "1"
+        }
         
-        # Upload to EFRIS
-        result = manager.upload_goods(efris_products)
+        # Stock settings
+        # Note: T130 doesn't allow opening stock (must be set via T131 after registration)
+        opening_stock = 0
+        if is_service:
+            efris_product["stockPrewarning"] = "0"
+            efris_product["stockPrequantity"] = "0"  # Services don't have stock
+        else:
+            efris_product["stockPrewarning"] = "10"
+            # Note: EFRIS doesn't allow opening stock in T130, must use T131 after registration
+            efris_product["stockPrequantity"] = "0"  # Always 0 for T130
         
-        # Check if successful and update database
-        success_count = 0
-        failed_items = []
-        items_to_retry = []
+        # Excise duty
+        if p.has_excise and p.excise_duty_code:
+            efris_product["exciseDutyCode"] = p.excise_duty_code
         
-        print(f"[Register Items] EFRIS Response: {json.dumps(result, indent=2)[:1000]}")
+        efris_products.append(efris_product)
+    
+    # Upload to EFRIS
+    result = manager.upload_goods(efris_products)
+    
+    # Check if successful and update database
+    success_count = 0
+    failed_items = []
+    items_to_retry = []
+    
+    print(f"[Register Items] EFRIS Response: {json.dumps(result, indent=2)[:1000]}")
+    
+    # Check for partial failure (returnCode 45) or success (00)
+    return_code = result.get('returnStateInfo', {}).get('returnCode')
+    
+    if return_code in ['00', '45']:  # Success or partial failure
+        # Parse the decrypted content to get individual item results
+        decrypted = result.get('data', {}).get('decrypted_content', [])
         
-        # Check for partial failure (returnCode 45) or success (00)
-        return_code = result.get('returnStateInfo', {}).get('returnCode')
+        print(f"[Register Items] Decrypted content type: {type(decrypted)}")
+        print(f"[Register Items] Decrypted content: {decrypted}")
         
-        if return_code in ['00', '45']:  # Success or partial failure
-            # Parse the decrypted content to get individual item results
-            decrypted = result.get('data', {}).get('decrypted_content', [])
-            
-            print(f"[Register Items] Decrypted content type: {type(decrypted)}")
-            print(f"[Register Items] Decrypted content: {decrypted}")
-            
-            if isinstance(decrypted, list):
-                # If empty array and return code is 00, all items succeeded
-                if len(decrypted) == 0 and return_code == '00':
-                    print(f"[Register Items] Empty response with code 00 - all items succeeded")
-                    for idx, product in enumerate(products):
+        if isinstance(decrypted, list):
+            # If empty array and return code is 00, all items succeeded
+            if len(decrypted) == 0 and return_code == '00':
+                print(f"[Register Items] Empty response with code 00 - all items succeeded")
+                for idx, product in enumerate(products):
+                    product.efris_status = "Registered"
+                    product.efris_product_code = efris_products[idx]['goodsCode']
+                    success_count += 1
+                    
+                    # Update or create EFRISGood
+                    efris_good = db.query(EFRISGood).filter(
+                        EFRISGood.company_id == company_id,
+                        EFRISGood.goods_code == efris_products[idx]['goodsCode']
+                    ).first()
+                    
+                    if efris_good:
+                        # Update existing
+                        efris_good.goods_name = efris_products[idx]['goodsName']
+                        efris_good.unit_price = float(efris_products[idx]['unitPrice'])
+                    else:
+                        # Create new
+                        efris_good = EFRISGood(
+                            company_id=company_id,
+                            goods_code=efris_products[idx]['goodsCode'],
+                            goods_name=efris_products[idx]['goodsName'],
+                            commodity_category_code=efris_products[idx]['commodityCategoryId'],
+                            commodity_category_name="",
+                            unit_price=float(efris_products[idx]['unitPrice']),
+                            currency="UGX",
+                            tax_rate=0.18,
+                            have_excise_tax=efris_products[idx]['haveExciseTax'],
+                            stock=0,
+                            efris_data={}
+                        )
+                        db.add(efris_good)
+            
+            for idx, item_result in enumerate(decrypted):
+                if idx < len(products):
+                    product = products[idx]
+                    
+                    result_code = item_result.get('resultCode') or item_result.get('returnCode')
+                    result_msg = item_result.get('resultMsg') or item_result.get('returnMessage')
+                    
+                    print(f"[Register Items] Item {idx}: {product.qb_name} - Code: {result_code}, Msg: {result_msg}")
+                    
+                    # Check if this specific item succeeded
+                    if result_code == '00' or result_msg == 'SUCCESS':
+                        # Update product status in database
                         product.efris_status = "Registered"
+                        product.efris_id = item_result.get('id', '')
                         product.efris_product_code = efris_products[idx]['goodsCode']
                         success_count += 1
                         
-                        # Update or create EFRISGood
+                        # Also save to EFRISGood table
                         efris_good = db.query(EFRISGood).filter(
                             EFRISGood.company_id == company_id,
                             EFRISGood.goods_code == efris_products[idx]['goodsCode']
                         ).first()
                         
-                        if efris_good:
-                            # Update existing
-                            efris_good.goods_name = efris_products[idx]['goodsName']
-                            efris_good.unit_price = float(efris_products[idx]['unitPrice'])
-                        else:
-                            # Create new
+                        if not efris_good:
                             efris_good = EFRISGood(
                                 company_id=company_id,
                                 goods_code=efris_products[idx]['goodsCode'],
@@ -6384,242 +6868,262 @@ async def register_qb_items_to_efris(
                                 commodity_category_name="",
                                 unit_price=float(efris_products[idx]['unitPrice']),
                                 currency="UGX",
-                                tax_rate=0.18,
+                                tax_rate=0.18,  # Default 18%
                                 have_excise_tax=efris_products[idx]['haveExciseTax'],
                                 stock=0,
-                                efris_data={}
+                                efris_data=item_result
                             )
                             db.add(efris_good)
+                    elif result_code == '602':
+                        # Item already exists, retry with operationType 102
+                        print(f"[Register Items] Item already exists, will retry with update (operationType 102)")
+                        retry_product = efris_products[idx].copy()
+                        retry_product['operationType'] = '102'
+                        items_to_retry.append((idx, product, retry_product))
+                    else:
+                        failed_items.append({
+                            "name": product.qb_name,
+                            "error": result_msg or 'Unknown error'
+                        })
+        
+        # Retry items that returned 602 with operationType 102
+        if items_to_retry:
+            print(f"[Register Items] Retrying {len(items_to_retry)} items with operationType 102")
+            retry_products_list = [item[2] for item in items_to_retry]
+            retry_result = manager.upload_goods(retry_products_list)
+            
+            print(f"[Register Items] Retry result: {json.dumps(retry_result, indent=2)[:1000]}")
+            
+            if retry_result.get('returnStateInfo', {}).get('returnCode') in ['00', '45']:
+                retry_decrypted = retry_result.get('data', {}).get('decrypted_content', [])
                 
-                for idx, item_result in enumerate(decrypted):
-                    if idx < len(products):
-                        product = products[idx]
-                        
-                        result_code = item_result.get('resultCode') or item_result.get('returnCode')
-                        result_msg = item_result.get('resultMsg') or item_result.get('returnMessage')
-                        
-                        print(f"[Register Items] Item {idx}: {product.qb_name} - Code: {result_code}, Msg: {result_msg}")
-                        
-                        # Check if this specific item succeeded
-                        if result_code == '00' or result_msg == 'SUCCESS':
-                            # Update product status in database
+                # Handle empty array response (means all succeeded)
+                if isinstance(retry_decrypted, list):
+                    # If decrypted is empty list, it means success for all items
+                    if len(retry_decrypted) == 0 and retry_result.get('returnStateInfo', {}).get('returnCode') == '00':
+                        print(f"[Register Items] Retry successful (empty response means success)")
+                        for retry_idx, (orig_idx, product, retry_product) in enumerate(items_to_retry):
                             product.efris_status = "Registered"
-                            product.efris_id = item_result.get('id', '')
-                            product.efris_product_code = efris_products[idx]['goodsCode']
+                            product.efris_product_code = retry_product['goodsCode']
                             success_count += 1
                             
-                            # Also save to EFRISGood table
+                            # Update or create EFRISGood
                             efris_good = db.query(EFRISGood).filter(
                                 EFRISGood.company_id == company_id,
-                                EFRISGood.goods_code == efris_products[idx]['goodsCode']
+                                EFRISGood.goods_code == retry_product['goodsCode']
                             ).first()
                             
-                            if not efris_good:
+                            if efris_good:
+                                # Update existing
+                                efris_good.goods_name = retry_product['goodsName']
+                                efris_good.unit_price = float(retry_product['unitPrice'])
+                            else:
+                                # Create new
                                 efris_good = EFRISGood(
                                     company_id=company_id,
-                                    goods_code=efris_products[idx]['goodsCode'],
-                                    goods_name=efris_products[idx]['goodsName'],
-                                    commodity_category_code=efris_products[idx]['commodityCategoryId'],
+                                    goods_code=retry_product['goodsCode'],
+                                    goods_name=retry_product['goodsName'],
+                                    commodity_category_code=retry_product['commodityCategoryId'],
                                     commodity_category_name="",
-                                    unit_price=float(efris_products[idx]['unitPrice']),
+                                    unit_price=float(retry_product['unitPrice']),
                                     currency="UGX",
-                                    tax_rate=0.18,  # Default 18%
-                                    have_excise_tax=efris_products[idx]['haveExciseTax'],
+                                    tax_rate=0.18,
+                                    have_excise_tax=retry_product['haveExciseTax'],
                                     stock=0,
-                                    efris_data=item_result
+                                    efris_data={}
                                 )
                                 db.add(efris_good)
-                        elif result_code == '602':
-                            # Item already exists, retry with operationType 102
-                            print(f"[Register Items] Item already exists, will retry with update (operationType 102)")
-                            retry_product = efris_products[idx].copy()
-                            retry_product['operationType'] = '102'
-                            items_to_retry.append((idx, product, retry_product))
-                        else:
-                            failed_items.append({
-                                "name": product.qb_name,
-                                "error": result_msg or 'Unknown error'
-                            })
-            
-            # Retry items that returned 602 with operationType 102
-            if items_to_retry:
-                print(f"[Register Items] Retrying {len(items_to_retry)} items with operationType 102")
-                retry_products_list = [item[2] for item in items_to_retry]
-                retry_result = manager.upload_goods(retry_products_list)
-                
-                print(f"[Register Items] Retry result: {json.dumps(retry_result, indent=2)[:1000]}")
-                
-                if retry_result.get('returnStateInfo', {}).get('returnCode') in ['00', '45']:
-                    retry_decrypted = retry_result.get('data', {}).get('decrypted_content', [])
-                    
-                    # Handle empty array response (means all succeeded)
-                    if isinstance(retry_decrypted, list):
-                        # If decrypted is empty list, it means success for all items
-                        if len(retry_decrypted) == 0 and retry_result.get('returnStateInfo', {}).get('returnCode') == '00':
-                            print(f"[Register Items] Retry successful (empty response means success)")
-                            for retry_idx, (orig_idx, product, retry_product) in enumerate(items_to_retry):
-                                product.efris_status = "Registered"
-                                product.efris_product_code = retry_product['goodsCode']
-                                success_count += 1
-                                
-                                # Update or create EFRISGood
-                                efris_good = db.query(EFRISGood).filter(
-                                    EFRISGood.company_id == company_id,
-                                    EFRISGood.goods_code == retry_product['goodsCode']
-                                ).first()
-                                
-                                if efris_good:
-                                    # Update existing
-                                    efris_good.goods_name = retry_product['goodsName']
-                                    efris_good.unit_price = float(retry_product['unitPrice'])
-                                else:
-                                    # Create new
-                                    efris_good = EFRISGood(
-                                        company_id=company_id,
-                                        goods_code=retry_product['goodsCode'],
-                                        goods_name=retry_product['goodsName'],
-                                        commodity_category_code=retry_product['commodityCategoryId'],
-                                        commodity_category_name="",
-                                        unit_price=float(retry_product['unitPrice']),
-                                        currency="UGX",
-                                        tax_rate=0.18,
-                                        have_excise_tax=retry_product['haveExciseTax'],
-                                        stock=0,
-                                        efris_data={}
-                                    )
-                                    db.add(efris_good)
+                            
+                            # Remove from failed items if it was added
+                            failed_items = [f for f in failed_items if f.get('name') != product.qb_name]
+                    else:
+                        # Process individual retry results
+                        for retry_idx, (orig_idx, product, retry_product) in enumerate(items_to_retry):
+                            if retry_idx < len(retry_decrypted):
+                                retry_item_result = retry_decrypted[retry_idx]
+                                retry_code = retry_item_result.get('resultCode') or retry_item_result.get('returnCode')
+                                retry_msg = retry_item_result.get('resultMsg') or retry_item_result.get('returnMessage')
                                 
-                                # Remove from failed items if it was added
-                                failed_items = [f for f in failed_items if f.get('name') != product.qb_name]
-                        else:
-                            # Process individual retry results
-                            for retry_idx, (orig_idx, product, retry_product) in enumerate(items_to_retry):
-                                if retry_idx < len(retry_decrypted):
-                                    retry_item_result = retry_decrypted[retry_idx]
-                                    retry_code = retry_item_result.get('resultCode') or retry_item_result.get('returnCode')
-                                    retry_msg = retry_item_result.get('resultMsg') or retry_item_result.get('returnMessage')
+                                if retry_code == '00' or retry_msg == 'SUCCESS':
+                                    product.efris_status = "Registered"
+                                    product.efris_id = retry_item_result.get('id', '')
+                                    product.efris_product_code = retry_product['goodsCode']
+                                    success_count += 1
+                                    
+                                    # Update or create EFRISGood
+                                    efris_good = db.query(EFRISGood).filter(
+                                        EFRISGood.company_id == company_id,
+                                        EFRISGood.goods_code == retry_product['goodsCode']
+                                    ).first()
                                     
-                                    if retry_code == '00' or retry_msg == 'SUCCESS':
-                                        product.efris_status = "Registered"
-                                        product.efris_id = retry_item_result.get('id', '')
-                                        product.efris_product_code = retry_product['goodsCode']
-                                        success_count += 1
-                                        
-                                        # Update or create EFRISGood
-                                        efris_good = db.query(EFRISGood).filter(
-                                            EFRISGood.company_id == company_id,
-                                            EFRISGood.goods_code == retry_product['goodsCode']
-                                        ).first()
-                                        
-                                        if efris_good:
-                                            # Update existing
-                                            efris_good.goods_name = retry_product['goodsName']
-                                            efris_good.unit_price = float(retry_product['unitPrice'])
-                                        else:
-                                            # Create new
-                                            efris_good = EFRISGood(
-                                                company_id=company_id,
-                                                goods_code=retry_product['goodsCode'],
-                                                goods_name=retry_product['goodsName'],
-                                                commodity_category_code=retry_product['commodityCategoryId'],
-                                                commodity_category_name="",
-                                                unit_price=float(retry_product['unitPrice']),
-                                                currency="UGX",
-                                                tax_rate=0.18,
-                                                have_excise_tax=retry_product['haveExciseTax'],
-                                                stock=0,
-                                                efris_data=retry_item_result
-                                            )
-                                            db.add(efris_good)
-                                        
-                                        # Remove from failed items if it was added
-                                        failed_items = [f for f in failed_items if f.get('name') != product.qb_name]
+                                    if efris_good:
+                                        # Update existing
+                                        efris_good.goods_name = retry_product['goodsName']
+                                        efris_good.unit_price = float(retry_product['unitPrice'])
                                     else:
-                                        failed_items.append({
-                                            "name": product.qb_name,
-                                            "error": f"Retry failed: {retry_msg or 'Unknown error'}"
-                                        })
-                else:
-                    # Retry itself failed
-                    print(f"[Register Items] Retry failed with code: {retry_result.get('returnStateInfo', {}).get('returnCode')}")
-                    for retry_idx, (orig_idx, product, retry_product) in enumerate(items_to_retry):
-                        if not any(f.get('name') == product.qb_name for f in failed_items):
-                            failed_items.append({
-                                "name": product.qb_name,
-                                "error": f"Retry failed: {retry_result.get('returnStateInfo', {}).get('returnMessage', 'Unknown error')}"
-                            })
-            
-            # After successful registration, add opening stock for items that have QtyOnHand > 0
-            # EFRIS requires T131 (Stock Increase) to set initial stock, not T130
-            # NOTE: Product model doesn't have qb_qty_on_hand field - would need to fetch from QB if needed
-            items_with_opening_stock = []
-            # Commenting out for now - opening stock would need to be set separately via T131
-            # for idx, product in enumerate(products):
-            #     if product.efris_status == "Registered":
-            #         items_with_opening_stock.append({
-            #             "product": product,
-            #             "goodsCode": efris_products[idx]['goodsCode'],
-            #             "quantity": 0,  # Would need to get from QuickBooks
-            #             "unitPrice": product.qb_unit_price or 0
-            #         })
-            
-            if items_with_opening_stock:
-                print(f"[Register Items] Adding opening stock for {len(items_with_opening_stock)} items via T131")
-                try:
-                    # Prepare T131 stock increase request
-                    stock_data = {
-                        "goodsStockIn": {
-                            "operationType": "101",  # Stock increase
-                            "supplierTin": company.tin or "",
-                            "supplierName": company.name or "Opening Stock",
-                            "remarks": "Opening stock - Initial inventory",
-                            "stockInDate": datetime.now().strftime("%Y-%m-%d"),
-                            "stockInType": "101",  # 101=Opening Stock
-                            "productionBatchNo": "",
-                            "productionDate": ""
-                        },
-                        "goodsStockInItem": [
-                            {
-                                "goodsCode": item["goodsCode"],
-                                "quantity": item["quantity"],
-                                "unitPrice": item["unitPrice"]
-                            }
-                            for item in items_with_opening_stock
-                        ]
-                    }
-                    
-                    stock_result = manager.stock_increase(stock_data)
-                    print(f"[Register Items] Opening stock result: {json.dumps(stock_result, indent=2)[:500]}")
-                    
-                    # Update stock in EFRISGood table
-                    if stock_result.get('returnStateInfo', {}).get('returnCode') == '00':
-                        for item in items_with_opening_stock:
-                            efris_good = db.query(EFRISGood).filter(
-                                EFRISGood.company_id == company_id,
-                                EFRISGood.goods_code == item["goodsCode"]
-                            ).first()
-                            if efris_good:
-                                efris_good.stock = item["quantity"]
-                        print(f"[Register Items] Successfully added opening stock for {len(items_with_opening_stock)} items")
-                except Exception as stock_err:
-                    print(f"[Register Items] Warning: Failed to add opening stock: {stock_err}")
-                    # Don't fail the entire registration if opening stock fails
-            
-            db.commit()
-        else:
-            # Entire batch failed
-            error_msg = result.get('returnStateInfo', {}).get('returnMessage', 'Unknown error')
-            print(f"[Register Items] Batch failed: {error_msg}")
-            failed_items = [{"name": p.qb_name, "error": error_msg} for p in products]
+                                        # Create new
+                                        efris_good = EFRISGood(
+                                            company_id=company_id,
+                                            goods_code=retry_product['goodsCode'],
+                                            goods_name=retry_product['goodsName'],
+                                            commodity_category_code=retry_product['commodityCategoryId'],
+                                            commodity_category_name="",
+                                            unit_price=float(retry_product['unitPrice']),
+                                            currency="UGX",
+                                            tax_rate=0.18,
+                                            have_excise_tax=retry_product['haveExciseTax'],
+                                            stock=0,
+                                            efris_data=retry_item_result
+                                        )
+                                        db.add(efris_good)
+                                    
+                                    # Remove from failed items if it was added
+                                    failed_items = [f for f in failed_items if f.get('name') != product.qb_name]
+                                else:
+                                    failed_items.append({
+                                        "name": product.qb_name,
+                                        "error": f"Retry failed: {retry_msg or 'Unknown error'}"
+                                    })
+            else:
+                # Retry itself failed
+                print(f"[Register Items] Retry failed with code: {retry_result.get('returnStateInfo', {}).get('returnCode')}")
+                for retry_idx, (orig_idx, product, retry_product) in enumerate(items_to_retry):
+                    if not any(f.get('name') == product.qb_name for f in failed_items):
+                        failed_items.append({
+                            "name": product.qb_name,
+                            "error": f"Retry failed: {retry_result.get('returnStateInfo', {}).get('returnMessage', 'Unknown error')}"
+                        })
         
-        return {
-            "success_count": success_count,
-            "failed_count": len(failed_items),
-            "failed_items": failed_items,
-            "message": f"Successfully registered {success_count} out of {len(products)} items to EFRIS",
-            "efris_response": result
-        }
+        # After successful registration, add opening stock for items that have QtyOnHand > 0
+        # EFRIS requires T131 (Stock Increase) to set initial stock, not T130
+        # NOTE: Product model doesn't have qb_qty_on_hand field - would need to fetch from QB if needed
+        items_with_opening_stock = []
+        # Commenting out for now - opening stock would need to be set separately via T131
+        # for idx, product in enumerate(products):
+        #     if product.efris_status == "Registered":
+        #         items_with_opening_stock.append({
+        #             "product": product,
+        #             "goodsCode": efris_products[idx]['goodsCode'],
+        #             "quantity": 0,  # Would need to get from QuickBooks
+        #             "unitPrice": product.qb_unit_price or 0
+        #         })
+        
+        if items_with_opening_stock:
+            print(f"[Register Items] Adding opening stock for {len(items_with_opening_stock)} items via T131")
+            try:
+                # Prepare T131 stock increase request
+                stock_data = {
+                    "goodsStockIn": {
+                        "operationType": "101",  # Stock increase
+                        "supplierTin": company.tin or "",
+                        "supplierName": company.name or "Opening Stock",
+                        "remarks": "Opening stock - Initial inventory",
+                        "stockInDate": datetime.now().strftime("%Y-%m-%d"),
+                        "stockInType": "101",  # 101=Opening Stock
+                        "productionBatchNo": "",
+                        "productionDate": ""
+                    },
+                    "goodsStockInItem": [
+                        {
+                            "goodsCode": item["goodsCode"],
+                            "quantity": item["quantity"],
+                            "unitPrice": item["unitPrice"]
+                        }
+                        for item in items_with_opening_stock
+                    ]
+                }
+                
+                stock_result = manager.stock_increase(stock_data)
+                print(f"[Register Items] Opening stock result: {json.dumps(stock_result, indent=2)[:500]}")
+                
+                # Update stock in EFRISGood table
+                if stock_result.get('returnStateInfo', {}).get('returnCode') == '00':
+                    for item in items_with_opening_stock:
+                        efris_good = db.query(EFRISGood).filter(
+                            EFRISGood.company_id == company_id,
+                            EFRISGood.goods_code == item["goodsCode"]
+                        ).first()
+                        if efris_good:
+                            efris_good.stock = item["quantity"]
+                    print(f"[Register Items] Successfully added opening stock for {len(items_with_opening_stock)} items")
+            except Exception as stock_err:
+                print(f"[Register Items] Warning: Failed to add opening stock: {stock_err}")
+                # Don't fail the entire registration if opening stock fails
         
+        db.commit()
+        invalidate_catalogue(company_id)
+    else:
+        # Entire batch failed
+        error_msg = result.get('returnStateInfo', {}).get('returnMessage', 'Unknown error')
+        print(f"[Register Items] Batch failed: {error_msg}")
+        failed_items = [{"name": p.qb_name, "error": error_msg} for p in products]
+    
+    return {
+        "success_count": success_count,
+        "failed_count": len(failed_items),
+        "failed_items": failed_items,
+        "message": f"Successfully registered {success_count} out of {len(products)} items to EFRIS",
+        "efris_response": result
+    }
+
+
+@job_handler("qb_items_register")
+def _register_qb_items_job(ctx: JobContext) -> dict:
+    """Background T130 registration, QB_REGISTER_BATCH_SIZE items per call, checkpoint after each batch"""
+    company = ctx.db.query(Company).filter(Company.id == ctx.company_id).first()
+    manager = get_efris_manager(company)
+    item_ids = ctx.params["item_ids"]
+    default_category_id = ctx.params.get("default_category_id", "50202306")
+    done = ctx.checkpoint.get("done", 0)
+    success_count = ctx.checkpoint.get("success_count", 0)
+    failed_items = ctx.checkpoint.get("failed_items", [])
+    
+    while done < len(item_ids):
+        batch = item_ids[done:done + QB_REGISTER_BATCH_SIZE]
+        try:
+            result = _register_qb_items(ctx.db, company, manager, batch, default_category_id)
+            success_count += result["success_count"]
+            failed_items.extend(result["failed_items"])
+        except HTTPException:
+            # None of this batch's products exist any more
+            failed_items.extend({"name": item_id, "error": "Product not found"} for item_id in batch)
+        done += len(batch)
+        ctx.progress(done, len(item_ids), message=f"Registered {success_count} of {len(item_ids)} items",
+                     checkpoint={"done": done, "success_count": success_count, "failed_items": failed_items})
+    
+    return {
+        "success_count": success_count,
+        "failed_count": len(failed_items),
+        "failed_items": failed_items,
+        "message": f"Successfully registered {success_count} out of {len(item_ids)} items to EFRIS"
+    }
+
+
+@app.post("/api/companies/{company_id}/qb-items/register-to-efris")
+async def register_qb_items_to_efris(
+    company_id: int,
+    item_ids: List[str] = Body(..., embed=True),
+    default_category_id: str = Body("50202306"),
+    background: bool = Query(False, description="Run as a background job and return it (poll /jobs/{job_id})"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Register selected QB items to EFRIS"""
+    if not verify_company_access(current_user, company_id, db):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if background:
+        return _job_accepted(db, company_id, "qb_items_register", current_user,
+                             {"item_ids": item_ids, "default_category_id": default_category_id})
+    
+    company = db.query(Company).filter(Company.id == company_id).first()
+    manager = get_efris_manager(company)
+    
+    try:
+        return await outbound_executor.run(company_id, _register_qb_items, db, company, manager,
+                                           item_ids, default_category_id)
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         import traceback
@@ -6628,9 +7132,21 @@ async def register_qb_items_to_efris(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@job_handler("qb_invoices_import")
+def _import_qb_invoices_job(ctx: JobContext) -> dict:
+    return _import_qb_pages(ctx, qb_client.get_invoices, Invoice, "qb_invoice_id", "invoices", lambda inv: {
+        "qb_doc_number": inv.get('DocNumber'),
+        "qb_customer_name": inv.get('CustomerRef', {}).get('name'),
+        "qb_txn_date": _qb_txn_date(inv),
+        "qb_total_amt": float(inv.get('TotalAmt', 0)),
+        "qb_data": inv
+    }, new_defaults={"efris_status": 'Pending'})
+
+
 @app.post("/api/companies/{company_id}/qb-invoices/import")
 async def import_qb_invoices_to_db(
     company_id: int,
+    background: bool = Query(False, description="Run as a background job and return it (poll /jobs/{job_id})"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -6638,56 +7154,11 @@ async def import_qb_invoices_to_db(
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
+    if background:
+        return _job_accepted(db, company_id, "qb_invoices_import", current_user)
+    
     try:
-        # Fetch from QuickBooks
-        invoices = qb_client.get_invoices(max_results=1000)
-        
-        saved_count = 0
-        for inv in invoices:
-            # Parse transaction date
-            txn_date = None
-            if inv.get('TxnDate'):
-                try:
-                    txn_date = datetime.strptime(inv.get('TxnDate'), '%Y-%m-%d')
-                except:
-                    pass
-            
-            # Check if already exists
-            existing = db.query(Invoice).filter(
-                Invoice.company_id == company_id,
-                Invoice.qb_invoice_id == inv.get('Id')
-            ).first()
-            
-            if existing:
-                # Update existing
-                existing.qb_doc_number = inv.get('DocNumber')
-                existing.qb_customer_name = inv.get('CustomerRef', {}).get('name')
-                existing.qb_txn_date = txn_date
-                existing.qb_total_amt = float(inv.get('TotalAmt', 0))
-                existing.qb_data = inv
-                existing.updated_at = datetime.now()
-            else:
-                # Create new
-                invoice = Invoice(
-                    company_id=company_id,
-                    qb_invoice_id=inv.get('Id'),
-                    qb_doc_number=inv.get('DocNumber'),
-                    qb_customer_name=inv.get('CustomerRef', {}).get('name'),
-                    qb_txn_date=txn_date,
-                    qb_total_amt=float(inv.get('TotalAmt', 0)),
-                    qb_data=inv,
-                    efris_status='Pending'
-                )
-                db.add(invoice)
-                saved_count += 1
-        
-        db.commit()
-        
-        return {
-            "success": True,
-            "message": f"Imported {len(invoices)} invoices ({saved_count} new, {len(invoices)-saved_count} updated)",
-            "count": len(invoices)
-        }
+        return await outbound_executor.run(company_id, run_inline, "qb_invoices_import", db, company_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -6711,41 +7182,54 @@ async def sync_qb_invoices_with_efris(
         print(f"[SYNC] Querying EFRIS for fiscalized invoices...")
         
         # Query EFRIS for recent invoices
-        efris_result = manager.query_invoices({'pageNo': '1', 'pageSize': '100'})
+        efris_result = await outbound_executor.run(company_id, manager.query_invoices, {'pageNo': '1', 'pageSize': '100'})
         
         if isinstance(efris_result, dict) and 'data' in efris_result:
             efris_data = efris_result['data'].get('decrypted_content', {})
             efris_records = efris_data.get('records', [])
             print(f"[SYNC] Found {len(efris_records)} EFRIS invoices")
             
+            # Load the matching QB invoices and their EFRIS records up front (2 queries, not 2 per record)
+            references = [r.get('referenceNo') for r in efris_records if r.get('referenceNo')]
+            qb_by_doc_number = {
+                inv.qb_doc_number: inv
+                for inv in db.query(Invoice).filter(
+                    Invoice.company_id == company_id,
+                    Invoice.qb_doc_number.in_(references)
+                )
+            } if references else {}
+            qb_invoice_ids = [inv.qb_invoice_id for inv in qb_by_doc_number.values()]
+            efris_by_qb_id = {}
+            if qb_invoice_ids:
+                for inv in db.query(EFRISInvoice).filter(
+                    EFRISInvoice.company_id == company_id,
+                    EFRISInvoice.qb_invoice_id.in_(qb_invoice_ids)
+                ).order_by(EFRISInvoice.id):
+                    efris_by_qb_id.setdefault(inv.qb_invoice_id, inv)
+            
+            # The QB row takes over FDNs that so far only exist as plain EFRIS imports
+            _release_import_copies(db, company_id, [
+                r.get('invoiceNo') for r in efris_records
+                if r.get('invoiceNo') and r.get('referenceNo') in qb_by_doc_number
+            ])
+            
             # Match EFRIS invoices with QB invoices by reference number
             for efris_rec in efris_records:
-                fdn = efris_rec.get('invoiceNo')
+                fdn = efris_rec.get('invoiceNo') or None
                 reference_no = efris_rec.get('referenceNo')  # This is the QB DocNumber
                 
                 if reference_no:
                     print(f"[SYNC] Checking EFRIS invoice {fdn} with reference {reference_no}")
                     # Find QB invoice by DocNumber
-                    qb_inv = db.query(Invoice).filter(
-                        Invoice.company_id == company_id,
-                        Invoice.qb_doc_number == reference_no
-                    ).first()
+                    qb_inv = qb_by_doc_number.get(reference_no)
                     
                     if qb_inv:
                         print(f"[SYNC] Found matching QB invoice {reference_no}")
                         # Check if we have an EFRISInvoice record for this QB invoice
-                        efris_inv = db.query(EFRISInvoice).filter(
-                            EFRISInvoice.company_id == company_id,
-                            EFRISInvoice.qb_invoice_id == qb_inv.qb_invoice_id
-                        ).first()
+                        efris_inv = efris_by_qb_id.get(qb_inv.qb_invoice_id)
                         
                         # Parse issued date
-                        issued_date = None
-                        try:
-                            if efris_rec.get('issuedDate'):
-                                issued_date = datetime.strptime(efris_rec.get('issuedDate'), '%d/%m/%Y %H:%M:%S')
-                        except:
-                            pass
+                        issued_date = _parse_efris_datetime(efris_rec.get('issuedDate'))
                         
                         # Convert invoice date
                         invoice_date = qb_inv.qb_txn_date.date() if qb_inv.qb_txn_date else None
@@ -6774,6 +7258,7 @@ async def sync_qb_invoices_with_efris(
                                 efris_data=efris_rec
                             )
                             db.add(efris_inv)
+                            efris_by_qb_id[qb_inv.qb_invoice_id] = efris_inv
                             synced_count += 1
                         elif not efris_inv.fdn or efris_inv.status != 'success':
                             print(f"[SYNC] Updating existing EFRIS invoice record for {reference_no}")
@@ -6821,8 +7306,11 @@ async def sync_qb_invoices_with_efris(
 async def get_saved_qb_invoices(
     company_id: int,
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size (omit for all rows)"),
+    include_total: bool = Query(False, description="Include total (approximate for large tenants)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get QB invoices saved in database with optional search"""
     if not verify_company_access(current_user, company_id, db):
@@ -6833,14 +7321,8 @@ async def get_saved_qb_invoices(
     
     query = db.query(Invoice).filter(Invoice.company_id == company_id)
     
-    if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (Invoice.qb_doc_number.ilike(search_pattern)) |
-            (Invoice.qb_customer_name.ilike(search_pattern))
-        )
-    
-    invoices = query.order_by(Invoice.qb_txn_date.desc()).all()
+    query, page = _list_page(query, Invoice, search, cursor, limit)
+    invoices = page.items
     
     # Build response with EFRIS status from EFRISInvoice table
     result_invoices = []
@@ -6870,13 +7352,27 @@ async def get_saved_qb_invoices(
     
     return {
         "count": len(result_invoices),
-        "invoices": result_invoices
+        "invoices": result_invoices,
+        "next_cursor": page.next_cursor,
+        **_page_total(query, include_total)
     }
 
 
+@job_handler("qb_purchase_orders_import")
+def _import_qb_pos_job(ctx: JobContext) -> dict:
+    return _import_qb_pages(ctx, qb_client.get_purchase_orders, PurchaseOrder, "qb_po_id", "purchase orders", lambda po: {
+        "qb_doc_number": po.get('DocNumber'),
+        "qb_vendor_name": po.get('VendorRef', {}).get('name'),
+        "qb_txn_date": _qb_txn_date(po),
+        "qb_total_amt": float(po.get('TotalAmt', 0)),
+        "qb_data": po
+    })
+
+
 @app.post("/api/companies/{company_id}/qb-purchase-orders/import")
 async def import_qb_pos_to_db(
     company_id: int,
+    background: bool = Query(False, description="Run as a background job and return it (poll /jobs/{job_id})"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -6884,55 +7380,11 @@ async def import_qb_pos_to_db(
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
+    if background:
+        return _job_accepted(db, company_id, "qb_purchase_orders_import", current_user)
+    
     try:
-        # Fetch from QuickBooks
-        pos = qb_client.get_purchase_orders()
-        
-        saved_count = 0
-        for po in pos:
-            # Parse transaction date
-            txn_date = None
-            if po.get('TxnDate'):
-                try:
-                    txn_date = datetime.strptime(po.get('TxnDate'), '%Y-%m-%d')
-                except:
-                    pass
-            
-            # Check if already exists
-            existing = db.query(PurchaseOrder).filter(
-                PurchaseOrder.company_id == company_id,
-                PurchaseOrder.qb_po_id == po.get('Id')
-            ).first()
-            
-            if existing:
-                # Update existing
-                existing.qb_doc_number = po.get('DocNumber')
-                existing.qb_vendor_name = po.get('VendorRef', {}).get('name')
-                existing.qb_txn_date = txn_date
-                existing.qb_total_amt = float(po.get('TotalAmt', 0))
-                existing.qb_data = po
-                existing.updated_at = datetime.now()
-            else:
-                # Create new
-                purchase_order = PurchaseOrder(
-                    company_id=company_id,
-                    qb_po_id=po.get('Id'),
-                    qb_doc_number=po.get('DocNumber'),
-                    qb_vendor_name=po.get('VendorRef', {}).get('name'),
-                    qb_txn_date=txn_date,
-                    qb_total_amt=float(po.get('TotalAmt', 0)),
-                    qb_data=po
-                )
-                db.add(purchase_order)
-                saved_count += 1
-        
-        db.commit()
-        
-        return {
-            "success": True,
-            "message": f"Imported {len(pos)} purchase orders ({saved_count} new, {len(pos)-saved_count} updated)",
-            "count": len(pos)
-        }
+        return await outbound_executor.run(company_id, run_inline, "qb_purchase_orders_import", db, company_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -6941,10 +7393,14 @@ async def import_qb_pos_to_db(
 @app.get("/api/companies/{company_id}/qb-purchase-orders")
 async def get_saved_qb_pos(
     company_id: int,
+    response: Response,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Page size (omit for all rows)"),
+    include_total: bool = Query(False, description="Send X-Total-Count (approximate for large tenants)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get QB POs saved in database with full details"""
+    """Get QB POs saved in database with full details, newest first (keyset paginated)"""
     if not verify_company_access(current_user, company_id, db):
         raise HTTPException(status_code=403, detail="Access denied")
     
@@ -6952,14 +7408,17 @@ async def get_saved_qb_pos(
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
-    pos = db.query(PurchaseOrder).filter(PurchaseOrder.company_id == company_id).all()
+    query = db.query(PurchaseOrder).filter(PurchaseOrder.company_id == company_id)
+    page = keyset_paginate(query, _list_order(PurchaseOrder), cursor, limit)
+    _set_page_headers(response, page, query if include_total else None)
+    pos = page.items
     
     # Return full details from QuickBooks using the global qb_client
     full_pos = []
     
     for po in pos:
         try:
-            full_po = qb_client.get_purchase_order(po.qb_po_id)
+            full_po = await outbound_executor.run(company_id, qb_client.get_purchase_order, po.qb_po_id)
             if full_po:
                 full_pos.append(full_po)
         except Exception as e:
@@ -7017,7 +7476,7 @@ async def sync_purchase_orders_to_efris(
                 continue
             
             # Get full PO from QuickBooks
-            po = qb_client.get_purchase_order(str(po_id))
+            po = await outbound_executor.run(company_id, qb_client.get_purchase_order, str(po_id))
             if not po:
                 failed.append({"po_id": po_id, "error": "Not found in QuickBooks"})
                 continue
@@ -7085,7 +7544,7 @@ async def sync_purchase_orders_to_efris(
                 "goodsStockInItem": items
             }
             
-            result = manager.stock_increase(stock_data)
+            result = await outbound_executor.run(company_id, manager.stock_increase, stock_data)
             
             if result.get('status') == 200:
                 synced.append({
@@ -7125,7 +7584,7 @@ async def import_qb_credit_memos_to_db(
     
     try:
         # Fetch from QuickBooks
-        credit_memos = qb_client.get_credit_memos(max_results=1000)
+        credit_memos = await outbound_executor.run(company_id, qb_client.get_credit_memos, max_results=1000)
         
         saved_count = 0
         for cm in credit_memos:
@@ -7181,8 +7640,11 @@ async def import_qb_credit_memos_to_db(
 async def get_saved_qb_credit_memos(
     company_id: int,
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size (omit for all rows)"),
+    include_total: bool = Query(False, description="Include total (approximate for large tenants)"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get QB credit memos saved in database with optional search"""
     if not verify_company_access(current_user, company_id, db):
@@ -7190,14 +7652,8 @@ async def get_saved_qb_credit_memos(
     
     query = db.query(CreditMemo).filter(CreditMemo.company_id == company_id)
     
-    if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            (CreditMemo.qb_doc_number.ilike(search_pattern)) |
-            (CreditMemo.qb_customer_name.ilike(search_pattern))
-        )
-    
-    credit_memos = query.order_by(CreditMemo.updated_at.desc()).all()
+    query, page = _list_page(query, CreditMemo, search, cursor, limit)
+    credit_memos = page.items
     
     return {
         "count": len(credit_memos),
@@ -7207,7 +7663,9 @@ async def get_saved_qb_credit_memos(
             "CustomerRef": {"name": cm.qb_customer_name},
             "TxnDate": cm.qb_txn_date.isoformat() if cm.qb_txn_date else None,
             "TotalAmt": cm.qb_total_amt
-        } for cm in credit_memos]
+        } for cm in credit_memos],
+        "next_cursor": page.next_cursor,
+        **_page_total(query, include_total)
     }
 
 
@@ -7338,8 +7796,8 @@ def _build_invoice_summary(invoice_data, calculated_net, calculated_tax, calcula
 @app.post("/api/external/efris/submit-invoice")
 async def external_submit_invoice(
     invoice_data: dict,
-    company: Company = Depends(get_company_from_api_key),
-    db: Session = Depends(get_db)
+    company: Company = Depends(get_company_from_api_key_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Submit invoice to EFRIS and get complete fiscal invoice data
@@ -7936,8 +8394,38 @@ async def external_submit_invoice(
             "airlineGoodsDetails": []
         }
         
-        # Submit to EFRIS (T109)
-        result = efris.upload_invoice(efris_payload)
+        # Pre-flight: reject locally what EFRIS would reject after a full round-trip
+        preflight_errors = await db.run_sync(preflight_invoice, company, goods_details)
+        if preflight_errors:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "success": False,
+                    "error_code": "PREFLIGHT",
+                    "message": "Invoice failed pre-flight validation - not sent to EFRIS",
+                    "errors": preflight_errors
+                }
+            )
+        
+        # An invoice number that is already fiscalized is never sent (or saved) again
+        fiscalized = (await db.execute(select(EFRISInvoice.fdn).where(
+            EFRISInvoice.company_id == company.id,
+            EFRISInvoice.invoice_no == invoice_data["invoice_number"],
+            EFRISInvoice.status == "success"
+        ))).first()
+        if fiscalized:
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "success": False,
+                    "error_code": "ALREADY_FISCALIZED",
+                    "message": f"Invoice {invoice_data['invoice_number']} is already fiscalized - not sent to EFRIS",
+                    "fdn": fiscalized.fdn
+                }
+            )
+        
+        # Submit to EFRIS (T109) - blocking HTTP call, keep it off the event loop
+        result = await outbound_executor.run(company.id, efris.upload_invoice, efris_payload)
         
         # Debug: Log the response structure
         print(f"[EXTERNAL API] EFRIS Response Structure:")
@@ -7966,27 +8454,39 @@ async def external_submit_invoice(
             # Save to database
             # Calculate excise total from excise items
             total_excise = sum(float(gd.get("exciseTax", 0)) for gd in goods_details if gd.get("exciseFlag") == "1")
-            efris_invoice = EFRISInvoice(
-                company_id=company.id,
-                invoice_no=invoice_data["invoice_number"],
-                invoice_date=datetime.strptime(invoice_data["invoice_date"], "%Y-%m-%d").date(),
-                customer_name=invoice_data["customer_name"],
-                customer_tin=invoice_data.get("customer_tin", ""),
-                buyer_type=invoice_data.get("buyer_type", "1"),
-                total_amount=round(payment_total, 2),
-                total_tax=round(float(invoice_summary["taxAmount"]), 2),
-                total_excise=round(total_excise, 2),
-                total_discount=sum(float(item.get("discount", item.get("discountTotal", 0)) or 0) for item in invoice_data["items"]),
-                currency=invoice_data.get("currency", "UGX"),
-                status="success",
-                fdn=fdn,
-                efris_invoice_id=invoice_id,
-                submission_date=datetime.utcnow(),
-                efris_payload=efris_payload,
-                efris_response=result
-            )
-            db.add(efris_invoice)
-            db.commit()
+            # Upsert on (company_id, invoice_no) so a retried submission updates the earlier attempt;
+            # a concurrent submission that fiscalized it first keeps its FDN
+            submitted_at = datetime.utcnow()
+            existing_status = await db.scalar(select(EFRISInvoice.status).where(
+                EFRISInvoice.company_id == company.id,
+                EFRISInvoice.invoice_no == invoice_data["invoice_number"]
+            ))
+            if existing_status == "success":
+                logger.warning(f"[T109] {invoice_data['invoice_number']} was fiscalized concurrently - "
+                               f"keeping the stored FDN, not {fdn}")
+            else:
+                payload_refs = await db.run_sync(archived_payloads, efris_payload, result)
+                await db.run_sync(upsert, EFRISInvoice, [{
+                    "company_id": company.id,
+                    "invoice_no": invoice_data["invoice_number"],
+                    "invoice_date": datetime.strptime(invoice_data["invoice_date"], "%Y-%m-%d").date(),
+                    "customer_name": invoice_data["customer_name"],
+                    "customer_tin": invoice_data.get("customer_tin", ""),
+                    "buyer_type": invoice_data.get("buyer_type", "1"),
+                    "total_amount": round(payment_total, 2),
+                    "total_tax": round(float(invoice_summary["taxAmount"]), 2),
+                    "total_excise": round(total_excise, 2),
+                    "total_discount": sum(float(item.get("discount", item.get("discountTotal", 0)) or 0) for item in invoice_data["items"]),
+                    "currency": invoice_data.get("currency", "UGX"),
+                    "status": "success",
+                    "fdn": fdn,
+                    "efris_invoice_id": invoice_id,
+                    "submission_date": submitted_at,
+                    "error_message": None,
+                    **payload_refs,
+                    "updated_at": datetime.now()
+                }], conflict_columns=["company_id", "invoice_no"])
+                await db.commit()
             
             # Return complete invoice data for rendering EFRIS-style fiscal invoice
             return {
@@ -8045,29 +8545,35 @@ async def external_submit_invoice(
                 
                 # Legacy fields for backward compatibility
                 "invoice_number": invoice_data["invoice_number"],
-                "fiscalized_at": efris_invoice.submission_date.isoformat()
+                "fiscalized_at": submitted_at.isoformat()
             }
         else:
             # EFRIS error
             error_msg = result.get("returnStateInfo", {}).get("returnMessage", "Unknown error")
             error_code = result.get("returnStateInfo", {}).get("returnCode", "")
             
-            # Save failed attempt
-            efris_invoice = EFRISInvoice(
-                company_id=company.id,
-                invoice_no=invoice_data["invoice_number"],
-                invoice_date=datetime.strptime(invoice_data["invoice_date"], "%Y-%m-%d").date(),
-                customer_name=invoice_data["customer_name"],
-                total_amount=round(payment_total, 2),
-                total_tax=round(float(invoice_summary["taxAmount"]), 2),
-                currency=invoice_data.get("currency", "UGX"),
-                status="failed",
-                error_message=f"{error_code}: {error_msg}",
-                efris_payload=efris_payload,
-                efris_response=result
-            )
-            db.add(efris_invoice)
-            db.commit()
+            # Save failed attempt (one row per invoice number - retries update it,
+            # but a rejected resubmission never overwrites an already fiscalized invoice)
+            existing_status = await db.scalar(select(EFRISInvoice.status).where(
+                EFRISInvoice.company_id == company.id,
+                EFRISInvoice.invoice_no == invoice_data["invoice_number"]
+            ))
+            if existing_status != "success":
+                payload_refs = await db.run_sync(archived_payloads, efris_payload, result)
+                await db.run_sync(upsert, EFRISInvoice, [{
+                    "company_id": company.id,
+                    "invoice_no": invoice_data["invoice_number"],
+                    "invoice_date": datetime.strptime(invoice_data["invoice_date"], "%Y-%m-%d").date(),
+                    "customer_name": invoice_data["customer_name"],
+                    "total_amount": round(payment_total, 2),
+                    "total_tax": round(float(invoice_summary["taxAmount"]), 2),
+                    "currency": invoice_data.get("currency", "UGX"),
+                    "status": "failed",
+                    "error_message": f"{error_code}: {error_msg}",
+                    **payload_refs,
+                    "updated_at": datetime.now()
+                }], conflict_columns=["company_id", "invoice_no"])
+                await db.commit()
             
             raise HTTPException(
                 status_code=400,
@@ -8173,7 +8679,7 @@ async def external_register_product(
         if have_excise == "101" and product_data.get("excise_duty_code"):
             t130_payload[0]["exciseDutyCode"] = product_data["excise_duty_code"]
         
-        result = efris.upload_goods(t130_payload)
+        result = await outbound_executor.run(company.id, efris.upload_goods, t130_payload)
         
         # Log the full response for debugging
         print(f"[REGISTER-PRODUCT] EFRIS returned: {result}")
@@ -8183,6 +8689,34 @@ async def external_register_product(
             raise HTTPException(status_code=500, detail=f"EFRIS communication error: {result}")
         
         if result.get("returnStateInfo", {}).get("returnCode") == "00":
+            # Keep the local goods snapshot in step so pre-flight validation knows this item
+            efris_good = db.query(EFRISGood).filter(
+                EFRISGood.company_id == company.id,
+                EFRISGood.goods_code == product_data["item_code"]
+            ).first()
+            if efris_good:
+                efris_good.goods_name = product_data["item_name"]
+                efris_good.commodity_category_code = product_data["commodity_code"]
+                efris_good.unit_price = float(product_data["unit_price"])
+                efris_good.have_excise_tax = have_excise
+                efris_good.efris_data = t130_payload[0]
+            else:
+                db.add(EFRISGood(
+                    company_id=company.id,
+                    goods_code=product_data["item_code"],
+                    goods_name=product_data["item_name"],
+                    commodity_category_code=product_data["commodity_code"],
+                    commodity_category_name=product_data.get("commodity_name", ""),
+                    unit_price=float(product_data["unit_price"]),
+                    currency="UGX",
+                    tax_rate=0.18,
+                    have_excise_tax=have_excise,
+                    stock=0,
+                    efris_data=t130_payload[0]
+                ))
+            db.commit()
+            invalidate_catalogue(company.id)
+            
             return {
                 "success": True,
                 "product_code": product_data["item_code"],
@@ -8258,7 +8792,7 @@ async def external_submit_purchase_order(
             })
         
         # Submit to EFRIS
-        result = efris.send_purchase_order(t130_payload)
+        result = await outbound_executor.run(company.id, efris.send_purchase_order, t130_payload)
         
         if result.get("returnStateInfo", {}).get("returnCode") == "00":
             # Success - save to database
@@ -8530,7 +9064,7 @@ async def external_submit_credit_note(
             if original_fdn:
                 try:
                     logger.info(f"[T110] Looking up invoiceId for FDN: {original_fdn}")
-                    invoice_details = efris.get_invoice_details(original_fdn)
+                    invoice_details = await outbound_executor.run(company.id, efris.get_invoice_details, original_fdn)
                     if isinstance(invoice_details, dict):
                         decrypted = invoice_details.get('data', {}).get('decrypted_content', {})
                         if isinstance(decrypted, dict):
@@ -8730,7 +9264,7 @@ async def external_submit_credit_note(
         logger.debug(f"[T110] Full payload: {json.dumps(efris_payload, indent=2)}")
         
         # Submit to EFRIS using T110 (Credit Note Application)
-        result = efris.submit_credit_note_application(efris_payload)
+        result = await outbound_executor.run(company.id, efris.submit_credit_note_application, efris_payload)
         
         # Handle string error response from efris_client
         if isinstance(result, str):
@@ -8801,14 +9335,14 @@ async def external_submit_credit_note(
 @app.get("/api/external/efris/invoice/{invoice_number}")
 async def external_get_invoice(
     invoice_number: str,
-    company: Company = Depends(get_company_from_api_key),
-    db: Session = Depends(get_db)
+    company: Company = Depends(get_company_from_api_key_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Query invoice status from database"""
-    invoice = db.query(EFRISInvoice).filter(
+    invoice = (await db.execute(select(EFRISInvoice).where(
         EFRISInvoice.company_id == company.id,
         EFRISInvoice.invoice_no == invoice_number
-    ).first()
+    ).limit(1))).scalars().first()
     
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
@@ -8827,25 +9361,39 @@ async def external_get_invoice(
 
 @app.get("/api/external/efris/invoices")
 async def external_list_invoices(
-    limit: int = Query(50, le=100),
-    offset: int = Query(0),
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0, description="Deprecated - use cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    include_total: bool = Query(True, description="Include total (approximate for large tenants)"),
     status: Optional[str] = Query(None),
-    company: Company = Depends(get_company_from_api_key),
-    db: Session = Depends(get_db)
+    company: Company = Depends(get_company_from_api_key_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """List invoices with pagination"""
-    query = db.query(EFRISInvoice).filter(EFRISInvoice.company_id == company.id)
-    
-    if status:
-        query = query.filter(EFRISInvoice.status == status)
-    
-    total = query.count()
-    invoices = query.order_by(EFRISInvoice.created_at.desc()).offset(offset).limit(limit).all()
+    """
+    List invoices, newest first
+
+    Pass next_cursor back as cursor for the following page. offset still works for
+    existing integrations but gets slower the deeper it goes.
+    """
+    def load_page(session: Session):
+        query = session.query(EFRISInvoice).filter(EFRISInvoice.company_id == company.id)
+        if status:
+            query = query.filter(EFRISInvoice.status == status)
+        total_info = _page_total(query, include_total)
+        if offset and not cursor:
+            return total_info, query.order_by(EFRISInvoice.id.desc()).offset(offset).limit(limit).all(), None
+        page = keyset_paginate(query, [EFRISInvoice.id], cursor, limit)
+        return total_info, page.items, page.next_cursor
+
+    # Query-building helpers are sync; run_sync drives them over the async connection
+    total_info, invoices, next_cursor = await db.run_sync(load_page)
     
     return {
-        "total": total,
+        "total": total_info.get("total"),
+        "total_is_estimate": total_info.get("total_is_estimate", False),
         "limit": limit,
         "offset": offset,
+        "next_cursor": next_cursor,
         "invoices": [{
             "invoice_number": inv.invoice_no,
             "fdn": inv.fdn,
@@ -8895,7 +9443,7 @@ async def external_get_excise_duty(
         efris = get_efris_manager(company)
         
         # Query excise duty from EFRIS (T125)
-        result = efris.query_excise_duty()
+        result = await outbound_executor.run(company.id, efris.query_excise_duty)
         
         # Extract excise list from response
         excise_list = result.get('data', {}).get('decrypted_content', {}).get('exciseDutyList', [])
@@ -9030,10 +9578,11 @@ async def external_get_units_of_measure(
         efris = get_efris_manager(company)
         
         # Query system dictionary from EFRIS (T115)
-        result = efris.get_code_list(None)
+        result = await outbound_executor.run(company.id, efris.get_code_list, None)
         
         # Extract rateUnit from response
         decrypted_content = result.get('data', {}).get('decrypted_content', {})
+        remember_t115_dictionary(company.efris_test_mode, decrypted_content)
         rate_units = decrypted_content.get('rateUnit', [])
         
         if not rate_units:
@@ -9157,7 +9706,7 @@ async def external_query_goods(
             if goods_name:
                 kwargs["goods_name"] = goods_name
 
-            result = efris.get_goods_and_services(**kwargs)
+            result = await outbound_executor.run(company.id, efris.get_goods_and_services, **kwargs)
 
             if not isinstance(result, dict) or 'data' not in result:
                 break
@@ -9241,41 +9790,12 @@ async def external_query_goods(
                 "goods_type": "fuel" if record.get('goodsTypeCode') == "102" else "non-fuel",
             })
 
-        # Save/update ALL fetched records to database for caching
-        for record in all_records:
-            code = record.get('goodsCode')
-            if not code:
-                continue
-            existing = db.query(EFRISGood).filter(
-                EFRISGood.company_id == company.id,
-                EFRISGood.goods_code == code
-            ).first()
-            if existing:
-                existing.goods_name = record.get('goodsName')
-                existing.commodity_category_code = record.get('commodityCategoryCode')
-                existing.commodity_category_name = record.get('commodityCategoryName')
-                existing.unit_price = float(record.get('unitPrice', 0))
-                existing.currency = record.get('currency')
-                existing.tax_rate = float(record.get('taxRate', 0))
-                existing.have_excise_tax = record.get('haveExciseTax')
-                existing.stock = float(record.get('stock', 0))
-                existing.efris_data = record
-                existing.updated_at = datetime.now()
-            else:
-                db.add(EFRISGood(
-                    company_id=company.id,
-                    goods_code=code,
-                    goods_name=record.get('goodsName'),
-                    commodity_category_code=record.get('commodityCategoryCode'),
-                    commodity_category_name=record.get('commodityCategoryName'),
-                    unit_price=float(record.get('unitPrice', 0)),
-                    currency=record.get('currency'),
-                    tax_rate=float(record.get('taxRate', 0)),
-                    have_excise_tax=record.get('haveExciseTax'),
-                    stock=float(record.get('stock', 0)),
-                    efris_data=record
-                ))
+        # Save/update ALL fetched records to database for caching (bulk upsert, no per-record SELECT)
+        upsert(db, EFRISGood, [
+            _efris_good_row(company.id, record) for record in all_records if record.get('goodsCode')
+        ], conflict_columns=["company_id", "goods_code"])
         db.commit()
+        invalidate_catalogue(company.id)
 
         return {
             "success": True,
@@ -9345,7 +9865,7 @@ async def external_stock_decrease(
         efris = get_efris_manager(company)
         
         # Submit stock decrease to EFRIS (T132)
-        result = efris.stock_decrease(stock_data)
+        result = await outbound_executor.run(company.id, efris.stock_decrease, stock_data)
         
         # Log the stock decrease
         stock_record = StockMovement(
@@ -9424,7 +9944,7 @@ async def external_stock_increase(
         efris = get_efris_manager(company)
         
         # Pass directly to manager - same as QuickBooks does
-        result = efris.stock_increase(stock_data)
+        result = await outbound_executor.run(company.id, efris.stock_increase, stock_data)
         
         return {
             "success": True,
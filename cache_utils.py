@@ -0,0 +1,151 @@
+"""
+In-process caching helpers
+- Thread-safe TTL cache with single-flight loading (one DB load per key, however many
+  concurrent requests miss at the same time), for sync loaders and for coroutine loaders
+- Detached ORM copies that can be cached and re-attached to any session
+"""
+import asyncio
+import time
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+
+def detached_copy(instance):
+    """Copy an ORM instance's column values into a detached instance (safe to share across sessions)"""
+    mapper = sa_inspect(type(instance))
+    copy = mapper.class_(**{attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+class TTLCache:
+    """
+    Small thread-safe TTL cache
+
+    Usage:
+        cache = TTLCache(ttl_seconds=60)
+        value = cache.get_or_load(key, lambda: load_from_db(key))
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._data: Dict[Hashable, Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+        self._async_loads: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing/expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            with self._lock:
+                if self._data.get(key) is entry:
+                    del self._data[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                self._evict()
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+        """
+        Return the cached value or call loader() once for all concurrent callers
+
+        None results are not cached (so a missing row is looked up again next time).
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have loaded it while we waited
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            try:
+                value = loader()
+                if value is not None:
+                    self.set(key, value)
+                return value
+            finally:
+                with self._lock:
+                    if self._load_locks.get(key) is load_lock:
+                        del self._load_locks[key]
+
+    async def aget_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """
+        get_or_load() for coroutine loaders - concurrent misses on the event loop await one load
+
+        Never blocks the event loop on the per-key thread lock.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        loading = self._async_loads.get(key)
+        if loading is None or loading.get_loop() is not asyncio.get_running_loop():
+            self.misses += 1
+            loading = asyncio.ensure_future(loader())
+            self._async_loads[key] = loading
+
+            def done(future):
+                if self._async_loads.get(key) is future:
+                    del self._async_loads[key]
+                if not future.cancelled() and future.exception() is None and future.result() is not None:
+                    self.set(key, future.result())
+
+            loading.add_done_callback(done)
+        else:
+            self.hits += 1
+        return await asyncio.shield(loading)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _evict(self):
+        """Drop expired entries, then the oldest ones if still full (lock held)"""
+        now = time.monotonic()
+        for key in [k for k, (_, exp) in self._data.items() if exp <= now]:
+            del self._data[key]
+        overflow = len(self._data) - self.max_entries + 1
+        if overflow > 0:
+            oldest = sorted(self._data.items(), key=lambda kv: kv[1][1])[:overflow]
+            for key, _ in oldest:
+                del self._data[key]
@@ -0,0 +1,117 @@
+"""
+Bulk write helpers
+- Chunked INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite
+- Portable fallback for other dialects (one SELECT per chunk + executemany insert/update)
+
+Usage:
+    upsert(db, EFRISGood, rows, conflict_columns=["company_id", "goods_code"])
+"""
+import os
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import tuple_, update
+from sqlalchemy.orm import Session
+
+from database.replicas import note_written
+
+BULK_CHUNK_SIZE = int(os.getenv("DATABASE_BULK_CHUNK_SIZE", "500"))
+
+# SQLite limits bound parameters per statement (32766 since 3.32)
+SQLITE_MAX_VARIABLES = 32000
+
+
+def _chunks(rows: List[dict], size: int) -> Iterable[List[dict]]:
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _dedupe(rows: List[dict], conflict_columns: Sequence[str]) -> List[dict]:
+    """Last row wins per conflict key - ON CONFLICT can't touch the same row twice in one statement"""
+    by_key: Dict[tuple, dict] = {}
+    unkeyed = []
+    for row in rows:
+        key = tuple(row.get(c) for c in conflict_columns)
+        if any(value is None for value in key):
+            unkeyed.append(row)  # NULLs never conflict
+        else:
+            by_key[key] = row
+    return list(by_key.values()) + unkeyed
+
+
+def _on_conflict_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def upsert(db: Session, model, rows: List[dict], conflict_columns: Sequence[str],
+           update_columns: Optional[Sequence[str]] = None, chunk_size: int = BULK_CHUNK_SIZE) -> int:
+    """
+    Insert rows, updating existing ones that match on conflict_columns
+
+    conflict_columns must be covered by a unique index/constraint. All rows must have
+    the same keys. update_columns defaults to every non-key column in the rows.
+    Does not commit. Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    rows = _dedupe(rows, conflict_columns)
+    note_written(db, (row.get("company_id") for row in rows))
+    columns = list(rows[0].keys())
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in conflict_columns]
+
+    dialect_name = db.get_bind().dialect.name
+    insert = _on_conflict_insert(dialect_name)
+    if insert is None:
+        return _upsert_fallback(db, model, rows, conflict_columns, update_columns, chunk_size)
+
+    if dialect_name == "sqlite":
+        chunk_size = max(1, min(chunk_size, SQLITE_MAX_VARIABLES // len(columns)))
+
+    table = model.__table__
+    for chunk in _chunks(rows, chunk_size):
+        stmt = insert(table).values(chunk)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(conflict_columns),
+                set_={c: stmt.excluded[c] for c in update_columns}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(conflict_columns))
+        db.execute(stmt)
+    return len(rows)
+
+
+def _upsert_fallback(db: Session, model, rows: List[dict], conflict_columns: Sequence[str],
+                     update_columns: Sequence[str], chunk_size: int) -> int:
+    """Same result without ON CONFLICT: look up existing ids per chunk, then executemany"""
+    key_columns = [getattr(model, c) for c in conflict_columns]
+    for chunk in _chunks(rows, chunk_size):
+        keys = [tuple(row.get(c) for c in conflict_columns) for row in chunk]
+        existing = {
+            tuple(found[1:]): found[0]
+            for found in db.query(model.id, *key_columns).filter(tuple_(*key_columns).in_(keys))
+        }
+        inserts, updates = [], []
+        for key, row in zip(keys, chunk):
+            if key in existing:
+                if update_columns:
+                    updates.append({"id": existing[key], **{c: row[c] for c in update_columns}})
+            else:
+                inserts.append(row)
+        if inserts:
+            db.execute(model.__table__.insert(), inserts)
+        if updates:
+            db.execute(update(model), updates)
+    return len(rows)
+
+
+__all__ = [
+    'BULK_CHUNK_SIZE',
+    'upsert'
+]
@@ -1,12 +1,27 @@
 """
 Database connection and session management
+- Sync engine + SessionLocal/get_db for the existing endpoints and scripts
+- Async engine + AsyncSessionLocal/get_async_db (asyncpg / aiosqlite / aiomysql) for
+  async endpoints, so queries don't block the event loop
+- Optional read replicas (DATABASE_REPLICA_URLS) + get_read_db for list, report and
+  search endpoints (lag-aware, falls back to the primary - see database/replicas.py)
+- SQLite files run in tuned mode: WAL, synchronous=NORMAL, busy timeout, mmap, page
+  cache and a single-writer queue (database/sqlite_mode.py, SQLITE_TUNED=false to disable)
 """
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import QueuePool
-from typing import Generator
+from typing import AsyncGenerator, Generator, Optional
+import functools
+import logging
 import os
+from anyio import to_thread
 from dotenv import load_dotenv
+from starlette.requests import Request
+
+from database.replicas import ReplicaRouter
+from database.sqlite_mode import SQLITE_TUNED, configure_sqlite
 
 load_dotenv()
 
@@ -24,9 +39,108 @@ engine = create_engine(
     echo=False  # Set to True for SQL query logging
 )
 
+# Single-node SQLite deployments: WAL + one writer at a time instead of "database is locked"
+sqlite_writer_queue = None
+if engine.dialect.name == "sqlite" and SQLITE_TUNED:
+    sqlite_writer_queue = configure_sqlite(engine)
+
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read replicas (comma separated URLs) - reporting/listing reads only
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_POOL_SIZE = int(os.getenv("DATABASE_REPLICA_POOL_SIZE", str(POOL_SIZE)))
+
+replica_engines = [
+    create_engine(url, poolclass=QueuePool, pool_size=REPLICA_POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                  pool_pre_ping=True)
+    for url in REPLICA_URLS
+]
+replica_router = ReplicaRouter(engine, replica_engines)
+
+logger = logging.getLogger("efris_api")
+
+# sync driver -> asyncio driver for the same database
+ASYNC_DRIVERS = {
+    "postgresql": ("asyncpg", "asyncpg"),
+    "sqlite": ("aiosqlite", "aiosqlite"),
+    "mysql": ("aiomysql", "aiomysql"),
+}
+
+
+def async_database_url(url: str):
+    """The async-driver form of a database URL, or None if the backend has no async driver"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        return None
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend][0]}")
+
+
+def create_async_db_engine(url: str):
+    """Async engine for url, or None when the async driver isn't installed"""
+    async_url = async_database_url(url)
+    if async_url is None:
+        return None
+    module = ASYNC_DRIVERS[async_url.get_backend_name()][1]
+    try:
+        __import__(module)
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError:
+        logger.warning(f"{module} not installed - async endpoints run their queries in the threadpool "
+                       f"(pip install {module})")
+        return None
+    if async_url.get_backend_name() == "sqlite":
+        return create_async_engine(async_url)
+    return create_async_engine(async_url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=True)
+
+
+async_engine = create_async_db_engine(DATABASE_URL)
+if async_engine is not None and async_engine.dialect.name == "sqlite" and SQLITE_TUNED:
+    # The writer queue's thread lock would block the event loop - busy_timeout only
+    configure_sqlite(async_engine.sync_engine, writer_queue=False)
+
+if async_engine is not None:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    # expire_on_commit=False: attributes can't be lazy-loaded after commit in async code
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    AsyncSessionLocal = None
+
+
+class ThreadpoolSession:
+    """
+    Stand-in for AsyncSession when no async driver is installed: the same awaitable
+    methods, run on a sync Session in the threadpool (still keeps the event loop free)
+    """
+
+    def __init__(self, sync_session: Session):
+        self.sync_session = sync_session
+
+    async def _call(self, fn, *args, **kwargs):
+        return await to_thread.run_sync(functools.partial(fn, *args, **kwargs))
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await self._call(fn, self.sync_session, *args, **kwargs)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await self._call(self.sync_session.execute, statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await self._call(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await self._call(self.sync_session.get, entity, ident, **kwargs)
+
+    async def commit(self):
+        await self._call(self.sync_session.commit)
+
+    async def rollback(self):
+        await self._call(self.sync_session.rollback)
+
+    async def close(self):
+        await self._call(self.sync_session.close)
+
 
 def get_db() -> Generator[Session, None, None]:
     """
@@ -43,6 +157,54 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def read_session(company_id: Optional[int] = None) -> Session:
+    """Read-only session on a replica (or the primary when none is fresh enough)"""
+    return SessionLocal(bind=replica_router.engine_for_read(company_id), info={"read_only": True})
+
+
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    """
+    Dependency for list / report / search endpoints - a read-only session, served by a
+    read replica when one is configured
+    Usage in FastAPI:
+        @app.get("/api/companies/{company_id}/efris-invoices")
+        def endpoint(company_id: int, db: Session = Depends(get_read_db)):
+            ...
+    Reads for a company this worker wrote within REPLICA_MAX_LAG_SECONDS go to the primary.
+    """
+    company_id = request.path_params.get("company_id") or request.query_params.get("company_id")
+    try:
+        company_id = int(company_id) if company_id is not None else None
+    except ValueError:
+        company_id = None
+    db = read_session(company_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncGenerator:
+    """
+    Dependency to get an async database session
+    Usage in FastAPI:
+        @app.get("/endpoint")
+        async def endpoint(db: AsyncSession = Depends(get_async_db)):
+            invoice = (await db.execute(select(EFRISInvoice).where(...))).scalars().first()
+    Sync helpers that take a Session (upsert, keyset_paginate, ...) go through
+    await db.run_sync(helper, ...).
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    db = ThreadpoolSession(SessionLocal(expire_on_commit=False))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
 def init_db():
     """Initialize database - create all tables"""
     from database.models import Base
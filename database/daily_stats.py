@@ -0,0 +1,230 @@
+"""
+Per-company, per-day dashboard counters (daily_company_stats)
+- Maintained on write: an after_flush hook turns new Invoice rows and invoice_fiscalized
+  ActivityLog rows into counter increments in the same transaction
+- rebuild_daily_stats() recomputes a range of days from the source tables - run it after
+  the table is created and nightly from cron to pick up rows written outside the ORM
+  (never further back than the activity_logs retention window - older counters are kept)
+- Owner and reseller dashboards read these counters instead of COUNT(*) over
+  invoices / activity_logs
+
+Days are local days in STATS_UTC_OFFSET_HOURS (default: the server's own offset, the day
+date.today() gave the dashboards before), so an EAT deployment counts 00:00-03:00 as today.
+Timestamps without a zone are UTC, like the activity_logs ones.
+
+Usage (cron):
+    python -m database.daily_stats 2    # rebuild today and yesterday
+"""
+import logging
+import os
+import sys
+import weakref
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, event, func, inspect, update
+from sqlalchemy.orm import Session, aliased
+
+from database.log_retention import retention_cutoff
+from database.models import ActivityLog, DailyCompanyStats, Invoice, User
+
+logger = logging.getLogger("efris_api")
+
+COUNTERS = ["invoices_created", "invoices_fiscalized", "invoices_failed", "amount_fiscalized"]
+
+_offset = os.getenv("STATS_UTC_OFFSET_HOURS")
+STATS_TZ = timezone(timedelta(hours=float(_offset))) if _offset else datetime.now().astimezone().tzinfo
+
+# engine -> daily_company_stats exists (databases that haven't been migrated yet are skipped)
+_enabled = weakref.WeakKeyDictionary()
+
+
+def local_day(value: Optional[datetime] = None) -> date:
+    """The STATS_TZ day of value (now when None); naive values are UTC"""
+    if value is None:
+        return datetime.now(STATS_TZ).date()
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(STATS_TZ).date()
+
+
+def day_start(day: date) -> datetime:
+    """Naive UTC timestamp of the start of a STATS_TZ day"""
+    return datetime.combine(day, time.min, tzinfo=STATS_TZ).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _amount(details) -> float:
+    try:
+        return float((details or {}).get("total_amount") or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+
+
+class _Tally:
+    """Counter rows keyed by (company_id, day)"""
+
+    def __init__(self):
+        self.rows: Dict[Tuple[int, date], dict] = {}
+
+    def add(self, company_id: int, day: date, reseller_id: Optional[int] = None, **counters):
+        row = self.rows.setdefault((company_id, day), {
+            "company_id": company_id, "day": day, "reseller_id": None, **{c: 0 for c in COUNTERS}
+        })
+        row["reseller_id"] = reseller_id or row["reseller_id"]
+        for name, value in counters.items():
+            row[name] += value
+
+    def add_invoice(self, company_id: int, created_at: Optional[datetime]):
+        self.add(company_id, local_day(created_at), invoices_created=1)
+
+    def add_activity(self, company_id: int, created_at: Optional[datetime], reseller_id: Optional[int],
+                     efris_status: Optional[str], details):
+        self.add(company_id, local_day(created_at), reseller_id,
+                 invoices_fiscalized=1,
+                 invoices_failed=0 if efris_status == "success" else 1,
+                 amount_fiscalized=_amount(details))
+
+
+def _increment(connection, rows: Iterable[dict]):
+    """Add rows' counters to daily_company_stats (insert when the day's row doesn't exist yet)"""
+    rows = list(rows)
+    table = DailyCompanyStats.__table__
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table)
+        set_ = {c: table.c[c] + statement.excluded[c] for c in COUNTERS}
+        set_["reseller_id"] = func.coalesce(statement.excluded.reseller_id, table.c.reseller_id)
+        connection.execute(statement.on_conflict_do_update(index_elements=["company_id", "day"], set_=set_), rows)
+        return
+
+    for row in rows:
+        values = {c: table.c[c] + row[c] for c in COUNTERS}
+        if row["reseller_id"]:
+            values["reseller_id"] = row["reseller_id"]
+        result = connection.execute(update(table).where(
+            table.c.company_id == row["company_id"], table.c.day == row["day"]
+        ).values(**values))
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+@event.listens_for(Session, "after_flush")
+def _count_new_rows(session: Session, flush_context):
+    tally = _Tally()
+    for obj in session.new:
+        if isinstance(obj, Invoice) and obj.company_id:
+            tally.add_invoice(obj.company_id, obj.created_at)
+        elif isinstance(obj, ActivityLog) and obj.activity_type == "invoice_fiscalized" and obj.company_id:
+            tally.add_activity(obj.company_id, obj.created_at, obj.reseller_id, obj.efris_status, obj.details)
+    if tally.rows:
+        _apply(session.connection(), tally)
+
+
+def count_activity_rows(connection, rows: Iterable[dict]):
+    """Counter increments for activity_logs rows inserted without the ORM (batched log writer)"""
+    tally = _Tally()
+    for row in rows:
+        if row.get("activity_type") == "invoice_fiscalized" and row.get("company_id"):
+            tally.add_activity(row["company_id"], row.get("created_at"), row.get("reseller_id"),
+                               row.get("efris_status"), row.get("details"))
+    if tally.rows:
+        _apply(connection, tally)
+
+
+def _apply(connection, tally: _Tally):
+    if connection.engine not in _enabled:
+        _enabled[connection.engine] = inspect(connection).has_table(DailyCompanyStats.__tablename__)
+        if not _enabled[connection.engine]:
+            logger.warning("daily_company_stats missing - dashboard counters not maintained "
+                           "(python migrations/add_daily_company_stats.py)")
+    if _enabled[connection.engine]:
+        _increment(connection, tally.rows.values())
+
+
+def rebuild_daily_stats(db: Session, since: Optional[date] = None) -> int:
+    """
+    Recompute daily_company_stats from invoices and activity_logs for days >= since
+    (all retained days when None). Returns the number of counter rows written. Does not commit.
+    """
+    kept_since = retention_cutoff("activity_logs")
+    if kept_since and (since is None or since < kept_since):
+        since = kept_since  # older activity has been rolled up - keep those counters
+    start = day_start(since) if since else None
+    tally = _Tally()
+
+    invoices = db.query(Invoice.company_id, Invoice.created_at).filter(Invoice.company_id.isnot(None))
+    if start:
+        invoices = invoices.filter(Invoice.created_at >= start)
+    for company_id, created_at in invoices.yield_per(5000):
+        tally.add_invoice(company_id, created_at)
+
+    client = aliased(User)
+    activities = db.query(
+        ActivityLog.company_id, ActivityLog.created_at,
+        func.coalesce(ActivityLog.reseller_id, client.parent_id),
+        ActivityLog.efris_status, ActivityLog.details
+    ).outerjoin(client, client.id == ActivityLog.user_id).filter(
+        ActivityLog.activity_type == "invoice_fiscalized",
+        ActivityLog.company_id.isnot(None)
+    )
+    if start:
+        activities = activities.filter(ActivityLog.created_at >= start)
+    for company_id, created_at, reseller_id, efris_status, details in activities.yield_per(5000):
+        tally.add_activity(company_id, created_at, reseller_id, efris_status, details)
+
+    stale = db.query(DailyCompanyStats)
+    if since:
+        stale = stale.filter(DailyCompanyStats.day >= since)
+    stale.delete(synchronize_session=False)
+    rows = [row for row in tally.rows.values() if not since or row["day"] >= since]
+    if rows:
+        db.execute(DailyCompanyStats.__table__.insert(), rows)
+    return len(rows)
+
+
+def platform_day_totals(db: Session, day: Optional[date] = None) -> dict:
+    """All companies' counters for one day (owner dashboard)"""
+    row = db.query(*[func.coalesce(func.sum(getattr(DailyCompanyStats, c)), 0) for c in COUNTERS]).filter(
+        DailyCompanyStats.day == (day or local_day())
+    ).one()
+    return dict(zip(COUNTERS, row))
+
+
+def reseller_fiscalized_totals(db: Session, reseller_id: int, today: Optional[date] = None) -> dict:
+    """Invoices fiscalized by a reseller's clients today, this month and overall"""
+    today = today or local_day()
+    fiscalized = DailyCompanyStats.invoices_fiscalized
+    row = db.query(
+        func.coalesce(func.sum(case((DailyCompanyStats.day == today, fiscalized), else_=0)), 0),
+        func.coalesce(func.sum(case((DailyCompanyStats.day >= today.replace(day=1), fiscalized), else_=0)), 0),
+        func.coalesce(func.sum(fiscalized), 0)
+    ).filter(DailyCompanyStats.reseller_id == reseller_id).one()
+    return {"today": row[0], "this_month": row[1], "total": row[2]}
+
+
+__all__ = [
+    'COUNTERS',
+    'STATS_TZ',
+    'local_day',
+    'count_activity_rows',
+    'rebuild_daily_stats',
+    'platform_day_totals',
+    'reseller_fiscalized_totals'
+]
+
+
+if __name__ == "__main__":
+    from database.connection import SessionLocal
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    db = SessionLocal()
+    try:
+        written = rebuild_daily_stats(db, local_day() - timedelta(days=days - 1))
+        db.commit()
+        print(f"✅ Rebuilt {written} daily stats row(s) for the last {days} day(s)")
+    finally:
+        db.close()
@@ -0,0 +1,244 @@
+"""
+Retention and rollup for the append-only log tables (activity_logs, audit_logs)
+- Rows older than ACTIVITY_LOG_RETENTION_DAYS / AUDIT_LOG_RETENTION_DAYS are compacted into
+  daily counts in log_rollups (day, company, activity_type/action, efris_status) and deleted,
+  one day per transaction (0 keeps a table forever)
+- PostgreSQL: migrations/partition_log_tables.py turns both tables into monthly range
+  partitions on created_at; whole months past retention are rolled up and dropped instead
+  of deleted, and partitions are created LOG_PARTITION_MONTHS_AHEAD months in advance
+- SQLite / MySQL keep one table: old days are deleted after they are rolled up
+- Feed queries filter on created_at >= feed_since() (LOG_FEED_DAYS) so they only read
+  recent partitions / the recent end of the created_at index
+
+Usage (cron, nightly):
+    python -m database.log_retention
+"""
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from database.models import ActivityLog, AuditLog, LogRollup
+
+logger = logging.getLogger("efris_api")
+
+ACTIVITY_LOG_RETENTION_DAYS = int(os.getenv("ACTIVITY_LOG_RETENTION_DAYS", "90"))
+AUDIT_LOG_RETENTION_DAYS = int(os.getenv("AUDIT_LOG_RETENTION_DAYS", "365"))
+LOG_FEED_DAYS = int(os.getenv("LOG_FEED_DAYS", "30"))
+LOG_PARTITION_MONTHS_AHEAD = int(os.getenv("LOG_PARTITION_MONTHS_AHEAD", "3"))
+
+
+class LogTable(NamedTuple):
+    model: type
+    kind: object  # column rolled up as log_rollups.kind
+    status: object  # column rolled up as log_rollups.status (None: not tracked)
+    retention_days: int
+
+
+LOG_TABLES: Dict[str, LogTable] = {
+    "activity_logs": LogTable(ActivityLog, ActivityLog.activity_type, ActivityLog.efris_status,
+                              ACTIVITY_LOG_RETENTION_DAYS),
+    "audit_logs": LogTable(AuditLog, AuditLog.action, None, AUDIT_LOG_RETENTION_DAYS),
+}
+
+PARTITION_NAME = re.compile(r"_(\d{4})_(\d{2})$")
+
+
+def feed_since(days: Optional[int] = None) -> datetime:
+    """Oldest created_at a feed query should read (UTC, naive like the stored timestamps)"""
+    return datetime.utcnow() - timedelta(days=LOG_FEED_DAYS if days is None else days)
+
+
+def retention_cutoff(table: str, today: Optional[date] = None) -> Optional[date]:
+    """First day still kept in full for a log table (None when kept forever)"""
+    days = LOG_TABLES[table].retention_days
+    if days <= 0:
+        return None
+    return (today or datetime.utcnow().date()) - timedelta(days=days)
+
+
+def _midnight(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+# ========== POSTGRESQL PARTITIONS ==========
+
+def is_partitioned(connection, table: str) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :t AND relkind IN ('p', 'r')"), {"t": table}
+    ).scalar() == "p"
+
+
+def monthly_partitions(connection, table: str) -> Dict[date, str]:
+    """month -> partition table name (the default partition is not included)"""
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :t"
+    ), {"t": table}).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def ensure_partitions(connection, table: str, first: date, last: date) -> List[str]:
+    """Create the monthly partitions covering first..last that don't exist yet"""
+    existing = monthly_partitions(connection, table)
+    created = []
+    month = month_start(first)
+    while month <= last:
+        if month not in existing:
+            name = partition_name(table, month)
+            connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+            ))
+            created.append(name)
+        month = next_month(month)
+    if created:
+        logger.info(f"[LOGS] Created partitions {', '.join(created)}")
+    return created
+
+
+# ========== ROLLUP ==========
+
+def _rollup(db: Session, table: str, start: datetime, end: datetime) -> int:
+    """Add daily counts of rows created in [start, end) to log_rollups. Does not commit."""
+    spec = LOG_TABLES[table]
+    created_at = spec.model.created_at
+    keys = [func.date(created_at), spec.model.company_id, spec.kind]
+    if spec.status is not None:
+        keys.append(spec.status)
+    rows = db.query(*keys, func.count()).filter(
+        created_at >= start, created_at < end
+    ).group_by(*keys).all()
+    if rows:
+        db.execute(LogRollup.__table__.insert(), [{
+            "log_table": table,
+            # func.date() comes back as a string on SQLite
+            "day": row[0] if isinstance(row[0], date) else date.fromisoformat(str(row[0])[:10]),
+            "company_id": row[1],
+            "kind": row[2] or "unknown",
+            "status": row[3] if spec.status is not None else None,
+            "count": row[-1]
+        } for row in rows])
+    return sum(row[-1] for row in rows)
+
+
+def _drop_expired_partitions(db: Session, table: str, cutoff: date, result: dict):
+    """Roll up and drop partitions whose whole month is older than cutoff"""
+    for month, name in sorted(monthly_partitions(db.connection(), table).items()):
+        if next_month(month) > cutoff:
+            break
+        rows = _rollup(db, table, _midnight(month), _midnight(next_month(month)))
+        db.execute(text(f"DROP TABLE {name}"))
+        db.commit()
+        result["rows"] += rows
+        result["partitions_dropped"] += 1
+        logger.info(f"[LOGS] Rolled up {rows} row(s) and dropped partition {name}")
+
+
+def compact(db: Session, table: str, cutoff: date) -> dict:
+    """
+    Roll up and remove rows created before cutoff: expired partitions first (PostgreSQL),
+    then day by day. One commit per partition / day, so an interrupted run can be resumed.
+    """
+    model = LOG_TABLES[table].model
+    result = {"rows": 0, "partitions_dropped": 0}
+    if is_partitioned(db.connection(), table):
+        _drop_expired_partitions(db, table, cutoff, result)
+
+    while True:
+        oldest = db.query(func.min(model.created_at)).filter(model.created_at < _midnight(cutoff)).scalar()
+        if oldest is None:
+            break
+        day = oldest.date()
+        start, end = _midnight(day), min(_midnight(day + timedelta(days=1)), _midnight(cutoff))
+        _rollup(db, table, start, end)
+        deleted = db.query(model).filter(model.created_at >= start, model.created_at < end).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        result["rows"] += deleted
+    return result
+
+
+def run_retention(db: Session, today: Optional[date] = None) -> Dict[str, dict]:
+    """Nightly job: create upcoming partitions and compact every log table past retention"""
+    today = today or datetime.utcnow().date()
+    results = {}
+    for table in LOG_TABLES:
+        if is_partitioned(db.connection(), table):
+            last = month_start(today)
+            for _ in range(LOG_PARTITION_MONTHS_AHEAD):
+                last = next_month(last)
+            ensure_partitions(db.connection(), table, today, last)
+            db.commit()
+        cutoff = retention_cutoff(table, today)
+        if cutoff is not None:
+            results[table] = compact(db, table, cutoff)
+            logger.info(f"[LOGS] {table}: compacted {results[table]} (kept since {cutoff})")
+    return results
+
+
+def rollup_summary(db: Session, table: str, since: Optional[date] = None,
+                   company_id: Optional[int] = None) -> List[dict]:
+    """Rolled-up counts per kind/status (for history older than the retention window)"""
+    query = db.query(LogRollup.kind, LogRollup.status, func.sum(LogRollup.count)).filter(
+        LogRollup.log_table == table
+    )
+    if since:
+        query = query.filter(LogRollup.day >= since)
+    if company_id:
+        query = query.filter(LogRollup.company_id == company_id)
+    return [{"kind": kind, "status": status, "count": int(count)}
+            for kind, status, count in query.group_by(LogRollup.kind, LogRollup.status)
+            .order_by(LogRollup.kind, LogRollup.status)]
+
+
+__all__ = [
+    'ACTIVITY_LOG_RETENTION_DAYS',
+    'AUDIT_LOG_RETENTION_DAYS',
+    'LOG_FEED_DAYS',
+    'LOG_TABLES',
+    'feed_since',
+    'retention_cutoff',
+    'partition_name',
+    'is_partitioned',
+    'ensure_partitions',
+    'compact',
+    'run_retention',
+    'rollup_summary'
+]
+
+
+if __name__ == "__main__":
+    from database.connection import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for table, result in run_retention(db).items():
+            print(f"✅ {table}: {result['rows']} row(s) rolled up, {result['partitions_dropped']} partition(s) dropped")
+    finally:
+        db.close()
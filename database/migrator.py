@@ -0,0 +1,202 @@
+"""
+Versioned schema migrations
+- MIGRATIONS lists the scripts in migrations/ in the order they were written; each one has
+  an upgrade(engine). Version 1 is the baseline: create_all for database/models.py
+- Applied versions are recorded in schema_migrations (version, name, applied_at)
+- run_migrations.py applies the pending versions once, at deploy time
+- Workers only compare MAX(version) with SCHEMA_VERSION at startup (one query) instead of
+  running create_all, which reflects every table on every worker spawn
+- An empty database (no tables, no version) is always migrated at startup, so a plain
+  uvicorn start on a fresh database still gets its schema
+- MIGRATE_ON_STARTUP=false (default): a worker on a behind schema only logs what's missing.
+  With true, a worker applies the pending online migrations (new tables / indexes) and
+  stops at the first deploy-only one (online=False: deletes duplicates, backfills or
+  rewrites tables) - those only run from run_migrations.py. PostgreSQL runs take an
+  advisory lock; a worker that finds it held skips migrating instead of waiting
+
+New migration: add migrations/<name>.py with upgrade(engine) (and downgrade), append it to
+MIGRATIONS with the next version number.
+
+Usage:
+    ensure_schema(engine)      # worker startup
+    migrate(engine)            # deploy (python run_migrations.py)
+"""
+import importlib.util
+import logging
+import os
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional, Set
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+logger = logging.getLogger("efris_api")
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+ADVISORY_LOCK_ID = 4637201  # pg_advisory_lock key for migration runs
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    script: Optional[str]  # file in migrations/ (None for the baseline)
+    online: bool = True  # safe for a worker to apply under live traffic
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", None),
+    Migration(2, "add_tenant_indexes", "add_tenant_indexes.py"),
+    Migration(3, "add_unique_tenant_keys", "add_unique_tenant_keys.py", online=False),  # deletes duplicates
+    Migration(4, "archive_efris_payloads", "archive_efris_payloads.py", online=False),  # backfill
+    Migration(5, "add_search_indexes", "add_search_indexes.py"),
+    Migration(6, "add_daily_company_stats", "add_daily_company_stats.py", online=False),  # backfill
+    Migration(7, "partition_log_tables", "partition_log_tables.py", online=False),  # rewrites log tables
+    Migration(8, "add_background_jobs", "add_background_jobs.py"),
+    Migration(9, "add_listing_order_indexes", "add_listing_order_indexes.py"),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def load_script(migration: Migration):
+    """Import a migrations/ script as a module"""
+    path = os.path.join(MIGRATIONS_DIR, migration.script)
+    spec = importlib.util.spec_from_file_location(f"migrations.{migration.name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """Highest applied version, None if schema_migrations doesn't exist yet"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def applied_versions(engine: Engine) -> Set[int]:
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine: Engine) -> List[Migration]:
+    schema_migrations.create(engine, checkfirst=True)
+    done = applied_versions(engine)
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+def _record(engine: Engine, migration: Migration):
+    try:
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.insert().values(version=migration.version, name=migration.name))
+    except IntegrityError:
+        pass  # recorded by a concurrent run
+
+
+@contextmanager
+def _migration_lock(engine: Engine, wait: bool = True):
+    """
+    Serialize migration runs across workers (PostgreSQL advisory lock; no-op elsewhere).
+    Yields False when wait=False and another run holds the lock.
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    with engine.connect() as conn:
+        if wait:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        elif not conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": ADVISORY_LOCK_ID}).scalar():
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ADVISORY_LOCK_ID})
+
+
+def apply(engine: Engine, migration: Migration):
+    if migration.script is None:
+        from database.models import Base
+        Base.metadata.create_all(bind=engine)
+    else:
+        load_script(migration).upgrade(engine)
+    _record(engine, migration)
+
+
+def migrate(engine: Engine, target: Optional[int] = None, online_only: bool = False,
+            wait: bool = True) -> List[Migration]:
+    """
+    Apply pending migrations up to target (all by default), in order; returns those applied.
+    online_only stops before the first deploy-only migration; wait=False returns [] when
+    another run holds the lock.
+    """
+    applied = []
+    with _migration_lock(engine, wait) as locked:
+        if not locked:
+            logger.info("[MIGRATE] Another process is migrating - skipped")
+            return applied
+        for migration in pending(engine):  # re-read under the lock
+            if target is not None and migration.version > target:
+                break
+            if online_only and not migration.online:
+                logger.error(f"[MIGRATE] {migration.version}: {migration.name} is deploy-only "
+                             f"- run python run_migrations.py")
+                break
+            logger.info(f"[MIGRATE] Applying {migration.version}: {migration.name}")
+            apply(engine, migration)
+            applied.append(migration)
+    return applied
+
+
+def stamp(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """Record migrations as applied without running them (databases migrated by hand)"""
+    stamped = [m for m in pending(engine) if target is None or m.version <= target]
+    for migration in stamped:
+        _record(engine, migration)
+    return stamped
+
+
+def ensure_schema(engine: Engine, migrate_on_startup: Optional[bool] = None) -> Optional[int]:
+    """
+    Worker startup: one version query when the schema is current. An empty database always
+    gets every migration (a fresh deploy started with just uvicorn has no other way to get
+    its tables). Otherwise log what's missing, or (MIGRATE_ON_STARTUP) apply the online
+    migrations. Returns the schema version.
+    """
+    version = current_version(engine)
+    if version is not None and version >= SCHEMA_VERSION:
+        return version
+    empty = version is None and not inspect(engine).get_table_names()
+    if not empty and not (MIGRATE_ON_STARTUP if migrate_on_startup is None else migrate_on_startup):
+        logger.error(f"[MIGRATE] Database schema is at version {version or 0}, this code expects "
+                     f"{SCHEMA_VERSION} - run python run_migrations.py")
+        return version
+    try:
+        migrate(engine, online_only=not empty, wait=False)
+    except Exception as e:
+        logger.error(f"[MIGRATE] Startup migration failed - run python run_migrations.py: {e}")
+    return current_version(engine)
+
+
+__all__ = [
+    'MIGRATE_ON_STARTUP',
+    'Migration',
+    'MIGRATIONS',
+    'SCHEMA_VERSION',
+    'current_version',
+    'pending',
+    'migrate',
+    'stamp',
+    'ensure_schema'
+]
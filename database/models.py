@@ -1,11 +1,15 @@
 """
 Database Models for Multi-Tenant EFRIS API
 Supports: Admin → Resellers → Clients (Taxpayers)
+
+Large JSON blobs (QB documents, EFRIS payloads/responses) are deferred in the "payloads"
+group: list queries skip them, and code that reads them opts in with
+.options(undefer(Model.column)) or undefer_group("payloads") so they load with the rows.
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Text, Float, JSON, Enum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Text, Float, JSON, Enum, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.sql import func, text
 from datetime import datetime
 import enum
 
@@ -43,6 +47,9 @@ class User(Base):
     - CLIENT: End taxpayers who use the control panel
     """
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_parent_id", "parent_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
@@ -82,6 +89,9 @@ class Company(Base):
     Each CLIENT has ONE company with their TIN, device_no, and private key
     """
     __tablename__ = "companies"
+    __table_args__ = (
+        Index("ix_companies_owner_id", "owner_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
@@ -174,6 +184,9 @@ class Company(Base):
 class CompanyUser(Base):
     """Many-to-many relationship between users and companies with roles"""
     __tablename__ = "company_users"
+    __table_args__ = (
+        Index("ix_company_users_user_company", "user_id", "company_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -231,6 +244,11 @@ class ClientReferral(Base):
 class Product(Base):
     """Products cached from QuickBooks with EFRIS metadata"""
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_company_qb_item_id", "company_id", "qb_item_id"),
+        Index("ix_products_company_keyset", "company_id", "id"),  # keyset pagination order
+        Index("ix_products_company_listed", "company_id", text("coalesce(updated_at, created_at)"), "id"),  # list order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -273,6 +291,11 @@ class Product(Base):
 class Invoice(Base):
     """Invoices from QuickBooks with EFRIS fiscalization data"""
     __tablename__ = "invoices"
+    __table_args__ = (
+        Index("ix_invoices_company_qb_invoice_id", "company_id", "qb_invoice_id"),
+        Index("ix_invoices_company_keyset", "company_id", "id"),  # keyset pagination order
+        Index("ix_invoices_company_listed", "company_id", text("coalesce(qb_txn_date, created_at)"), "id"),  # list order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -283,7 +306,7 @@ class Invoice(Base):
     qb_customer_name = Column(String(255))
     qb_txn_date = Column(DateTime)
     qb_total_amt = Column(Float)
-    qb_data = Column(JSON)  # Full QB invoice data
+    qb_data = deferred(Column(JSON), group="payloads")  # Full QB invoice data
     
     # EFRIS Fiscalization
     efris_fdn = Column(String(100), unique=True, index=True)  # Fiscal Document Number
@@ -291,7 +314,7 @@ class Invoice(Base):
     efris_qr_code = Column(Text)
     efris_invoice_id = Column(String(100))
     efris_status = Column(String(50), default="Pending")  # Fiscalized, Pending, Failed
-    efris_response = Column(JSON)  # Full EFRIS response
+    efris_response = deferred(Column(JSON), group="payloads")  # Full EFRIS response
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -305,6 +328,11 @@ class Invoice(Base):
 class PurchaseOrder(Base):
     """Purchase Orders from QuickBooks"""
     __tablename__ = "purchase_orders"
+    __table_args__ = (
+        Index("ix_purchase_orders_company_qb_po_id", "company_id", "qb_po_id"),
+        Index("ix_purchase_orders_company_keyset", "company_id", "id"),  # keyset pagination order
+        Index("ix_purchase_orders_company_listed", "company_id", text("coalesce(qb_txn_date, created_at)"), "id"),  # list order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -315,12 +343,12 @@ class PurchaseOrder(Base):
     qb_vendor_name = Column(String(255))
     qb_txn_date = Column(DateTime)
     qb_total_amt = Column(Float)
-    qb_data = Column(JSON)  # Full QB PO data
+    qb_data = deferred(Column(JSON), group="payloads")  # Full QB PO data
     
     # EFRIS Status
     efris_status = Column(String(50), default="pending")  # pending, sent, failed
     efris_sent_at = Column(DateTime(timezone=True))  # When sent to EFRIS
-    efris_response = Column(JSON)  # EFRIS response data
+    efris_response = deferred(Column(JSON), group="payloads")  # EFRIS response data
     efris_error = Column(Text)  # Error message if failed
     
     # Timestamps
@@ -334,6 +362,11 @@ class PurchaseOrder(Base):
 class CreditMemo(Base):
     """Credit Memos from QuickBooks"""
     __tablename__ = "credit_memos"
+    __table_args__ = (
+        Index("ix_credit_memos_company_qb_credit_memo_id", "company_id", "qb_credit_memo_id"),
+        Index("ix_credit_memos_company_keyset", "company_id", "id"),  # keyset pagination order
+        Index("ix_credit_memos_company_listed", "company_id", text("coalesce(updated_at, created_at)"), "id"),  # list order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -344,7 +377,7 @@ class CreditMemo(Base):
     qb_customer_name = Column(String(255))
     qb_txn_date = Column(DateTime)
     qb_total_amt = Column(Float)
-    qb_data = Column(JSON)  # Full QB credit memo data
+    qb_data = deferred(Column(JSON), group="payloads")  # Full QB credit memo data
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -354,6 +387,12 @@ class CreditMemo(Base):
 class EFRISGood(Base):
     """Goods/Products imported from EFRIS"""
     __tablename__ = "efris_goods"
+    __table_args__ = (
+        # One row per registered item - target of the bulk upsert in database/bulk.py
+        Index("uq_efris_goods_company_goods_code", "company_id", "goods_code", unique=True),
+        Index("ix_efris_goods_company_keyset", "company_id", "id"),  # keyset pagination order
+        Index("ix_efris_goods_company_listed", "company_id", text("coalesce(updated_at, created_at)"), "id"),  # list order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -370,7 +409,7 @@ class EFRISGood(Base):
     stock = Column(Float)  # stock
     
     # Full data
-    efris_data = Column(JSON)  # Complete EFRIS response
+    efris_data = deferred(Column(JSON), group="payloads")  # Complete EFRIS response
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -384,6 +423,15 @@ class EFRISGood(Base):
 class EFRISInvoice(Base):
     """Invoices imported from EFRIS and submitted to EFRIS"""
     __tablename__ = "efris_invoices"
+    __table_args__ = (
+        # One row per invoice number (FDN for fiscalized QB/imported invoices, ERP number for external API)
+        Index("uq_efris_invoices_company_invoice_no", "company_id", "invoice_no", unique=True),
+        Index("ix_efris_invoices_company_qb_invoice_id", "company_id", "qb_invoice_id"),
+        Index("ix_efris_invoices_company_qb_number_fdn", "company_id", "qb_invoice_number", "fdn"),
+        Index("ix_efris_invoices_company_created", "company_id", "created_at"),
+        Index("ix_efris_invoices_company_keyset", "company_id", "id"),  # keyset pagination order
+        Index("ix_efris_invoices_company_listed", "company_id", text("coalesce(issued_date, created_at)"), "id"),  # list order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -406,8 +454,11 @@ class EFRISInvoice(Base):
     efris_invoice_id = Column(String(100))  # EFRIS invoice ID
     submission_date = Column(DateTime)  # When submitted
     error_message = Column(Text)  # Error details if failed
-    efris_payload = Column(JSON)  # T109 request payload
-    efris_response = Column(JSON)  # T109 response
+    # Legacy inline copies - new submissions go to payload_archive (payload_ref / response_ref)
+    efris_payload = deferred(Column(JSON(none_as_null=True)), group="payloads")  # T109 request payload
+    efris_response = deferred(Column(JSON(none_as_null=True)), group="payloads")  # T109 response
+    payload_ref = Column(String(64))  # payload_archive.digest of the T109 request
+    response_ref = Column(String(64))  # payload_archive.digest of the T109 response
     
     # EFRIS Data (for imported invoices)
     invoice_no = Column(String(100), index=True)  # invoiceNo
@@ -440,7 +491,7 @@ class EFRISInvoice(Base):
     device_no = Column(String(100))  # deviceNo
     
     # Full data
-    efris_data = Column(JSON)  # Complete EFRIS response
+    efris_data = deferred(Column(JSON), group="payloads")  # Complete EFRIS response
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -451,9 +502,24 @@ class EFRISInvoice(Base):
     company = relationship("Company")
 
 
+class PayloadArchive(Base):
+    """Compressed, content-addressed EFRIS payloads (database/payload_archive.py)"""
+    __tablename__ = "payload_archive"
+
+    digest = Column(String(64), primary_key=True)  # sha256 of the canonical JSON
+    codec = Column(String(10), nullable=False)  # zstd, gzip
+    data = Column(LargeBinary, nullable=False)
+    raw_size = Column(Integer)  # bytes before compression
+    stored_size = Column(Integer)  # bytes after compression
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class ExciseCode(Base):
     """Excise duty codes from EFRIS T125 - stored per company"""
     __tablename__ = "excise_codes"
+    __table_args__ = (
+        Index("ix_excise_codes_company_excise_code", "company_id", "excise_code"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
@@ -476,6 +542,11 @@ class ExciseCode(Base):
 class AuditLog(Base):
     """Audit trail for all operations"""
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        Index("ix_audit_logs_company_created", "company_id", "created_at"),
+        Index("ix_audit_logs_user_created", "user_id", "created_at"),
+        Index("ix_audit_logs_created", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -492,6 +563,11 @@ class AuditLog(Base):
 class ActivityLog(Base):
     """Activity log for tracking invoice/EFRIS operations (for owner dashboard)"""
     __tablename__ = "activity_logs"
+    __table_args__ = (
+        Index("ix_activity_logs_user_type_created", "user_id", "activity_type", "created_at"),
+        Index("ix_activity_logs_company_created", "company_id", "created_at"),
+        Index("ix_activity_logs_created", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"))
@@ -518,6 +594,74 @@ class ActivityLog(Base):
     reseller = relationship("User", foreign_keys=[reseller_id])
 
 
+class LogRollup(Base):
+    """Daily counts of activity_logs / audit_logs rows past retention (database/log_retention.py)"""
+    __tablename__ = "log_rollups"
+    __table_args__ = (
+        Index("ix_log_rollups_table_day", "log_table", "day"),
+        Index("ix_log_rollups_company_day", "company_id", "day"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    log_table = Column(String(20), nullable=False)  # activity_logs, audit_logs
+    day = Column(Date, nullable=False)  # UTC
+    company_id = Column(Integer, ForeignKey("companies.id"))
+    kind = Column(String(100), nullable=False)  # activity_type / action
+    status = Column(String(20))  # efris_status (activity_logs only)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyCompanyStats(Base):
+    """Per-company, per-day dashboard counters (maintained by database/daily_stats.py)"""
+    __tablename__ = "daily_company_stats"
+    __table_args__ = (
+        Index("ix_daily_company_stats_reseller_day", "reseller_id", "day"),
+        Index("ix_daily_company_stats_day", "day"),
+    )
+
+    company_id = Column(Integer, ForeignKey("companies.id"), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC
+    reseller_id = Column(Integer, ForeignKey("users.id"))
+
+    invoices_created = Column(Integer, nullable=False, default=0)  # QB invoices saved
+    invoices_fiscalized = Column(Integer, nullable=False, default=0)  # invoice_fiscalized activity, any outcome
+    invoices_failed = Column(Integer, nullable=False, default=0)
+    amount_fiscalized = Column(Float, nullable=False, default=0)
+
+
+class BackgroundJob(Base):
+    """Durable queue of long-running imports / syncs, run by jobs.py workers"""
+    __tablename__ = "background_jobs"
+    __table_args__ = (
+        Index("ix_background_jobs_claim", "status", "run_after"),
+        Index("ix_background_jobs_company_created", "company_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    job_type = Column(String(50), nullable=False)  # key in jobs.JOB_HANDLERS
+    params = Column(JSON)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, succeeded, failed, cancelled
+
+    progress_done = Column(Integer, nullable=False, default=0)
+    progress_total = Column(Integer)  # None while unknown (QuickBooks doesn't say up front)
+    message = Column(String(500))
+    checkpoint = Column(JSON)  # handler's resume point, committed with each page of work
+    result = Column(JSON)
+    error = Column(Text)
+
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)  # retry backoff
+    locked_by = Column(String(100))  # worker id while running
+    heartbeat_at = Column(DateTime)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
 class SystemSettings(Base):
     """System-wide settings for landing page and app configuration"""
     __tablename__ = "system_settings"
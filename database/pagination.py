@@ -0,0 +1,148 @@
+"""
+Keyset (cursor) pagination
+- Pages continue from the last row seen (WHERE (sort_key, id) < cursor) instead of OFFSET,
+  so deep pages cost the same as the first one and rows don't shift between requests
+- Opaque URL-safe cursors
+- Sort keys can be expressions, e.g. a nullable date with a NOT NULL fallback
+  (coalesce(qb_txn_date, created_at)) followed by the primary key as tie-breaker
+- Approximate totals: PostgreSQL planner estimate for large result sets, exact COUNT otherwise
+
+Usage:
+    page = keyset_paginate(query, [func.coalesce(Invoice.qb_txn_date, Invoice.created_at), Invoice.id],
+                           cursor, limit)
+    page.items, page.next_cursor
+"""
+import base64
+import json
+import os
+from datetime import date, datetime
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, Date, String, tuple_, type_coerce
+from sqlalchemy.orm import Query
+
+# Below this many (estimated) rows the exact COUNT is cheap enough to run
+EXACT_COUNT_BELOW = int(os.getenv("PAGINATION_EXACT_COUNT_BELOW", "10000"))
+
+
+class InvalidCursor(ValueError):
+    """Cursor could not be decoded or doesn't match the endpoint's sort keys"""
+
+
+class KeysetPage(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Date):
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> Tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("wrong number of sort keys")
+        return tuple(_decode_value(col, value) for col, value in zip(columns, values))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}") from e
+
+
+def keyset_query(query: Query, order_by: Sequence, cursor: Optional[str] = None,
+                 descending: bool = True) -> Query:
+    """query ordered by order_by, restricted to rows after cursor"""
+    columns = list(order_by)
+    if cursor:
+        after = tuple_(*columns)
+        values = tuple_(*decode_cursor(cursor, columns))
+        query = query.filter(after < values if descending else after > values)
+    return query.order_by(*[col.desc() if descending else col.asc() for col in columns])
+
+
+def _sort_keys(query: Query, order_by: Sequence) -> list:
+    """
+    order_by as compared in SQL. SQLite stores server_default timestamps without
+    microseconds but would bind cursor datetimes with them, so there dates are
+    compared (and put in the cursor) as the stored text
+    """
+    if query.session.get_bind().dialect.name != "sqlite":
+        return list(order_by)
+    return [type_coerce(key, String) if isinstance(key.type, (DateTime, Date)) else key for key in order_by]
+
+
+def keyset_paginate(query: Query, order_by: Sequence, cursor: Optional[str] = None,
+                    limit: Optional[int] = None, descending: bool = True) -> KeysetPage:
+    """
+    Order query (a single-entity query) by order_by and return the page after cursor.
+    limit=None returns every remaining row.
+
+    The last key must be unique, e.g. the primary key, and every key must be NOT NULL -
+    a NULL in a row value comparison never matches, so coalesce nullable dates.
+    """
+    keys = _sort_keys(query, order_by)
+    query = keyset_query(query, keys, cursor, descending)
+    if limit is None:
+        return KeysetPage(query.all(), None)
+
+    rows = query.add_columns(*keys).limit(limit + 1).all()
+    items = [row[0] for row in rows[:limit]]
+    if len(rows) <= limit:
+        return KeysetPage(items, None)
+    return KeysetPage(items, encode_cursor(list(rows[limit - 1][1:])))
+
+
+def _explain_sql(query: Query, dialect) -> Tuple[str, dict]:
+    """EXPLAIN for query in the driver's paramstyle (IN (...) lists expanded to one bind each)"""
+    compiled = query.statement.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    return f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+
+
+def estimate_count(query: Query, exact_below: int = EXACT_COUNT_BELOW) -> Tuple[int, bool]:
+    """
+    Row count for query as (count, is_estimate)
+
+    On PostgreSQL the planner's row estimate is used when it is at least exact_below,
+    avoiding a full COUNT(*) over hundreds of thousands of rows on every page.
+    """
+    query = query.order_by(None)
+    session = query.session
+    dialect = session.get_bind().dialect
+    if dialect.name == "postgresql":
+        sql, params = _explain_sql(query, dialect)
+        plan = session.connection().exec_driver_sql(sql, params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        if estimate >= exact_below:
+            return estimate, True
+    return query.count(), False
+
+
+__all__ = [
+    'EXACT_COUNT_BELOW',
+    'InvalidCursor',
+    'KeysetPage',
+    'encode_cursor',
+    'decode_cursor',
+    'keyset_query',
+    'keyset_paginate',
+    'estimate_count'
+]
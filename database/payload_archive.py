@@ -0,0 +1,120 @@
+"""
+Cold storage for EFRIS request/response payloads
+- Content-addressed: the key is the sha256 of the canonical JSON, so identical payloads
+  (retries, duplicate-invoice responses) are stored once
+- zstd compressed when the zstandard package is installed, gzip otherwise; the codec is
+  recorded per blob so both can be read back
+- efris_invoices keeps only the digests (payload_ref / response_ref); payloads are fetched
+  on demand for audits and invoice re-renders
+
+Usage:
+    efris_inv = EFRISInvoice(..., **archived_payloads(db, payload, response))
+    response = efris_response_of(db, efris_inv)
+"""
+import gzip
+import hashlib
+import json
+import logging
+from typing import Any, Optional
+
+from sqlalchemy.orm import Session
+
+from database.bulk import upsert
+from database.models import PayloadArchive
+
+logger = logging.getLogger("efris_api")
+
+try:
+    import zstandard
+    _zstd_compressor = zstandard.ZstdCompressor(level=10)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+    DEFAULT_CODEC = "zstd"
+except ImportError:
+    zstandard = None
+    DEFAULT_CODEC = "gzip"
+    logger.info("zstandard not installed - archiving EFRIS payloads with gzip (pip install zstandard)")
+
+
+def canonical_json(obj: Any) -> bytes:
+    """Stable serialization, so equal payloads hash the same"""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+
+
+def compress(raw: bytes, codec: str = DEFAULT_CODEC) -> bytes:
+    if codec == "zstd":
+        return _zstd_compressor.compress(raw)
+    return gzip.compress(raw, compresslevel=6, mtime=0)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Payload was archived with zstd - pip install zstandard to read it")
+        return _zstd_decompressor.decompress(data)
+    return gzip.decompress(data)
+
+
+def archive_payload(db: Session, obj: Any) -> Optional[str]:
+    """Store obj (if not already stored) and return its digest. Does not commit."""
+    if obj is None:
+        return None
+    raw = canonical_json(obj)
+    digest = hashlib.sha256(raw).hexdigest()
+    data = compress(raw)
+    upsert(db, PayloadArchive, [{
+        "digest": digest,
+        "codec": DEFAULT_CODEC,
+        "data": data,
+        "raw_size": len(raw),
+        "stored_size": len(data)
+    }], conflict_columns=["digest"], update_columns=[])
+    return digest
+
+
+def load_payload(db: Session, digest: Optional[str]) -> Any:
+    """Fetch and decode an archived payload (None if digest is None or unknown)"""
+    if not digest:
+        return None
+    row = db.query(PayloadArchive.codec, PayloadArchive.data).filter(PayloadArchive.digest == digest).first()
+    if row is None:
+        logger.warning(f"[ARCHIVE] Payload {digest} not found")
+        return None
+    return json.loads(decompress(row.codec, row.data))
+
+
+def archived_payloads(db: Session, payload: Any, response: Any) -> dict:
+    """
+    EFRISInvoice column values for a T109 request/response: archived references,
+    inline copies cleared. Works as constructor kwargs, upsert row values or via setattr.
+    """
+    return {
+        "payload_ref": archive_payload(db, payload),
+        "response_ref": archive_payload(db, response),
+        "efris_payload": None,
+        "efris_response": None
+    }
+
+
+def efris_payload_of(db: Session, invoice) -> Any:
+    """T109 request for an EFRISInvoice, inline (pre-archive rows) or from the archive"""
+    if invoice.efris_payload is not None:
+        return invoice.efris_payload
+    return load_payload(db, invoice.payload_ref)
+
+
+def efris_response_of(db: Session, invoice) -> Any:
+    """T109 response for an EFRISInvoice, inline (pre-archive rows) or from the archive"""
+    if invoice.efris_response is not None:
+        return invoice.efris_response
+    return load_payload(db, invoice.response_ref)
+
+
+__all__ = [
+    'DEFAULT_CODEC',
+    'canonical_json',
+    'archive_payload',
+    'load_payload',
+    'archived_payloads',
+    'efris_payload_of',
+    'efris_response_of'
+]
@@ -0,0 +1,141 @@
+"""
+Per-request SQL instrumentation
+- Engine cursor hooks count statements and DB time for the request being served
+  (request_scope() is opened by the HTTP middleware in api_multitenant)
+- Statements slower than SLOW_QUERY_THRESHOLD go to performance_monitor.log_slow_query
+  with the route and company that issued them
+- The same SQL text executed SQL_REPEAT_THRESHOLD+ times in one request is reported as a
+  likely N+1 pattern, with the route that caused it
+- Statements run outside a request (cron, background flushers) only get the slow query log
+
+Usage:
+    install(engine)                       # once per engine (api_multitenant startup)
+    with request_scope() as stats:        # around one request
+        ...
+        stats.route = "/api/companies/{company_id}/invoices"
+    attribute_company(company_id)         # once the tenant is known (auth dependencies)
+"""
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from monitoring import performance_monitor
+
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "10"))
+
+_current: ContextVar[Optional["RequestQueryStats"]] = ContextVar("request_query_stats", default=None)
+
+# engines that already have the cursor hooks attached
+_installed = weakref.WeakSet()
+
+
+class RequestQueryStats:
+    """SQL statements executed on behalf of one request"""
+
+    def __init__(self, route: Optional[str] = None):
+        self.route = route
+        self.company_id: Optional[int] = None
+        self.count = 0
+        self.seconds = 0.0
+        self.slow: List[Dict] = []
+        self.statements: Counter = Counter()
+        # sync endpoints and dependencies run in the threadpool but share this object
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, duration: float):
+        with self._lock:
+            self.count += 1
+            self.seconds += duration
+            self.statements[statement] += 1
+
+    @property
+    def milliseconds(self) -> float:
+        return round(self.seconds * 1000, 1)
+
+    def repeated(self, threshold: Optional[int] = None) -> Dict[str, int]:
+        """Statements executed at least `threshold` times (likely N+1 lookups)"""
+        threshold = threshold or SQL_REPEAT_THRESHOLD
+        return {sql: n for sql, n in self.statements.items() if n >= threshold}
+
+    def context(self) -> Dict:
+        return {"route": self.route, "company_id": self.company_id}
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-DB-Query-Count": str(self.count),
+            "Server-Timing": f"db;dur={self.milliseconds}",
+        }
+
+
+def current() -> Optional[RequestQueryStats]:
+    return _current.get()
+
+
+def attribute_company(company_id: Optional[int]):
+    """Attribute the current request's queries to a company (no-op outside a request)"""
+    stats = _current.get()
+    if stats is not None and company_id is not None:
+        stats.company_id = company_id
+
+
+@contextmanager
+def request_scope(route: Optional[str] = None):
+    """Collect statements for one request; repeated statements are reported on exit"""
+    stats = RequestQueryStats(route)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        for statement, times in stats.repeated().items():
+            performance_monitor.log_repeated_query(statement, times, stats.context())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    if duration > performance_monitor.slow_query_threshold:
+        if stats is not None:
+            stats.slow.append({"statement": statement[:200], "seconds": round(duration, 3)})
+        performance_monitor.log_slow_query(statement, duration, stats.context() if stats else None)
+
+
+def _handle_error(exception_context):
+    # the statement never reached after_cursor_execute - drop its start time
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def install(engine: Engine):
+    """Attach the timing hooks to an engine (idempotent)"""
+    if engine in _installed:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    _installed.add(engine)
+
+
+__all__ = [
+    'SQL_REPEAT_THRESHOLD',
+    'RequestQueryStats',
+    'current',
+    'attribute_company',
+    'request_scope',
+    'install'
+]
@@ -0,0 +1,175 @@
+"""
+Read-replica routing
+- DATABASE_REPLICA_URLS (comma separated) adds read replicas next to DATABASE_URL
+- get_read_db (database/connection.py) hands list / report / search endpoints a read-only
+  session on a replica, round-robin
+- Falls back to the primary when a replica is down or lags by more than
+  REPLICA_MAX_LAG_SECONDS (measured at most every REPLICA_LAG_CHECK_SECONDS)
+- Read-your-writes: reads for a company written by this worker within the last
+  REPLICA_MAX_LAG_SECONDS go to the primary (ORM flushes and bulk upserts are tracked)
+
+Usage:
+    router = ReplicaRouter(engine, [replica_engine])
+    bind = router.engine_for_read(company_id)
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("efris_api")
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "10"))
+
+# Seconds since the last replayed transaction, 0 when the replica has replayed everything
+# it received (an idle primary would otherwise look like growing lag)
+POSTGRES_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class ReadOnlySessionError(RuntimeError):
+    """A session from get_read_db tried to write"""
+
+
+class RecentWrites:
+    """company_id -> when this worker last committed a write for it"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.enabled = False  # only tracked once a router with replicas exists
+        self._written_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def note(self, company_ids: Iterable[int]):
+        now = self.clock()
+        with self._lock:
+            for company_id in company_ids:
+                self._written_at[int(company_id)] = now
+            if len(self._written_at) > 10000:
+                cutoff = now - REPLICA_MAX_LAG_SECONDS
+                self._written_at = {c: t for c, t in self._written_at.items() if t >= cutoff}
+
+    def within(self, company_id, seconds: float) -> bool:
+        written_at = self._written_at.get(int(company_id))
+        return written_at is not None and self.clock() - written_at < seconds
+
+
+recent_writes = RecentWrites()
+
+
+def note_written(session: Session, company_ids: Iterable[Optional[int]]):
+    """Remember companies written in this session's transaction (recorded on commit)"""
+    if recent_writes.enabled:
+        session.info.setdefault("written_companies", set()).update(c for c in company_ids if c is not None)
+
+
+@event.listens_for(Session, "before_flush")
+def _reject_writes(session: Session, flush_context, instances):
+    if session.info.get("read_only") and (session.new or session.dirty or session.deleted):
+        raise ReadOnlySessionError("Read-only session (get_read_db) cannot write - use get_db")
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed(session: Session, flush_context):
+    if not recent_writes.enabled:
+        return
+    note_written(session, (
+        getattr(obj, "company_id", None) if obj.__tablename__ != "companies" else obj.id
+        for obj in itertools.chain(session.new, session.dirty, session.deleted)
+    ))
+
+
+@event.listens_for(Session, "after_commit")
+def _record_written(session: Session):
+    written = session.info.pop("written_companies", None)
+    if written:
+        recent_writes.note(written)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session: Session):
+    session.info.pop("written_companies", None)
+
+
+class ReplicaRouter:
+    """Chooses the engine for a read: a fresh-enough replica, else the primary"""
+
+    def __init__(self, primary: Engine, replicas: List[Engine],
+                 max_lag: float = REPLICA_MAX_LAG_SECONDS,
+                 check_interval: float = REPLICA_LAG_CHECK_SECONDS,
+                 writes: RecentWrites = recent_writes):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.writes = writes
+        self.writes.enabled = self.writes.enabled or bool(replicas)
+        self._lag: Dict[Engine, tuple] = {}  # engine -> (lag seconds or None if down, checked at)
+        self._turn = itertools.count()
+        self._counts = Counter()
+
+    def measure_lag(self, replica: Engine) -> Optional[float]:
+        """Replication lag in seconds, None if the replica can't be reached"""
+        try:
+            with replica.connect() as conn:
+                if conn.dialect.name == "postgresql":
+                    return float(conn.execute(POSTGRES_LAG_SQL).scalar() or 0)
+                conn.execute(text("SELECT 1"))
+                return 0.0
+        except Exception as e:
+            logger.warning(f"[REPLICA] {replica.url.host or replica.url.database} unavailable: {e}")
+            return None
+
+    def lag(self, replica: Engine) -> Optional[float]:
+        """Cached lag, re-measured every check_interval seconds"""
+        cached = self._lag.get(replica)
+        now = self.writes.clock()
+        if cached is None or now - cached[1] >= self.check_interval:
+            cached = (self.measure_lag(replica), now)
+            self._lag[replica] = cached
+        return cached[0]
+
+    def engine_for_read(self, company_id: Optional[int] = None) -> Engine:
+        if not self.replicas:
+            return self.primary
+        if company_id is not None and self.writes.within(company_id, self.max_lag):
+            self._counts["primary_recent_write"] += 1
+            return self.primary
+        start = next(self._turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            lag = self.lag(replica)
+            if lag is not None and lag <= self.max_lag:
+                self._counts["replica"] += 1
+                return replica
+        self._counts["primary_replica_lagging"] += 1
+        return self.primary
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.replicas),
+            "lag_seconds": [self._lag.get(r, (None,))[0] for r in self.replicas],
+            "reads": dict(self._counts),
+        }
+
+
+__all__ = [
+    'REPLICA_MAX_LAG_SECONDS',
+    'REPLICA_LAG_CHECK_SECONDS',
+    'ReadOnlySessionError',
+    'RecentWrites',
+    'recent_writes',
+    'note_written',
+    'ReplicaRouter'
+]
@@ -0,0 +1,130 @@
+"""
+Indexed search for the goods, invoice and QuickBooks list endpoints
+- PostgreSQL: pg_trgm GIN index over one lower-cased document expression per table;
+  substring LIKE is answered from the index, results ranked by word_similarity
+- SQLite: FTS5 table with the trigram tokenizer (external content, kept in sync by
+  triggers), results ranked by bm25
+- Anything else, or a database the migration hasn't been run on: plain LIKE, newest first
+
+Indexes are created by migrations/add_search_indexes.py.
+
+Usage:
+    query = search_query(db.query(EFRISGood).filter(EFRISGood.company_id == company_id),
+                         EFRISGood, "cement")
+    query, keys = search_keys(query, EFRISGood, "cement")  # paged: keyset_paginate(query, keys, cursor, limit)
+"""
+import logging
+import os
+import weakref
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Float, Integer, func, literal_column, text
+from sqlalchemy.orm import Query
+
+logger = logging.getLogger("efris_api")
+
+# Page size for ranked search results when the caller doesn't pass a limit
+SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT", "500"))
+
+# FTS5 trigram tokens are 3 characters; shorter terms fall back to LIKE
+MIN_INDEXED_TERM = 3
+
+# table -> searchable columns
+SEARCH_FIELDS: Dict[str, List[str]] = {
+    "efris_goods": ["goods_code", "goods_name"],
+    "efris_invoices": ["invoice_no", "fdn", "reference_no", "qb_invoice_number",
+                       "buyer_legal_name", "buyer_business_name"],
+    "products": ["qb_name", "qb_sku", "qb_description"],
+    "invoices": ["qb_doc_number", "qb_customer_name"],
+    "purchase_orders": ["qb_doc_number", "qb_vendor_name"],
+    "credit_memos": ["qb_doc_number", "qb_customer_name"],
+}
+
+# engine -> {"trgm": bool, "fts": set of tables}
+_backends = weakref.WeakKeyDictionary()
+
+
+def fts_table(table: str) -> str:
+    return f"{table}_search"
+
+
+def document_sql(table: str) -> str:
+    """
+    The text searched on PostgreSQL. The trigram index is built on exactly this
+    expression, so queries must use it verbatim to be index-backed.
+    """
+    return "lower(" + " || ' ' || ".join(f"coalesce({col}, '')" for col in SEARCH_FIELDS[table]) + ")"
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _backend(query: Query) -> dict:
+    engine = query.session.get_bind()
+    if engine not in _backends:
+        with engine.connect() as conn:
+            if engine.dialect.name == "postgresql":
+                trgm = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+                _backends[engine] = {"trgm": bool(trgm), "fts": set()}
+            elif engine.dialect.name == "sqlite":
+                names = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+                _backends[engine] = {"trgm": False, "fts": {t for t in SEARCH_FIELDS if fts_table(t) in names}}
+            else:
+                _backends[engine] = {"trgm": False, "fts": set()}
+        if not _backends[engine]["trgm"] and not _backends[engine]["fts"]:
+            logger.warning("Search indexes not installed - searches use LIKE scans "
+                           "(python migrations/add_search_indexes.py)")
+    return _backends[engine]
+
+
+def search_keys(query: Query, model, term: str) -> Tuple[Query, list]:
+    """
+    Restrict query (over model) to rows matching term in any of the model's search
+    fields. Returns (query, keys): sort keys for best matches first, ties newest first,
+    all descending - usable with keyset_paginate. Case-insensitive substring match.
+    """
+    table = model.__tablename__
+    term = term.strip().lower()
+    backend = _backend(query)
+
+    if table in backend["fts"] and len(term) >= MIN_INDEXED_TERM:
+        fts = fts_table(table)
+        matches = text(
+            f"SELECT rowid AS id, bm25({fts}) AS rank FROM {fts} WHERE {fts} MATCH :match"
+        ).bindparams(match='"' + term.replace('"', '""') + '"').columns(id=Integer, rank=Float).subquery()
+        return query.join(matches, matches.c.id == model.id), [-matches.c.rank, model.id]  # bm25: lower is better
+
+    if query.session.get_bind().dialect.name == "postgresql":
+        document = literal_column(document_sql(table))
+        query = query.filter(document.like(_like_pattern(term), escape="\\"))
+        if backend["trgm"]:
+            return query, [func.word_similarity(term, document), model.id]
+        return query, [model.id]
+
+    pattern = _like_pattern(term)
+    columns = [getattr(model, col) for col in SEARCH_FIELDS[table]]
+    condition = columns[0].ilike(pattern, escape="\\")
+    for column in columns[1:]:
+        condition = condition | column.ilike(pattern, escape="\\")
+    return query.filter(condition), [model.id]
+
+
+def search_query(query: Query, model, term: str) -> Query:
+    """
+    Restrict query (over model) to rows matching term in any of the model's search
+    fields, best matches first (ties newest first). Case-insensitive substring match.
+    """
+    query, keys = search_keys(query, model, term)
+    return query.order_by(*[key.desc() for key in keys])
+
+
+__all__ = [
+    'SEARCH_RESULT_LIMIT',
+    'SEARCH_FIELDS',
+    'fts_table',
+    'document_sql',
+    'search_keys',
+    'search_query'
+]
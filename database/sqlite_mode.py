@@ -0,0 +1,120 @@
+"""
+Tuned SQLite mode for small single-node deployments (DATABASE_URL=sqlite:///efris.db)
+- WAL journal: readers no longer block the writer (or each other)
+- synchronous=NORMAL: fsync at checkpoints instead of every commit (safe with WAL)
+- busy_timeout, memory-mapped I/O and a larger page cache per connection
+- Single-writer queue: SQLite allows one writer at a time, so write transactions wait
+  their turn on an in-process lock instead of polling the file lock in the busy handler
+
+The lock is taken on a connection's first INSERT/UPDATE/DELETE and released when the
+connection goes back to the pool (after commit/rollback). Set SQLITE_TUNED=false to
+use SQLite's defaults.
+
+Usage:
+    configure_sqlite(engine)                      # sync engine (with the writer queue)
+    configure_sqlite(async_engine.sync_engine, writer_queue=False)
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("efris_api")
+
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+PRAGMAS = [
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", SQLITE_BUSY_TIMEOUT_MS),
+    ("mmap_size", SQLITE_MMAP_SIZE),
+    ("cache_size", -SQLITE_CACHE_SIZE_KB),  # negative = KiB rather than pages
+    ("temp_store", "MEMORY"),
+]
+
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class WriterQueue:
+    """One write transaction at a time per process, in arrival order of the waiters"""
+
+    def __init__(self, timeout: float = SQLITE_BUSY_TIMEOUT_MS / 1000):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._owner: Optional[int] = None
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def acquire(self) -> bool:
+        """True if the caller now holds the writer slot (and must release it)"""
+        if self._owner == threading.get_ident():
+            # Same thread writing through a second connection - waiting would deadlock,
+            # leave it to SQLite's busy handler
+            return False
+        started = time.perf_counter()
+        if not self._lock.acquire(timeout=self.timeout):
+            self.timeouts += 1
+            logger.warning(f"[SQLITE] Writer queue wait exceeded {self.timeout}s - continuing without it")
+            return False
+        waited = time.perf_counter() - started
+        self.waits += 1
+        self.wait_seconds += waited
+        self._owner = threading.get_ident()
+        return True
+
+    def release(self):
+        self._owner = None
+        self._lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.waits,
+            "avg_wait_ms": round(self.wait_seconds / self.waits * 1000, 2) if self.waits else 0.0,
+            "timeouts": self.timeouts,
+        }
+
+
+def configure_sqlite(engine: Engine, writer_queue: bool = True) -> Optional[WriterQueue]:
+    """Apply the tuned PRAGMAs to every new connection; returns the writer queue if enabled"""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    if not writer_queue:
+        return None
+    queue = WriterQueue()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def wait_for_writer_slot(conn, cursor, statement, parameters, context, executemany):
+        info = conn.connection.info  # the pooled connection's info, also seen on checkin
+        if "writer_slot" in info:
+            return
+        if statement.lstrip()[:7].upper().startswith(WRITE_PREFIXES):
+            info["writer_slot"] = queue.acquire()
+
+    @event.listens_for(engine, "checkin")
+    def release_writer_slot(dbapi_connection, connection_record):
+        if connection_record.info.pop("writer_slot", False):
+            queue.release()
+
+    return queue
+
+
+__all__ = [
+    'SQLITE_TUNED',
+    'PRAGMAS',
+    'WriterQueue',
+    'configure_sqlite'
+]
@@ -14,6 +14,7 @@ from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding as sym_padding
 from cryptography.hazmat.backends import default_backend
 import urllib3
+from efris_guard import guard_session
 
 # Disable SSL warnings for test environment
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -56,6 +57,11 @@ class EfrisManager:
             self.registration_details = {}  # Initialize
             print(f"[EFRIS] Initialized with TIN: {self.tin}, Device: {self.device_no}, Production Mode: YES, URL: {base_url}, SSL Verify: YES, Timeout: {self.request_timeout}s")
         self.base_url = base_url
+        # Circuit breaker per environment + TIN, adaptive concurrency limit per environment
+        guard_session(self.session, self._environment(), self.tin)
+
+    def _environment(self):
+        return "test" if self.test_mode else "production"
 
     def _load_certificate(self, cert_path):
         print(f"Loading certificate from {cert_path}")
@@ -1553,6 +1559,7 @@ class EfrisManager:
             self.session.cert = (self.cert_path, self.key_path)
         else:
             self.session = OAuth2Session(client_id=self.client_id)
+        guard_session(self.session, self._environment(), self.tin)
 
         # Use client_credentials flow
         response = self.session.post(
@@ -0,0 +1,301 @@
+"""
+Circuit Breakers and Adaptive Concurrency for EFRIS Requests
+- One circuit breaker per (environment, TIN): an outage on URA's test server no longer
+  fails production calls, and one company's broken device / certificate does not trip
+  the breaker for everyone else
+- One AIMD concurrency limit per environment: the number of EFRIS requests allowed in
+  flight grows by one per fast success and is multiplied by EFRIS_LIMIT_BACKOFF on a
+  timeout, connection error, 5xx or a response slower than EFRIS_LIMIT_SLOW_MS.
+  Requests over the limit fail at once instead of queueing behind 30s timeouts
+- Mounted on every EfrisManager session as a requests transport adapter, so every
+  T1xx call goes through it without changes to the individual methods
+- Both raise EfrisUnavailable (a requests ConnectionError); the API answers 503 with
+  Retry-After. State is reported under "efris_guard" in /metrics
+
+Usage:
+    guard_session(self.session, "test" if self.test_mode else "production", self.tin)
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("efris_api")
+
+EFRIS_BREAKER_FAILURES = int(os.getenv("EFRIS_BREAKER_FAILURES", "5"))  # consecutive failures that open it
+EFRIS_BREAKER_RESET_SECONDS = float(os.getenv("EFRIS_BREAKER_RESET_SECONDS", "30"))  # open -> one probe request
+EFRIS_LIMIT_INITIAL = int(os.getenv("EFRIS_LIMIT_INITIAL", "20"))
+EFRIS_LIMIT_MIN = int(os.getenv("EFRIS_LIMIT_MIN", "2"))
+EFRIS_LIMIT_MAX = int(os.getenv("EFRIS_LIMIT_MAX", "64"))
+EFRIS_LIMIT_BACKOFF = float(os.getenv("EFRIS_LIMIT_BACKOFF", "0.5"))
+EFRIS_LIMIT_SLOW_MS = float(os.getenv("EFRIS_LIMIT_SLOW_MS", "5000"))
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+class EfrisUnavailable(requests.exceptions.ConnectionError):
+    """Request refused locally: circuit open or concurrency limit reached"""
+
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker
+
+    States:
+    - CLOSED: Normal operation
+    - OPEN: Service is down, reject all requests until reset_seconds have passed
+    - HALF_OPEN: One probe request is let through; success closes, failure re-opens
+
+    Every state change starts a new generation. before_call() returns a token (generation,
+    is_probe); record() ignores results from an earlier generation, and while not CLOSED
+    only the probe's result moves the breaker, so a slow call that started before the
+    breaker opened can't close it again.
+
+    Usage:
+        token = breaker.before_call()  # raises EfrisUnavailable while open
+        ...
+        breaker.record(ok, token)
+    """
+
+    def __init__(self, name: str = "efris", failure_threshold: int = EFRIS_BREAKER_FAILURES,
+                 reset_seconds: float = EFRIS_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._generation = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self) -> Tuple[int, bool]:
+        with self._lock:
+            if self.state == CLOSED:
+                return self._generation, False
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+                logger.info(f"[BREAKER] {self.name}: HALF_OPEN - testing service")
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return self._generation, True
+            self.rejected += 1
+        raise EfrisUnavailable(f"EFRIS temporarily unavailable ({self.name}), circuit open",
+                               retry_after=max(1.0, remaining))
+
+    def record(self, ok: bool, token: Optional[Tuple[int, bool]] = None):
+        """Outcome of the call before_call() returned token for (None: a call in the current generation)"""
+        with self._lock:
+            generation, probe = token if token is not None else (self._generation, False)
+            if generation != self._generation:
+                return  # started before the last state change
+            if self.state != CLOSED:
+                if not probe:
+                    return
+                self._probing = False
+                self._generation += 1
+                if ok:
+                    logger.info(f"[BREAKER] {self.name}: CLOSED - service recovered")
+                    self.state = CLOSED
+                    self.failures = 0
+                else:
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+                return
+            if ok:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                logger.error(f"[BREAKER] {self.name}: OPEN - service failed {self.failures} times")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                self._generation += 1
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func(*args, **kwargs) under the breaker; any exception counts as a failure"""
+        token = self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record(False, token)
+            raise
+        self.record(True, token)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit: +1 per fast success while the limit is in use,
+    x backoff on a failure or a response slower than slow_ms
+    """
+
+    def __init__(self, name: str, initial: int = EFRIS_LIMIT_INITIAL, min_limit: int = EFRIS_LIMIT_MIN,
+                 max_limit: int = EFRIS_LIMIT_MAX, backoff: float = EFRIS_LIMIT_BACKOFF,
+                 slow_ms: float = EFRIS_LIMIT_SLOW_MS):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.slow_seconds = slow_ms / 1000
+        self._lock = threading.Lock()
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.rejected = 0
+        self.decreases = 0
+        self.last_latency_ms: Optional[float] = None
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: Optional[float] = None, ok: bool = True):
+        """latency None: the request never reached EFRIS, leave the limit alone"""
+        with self._lock:
+            utilised = self.in_flight * 2 >= self.limit
+            self.in_flight -= 1
+            if latency is None:
+                return
+            self.last_latency_ms = round(latency * 1000, 1)
+            if not ok or latency > self.slow_seconds:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.decreases += 1
+            elif utilised:  # only grow when the limit is what's holding callers back
+                self.limit = min(self.max_limit, self.limit + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "decreases": self.decreases,
+                "last_latency_ms": self.last_latency_ms,
+            }
+
+
+class EfrisGuard:
+    """Breakers per (environment, TIN) and limits per environment, created on first use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._limits: Dict[str, AdaptiveLimit] = {}
+
+    def breaker(self, environment: str, tin: str) -> CircuitBreaker:
+        key = (environment, str(tin))
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(f"{environment}:{tin}"))
+        return breaker
+
+    def limit(self, environment: str) -> AdaptiveLimit:
+        limit = self._limits.get(environment)
+        if limit is None:
+            with self._lock:
+                limit = self._limits.setdefault(environment, AdaptiveLimit(environment))
+        return limit
+
+    def reset(self):
+        """Forget every breaker and limit (tests, or after changing the settings)"""
+        with self._lock:
+            self._breakers.clear()
+            self._limits.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            breakers = list(self._breakers.values())
+            limits = dict(self._limits)
+        by_state = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        tripped = {}
+        for breaker in breakers:
+            state = breaker.stats()
+            by_state[state["state"]] += 1
+            if state["state"] != CLOSED:
+                tripped[breaker.name] = state
+        return {
+            "limits": {environment: limit.stats() for environment, limit in limits.items()},
+            "breakers": {"by_state": by_state, "not_closed": tripped},
+        }
+
+
+class GuardedAdapter(HTTPAdapter):
+    """requests transport adapter that sends through a breaker and an adaptive limit"""
+
+    def __init__(self, environment: str, tin: str, guard: Optional[EfrisGuard] = None, **kwargs):
+        self.environment = environment
+        self.tin = tin
+        self.guard = guard or efris_guard
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        limit = self.guard.limit(self.environment)
+        breaker = self.guard.breaker(self.environment, self.tin)
+        if not limit.acquire():
+            raise EfrisUnavailable(f"EFRIS {self.environment} concurrency limit reached ({int(limit.limit)} in flight)")
+        try:
+            token = breaker.before_call()
+        except EfrisUnavailable:
+            limit.release()
+            raise
+
+        started = time.monotonic()
+        ok = False
+        try:
+            response = super().send(request, **kwargs)
+            ok = response.status_code < 500
+            return response
+        finally:
+            breaker.record(ok, token)
+            limit.release(time.monotonic() - started, ok)
+
+
+def guard_session(session: requests.Session, environment: str, tin: str) -> requests.Session:
+    """Route all of session's HTTP(S) requests through the breaker / limit for environment + TIN"""
+    adapter = GuardedAdapter(environment, tin)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared by every EfrisManager in the process
+efris_guard = EfrisGuard()
+
+
+__all__ = [
+    'EfrisUnavailable',
+    'CircuitBreaker',
+    'AdaptiveLimit',
+    'EfrisGuard',
+    'GuardedAdapter',
+    'guard_session',
+    'efris_guard'
+]
@@ -0,0 +1,399 @@
+"""
+Bounded Worker Pools for Blocking Work
+- Keeps CPU-heavy or blocking calls (bcrypt, ...) off the asyncio event loop
+- Each pool has a fixed number of threads and a cap on queued work, so a burst
+  degrades into fast 503s instead of an ever-growing backlog
+- Outbound EFRIS / QuickBooks HTTP calls (sync clients) get their own pool, separate
+  from the default threadpool FastAPI uses for sync dependencies, shared between tenants
+  by weighted fair queueing, with interactive calls (T109 / T110) ahead of bulk ones
+  (T127 / T130 / T106)
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger("efris_api")
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+OUTBOUND_IO_WORKERS = int(os.getenv("OUTBOUND_IO_WORKERS", "32"))
+OUTBOUND_IO_MAX_PENDING = int(os.getenv("OUTBOUND_IO_MAX_PENDING", "1000"))
+OUTBOUND_IO_TENANT_MAX_PENDING = int(os.getenv("OUTBOUND_IO_TENANT_MAX_PENDING", "200"))
+OUTBOUND_IO_TENANT_MAX_WORKERS = int(os.getenv("OUTBOUND_IO_TENANT_MAX_WORKERS", "0")) or None  # default: half the pool
+OUTBOUND_IO_BULK_MAX_WORKERS = int(os.getenv("OUTBOUND_IO_BULK_MAX_WORKERS", "0")) or None  # default: half the pool
+OUTBOUND_IO_INTERACTIVE_WEIGHT = float(os.getenv("OUTBOUND_IO_INTERACTIVE_WEIGHT", "4"))  # interactive turns per bulk turn
+# Calls scheduled as bulk: T127 goods list, T130 goods upload, T106 invoice query, QuickBooks list reads
+OUTBOUND_IO_BULK_CALLS = set(filter(None, os.getenv(
+    "OUTBOUND_IO_BULK_CALLS",
+    "get_goods_and_services,upload_goods,query_invoices,get_all_items,get_invoices,get_purchase_orders,get_credit_memos"
+).split(",")))
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+def _tenant_settings(value: str, cast: Callable) -> Dict[Hashable, Any]:
+    """'12=4,public-demo=1' -> {12: 4, 'public-demo': 1} (company ids become ints)"""
+    settings = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        tenant, _, setting = entry.partition("=")
+        tenant = tenant.strip()
+        settings[int(tenant) if tenant.isdigit() else tenant] = cast(setting)
+    return settings
+
+
+# Per-company overrides, e.g. a larger share or cap for a reseller's own company
+OUTBOUND_IO_TENANT_WEIGHTS = _tenant_settings(os.getenv("OUTBOUND_IO_TENANT_WEIGHTS", ""), float)
+OUTBOUND_IO_TENANT_CAPS = _tenant_settings(os.getenv("OUTBOUND_IO_TENANT_CAPS", ""), int)
+
+
+def bulk_call(fn: Callable) -> Callable:
+    """Mark a helper (an import page, a registration batch) as bulk for FairExecutor scheduling"""
+    fn.outbound_class = BULK
+    return fn
+
+
+def call_class(fn: Callable) -> str:
+    """INTERACTIVE or BULK: marked with bulk_call, or a method named in OUTBOUND_IO_BULK_CALLS"""
+    marked = getattr(fn, "outbound_class", None)
+    if marked:
+        return marked
+    return BULK if getattr(fn, "__name__", None) in OUTBOUND_IO_BULK_CALLS else INTERACTIVE
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a pool already has max_pending calls queued or running"""
+
+
+class BoundedExecutor:
+    """
+    Named thread pool with a pending-work cap and basic metrics
+
+    Usage:
+        result = await password_executor.run(pwd_context.verify, password, hashed)
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorSaturated(f"{self.name} pool is saturated ({self.pending} calls pending)")
+            self.pending += 1
+
+    def _timed(self, submitted_at: float, fn: Callable, *args, **kwargs):
+        started_at = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            finished_at = time.monotonic()
+            with self._lock:
+                self.total_wait_seconds += started_at - submitted_at
+                self.total_run_seconds += finished_at - started_at
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) in the pool and await the result"""
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._pool, partial(self._timed, time.monotonic(), fn, *args, **kwargs)
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_seconds / done * 1000, 2),
+                "avg_run_ms": round(self.total_run_seconds / done * 1000, 2),
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+class FairExecutor:
+    """
+    Thread pool that schedules tenants by weighted fair queueing instead of first-come-first-served
+
+    Each call is interactive (default - T109 invoices, T110 credit notes, lookups) or bulk
+    (T127 / T130 / T106 and QuickBooks list imports, see call_class). Each class keeps one
+    FIFO queue per tenant. A free worker picks a class, then a tenant within it, by stride
+    scheduling: the class / tenant that has been served least relative to its weight goes
+    next. Interactive calls get interactive_weight turns for each bulk turn, and bulk calls
+    never hold more than bulk_max_workers threads, so a reseller importing catalogues for
+    20 companies leaves threads free for everyone's invoices.
+
+    A tenant can occupy at most tenant_max_workers threads at once (per-tenant overrides in
+    tenant_caps) and have tenant_max_pending calls queued or running; the whole pool caps
+    at max_pending.
+
+    Usage:
+        result = await outbound_executor.run(company.id, manager.upload_invoice, payload)
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int,
+                 tenant_max_pending: int, tenant_max_workers: Optional[int] = None,
+                 bulk_max_workers: Optional[int] = None, interactive_weight: float = 4,
+                 tenant_weights: Optional[Dict[Hashable, float]] = None,
+                 tenant_caps: Optional[Dict[Hashable, int]] = None,
+                 classify: Optional[Callable[[Callable], str]] = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.tenant_max_pending = tenant_max_pending
+        self.tenant_max_workers = tenant_max_workers or max(1, max_workers // 2)
+        self.bulk_max_workers = bulk_max_workers or max(1, max_workers // 2)
+        self.class_weights = {INTERACTIVE: interactive_weight, BULK: 1.0}
+        self.tenant_weights = dict(tenant_weights or {})
+        self.tenant_caps = dict(tenant_caps or {})
+        self.classify = classify or call_class
+        self._cond = threading.Condition()
+        # class -> tenant -> calls waiting for a worker
+        self._queues: Dict[str, Dict[Hashable, Deque[tuple]]] = {INTERACTIVE: {}, BULK: {}}
+        # stride scheduling: the lowest pass is served next, serving adds 1/weight
+        self._class_pass = {INTERACTIVE: 0.0, BULK: 0.0}
+        self._tenant_pass: Dict[str, Dict[Hashable, float]] = {INTERACTIVE: {}, BULK: {}}
+        self._clock = {INTERACTIVE: 0.0, BULK: 0.0}  # pass of the last tenant served per class
+        self._pending_by_tenant: Dict[Hashable, int] = {}
+        self._running_by_tenant: Dict[Hashable, int] = {}
+        self._threads: List[threading.Thread] = []
+        self._shutdown = False
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.by_class = {cls: {"queued": 0, "running": 0, "completed": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+                         for cls in (INTERACTIVE, BULK)}
+
+    def set_tenant_policy(self, tenant: Hashable, weight: Optional[float] = None, max_workers: Optional[int] = None):
+        """Give a tenant a larger (or smaller) share and / or its own concurrency cap"""
+        with self._cond:
+            if weight is not None:
+                self.tenant_weights[tenant] = weight
+            if max_workers is not None:
+                self.tenant_caps[tenant] = max_workers
+            self._cond.notify_all()
+
+    def _submit(self, tenant: Hashable, cls: str, job: tuple):
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError(f"{self.name} pool is shut down")
+            tenant_pending = self._pending_by_tenant.get(tenant, 0)
+            if self.queued + self.running >= self.max_pending or tenant_pending >= self.tenant_max_pending:
+                self.rejected += 1
+                raise ExecutorSaturated(f"{self.name} pool is saturated "
+                                        f"({self.queued + self.running} calls pending, {tenant_pending} for this tenant)")
+            self._pending_by_tenant[tenant] = tenant_pending + 1
+            queues = self._queues[cls]
+            if not queues:
+                # an idle class rejoins at the other class's pass instead of cashing in its idle time
+                self._class_pass[cls] = max(self._class_pass[cls], min(self._class_pass.values()))
+            if tenant not in queues:
+                queues[tenant] = deque()
+                self._tenant_pass[cls][tenant] = self._clock[cls]
+            queues[tenant].append(job)
+            self.queued += 1
+            self.by_class[cls]["queued"] += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            if not self._threads:
+                for i in range(self.max_workers):
+                    thread = threading.Thread(target=self._worker, name=f"{self.name}_{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            self._cond.notify()
+
+    def _next_tenant(self, cls: str) -> Optional[Hashable]:
+        """Tenant of cls with the lowest pass that is below its worker cap"""
+        passes = self._tenant_pass[cls]
+        best = None
+        for tenant in self._queues[cls]:
+            if self._running_by_tenant.get(tenant, 0) >= self.tenant_caps.get(tenant, self.tenant_max_workers):
+                continue
+            if best is None or passes[tenant] < passes[best]:
+                best = tenant
+        return best
+
+    def _next_job(self) -> Optional[Tuple[str, Hashable, tuple]]:
+        """Oldest call of the next tenant of the next class in turn"""
+        candidates = []
+        for cls in (INTERACTIVE, BULK):
+            if cls == BULK and self.by_class[BULK]["running"] >= self.bulk_max_workers:
+                continue
+            tenant = self._next_tenant(cls)
+            if tenant is not None:
+                candidates.append((self._class_pass[cls], cls, tenant))
+        if not candidates:
+            return None
+        _, cls, tenant = min(candidates, key=lambda candidate: candidate[0])
+        self._class_pass[cls] += 1.0 / self.class_weights[cls]
+        passes = self._tenant_pass[cls]
+        self._clock[cls] = passes[tenant]
+        passes[tenant] += 1.0 / self.tenant_weights.get(tenant, 1.0)
+
+        jobs = self._queues[cls][tenant]
+        job = jobs.popleft()
+        if not jobs:
+            del self._queues[cls][tenant]
+            del passes[tenant]
+        return cls, tenant, job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                item = self._next_job()
+                while item is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                    item = self._next_job()
+                cls, tenant, (call, loop, future, submitted_at) = item
+                self.queued -= 1
+                self.running += 1
+                self.by_class[cls]["queued"] -= 1
+                self.by_class[cls]["running"] += 1
+                self._running_by_tenant[tenant] = self._running_by_tenant.get(tenant, 0) + 1
+
+            started_at = time.monotonic()
+            result = error = None
+            if not future.cancelled():  # request gone while queued - don't call EFRIS for it
+                try:
+                    result = call()
+                except BaseException as e:
+                    error = e
+            finished_at = time.monotonic()
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                pass  # event loop already closed
+
+            with self._cond:
+                wait = started_at - submitted_at
+                self.running -= 1
+                self.completed += 1
+                self.total_wait_seconds += wait
+                self.total_run_seconds += finished_at - started_at
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+                class_stats = self.by_class[cls]
+                class_stats["running"] -= 1
+                class_stats["completed"] += 1
+                class_stats["wait_seconds"] += wait
+                class_stats["max_wait_seconds"] = max(class_stats["max_wait_seconds"], wait)
+                for counts in (self._running_by_tenant, self._pending_by_tenant):
+                    counts[tenant] -= 1
+                    if not counts[tenant]:
+                        del counts[tenant]
+                if self.queued:
+                    self._cond.notify()  # a call may have been held back by a tenant or bulk cap
+
+    async def run(self, tenant: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) in the pool on behalf of tenant and await the result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._submit(tenant, self.classify(fn), (partial(fn, *args, **kwargs), loop, future, time.monotonic()))
+        return await future
+
+    def stats(self, top: int = 5) -> dict:
+        with self._cond:
+            done = self.completed or 1
+            busiest = sorted(self._pending_by_tenant.items(), key=lambda item: item[1], reverse=True)[:top]
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "tenant_max_pending": self.tenant_max_pending,
+                "tenant_max_workers": self.tenant_max_workers,
+                "bulk_max_workers": self.bulk_max_workers,
+                "running": self.running,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "tenants_waiting": len(set(self._queues[INTERACTIVE]) | set(self._queues[BULK])),
+                "busiest_tenants": {str(tenant): pending for tenant, pending in busiest},
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_seconds / done * 1000, 2),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+                "avg_run_ms": round(self.total_run_seconds / done * 1000, 2),
+                "classes": {
+                    cls: {
+                        "weight": self.class_weights[cls],
+                        "running": s["running"],
+                        "queued": s["queued"],
+                        "completed": s["completed"],
+                        "avg_wait_ms": round(s["wait_seconds"] / (s["completed"] or 1) * 1000, 2),
+                        "max_wait_ms": round(s["max_wait_seconds"] * 1000, 2),
+                    }
+                    for cls, s in self.by_class.items()
+                },
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+def _resolve(future: asyncio.Future, result: Any, error: Optional[BaseException]):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+# bcrypt verification / hashing (CPU-bound; the bcrypt extension releases the GIL)
+password_executor = BoundedExecutor("password-hash", PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+# EfrisManager / QuickBooksClient calls (blocking HTTP, seconds per call on a slow URA day)
+outbound_executor = FairExecutor("outbound-io", OUTBOUND_IO_WORKERS, OUTBOUND_IO_MAX_PENDING,
+                                 OUTBOUND_IO_TENANT_MAX_PENDING, OUTBOUND_IO_TENANT_MAX_WORKERS,
+                                 bulk_max_workers=OUTBOUND_IO_BULK_MAX_WORKERS,
+                                 interactive_weight=OUTBOUND_IO_INTERACTIVE_WEIGHT,
+                                 tenant_weights=OUTBOUND_IO_TENANT_WEIGHTS,
+                                 tenant_caps=OUTBOUND_IO_TENANT_CAPS)
+
+
+__all__ = [
+    'ExecutorSaturated',
+    'BoundedExecutor',
+    'FairExecutor',
+    'INTERACTIVE',
+    'BULK',
+    'bulk_call',
+    'call_class',
+    'password_executor',
+    'outbound_executor'
+]
@@ -0,0 +1,297 @@
+"""
+Invoice Pre-flight Validation for EFRIS T109
+- Checks goodsDetails against the tenant's EFRISGood snapshot (T127/T130 registration).
+  Unknown item codes are only rejected once a full efris_goods_import job has succeeded -
+  the inline import saves page 1 only, so before that the snapshot is partial
+- Checks unit codes against the cached T115 system dictionary
+- Catches discount-line layout errors (EFRIS error 1181) locally
+
+Every invoice rejected here is one encrypted round-trip to URA that never happened.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, NamedTuple, Iterable
+
+from sqlalchemy.orm import Session
+
+from database.models import BackgroundJob, EFRISGood
+
+logger = logging.getLogger("efris_api")
+
+# enforce = reject invalid invoices locally, warn = log only, off = skip validation
+PREFLIGHT_MODE = os.getenv("EFRIS_PREFLIGHT_MODE", "enforce").lower()
+CATALOGUE_TTL_SECONDS = int(os.getenv("EFRIS_PREFLIGHT_CATALOGUE_TTL", "300"))
+DICTIONARY_TTL_SECONDS = int(os.getenv("EFRIS_PREFLIGHT_DICTIONARY_TTL", str(24 * 3600)))
+
+# Placeholder commodity codes the ERPs send when they don't know the real one
+PLACEHOLDER_CATEGORY_IDS = {"000000000", "100000000"}
+
+
+class CatalogueEntry(NamedTuple):
+    """Registration facts for one goodsCode, as last seen from EFRIS"""
+    goods_code: str
+    measure_unit: str
+    piece_measure_unit: str
+    commodity_category_code: str
+    status_code: str
+
+
+class CatalogueIndex:
+    """
+    In-memory index of a company's registered goods keyed by goodsCode
+
+    complete: every page of the EFRIS goods list has been imported, so a goodsCode
+    missing from entries is known to be unregistered
+    """
+
+    def __init__(self, entries: Dict[str, CatalogueEntry], complete: bool = False):
+        self.entries = entries
+        self.complete = complete
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, goods_code: str) -> Optional[CatalogueEntry]:
+        return self.entries.get(goods_code)
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.built_at < CATALOGUE_TTL_SECONDS
+
+    @classmethod
+    def from_rows(cls, rows: Iterable, complete: bool = False) -> "CatalogueIndex":
+        """Build from (goods_code, commodity_category_code, efris_data) rows"""
+        entries = {}
+        for goods_code, commodity_category_code, efris_data in rows:
+            if not goods_code:
+                continue
+            data = efris_data if isinstance(efris_data, dict) else {}
+            entries[goods_code] = CatalogueEntry(
+                goods_code=goods_code,
+                measure_unit=str(data.get("measureUnit") or ""),
+                piece_measure_unit=str(data.get("pieceMeasureUnit") or ""),
+                commodity_category_code=str(commodity_category_code or data.get("commodityCategoryCode") or ""),
+                status_code=str(data.get("statusCode") or "101"),
+            )
+        return cls(entries, complete)
+
+
+class PreflightStats:
+    """Thread-safe counters for the pre-flight validator"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.passed = 0
+        self.round_trips_avoided = 0
+        self.errors_by_code: Dict[str, int] = {}
+
+    def record(self, errors: List[dict], blocked: bool = True):
+        with self._lock:
+            self.checked += 1
+            if errors:
+                if blocked:
+                    self.round_trips_avoided += 1
+                for error in errors:
+                    self.errors_by_code[error["code"]] = self.errors_by_code.get(error["code"], 0) + 1
+            else:
+                self.passed += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "mode": PREFLIGHT_MODE,
+                "checked": self.checked,
+                "passed": self.passed,
+                "round_trips_avoided": self.round_trips_avoided,
+                "errors_by_code": dict(self.errors_by_code),
+            }
+
+
+preflight_stats = PreflightStats()
+
+_catalogue_cache: Dict[int, CatalogueIndex] = {}
+_dictionary_cache: Dict[bool, tuple] = {}  # test_mode -> (frozenset of unit codes, loaded_at)
+_cache_lock = threading.Lock()
+
+
+# ========== Catalogue / Dictionary Caches ==========
+
+def get_catalogue_index(db: Session, company_id: int) -> CatalogueIndex:
+    """Get the cached goods index for a company, rebuilding it when stale"""
+    index = _catalogue_cache.get(company_id)
+    if index is not None and index.is_fresh():
+        return index
+
+    rows = db.query(
+        EFRISGood.goods_code,
+        EFRISGood.commodity_category_code,
+        EFRISGood.efris_data
+    ).filter(EFRISGood.company_id == company_id).all()
+    complete = db.query(BackgroundJob.id).filter(
+        BackgroundJob.company_id == company_id,
+        BackgroundJob.job_type == "efris_goods_import",
+        BackgroundJob.status == "succeeded"
+    ).first() is not None
+
+    index = CatalogueIndex.from_rows(rows, complete)
+    with _cache_lock:
+        _catalogue_cache[company_id] = index
+    logger.debug(f"[PREFLIGHT] Indexed {len(index)} goods for company {company_id} "
+                 f"({'complete' if complete else 'partial'})")
+    return index
+
+
+def invalidate_catalogue(company_id: int):
+    """Drop a company's goods index (call after T127 import or T130 registration)"""
+    with _cache_lock:
+        _catalogue_cache.pop(company_id, None)
+
+
+def remember_t115_dictionary(test_mode: bool, dictionary: dict):
+    """Cache the rateUnit codes from a T115 system dictionary response"""
+    if not isinstance(dictionary, dict):
+        return
+    units = frozenset(
+        str(unit.get("value"))
+        for unit in dictionary.get("rateUnit", []) or []
+        if isinstance(unit, dict) and unit.get("value")
+    )
+    if not units:
+        return
+    with _cache_lock:
+        _dictionary_cache[bool(test_mode)] = (units, time.monotonic())
+
+
+def get_valid_units(test_mode: bool) -> Optional[frozenset]:
+    """Unit codes from the last T115 response, or None if not cached / expired"""
+    cached = _dictionary_cache.get(bool(test_mode))
+    if not cached:
+        return None
+    units, loaded_at = cached
+    if time.monotonic() - loaded_at > DICTIONARY_TTL_SECONDS:
+        return None
+    return units
+
+
+# ========== Validation ==========
+
+def _error(line: int, item: dict, field: str, code: str, message: str) -> dict:
+    return {
+        "line": line,
+        "itemCode": item.get("itemCode", ""),
+        "field": field,
+        "code": code,
+        "message": message,
+    }
+
+
+def validate_goods_details(goods_details: List[dict], catalogue: Optional[CatalogueIndex] = None,
+                           valid_units: Optional[frozenset] = None) -> List[dict]:
+    """
+    Validate T109 goodsDetails locally
+
+    Registration checks only run when the company has a goods snapshot; an empty
+    catalogue means we simply don't know, so those items are forwarded to EFRIS.
+    Item codes missing from a partial catalogue are forwarded too.
+
+    Returns a list of structured errors (empty list = invoice will be forwarded)
+    """
+    errors = []
+    have_catalogue = catalogue is not None and len(catalogue) > 0
+    previous_flag = None
+
+    for line, item in enumerate(goods_details, 1):
+        item_code = str(item.get("itemCode", "") or "")
+        discount_flag = str(item.get("discountFlag", "2"))
+        unit = str(item.get("unitOfMeasure", "") or "")
+        category_id = str(item.get("goodsCategoryId", "") or "")
+
+        if discount_flag == "0":
+            # EFRIS 1181: discount lines must not carry qty / unit / unit price
+            for field in ("qty", "unitOfMeasure", "unitPrice"):
+                if str(item.get(field, "") or "").strip():
+                    errors.append(_error(line, item, field, "1181",
+                                         f"Discount line must have an empty {field}"))
+            if previous_flag != "1":
+                errors.append(_error(line, item, "discountFlag", "DISCOUNT_WITHOUT_ITEM",
+                                     "Discount line (discountFlag=0) must follow an item with discountFlag=1"))
+            previous_flag = discount_flag
+            continue
+
+        if discount_flag == "1" and (line == len(goods_details) or
+                                     str(goods_details[line].get("discountFlag", "2")) != "0"):
+            errors.append(_error(line, item, "discountFlag", "DISCOUNT_LINE_MISSING",
+                                 "Item with discountFlag=1 must be followed by its discount line (discountFlag=0)"))
+        previous_flag = discount_flag
+
+        if not item_code:
+            errors.append(_error(line, item, "itemCode", "ITEM_CODE_MISSING", "itemCode is required"))
+            continue
+
+        if category_id in PLACEHOLDER_CATEGORY_IDS:
+            errors.append(_error(line, item, "goodsCategoryId", "CATEGORY_INVALID",
+                                 f"goodsCategoryId '{category_id}' is a placeholder, not a commodity code"))
+
+        if valid_units is not None and unit and unit not in valid_units:
+            errors.append(_error(line, item, "unitOfMeasure", "UNIT_UNKNOWN",
+                                 f"unitOfMeasure '{unit}' is not a T115 rateUnit code"))
+
+        if not have_catalogue:
+            continue
+
+        entry = catalogue.get(item_code)
+        if entry is None and not catalogue.complete:
+            continue
+        if entry is None:
+            errors.append(_error(line, item, "itemCode", "ITEM_NOT_REGISTERED",
+                                 f"itemCode '{item_code}' is not registered with EFRIS (register it via T130 first)"))
+            continue
+
+        if entry.status_code == "102":
+            errors.append(_error(line, item, "itemCode", "ITEM_DISABLED",
+                                 f"itemCode '{item_code}' is disabled in EFRIS"))
+
+        registered_units = {u for u in (entry.measure_unit, entry.piece_measure_unit) if u}
+        if unit and registered_units and unit not in registered_units:
+            errors.append(_error(line, item, "unitOfMeasure", "UNIT_MISMATCH",
+                                 f"unitOfMeasure '{unit}' does not match the T130 registration "
+                                 f"({', '.join(sorted(registered_units))})"))
+
+        if category_id and entry.commodity_category_code and category_id != entry.commodity_category_code:
+            errors.append(_error(line, item, "goodsCategoryId", "CATEGORY_MISMATCH",
+                                 f"goodsCategoryId '{category_id}' does not match the registered "
+                                 f"commodity code '{entry.commodity_category_code}'"))
+
+    return errors
+
+
+def preflight_invoice(db: Session, company, goods_details: List[dict]) -> List[dict]:
+    """
+    Run pre-flight validation for a company's T109 goodsDetails
+
+    Returns the errors that should block submission. In 'warn' mode errors are
+    logged and an empty list is returned; in 'off' mode nothing is checked.
+    """
+    if PREFLIGHT_MODE == "off":
+        return []
+
+    try:
+        catalogue = get_catalogue_index(db, company.id)
+    except Exception as e:
+        # Never block invoicing because the snapshot couldn't be read
+        logger.warning(f"[PREFLIGHT] Catalogue unavailable for company {company.id}: {e}")
+        catalogue = None
+
+    errors = validate_goods_details(goods_details, catalogue, get_valid_units(company.efris_test_mode))
+    preflight_stats.record(errors, blocked=PREFLIGHT_MODE == "enforce")
+
+    if errors:
+        logger.info(f"[PREFLIGHT] Company {company.id}: {len(errors)} issue(s) found before T109 - "
+                    f"{', '.join(sorted({e['code'] for e in errors}))}")
+        if PREFLIGHT_MODE == "warn":
+            return []
+
+    return errors
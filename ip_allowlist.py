@@ -0,0 +1,134 @@
+"""
+Compiled IP Allowlists for the External ERP API
+- Accepts exact addresses, CIDR ranges and trailing wildcards ("192.168.1.*"), IPv4 and IPv6
+- Compiled once per whitelist value; a lookup is a handful of set probes (one per prefix length in use)
+"""
+import json
+import logging
+import ipaddress
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+logger = logging.getLogger("efris_api")
+
+
+def _parse_entry(entry: str):
+    """
+    Turn one whitelist entry into an ip_network, or an octet pattern for mid-string
+    IPv4 wildcards such as "10.*.0.1". Raises ValueError for anything else.
+    """
+    entry = str(entry).strip()
+    if not entry:
+        raise ValueError("empty entry")
+
+    if "*" in entry:
+        octets = entry.split(".")
+        if len(octets) != 4 or any(o != "*" and not (o.isdigit() and 0 <= int(o) <= 255) for o in octets):
+            raise ValueError(f"invalid wildcard pattern '{entry}'")
+        fixed = len(octets)
+        while fixed and octets[fixed - 1] == "*":
+            fixed -= 1
+        if "*" not in octets[:fixed]:
+            # Trailing wildcards are just a CIDR range: 192.168.*.* == 192.168.0.0/16
+            base = ".".join(octets[:fixed] + ["0"] * (4 - fixed))
+            return ipaddress.ip_network(f"{base}/{fixed * 8}")
+        return tuple(None if o == "*" else int(o) for o in octets)
+
+    # strict=False accepts host bits in CIDR ("10.0.0.5/24" -> 10.0.0.0/24)
+    return ipaddress.ip_network(entry, strict=False)
+
+
+def _normalize(address):
+    """Treat IPv4-mapped IPv6 clients (::ffff:1.2.3.4) as IPv4"""
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+class CompiledAllowlist:
+    """
+    Immutable matcher for one company's whitelist
+
+    Networks are stored as {(version, prefixlen): {network_int, ...}}, so a lookup
+    masks the client address once per prefix length in use and probes a set.
+    An empty allowlist allows everyone (same as an unset whitelist).
+    """
+
+    __slots__ = ("_networks", "_patterns", "entries", "invalid")
+
+    def __init__(self, entries: List[str]):
+        networks: Dict[Tuple[int, int], set] = {}
+        patterns = []
+        invalid = []
+        for entry in entries or []:
+            try:
+                parsed = _parse_entry(entry)
+            except ValueError:
+                invalid.append(str(entry))
+                continue
+            if isinstance(parsed, tuple):
+                patterns.append(parsed)
+            else:
+                networks.setdefault((parsed.version, parsed.prefixlen), set()).add(int(parsed.network_address))
+
+        self._networks: Dict[Tuple[int, int], FrozenSet[int]] = {k: frozenset(v) for k, v in networks.items()}
+        self._patterns = tuple(patterns)
+        self.entries = tuple(str(e) for e in entries or [])
+        self.invalid = tuple(invalid)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def allows_all(self) -> bool:
+        return not self.entries
+
+    def is_allowed(self, client_ip: str) -> bool:
+        if self.allows_all:
+            return True
+        try:
+            address = _normalize(ipaddress.ip_address(client_ip.strip()))
+        except (ValueError, AttributeError):
+            return False
+
+        value = int(address)
+        bits = address.max_prefixlen
+        for (version, prefixlen), network_ints in self._networks.items():
+            if version == address.version:
+                mask = ((1 << prefixlen) - 1) << (bits - prefixlen) if prefixlen else 0
+                if value & mask in network_ints:
+                    return True
+
+        if self._patterns and address.version == 4:
+            octets = tuple(address.packed)
+            for pattern in self._patterns:
+                if all(p is None or p == o for p, o in zip(pattern, octets)):
+                    return True
+        return False
+
+
+def invalid_entries(entries: List[str]) -> List[str]:
+    """Entries that can't be compiled (used to validate whitelist updates)"""
+    return list(CompiledAllowlist(entries).invalid)
+
+
+@lru_cache(maxsize=4096)
+def compile_allowlist(allowed_ips_json: Optional[str]) -> CompiledAllowlist:
+    """Compile a Company.allowed_ips JSON value (cached by value, so changes recompile)"""
+    if not allowed_ips_json:
+        return CompiledAllowlist([])
+    try:
+        entries = json.loads(allowed_ips_json)
+    except (json.JSONDecodeError, TypeError):
+        entries = []
+    allowlist = CompiledAllowlist(entries if isinstance(entries, list) else [])
+    if allowlist.invalid:
+        logger.warning(f"[Security] Ignoring invalid IP whitelist entries: {', '.join(allowlist.invalid)}")
+    return allowlist
+
+
+__all__ = [
+    'CompiledAllowlist',
+    'compile_allowlist',
+    'invalid_entries'
+]
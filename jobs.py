@@ -0,0 +1,348 @@
+"""
+Durable background jobs for long-running sync operations
+- QuickBooks / EFRIS imports and item registration can run outside the HTTP request:
+  the endpoint enqueues a background_jobs row and returns its id, the dashboard polls
+  GET /api/companies/{company_id}/jobs/{job_id} for progress
+- Workers claim jobs with an atomic UPDATE (candidates read with FOR UPDATE SKIP LOCKED
+  on PostgreSQL), so any number of worker threads / processes can share the table
+- Handlers call JobContext.progress() after each page: it commits the page's rows together
+  with the job's progress, checkpoint (e.g. the next QuickBooks STARTPOSITION) and
+  heartbeat. A job whose worker died (no heartbeat for JOB_STALE_SECONDS) is claimed
+  again and resumes from its checkpoint instead of starting over
+- Failed attempts are retried with exponential backoff (JOB_RETRY_BASE_SECONDS, doubling,
+  capped at JOB_RETRY_MAX_SECONDS) until max_attempts
+- JOBS_IN_PROCESS_WORKER=true (default) runs a worker thread inside each API process for
+  hosts without a separate worker; `python run_job_worker.py` runs a standalone worker process
+
+Usage:
+    @job_handler("qb_items_import")
+    def import_qb_items(ctx: JobContext) -> dict:
+        ...
+        ctx.progress(done, total, checkpoint={"start_position": start})
+
+    job = enqueue(db, company_id, "qb_items_import", user_id=current_user.id)
+"""
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from database.models import BackgroundJob
+from executors import bulk_call
+
+logger = logging.getLogger("efris_api")
+
+JOBS_IN_PROCESS_WORKER = os.getenv("JOBS_IN_PROCESS_WORKER", "true").lower() == "true"
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "1800"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+JOB_HANDLERS: Dict[str, Callable[["JobContext"], dict]] = {}
+
+
+def job_handler(job_type: str):
+    """Register fn(ctx) -> result dict as the handler for job_type"""
+    def register(fn):
+        JOB_HANDLERS[job_type] = fn
+        return fn
+    return register
+
+
+class JobCancelled(Exception):
+    """The job was cancelled (or claimed by another worker) while it was running"""
+
+
+class JobContext:
+    """
+    What a handler gets: the tenant, its params, the last checkpoint and a session.
+    Without a job (inline, inside the request) progress() only commits.
+    """
+
+    def __init__(self, db: Session, company_id: int, params: Optional[dict] = None,
+                 job: Optional[BackgroundJob] = None, worker_id: Optional[str] = None):
+        self.db = db
+        self.company_id = company_id
+        self.params = params or {}
+        self.job = job
+        self.worker_id = worker_id
+        self.checkpoint = dict(job.checkpoint or {}) if job is not None else {}
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None,
+                 checkpoint: Optional[dict] = None):
+        """Commit the work so far together with progress and the resume point"""
+        if self.job is None:
+            self.db.commit()
+            return
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+        values = {"progress_done": done, "heartbeat_at": datetime.utcnow(), "checkpoint": self.checkpoint}
+        if total is not None:
+            values["progress_total"] = total
+        if message is not None:
+            values["message"] = message[:500]
+        # Only while this worker still owns the running job
+        owned = self.db.query(BackgroundJob).filter(
+            BackgroundJob.id == self.job.id,
+            BackgroundJob.status == "running",
+            BackgroundJob.locked_by == self.worker_id
+        ).update(values, synchronize_session=False)
+        if not owned:
+            self.db.rollback()
+            raise JobCancelled(f"Job {self.job.id} was cancelled or taken over")
+        self.db.commit()
+
+
+def enqueue(db: Session, company_id: int, job_type: str, params: Optional[dict] = None,
+            user_id: Optional[int] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> BackgroundJob:
+    """Queue a job; an identical job that is still queued or running is returned instead"""
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    params = params or {}
+    for existing in db.query(BackgroundJob).filter(
+        BackgroundJob.company_id == company_id,
+        BackgroundJob.job_type == job_type,
+        BackgroundJob.status.in_(ACTIVE_STATUSES)
+    ):
+        if (existing.params or {}) == params:
+            return existing
+    job = BackgroundJob(company_id=company_id, user_id=user_id, job_type=job_type, params=params,
+                        status="queued", max_attempts=max_attempts, run_after=datetime.utcnow())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number attempts (exponential, capped, +-20% jitter)"""
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claimable(now: datetime):
+    stale = now - timedelta(seconds=JOB_STALE_SECONDS)
+    return or_(
+        and_(BackgroundJob.status == "queued", BackgroundJob.run_after <= now),
+        and_(BackgroundJob.status == "running", BackgroundJob.heartbeat_at < stale),  # worker died
+    )
+
+
+def claim_next(db: Session, worker_id: str) -> Optional[BackgroundJob]:
+    """Take the oldest due job (or a stale running one); None when there is nothing to do"""
+    now = datetime.utcnow()
+    candidates = db.query(BackgroundJob.id).filter(_claimable(now)).order_by(
+        BackgroundJob.run_after, BackgroundJob.id
+    ).limit(5)
+    if db.bind.dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True)
+    for (job_id,) in candidates.all():
+        claimed = db.query(BackgroundJob).filter(BackgroundJob.id == job_id, _claimable(now)).update({
+            "status": "running",
+            "locked_by": worker_id,
+            "heartbeat_at": now,
+            "started_at": func.coalesce(BackgroundJob.started_at, now),
+            "attempts": BackgroundJob.attempts + 1,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return db.get(BackgroundJob, job_id)
+    db.commit()
+    return None
+
+
+def run_job(db: Session, job: BackgroundJob, worker_id: str) -> str:
+    """Run one claimed job to completion, retry or failure; returns its new status"""
+    handler = JOB_HANDLERS.get(job.job_type)
+    ctx = JobContext(db, job.company_id, job.params, job=job, worker_id=worker_id)
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for {job.job_type}")
+        result = handler(ctx)
+    except JobCancelled as e:
+        logger.info(f"[JOBS] {e}")
+        db.rollback()
+        return "cancelled"
+    except Exception as e:
+        db.rollback()
+        job = db.get(BackgroundJob, job.id)
+        if job.status != "running" or job.locked_by != worker_id:
+            return job.status
+        job.error = str(e)[:2000]
+        job.locked_by = None
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=backoff_seconds(job.attempts))
+            logger.warning(f"[JOBS] {job.job_type} #{job.id} attempt {job.attempts} failed, "
+                           f"retrying after {job.run_after:%H:%M:%S}: {e}")
+        else:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+            logger.error(f"[JOBS] {job.job_type} #{job.id} failed after {job.attempts} attempts: {e}")
+        db.commit()
+        return job.status
+
+    finished = db.query(BackgroundJob).filter(
+        BackgroundJob.id == job.id,
+        BackgroundJob.status == "running",
+        BackgroundJob.locked_by == worker_id
+    ).update({
+        "status": "succeeded",
+        "result": result,
+        "error": None,
+        "locked_by": None,
+        "finished_at": datetime.utcnow(),
+        "heartbeat_at": datetime.utcnow(),
+    }, synchronize_session=False)
+    db.commit()
+    return "succeeded" if finished else "cancelled"
+
+
+@bulk_call  # inline imports run in the outbound pool's bulk lane
+def run_inline(job_type: str, db: Session, company_id: int, params: Optional[dict] = None) -> dict:
+    """Run a job's handler directly (inside the request), without a background_jobs row"""
+    return JOB_HANDLERS[job_type](JobContext(db, company_id, params))
+
+
+def cancel(db: Session, job: BackgroundJob) -> bool:
+    """Cancel a queued or running job; a running handler stops at its next progress()"""
+    if job.status not in ACTIVE_STATUSES:
+        return False
+    job.status = "cancelled"
+    job.locked_by = None
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    return True
+
+
+def job_summary(job: BackgroundJob) -> dict:
+    percent = None
+    if job.progress_total:
+        percent = round(min(100.0, (job.progress_done or 0) * 100 / job.progress_total), 1)
+    elif job.status == "succeeded":
+        percent = 100.0
+    return {
+        "id": job.id,
+        "type": job.job_type,
+        "status": job.status,
+        "progress": {"done": job.progress_done or 0, "total": job.progress_total, "percent": percent},
+        "message": job.message,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "next_attempt_at": job.run_after.isoformat() if job.status == "queued" and job.run_after else None,
+        "error": job.error,
+        "result": job.result,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def queue_stats(db: Session) -> dict:
+    counts = dict(db.query(BackgroundJob.status, func.count(BackgroundJob.id)).group_by(BackgroundJob.status).all())
+    oldest = db.query(func.min(BackgroundJob.run_after)).filter(BackgroundJob.status == "queued").scalar()
+    return {
+        "by_status": counts,
+        "oldest_queued_seconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+    }
+
+
+class JobWorker:
+    """Polls background_jobs and runs one job at a time on a background thread"""
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None,
+                 worker_id: Optional[str] = None, poll_seconds: float = JOB_POLL_SECONDS):
+        self._session_factory = session_factory
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.current_job: Optional[int] = None
+        self.processed = 0
+        self.outcomes: Dict[str, int] = {}
+
+    def run_once(self) -> bool:
+        """Claim and run one job; False when the queue had nothing due"""
+        db = self._get_session()
+        try:
+            job = claim_next(db, self.worker_id)
+            if job is None:
+                return False
+            self.current_job = job.id
+            logger.info(f"[JOBS] {self.worker_id} running {job.job_type} #{job.id} (attempt {job.attempts})")
+            outcome = run_job(db, job, self.worker_id)
+            self.processed += 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            return True
+        finally:
+            self.current_job = None
+            db.close()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="job-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Stop polling; a running job is left to finish or to be resumed from its checkpoint"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.warning(f"[JOBS] Worker error: {e}")
+            self._stop.wait(self.poll_seconds)
+
+    def _get_session(self) -> Session:
+        if self._session_factory is None:
+            from database.connection import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "current_job": self.current_job,
+            "processed": self.processed,
+            "outcomes": dict(self.outcomes),
+        }
+
+
+# In-process worker (started by the API lifespan when JOBS_IN_PROCESS_WORKER=true)
+job_worker = JobWorker()
+
+
+__all__ = [
+    'JOBS_IN_PROCESS_WORKER',
+    'JOB_HANDLERS',
+    'JobCancelled',
+    'JobContext',
+    'JobWorker',
+    'job_handler',
+    'enqueue',
+    'claim_next',
+    'run_job',
+    'run_inline',
+    'cancel',
+    'job_summary',
+    'queue_stats',
+    'job_worker'
+]
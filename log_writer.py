@@ -0,0 +1,262 @@
+"""
+Background writer for audit_logs / activity_logs rows
+- submit() only appends to a bounded in-memory queue - request handlers never wait on a
+  log INSERT or commit
+- A background thread writes batches as multi-row INSERTs: every LOG_WRITER_FLUSH_MS, or as
+  soon as LOG_WRITER_BATCH_SIZE rows are waiting
+- When the queue is full (database down or too slow) new rows are dropped and counted
+  rather than blocking the request; stats() reports depth, high-water mark and drops
+- A batch the database rejects (constraint violation, value too long) is retried row by row
+  and only the rows that fail again are dropped, counted as "rejected" in stats(). When the
+  database itself is failing, rows go back on the queue and are retried after a short backoff
+- stop() (app shutdown) writes whatever is still queued
+- invoice_fiscalized activity rows update daily_company_stats in the same transaction,
+  like ORM inserts do
+
+Usage:
+    log_writer.audit(company_id=company.id, action="ip_blocked", ip_address=ip, details=...)
+    log_writer.activity(company_id=company.id, activity_type="product_synced", details={...})
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from database.models import ActivityLog, AuditLog
+
+logger = logging.getLogger("efris_api")
+
+LOG_WRITER_QUEUE_SIZE = int(os.getenv("LOG_WRITER_QUEUE_SIZE", "10000"))
+LOG_WRITER_BATCH_SIZE = int(os.getenv("LOG_WRITER_BATCH_SIZE", "500"))
+LOG_WRITER_FLUSH_MS = float(os.getenv("LOG_WRITER_FLUSH_MS", "200"))
+LOG_WRITER_MAX_BACKOFF = 5.0  # seconds between retries while the database is failing
+
+
+class LogWriter:
+    """Bounded queue of log rows, written in batches by one background thread"""
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None,
+                 max_queue: int = LOG_WRITER_QUEUE_SIZE, batch_size: int = LOG_WRITER_BATCH_SIZE,
+                 flush_ms: float = LOG_WRITER_FLUSH_MS):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self._queue: "queue.Queue[Tuple[type, dict]]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._backoff = 0.0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.max_depth = 0
+        self.last_batch_ms = 0.0
+
+    # ---- producers (request handlers) ----
+
+    def submit(self, model: type, **values) -> bool:
+        """Queue one row; False if it was dropped because the queue is full"""
+        values.setdefault("created_at", datetime.utcnow())  # event time, not write time
+        try:
+            self._queue.put_nowait((model, values))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"[LOG WRITER] Queue full ({self._queue.maxsize}) - "
+                               f"{self.dropped} log row(s) dropped so far")
+            return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        self._ensure_started()
+        return True
+
+    def audit(self, **values) -> bool:
+        return self.submit(AuditLog, **values)
+
+    def activity(self, **values) -> bool:
+        return self.submit(ActivityLog, **values)
+
+    # ---- writing ----
+
+    def _take_batch(self, wait: bool) -> List[Tuple[type, dict]]:
+        """Up to batch_size rows; when waiting, give more rows flush_seconds to arrive"""
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = (self._queue.get(timeout=remaining) if wait and remaining > 0
+                        else self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if item is None:  # stop() wake-up
+                if wait:
+                    break
+                continue
+            batch.append(item)
+        return batch
+
+    def _insert(self, db: Session, batch: List[Tuple[type, dict]]):
+        """INSERT batch and commit"""
+        # executemany needs the same columns in every row of a statement
+        groups: Dict[tuple, list] = {}
+        for model, values in batch:
+            groups.setdefault((model, tuple(sorted(values))), []).append(values)
+        for (model, _columns), rows in groups.items():
+            db.execute(model.__table__.insert(), rows)
+            if model is ActivityLog:
+                from database.daily_stats import count_activity_rows
+                count_activity_rows(db.connection(), rows)
+        db.commit()
+
+    def _write(self, batch: List[Tuple[type, dict]]) -> int:
+        """One transaction per batch; a batch the database rejects is retried row by row"""
+        started = time.perf_counter()
+        db = None
+        try:
+            db = self._get_session()
+            self._insert(db, batch)
+        except (IntegrityError, DataError) as e:
+            db.rollback()
+            self.failed_batches += 1
+            logger.warning(f"[LOG WRITER] Batch of {len(batch)} rejected, writing row by row: {e.orig}")
+            return self._write_rows(db, batch)
+        except Exception as e:
+            if db is not None:
+                db.rollback()
+            self.failed_batches += 1
+            self._requeue(batch, e)
+            return 0
+        finally:
+            if db is not None:
+                db.close()
+
+        self._backoff = 0.0
+        self.batches += 1
+        self.written += len(batch)
+        self.last_batch_ms = round((time.perf_counter() - started) * 1000, 2)
+        return len(batch)
+
+    def _write_rows(self, db: Session, batch: List[Tuple[type, dict]]) -> int:
+        """Rows the database rejects again are dropped and counted instead of blocking the queue"""
+        written = 0
+        for done, item in enumerate(batch):
+            try:
+                self._insert(db, [item])
+            except (IntegrityError, DataError) as e:
+                db.rollback()
+                self.rejected += 1
+                logger.warning(f"[LOG WRITER] Dropped a {item[0].__tablename__} row: {e.orig}")
+                continue
+            except Exception as e:
+                db.rollback()
+                self._requeue(batch[done:], e)
+                break
+            written += 1
+        else:
+            self._backoff = 0.0
+        self.written += written
+        return written
+
+    def _requeue(self, rows: List[Tuple[type, dict]], error: Exception):
+        """Database failing: put rows back on the queue and back off"""
+        self._backoff = min(max(self._backoff * 2, self.flush_seconds), LOG_WRITER_MAX_BACKOFF)
+        logger.warning(f"[LOG WRITER] {len(rows)} row(s) failed, will retry: {error}")
+        for item in rows:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self) -> int:
+        """Write everything queued right now (returns rows written)"""
+        written = 0
+        while True:
+            batch = self._take_batch(wait=False)
+            if not batch:
+                return written
+            written += self._write(batch)
+            if self._backoff:
+                return written  # database failing - rows are back on the queue
+
+    # ---- lifecycle ----
+
+    def start(self):
+        self._ensure_started()
+
+    def stop(self):
+        """Stop the background thread and write whatever is left"""
+        self._stop.set()
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(None)  # wake the thread if it is waiting for rows
+            except queue.Full:
+                pass
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        self._stop.clear()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._stop.is_set() or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = self._take_batch(wait=True)
+                if batch:
+                    self._write(batch)
+                    if self._backoff:
+                        self._stop.wait(self._backoff)
+            except Exception as e:
+                logger.warning(f"[LOG WRITER] Background write error: {e}")
+
+    def _get_session(self) -> Session:
+        if self._session_factory is None:
+            from database.connection import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def stats(self) -> dict:
+        depth = self._queue.qsize()
+        return {
+            "queue_depth": depth,
+            "queue_capacity": self._queue.maxsize,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "avg_batch_size": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "failed_batches": self.failed_batches,
+            "last_batch_ms": self.last_batch_ms,
+        }
+
+
+# Shared instance
+log_writer = LogWriter()
+
+
+__all__ = [
+    'LOG_WRITER_QUEUE_SIZE',
+    'LOG_WRITER_BATCH_SIZE',
+    'LOG_WRITER_FLUSH_MS',
+    'LogWriter',
+    'log_writer'
+]
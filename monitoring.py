@@ -37,9 +37,11 @@ console_formatter = logging.Formatter(
 )
 console_handler.setFormatter(console_formatter)
 
-# Add handlers
+# Add handlers (the console one only when the app hasn't configured root logging already,
+# otherwise every record would be printed twice)
 logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+if not logging.getLogger().handlers:
+    logger.addHandler(console_handler)
 
 
 class ErrorMonitor:
@@ -111,24 +113,19 @@ class ErrorMonitor:
         
         logger.info(log_message)
         
-        # Also store in database if session available
+        # Also store in database - queued, written in batches by the background log writer
         try:
-            from database.connection import SessionLocal
-            from database.models import ActivityLog
+            from log_writer import log_writer
             
-            db = SessionLocal()
-            activity = ActivityLog(
+            log_writer.activity(
                 user_id=user_id,
                 company_id=company_id,
-                action=action,
-                details=details,
+                activity_type=action,
+                details={"message": details},
                 document_number=document_number
             )
-            db.add(activity)
-            db.commit()
-            db.close()
         except Exception as e:
-            logger.warning(f"Failed to save activity to database: {e}")
+            logger.warning(f"Failed to queue activity for the database: {e}")
 
 
 def log_errors(func):
@@ -181,6 +178,12 @@ class PerformanceMonitor:
                 f"SLOW QUERY ({duration:.2f}s): {query[:200]}... | Context: {context}"
             )
 
+    def log_repeated_query(self, query: str, times: int, context: Optional[Dict] = None):
+        """Log a statement repeated within one request (likely N+1 lookups)"""
+        logger.warning(
+            f"REPEATED QUERY (x{times}, possible N+1): {query[:200]}... | Context: {context}"
+        )
+
 
 # Initialize monitors
 error_monitor = ErrorMonitor()
@@ -0,0 +1,167 @@
+"""
+JWT Principal Cache for Dashboard Endpoints
+- Short-TTL cache of token subject (email) -> user snapshot + accessible company ids
+- One DB load per user per TTL, shared by the dashboard's burst of parallel requests
+- Invalidated automatically after commits that touch users or company ownership
+"""
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Callable, Dict, FrozenSet, Iterable, Optional
+
+from sqlalchemy import event, inspect as sa_inspect, or_
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache, detached_copy
+from database.models import User, Company
+
+logger = logging.getLogger("efris_api")
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))  # seconds
+
+# Roles that can see every company - no id set is kept for them
+ALL_COMPANIES_ROLES = ("owner", "admin")
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated dashboard user and what they may access"""
+    user_id: int
+    role: Optional[str]
+    company_ids: Optional[FrozenSet[int]]  # None = all companies
+    client_user_ids: FrozenSet[int]  # reseller's clients (ownership changes for them invalidate us)
+    user: User = field(repr=False, compare=False)
+
+    def can_access(self, company_id: int) -> bool:
+        return self.company_ids is None or company_id in self.company_ids
+
+    def attach(self, db: Session) -> User:
+        """User instance bound to the request session - no SELECT is emitted"""
+        return db.merge(self.user, load=False)
+
+
+def load_principal(db: Session, user: User) -> Principal:
+    """Build a Principal for a loaded user (one extra query for clients/resellers)"""
+    client_user_ids = frozenset()
+    if user.role in ALL_COMPANIES_ROLES:
+        company_ids = None
+    elif user.role == "reseller":
+        client_user_ids = frozenset(uid for (uid,) in db.query(User.id).filter(User.parent_id == user.id))
+        company_ids = frozenset(cid for (cid,) in db.query(Company.id).filter(
+            or_(Company.owner_id == user.id, Company.owner_id.in_(client_user_ids))
+        ))
+    elif user.role == "client":
+        company_ids = frozenset(cid for (cid,) in db.query(Company.id).filter(Company.owner_id == user.id))
+    else:
+        company_ids = frozenset()
+
+    return Principal(
+        user_id=user.id,
+        role=user.role,
+        company_ids=company_ids,
+        client_user_ids=client_user_ids,
+        user=detached_copy(user),
+    )
+
+
+class PrincipalCache:
+    """Email -> Principal, with invalidation by user id"""
+
+    def __init__(self, ttl_seconds: float = PRINCIPAL_CACHE_TTL):
+        self._cache = TTLCache(ttl_seconds)
+        self._email_by_user: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, email: str, loader: Callable[[], Optional[User]], db: Session) -> Optional[Principal]:
+        """Return the principal for a token subject, calling loader() on a cache miss"""
+        def load():
+            user = loader()
+            if user is None:
+                return None
+            principal = load_principal(db, user)
+            with self._lock:
+                self._email_by_user[principal.user_id] = email
+            return principal
+
+        return self._cache.get_or_load(email, load)
+
+    def get_by_user_id(self, user_id: int) -> Optional[Principal]:
+        email = self._email_by_user.get(user_id)
+        return self._cache.get(email) if email is not None else None
+
+    def invalidate_users(self, user_ids: Iterable[int]):
+        """Forget these users and any reseller whose client list includes them"""
+        user_ids = set(uid for uid in user_ids if uid is not None)
+        if not user_ids:
+            return
+        with self._lock:
+            emails = {self._email_by_user.pop(uid) for uid in list(user_ids) if uid in self._email_by_user}
+            for uid, email in list(self._email_by_user.items()):
+                principal = self._cache.get(email)
+                if principal is not None and principal.client_user_ids & user_ids:
+                    emails.add(self._email_by_user.pop(uid))
+        for email in emails:
+            self._cache.pop(email)
+
+    def clear(self):
+        with self._lock:
+            self._email_by_user.clear()
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+principal_cache = PrincipalCache()
+
+
+# ========== Automatic Invalidation ==========
+
+def _owner_ids(company: Company, include_history: bool):
+    state = sa_inspect(company)
+    ids = {company.owner_id}
+    if include_history:
+        history = state.attrs.owner_id.history
+        ids.update(history.deleted or ())
+    return ids
+
+
+def _collect_changes(session: Session, flush_context):
+    """Remember which users' principals a flush affects (applied after commit)"""
+    touched = session.info.setdefault("principal_user_ids", set())
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, User):
+            touched.update((obj.id, obj.parent_id))
+        elif isinstance(obj, Company):
+            touched.update(_owner_ids(obj, include_history=False))
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj, include_collections=False):
+            history = sa_inspect(obj).attrs.parent_id.history
+            touched.update((obj.id, obj.parent_id, *(history.deleted or ())))
+        elif isinstance(obj, Company) and sa_inspect(obj).attrs.owner_id.history.has_changes():
+            touched.update(_owner_ids(obj, include_history=True))
+
+
+def _apply_changes(session: Session):
+    touched = session.info.pop("principal_user_ids", None)
+    if touched:
+        principal_cache.invalidate_users(touched)
+
+
+def _discard_changes(session: Session):
+    session.info.pop("principal_user_ids", None)
+
+
+event.listen(Session, "after_flush", _collect_changes)
+event.listen(Session, "after_commit", _apply_changes)
+event.listen(Session, "after_rollback", _discard_changes)
+
+
+__all__ = [
+    'Principal',
+    'PrincipalCache',
+    'load_principal',
+    'principal_cache'
+]
@@ -0,0 +1,229 @@
+"""
+Sliding-Window Rate Limiter for the External ERP API
+- Enforces Company.api_rate_limit (requests per rolling 24h) without touching the companies row
+- Counts live in memory, or in Redis when RATE_LIMIT_STORAGE_URI is set (multi-worker deployments)
+- Aggregated call counts are flushed to companies.api_calls_today in the background
+
+The window is split into fixed buckets (RATE_LIMIT_BUCKET_SECONDS); a request is allowed
+while the sum of the buckets inside the window is below the limit.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Optional
+
+from api_key_cache import api_usage_recorder
+
+logger = logging.getLogger("efris_api")
+
+RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", str(24 * 3600)))
+RATE_LIMIT_BUCKET_SECONDS = int(os.getenv("RATE_LIMIT_BUCKET_SECONDS", "600"))
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    """Outcome of one rate-limit check"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_at: float  # epoch seconds at which the oldest counted request leaves the window
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, int(self.reset_at - time.time()) + 1)
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": datetime.fromtimestamp(self.reset_at, timezone.utc)
+                                         .strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class MemoryBackend:
+    """Per-process bucket counters (exact for a single worker)"""
+
+    def __init__(self, window_seconds: int, bucket_seconds: int):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._buckets: Dict[str, Deque[List[int]]] = {}  # key -> deque of [bucket_start, count]
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, now: float, seed: Optional[Callable[[], int]] = None) -> RateLimitResult:
+        bucket_start = int(now // self.bucket_seconds) * self.bucket_seconds
+        window_start = bucket_start - self.window_seconds + self.bucket_seconds
+
+        with self._lock:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                buckets = self._buckets[key] = deque()
+                initial = seed() if seed else 0
+                if initial:
+                    buckets.append([bucket_start, initial])
+
+            while buckets and buckets[0][0] < window_start:
+                buckets.popleft()
+
+            used = sum(count for _, count in buckets)
+            allowed = used < limit
+            if allowed:
+                if buckets and buckets[-1][0] == bucket_start:
+                    buckets[-1][1] += 1
+                else:
+                    buckets.append([bucket_start, 1])
+                used += 1
+
+            oldest = buckets[0][0] if buckets else bucket_start
+            return RateLimitResult(allowed, limit, max(0, limit - used), oldest + self.window_seconds)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class RedisBackend:
+    """Bucket counters in a Redis hash per key, shared by all workers"""
+
+    # Atomically drop expired buckets, check the sum and count the request
+    _SCRIPT = """
+local key = KEYS[1]
+local bucket = tonumber(ARGV[1])
+local window_start = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local seed = tonumber(ARGV[5])
+if redis.call('EXISTS', key) == 0 and seed > 0 then
+    redis.call('HSET', key, bucket, seed)
+end
+local fields = redis.call('HGETALL', key)
+local used, oldest = 0, bucket
+for i = 1, #fields, 2 do
+    local start = tonumber(fields[i])
+    if start < window_start then
+        redis.call('HDEL', key, fields[i])
+    else
+        used = used + tonumber(fields[i + 1])
+        if start < oldest then oldest = start end
+    end
+end
+local allowed = 0
+if used < limit then
+    redis.call('HINCRBY', key, bucket, 1)
+    used = used + 1
+    allowed = 1
+end
+redis.call('EXPIRE', key, ttl)
+return {allowed, used, oldest}
+"""
+
+    def __init__(self, uri: str, window_seconds: int, bucket_seconds: int):
+        import redis
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._client = redis.Redis.from_url(uri)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    def hit(self, key: str, limit: int, now: float, seed: Optional[Callable[[], int]] = None) -> RateLimitResult:
+        bucket_start = int(now // self.bucket_seconds) * self.bucket_seconds
+        window_start = bucket_start - self.window_seconds + self.bucket_seconds
+        redis_key = f"efris:ratelimit:{key}"
+        initial = 0
+        if seed and not self._client.exists(redis_key):
+            initial = seed() or 0
+        allowed, used, oldest = self._script(
+            keys=[redis_key],
+            args=[bucket_start, window_start, limit, self.window_seconds + self.bucket_seconds, initial]
+        )
+        return RateLimitResult(bool(allowed), limit, max(0, limit - int(used)), int(oldest) + self.window_seconds)
+
+    def reset(self, key: str):
+        self._client.delete(f"efris:ratelimit:{key}")
+
+
+def _create_backend(uri: str, window_seconds: int, bucket_seconds: int):
+    if uri.startswith(("redis://", "rediss://")):
+        try:
+            return RedisBackend(uri, window_seconds, bucket_seconds)
+        except ImportError:
+            logger.warning("redis not installed - API rate limits are per worker (pip install redis)")
+        except Exception as e:
+            logger.warning(f"Rate limit storage unavailable ({e}) - falling back to in-memory counters")
+    return MemoryBackend(window_seconds, bucket_seconds)
+
+
+class SlidingWindowRateLimiter:
+    """
+    Per-company request limiter
+
+    Usage:
+        result = api_rate_limiter.hit(company.id, company.api_rate_limit)
+        if not result.allowed: ...  # 429 with result.headers()
+    """
+
+    def __init__(self, storage_uri: str = RATE_LIMIT_STORAGE_URI,
+                 window_seconds: int = RATE_LIMIT_WINDOW_SECONDS,
+                 bucket_seconds: int = RATE_LIMIT_BUCKET_SECONDS,
+                 on_allowed: Optional[Callable[[int], None]] = None):
+        self.window_seconds = window_seconds
+        self.backend = _create_backend(storage_uri, window_seconds, bucket_seconds)
+        self._fallback = MemoryBackend(window_seconds, bucket_seconds)
+        self.on_allowed = on_allowed
+        self.allowed_count = 0
+        self.rejected_count = 0
+
+    def hit(self, company_id: int, limit: Optional[int], seed: Optional[Callable[[], int]] = None,
+            now: Optional[float] = None) -> RateLimitResult:
+        """
+        Count one request for a company if it is under its limit
+
+        seed() is called once, when the company has no counters yet (e.g. after a restart),
+        so calls already recorded in the database still count towards the window.
+        """
+        now = time.time() if now is None else now
+        try:
+            result = self.backend.hit(str(company_id), limit or 1000, now, seed)
+        except Exception as e:
+            # Shared storage down - keep limiting per worker rather than failing requests
+            logger.warning(f"[RATE LIMIT] {type(self.backend).__name__} error, using in-memory counters: {e}")
+            result = self._fallback.hit(str(company_id), limit or 1000, now, seed)
+        if result.allowed:
+            self.allowed_count += 1
+            if self.on_allowed:
+                self.on_allowed(company_id)
+        else:
+            self.rejected_count += 1
+        return result
+
+    def reset(self, company_id: int):
+        self.backend.reset(str(company_id))
+        self._fallback.reset(str(company_id))
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "window_seconds": self.window_seconds,
+            "allowed": self.allowed_count,
+            "rejected": self.rejected_count,
+        }
+
+
+# Shared instance - allowed calls are aggregated into companies.api_calls_today
+api_rate_limiter = SlidingWindowRateLimiter(on_allowed=api_usage_recorder.add_calls)
+
+
+__all__ = [
+    'RateLimitResult',
+    'MemoryBackend',
+    'RedisBackend',
+    'SlidingWindowRateLimiter',
+    'api_rate_limiter'
+]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Background Job Worker
+Runs the queued QuickBooks / EFRIS imports (background_jobs, see jobs.py) outside the API
+processes. Set JOBS_IN_PROCESS_WORKER=false on the API when this runs as its own service.
+
+Usage:
+    python run_job_worker.py              # JOB_WORKER_THREADS worker threads, until Ctrl+C
+    python run_job_worker.py --threads 4
+    python run_job_worker.py --once       # run everything due, then exit (cron)
+"""
+
+import argparse
+import logging
+import os
+import socket
+import time
+
+from jobs import JOB_POLL_SECONDS, JobWorker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("JOB_WORKER_THREADS", "2")),
+                        help="jobs to run concurrently in this process")
+    parser.add_argument("--once", action="store_true", help="run the jobs that are due, then exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    import api_multitenant  # noqa: F401 - registers the job handlers in jobs.JOB_HANDLERS
+
+    if args.once:
+        worker = JobWorker(worker_id=f"{socket.gethostname()}:{os.getpid()}:once")
+        while worker.run_once():
+            pass
+        print(f"[OK] Processed {worker.processed} job(s): {worker.outcomes}")
+        return worker
+
+    workers = [JobWorker(worker_id=f"{socket.gethostname()}:{os.getpid()}:{i}") for i in range(args.threads)]
+    for worker in workers:
+        worker.start()
+    print(f"[OK] {len(workers)} job worker thread(s) polling every {JOB_POLL_SECONDS}s")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,75 +3,68 @@
 Database Migration Runner
 Automatically runs when deploying via GitHub Actions
 
-This ensures database schema stays up to date with code changes.
+Applies the pending versions from database/migrator.py (scripts in migrations/) to
+DATABASE_URL and records them in schema_migrations, so workers only need a version
+check at startup.
+
+Usage:
+    python run_migrations.py              # apply everything pending
+    python run_migrations.py --status     # list applied / pending versions
+    python run_migrations.py --stamp      # mark pending as applied (schema migrated by hand)
+    python run_migrations.py --target 3   # stop after version 3
 """
 
-import sqlite3
-import os
+import argparse
 from datetime import datetime
 
-# Database path
-DB_PATH = os.getenv('DATABASE_PATH', 'efris_api.db')
+from database.connection import engine
+from database.migrator import MIGRATIONS, SCHEMA_VERSION, current_version, migrate, pending, stamp
+
 
 def log(message):
     """Print timestamped log message"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {message}")
 
-def run_migrations():
+
+def run_migrations(target=None, mark_only=False):
     """Run all database migrations"""
-    log("Starting database migrations...")
-    
+    log(f"Starting database migrations ({engine.dialect.name}, schema version {SCHEMA_VERSION})...")
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Create migrations tracking table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS schema_migrations (
-                version INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Get applied migrations
-        cursor.execute("SELECT version FROM schema_migrations")
-        applied = {row[0] for row in cursor.fetchall()}
-        
-        # Define migrations (add new ones here)
-        migrations = [
-            # Example:
-            # (1, "initial_schema", """
-            #     CREATE TABLE IF NOT EXISTS users (
-            #         id INTEGER PRIMARY KEY AUTOINCREMENT,
-            #         email TEXT UNIQUE NOT NULL
-            #     )
-            # """),
-        ]
-        
-        # Run pending migrations
-        for version, name, sql in migrations:
-            if version not in applied:
-                log(f"Applying migration {version}: {name}")
-                cursor.executescript(sql)
-                cursor.execute(
-                    "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
-                    (version, name)
-                )
-                conn.commit()
-                log(f"✅ Migration {version} applied successfully")
-            else:
-                log(f"⏭️  Migration {version} already applied, skipping")
-        
-        conn.close()
-        log("✅ All migrations completed successfully")
+        if mark_only:
+            for migration in stamp(engine, target):
+                log(f"📌 Migration {migration.version} ({migration.name}) marked as applied")
+        else:
+            applied = migrate(engine, target)
+            for migration in applied:
+                log(f"✅ Migration {migration.version} ({migration.name}) applied")
+            if not applied:
+                log("⏭️  No pending migrations")
+        log(f"✅ Database at version {current_version(engine)}")
         return True
-        
+
     except Exception as e:
         log(f"❌ Migration failed: {str(e)}")
         return False
 
+
+def show_status():
+    waiting = {m.version for m in pending(engine)}
+    for migration in MIGRATIONS:
+        state = "pending" if migration.version in waiting else "applied"
+        log(f"{migration.version:>3}  {migration.name:<28} {state}{'' if migration.online else '  (deploy-only)'}")
+
+
 if __name__ == "__main__":
-    success = run_migrations()
+    parser = argparse.ArgumentParser(description="Apply versioned database migrations")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--stamp", action="store_true", help="record pending migrations without running them")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    args = parser.parse_args()
+
+    if args.status:
+        show_status()
+        exit(0)
+    success = run_migrations(args.target, args.stamp)
     exit(0 if success else 1)
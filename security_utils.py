@@ -4,16 +4,20 @@ Security Utilities for EFRIS Multi-Tenant Platform
 - IP Whitelisting for Custom ERP API
 - API Rate Limiting per client
 """
-from typing import Tuple
+from typing import Optional
 import pyotp
 import qrcode
 import io
 import base64
 import json
-from datetime import datetime, date
+from datetime import date
 from fastapi import HTTPException, Request
 from sqlalchemy.orm import Session
-from database.models import Company, AuditLog
+from database.models import Company
+from cache_utils import TTLCache
+from log_writer import log_writer
+from rate_limiter import RateLimitResult, api_rate_limiter
+from ip_allowlist import CompiledAllowlist, compile_allowlist
 
 
 # ========== 2FA / TOTP Functions ==========
@@ -93,40 +97,18 @@ def parse_allowed_ips(allowed_ips_json: str) -> list:
 
 
 def is_ip_allowed(client_ip: str, allowed_ips: list) -> bool:
-    """Check if client IP is in whitelist. Empty whitelist = allow all"""
-    if not allowed_ips:
-        # No whitelist = allow everyone
-        return True
-    
-    # Check for exact match
-    if client_ip in allowed_ips:
-        return True
-    
-    # Check for wildcard patterns (e.g., "192.168.1.*")
-    for allowed_pattern in allowed_ips:
-        if "*" in allowed_pattern:
-            pattern_parts = allowed_pattern.split(".")
-            ip_parts = client_ip.split(".")
-            
-            if len(pattern_parts) == len(ip_parts):
-                match = True
-                for i, part in enumerate(pattern_parts):
-                    if part != "*" and part != ip_parts[i]:
-                        match = False
-                        break
-                
-                if match:
-                    return True
-    
-    return False
+    """Check if client IP is in whitelist (exact, CIDR or wildcard, IPv4/IPv6). Empty whitelist = allow all"""
+    return CompiledAllowlist(allowed_ips).is_allowed(client_ip)
 
 
-def check_ip_whitelist(request: Request, company: Company) -> bool:
-    """Check if request IP is whitelisted for company"""
+def check_ip_whitelist(request: Request, company: Company,
+                       allowlist: Optional[CompiledAllowlist] = None) -> bool:
+    """Check if request IP is whitelisted for company (pass the cached compiled allowlist when available)"""
     client_ip = get_client_ip(request)
-    allowed_ips = parse_allowed_ips(company.allowed_ips)
+    if allowlist is None:
+        allowlist = compile_allowlist(company.allowed_ips)
     
-    is_allowed = is_ip_allowed(client_ip, allowed_ips)
+    is_allowed = allowlist.is_allowed(client_ip)
     
     if not is_allowed:
         # Log failed attempt
@@ -137,111 +119,87 @@ def check_ip_whitelist(request: Request, company: Company) -> bool:
 
 # ========== API Rate Limiting Functions ==========
 
-def reset_daily_counter_if_needed(company: Company, db: Session):
-    """Reset API call counter if it's a new day"""
-    now = datetime.now()
-    today = date.today()
-    
-    # Check if we need to reset (new day or never reset)
-    if not company.api_last_reset or company.api_last_reset.date() < today:
-        company.api_calls_today = 0
-        company.api_last_reset = now
-        db.commit()
+RATE_LIMIT_AUDIT_INTERVAL = 60  # seconds between rate_limit_exceeded audit rows per company
+_rate_limit_audited = TTLCache(ttl_seconds=RATE_LIMIT_AUDIT_INTERVAL)  # company_id -> True while audited
 
 
-def check_rate_limit(company: Company, db: Session) -> Tuple[bool, int, int]:
+def calls_recorded_today(company: Company) -> int:
+    """API calls already persisted for today (seeds the limiter after a restart)"""
+    if company.api_last_reset and company.api_last_reset.date() == date.today():
+        return company.api_calls_today or 0
+    return 0
+
+
+def check_rate_limit(company: Company) -> RateLimitResult:
     """
-    Check if company has exceeded rate limit
-    Returns: (is_allowed, calls_remaining, limit)
+    Count this request against the company's limit
+    Counters are held by the shared limiter - no database read or write
     """
-    # Reset counter if needed
-    reset_daily_counter_if_needed(company, db)
-    
-    # Check limit
-    limit = company.api_rate_limit or 1000
-    calls_today = company.api_calls_today or 0
-    
-    is_allowed = calls_today < limit
-    calls_remaining = max(0, limit - calls_today)
-    
-    return is_allowed, calls_remaining, limit
-
+    return api_rate_limiter.hit(company.id, company.api_rate_limit,
+                                seed=lambda: calls_recorded_today(company))
 
-def increment_api_call_counter(company: Company, db: Session):
-    """Increment API call counter for rate limiting"""
-    reset_daily_counter_if_needed(company, db)
-    
-    company.api_calls_today = (company.api_calls_today or 0) + 1
-    company.api_last_used = datetime.now()
-    db.commit()
 
+def log_rate_limit_exceeded(company: Company, client_ip: str, result: RateLimitResult):
+    """Log rate limit violation to audit log (at most once a minute per company, written in the background)"""
+    # The loader runs once per company per interval, however many threadpool threads race here
+    first = []
+    _rate_limit_audited.get_or_load(company.id, lambda: first.append(company.id) or True)
+    if not first:
+        return
 
-def log_rate_limit_exceeded(company: Company, client_ip: str, db: Session):
-    """Log rate limit violation to audit log"""
-    audit_log = AuditLog(
+    log_writer.audit(
         company_id=company.id,
         user_id=None,  # External API, no user
         action="rate_limit_exceeded",
-        details=f"API rate limit exceeded ({company.api_calls_today}/{company.api_rate_limit}). IP: {client_ip}",
+        details=f"API rate limit exceeded ({result.limit}/{result.limit} in 24h). IP: {client_ip}",
         ip_address=client_ip
     )
-    db.add(audit_log)
-    db.commit()
 
 
 # ========== Combined Security Check for External API ==========
 
-def enforce_api_security(request: Request, company: Company, db: Session):
+def enforce_api_security(request: Request, company: Company, db: Optional[Session],
+                         allowlist: Optional[CompiledAllowlist] = None):
     """
     Comprehensive security check for external API endpoints
     - IP Whitelisting
     - Rate Limiting
-    - Audit Logging
+    - Audit Logging (queued on log_writer - no database access here, db may be None)
     
     Raises HTTPException if security check fails
     """
     client_ip = get_client_ip(request)
     
     # 1. Check IP Whitelist
-    if not check_ip_whitelist(request, company):
-        # Log security violation
-        audit_log = AuditLog(
+    if not check_ip_whitelist(request, company, allowlist):
+        # Log security violation (queued - the rejection doesn't wait for the INSERT)
+        log_writer.audit(
             company_id=company.id,
             user_id=None,
             action="ip_blocked",
             details=f"Blocked API request from non-whitelisted IP: {client_ip}",
             ip_address=client_ip
         )
-        db.add(audit_log)
-        db.commit()
         
         raise HTTPException(
             status_code=403,
             detail="Access denied: IP address not whitelisted for this API key"
         )
     
-    # 2. Check Rate Limit
-    is_allowed, calls_remaining, limit = check_rate_limit(company, db)
+    # 2. Check Rate Limit (also counts the request)
+    result = check_rate_limit(company)
     
-    if not is_allowed:
-        log_rate_limit_exceeded(company, client_ip, db)
+    if not result.allowed:
+        log_rate_limit_exceeded(company, client_ip, result)
         
         raise HTTPException(
             status_code=429,
-            detail=f"Rate limit exceeded. Limit: {limit} requests/day. Try again tomorrow.",
-            headers={
-                "X-RateLimit-Limit": str(limit),
-                "X-RateLimit-Remaining": "0",
-                "X-RateLimit-Reset": company.api_last_reset.isoformat() if company.api_last_reset else ""
-            }
+            detail=f"Rate limit exceeded. Limit: {result.limit} requests per 24 hours. "
+                   f"Retry after {result.retry_after} seconds.",
+            headers=result.headers()
         )
     
-    # 3. Increment counter (passed all checks)
-    increment_api_call_counter(company, db)
-    
-    # 4. Add rate limit headers to response (informational)
-    return {
-        "X-RateLimit-Limit": str(limit),
-        "X-RateLimit-Remaining": str(calls_remaining - 1),  # -1 because we just incremented
-        "X-RateLimit-Reset": company.api_last_reset.isoformat() if company.api_last_reset else ""
-    }
+    # 3. Rate limit headers for the response (added by the API middleware)
+    headers = result.headers()
+    request.state.rate_limit_headers = headers
+    return headers
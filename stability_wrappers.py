@@ -6,7 +6,7 @@ from functools import wraps
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import traceback
-from typing import Callable, Any
+from typing import Callable
 from monitoring import logger, error_monitor
 
 
@@ -171,71 +171,9 @@ def with_timeout(seconds: int):
     return decorator
 
 
-class CircuitBreaker:
-    """
-    Circuit breaker pattern for external services (EFRIS)
-    Prevents cascading failures when external service is down
-    
-    States:
-    - CLOSED: Normal operation
-    - OPEN: Service is down, reject all requests
-    - HALF_OPEN: Testing if service recovered
-    """
-    
-    def __init__(self, failure_threshold: int = 5, timeout: int = 60):
-        self.failure_threshold = failure_threshold
-        self.timeout = timeout
-        self.failures = 0
-        self.last_failure_time = None
-        self.state = "CLOSED"  # CLOSED, OPEN, HALF_OPEN
-    
-    def call(self, func: Callable, *args, **kwargs) -> Any:
-        """
-        Execute function with circuit breaker protection
-        
-        Usage:
-            circuit_breaker = CircuitBreaker()
-            result = circuit_breaker.call(make_efris_request, url, data)
-        """
-        import time
-        
-        # Check if circuit is open
-        if self.state == "OPEN":
-            # Check if timeout period has passed
-            if time.time() - self.last_failure_time > self.timeout:
-                self.state = "HALF_OPEN"
-                logger.info("Circuit breaker: HALF_OPEN - testing service")
-            else:
-                raise HTTPException(
-                    status_code=503,
-                    detail="Service temporarily unavailable. Please try again later."
-                )
-        
-        try:
-            result = func(*args, **kwargs)
-            
-            # Success - reset failures
-            if self.state == "HALF_OPEN":
-                self.state = "CLOSED"
-                self.failures = 0
-                logger.info("Circuit breaker: CLOSED - service recovered")
-            
-            return result
-        
-        except Exception as e:
-            self.failures += 1
-            self.last_failure_time = time.time()
-            
-            # Open circuit if threshold reached
-            if self.failures >= self.failure_threshold:
-                self.state = "OPEN"
-                logger.error(f"Circuit breaker: OPEN - service failed {self.failures} times")
-            
-            raise
-
-
-# Global circuit breaker for EFRIS
-efris_circuit_breaker = CircuitBreaker(failure_threshold=5, timeout=60)
+# Circuit breakers for EFRIS are thread-safe and scoped per environment / TIN, and are
+# applied to every EfrisManager request - see efris_guard
+from efris_guard import CircuitBreaker, efris_guard
 
 
 # Export all utilities
@@ -246,5 +184,5 @@ __all__ = [
     'safe_commit',
     'with_timeout',
     'CircuitBreaker',
-    'efris_circuit_breaker'
+    'efris_guard'
 ]
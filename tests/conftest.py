@@ -13,11 +13,20 @@ from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from efris_client import EfrisManager
+from efris_guard import efris_guard
 
 # Initialize Faker for generating random test data
 fake = Faker()
 
 
+@pytest.fixture(autouse=True)
+def reset_efris_guard():
+    """EFRIS breakers and concurrency limits are process-wide - start every test closed"""
+    efris_guard.reset()
+    yield
+    efris_guard.reset()
+
+
 # ============================================================================
 # CONFIGURATION FIXTURES
 # ============================================================================
@@ -0,0 +1,158 @@
+"""
+Unit tests for the API-key auth cache and coalesced usage writes (api_key_cache.py)
+
+Run tests:
+    pytest tests/test_api_key_cache.py -v
+"""
+
+import pytest
+import sys
+import os
+import threading
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cache_utils import TTLCache
+from api_key_cache import ApiKeyAuthCache, ApiUsageRecorder, hash_api_key
+from database.models import Base, Company
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def session_factory(engine):
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(Company(id=1, name="Acme Ltd", tin="1000000001", device_no="1000000001_02",
+                   api_key="efris_test_key", api_enabled=True, is_active=True, api_rate_limit=500))
+    db.commit()
+    db.close()
+    return factory
+
+
+def count_statements(engine):
+    """Attach a counter of executed SQL statements to an engine"""
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def load_company(db, api_key):
+    return db.query(Company).filter(Company.api_key == api_key, Company.is_active == True).first()
+
+
+class TestTTLCache:
+    """Test the generic TTL cache"""
+
+    def test_expired_entries_are_dropped(self):
+        cache = TTLCache(ttl_seconds=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+    def test_single_flight_loading(self):
+        """Concurrent misses on the same key call the loader once"""
+        cache = TTLCache(ttl_seconds=60)
+        calls = []
+        gate = threading.Event()
+
+        def loader():
+            calls.append(1)
+            gate.wait(1)
+            return "value"
+
+        threads = [threading.Thread(target=cache.get_or_load, args=("k", loader)) for _ in range(10)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
+        assert cache.get("k") == "value"
+
+    def test_none_is_not_cached(self):
+        cache = TTLCache(ttl_seconds=60)
+        assert cache.get_or_load("missing", lambda: None) is None
+        assert len(cache) == 0
+
+
+class TestApiKeyAuthCache:
+    """Test cached API-key authentication"""
+
+    def test_cache_hit_issues_no_queries(self, engine, session_factory):
+        """Second lookup is served from memory and attached without a SELECT"""
+        cache = ApiKeyAuthCache(ttl_seconds=60)
+        db = session_factory()
+        auth = cache.get_or_load("efris_test_key", lambda: load_company(db, "efris_test_key"))
+        assert auth.company_id == 1
+        assert auth.api_rate_limit == 500
+        db.close()
+
+        statements = count_statements(engine)
+        db = session_factory()
+        auth = cache.get_or_load("efris_test_key", lambda: pytest.fail("loader called on cache hit"))
+        company = auth.attach(db)
+        assert company.tin == "1000000001"
+        assert company in db
+        assert statements == []
+        db.close()
+
+    def test_unknown_key_returns_none(self, session_factory):
+        cache = ApiKeyAuthCache(ttl_seconds=60)
+        db = session_factory()
+        assert cache.get_or_load("nope", lambda: load_company(db, "nope")) is None
+        db.close()
+
+    def test_invalidate_company(self, session_factory):
+        """Invalidation forces the next request back to the database"""
+        cache = ApiKeyAuthCache(ttl_seconds=60)
+        db = session_factory()
+        cache.get_or_load("efris_test_key", lambda: load_company(db, "efris_test_key"))
+
+        company = db.get(Company, 1)
+        company.is_active = False
+        db.commit()
+        cache.invalidate_company(1)
+
+        assert cache.get_or_load("efris_test_key", lambda: load_company(db, "efris_test_key")) is None
+        db.close()
+
+    def test_keys_are_hashed(self):
+        assert hash_api_key("efris_test_key") != "efris_test_key"
+        assert len(hash_api_key("efris_test_key")) == 64
+
+
+class TestApiUsageRecorder:
+    """Test coalesced api_last_used writes"""
+
+    def test_many_marks_one_update(self, engine, session_factory):
+        """Repeated marks for a company collapse into a single row update"""
+        recorder = ApiUsageRecorder(session_factory=session_factory, interval=3600)
+        last = datetime(2026, 1, 1, 12, 0, 0)
+        for second in range(50):
+            recorder.record(1, api_last_used=last.replace(second=second))
+        assert recorder.pending_count() == 1
+
+        statements = count_statements(engine)
+        assert recorder.flush() == 1
+        assert len([s for s in statements if s.lstrip().upper().startswith("UPDATE")]) == 1
+
+        db = session_factory()
+        assert db.get(Company, 1).api_last_used.replace(tzinfo=None) == last.replace(second=49)
+        db.close()
+        recorder.stop()
+
+    def test_flush_with_nothing_pending(self, session_factory):
+        recorder = ApiUsageRecorder(session_factory=session_factory, interval=3600)
+        assert recorder.flush() == 0
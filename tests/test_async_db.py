@@ -0,0 +1,242 @@
+"""
+Tests for the async session path (database/connection.py get_async_db) and the
+external invoice endpoints migrated to it
+
+Includes a mixed-load benchmark: slow invoice listings (status filter + total over a
+large tenant) running concurrently with invoice lookups, once with the async session
+and once with a session that blocks the event loop like the old sync get_db did.
+SQLite is local, so each statement gets an ASYNC_BENCH_ROUNDTRIP_MS delay in the
+driver to stand in for the network round-trip to a PostgreSQL server (set
+ASYNC_BENCH_ROWS to change the table size). It compares wall-clock timings, so it
+only runs when ASYNC_BENCH=1.
+
+Run tests:
+    pytest tests/test_async_db.py -v -s
+    ASYNC_BENCH=1 pytest tests/test_async_db.py -v -s -k Benchmark
+"""
+
+import pytest
+import sys
+import os
+import asyncio
+import statistics
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import ThreadpoolSession, async_database_url
+from database.models import Base, Company, EFRISInvoice
+
+api = pytest.importorskip("api_multitenant")
+pytest.importorskip("aiosqlite")
+httpx = pytest.importorskip("httpx")
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+API_KEY = "efris_test_key"
+BENCH_ROWS = int(os.getenv("ASYNC_BENCH_ROWS", "20000"))
+ROUNDTRIP_MS = float(os.getenv("ASYNC_BENCH_ROUNDTRIP_MS", "10"))
+RUN_BENCH = os.getenv("ASYNC_BENCH", "").lower() in ("1", "true")
+
+
+class BlockingSession(ThreadpoolSession):
+    """The old behaviour: sync Session calls made directly on the event loop"""
+
+    async def _call(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+def build_db(path, invoices: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Company.__table__), [{
+            "id": 1, "name": "Acme Ltd", "tin": "1000000001", "device_no": "1000000001_02",
+            "api_key": API_KEY, "api_enabled": True, "is_active": True, "api_rate_limit": 10 ** 6
+        }])
+        for start in range(0, invoices, 50000):
+            conn.execute(insert(EFRISInvoice.__table__), [
+                {"company_id": 1, "invoice_no": f"INV-{i}", "customer_name": f"Customer {i % 97}",
+                 "status": "failed" if i % 50 == 0 else "success", "fdn": f"FDN{i}", "total_amount": 118.0}
+                for i in range(start, min(invoices, start + 50000))
+            ])
+    return engine
+
+
+def simulate_roundtrip(engine, milliseconds: float):
+    """Delay every statement inside the driver (the thread that waits on the database)"""
+    if not milliseconds:
+        return
+
+    def delay(statement):
+        time.sleep(milliseconds / 1000)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, "run_async"):  # aiosqlite adapter
+            dbapi_connection.run_async(lambda conn: conn.set_trace_callback(delay))
+        else:
+            dbapi_connection.set_trace_callback(delay)
+
+
+def session_override(kind, path, roundtrip_ms=0):
+    """get_async_db replacement: real AsyncSession, threadpool fallback or blocking session"""
+    if kind == "async":
+        async_engine = create_async_engine(async_database_url(f"sqlite:///{path}"))
+        simulate_roundtrip(async_engine.sync_engine, roundtrip_ms)
+        factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+        async def get_async_db():
+            async with factory() as db:
+                yield db
+        return get_async_db
+
+    # enough connections for every in-flight request (a blocked loop can't hand them back)
+    engine = create_engine(f"sqlite:///{path}", pool_size=60)
+    simulate_roundtrip(engine, roundtrip_ms)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    session_class = ThreadpoolSession if kind == "threadpool" else BlockingSession
+
+    async def get_session():
+        db = session_class(factory())
+        try:
+            yield db
+        finally:
+            await db.close()
+    return get_session
+
+
+@pytest.fixture
+def client_for(tmp_path):
+    """AsyncClient on the app with get_async_db swapped for the given session kind"""
+    api.api_key_cache.clear()
+    api.app.dependency_overrides.clear()
+
+    def make(kind, invoices=3, roundtrip_ms=0):
+        path = tmp_path / f"{invoices}.db"
+        if not path.exists():
+            build_db(path, invoices).dispose()
+        api.app.dependency_overrides[api.get_async_db] = session_override(kind, path, roundtrip_ms)
+        api.api_key_cache.clear()
+        return httpx.AsyncClient(app=api.app, base_url="http://test", headers={"X-API-Key": API_KEY})
+
+    yield make
+    api.app.dependency_overrides.clear()
+    api.api_key_cache.clear()
+
+
+def test_async_database_url():
+    url = async_database_url("postgresql://u:p@db:5432/efris")
+    assert (url.drivername, url.password, url.database) == ("postgresql+asyncpg", "p", "efris")
+    assert str(async_database_url("sqlite:///efris.db")) == "sqlite+aiosqlite:///efris.db"
+    assert async_database_url("mysql+pymysql://u:p@localhost/efris").drivername == "mysql+aiomysql"
+    assert async_database_url("mssql+pyodbc://u:p@dsn") is None
+
+
+@pytest.mark.parametrize("kind", ["async", "threadpool"])
+class TestExternalEndpoints:
+    """Migrated endpoints behave the same on the async session and the threadpool fallback"""
+
+    def test_list_and_get(self, client_for, kind):
+        async def run():
+            async with client_for(kind) as client:
+                listed = (await client.get("/api/external/efris/invoices", params={"limit": 2})).json()
+                following = (await client.get("/api/external/efris/invoices",
+                                              params={"limit": 2, "cursor": listed["next_cursor"]})).json()
+                failed = (await client.get("/api/external/efris/invoices", params={"status": "failed"})).json()
+                invoice = await client.get("/api/external/efris/invoice/INV-1")
+                missing = await client.get("/api/external/efris/invoice/NOPE")
+                return listed, following, failed, invoice, missing
+
+        listed, following, failed, invoice, missing = asyncio.run(run())
+        assert listed["total"] == 3
+        assert [i["invoice_number"] for i in listed["invoices"] + following["invoices"]] == ["INV-2", "INV-1", "INV-0"]
+        assert [i["invoice_number"] for i in failed["invoices"]] == ["INV-0"]
+        assert invoice.status_code == 200 and invoice.json()["fdn"] == "FDN1"
+        assert missing.status_code == 404
+
+    def test_bad_api_key(self, client_for, kind):
+        async def run():
+            async with client_for(kind) as client:
+                return await client.get("/api/external/efris/invoices", headers={"X-API-Key": "wrong"})
+        assert asyncio.run(run()).status_code == 401
+
+    def test_submit_invoice(self, client_for, kind, monkeypatch):
+        uploads = []
+
+        class FakeEfris:
+            def upload_invoice(self, payload):
+                uploads.append(payload)
+                return {"returnStateInfo": {"returnCode": "00"},
+                        "data": {"basicInformation": {"invoiceNo": f"324000{len(uploads)}", "antifakeCode": "AF1",
+                                                      "invoiceId": "99"}}}
+
+        monkeypatch.setattr(api, "get_efris_manager", lambda company: FakeEfris())
+        invoice = {
+            "invoice_number": "INV-NEW", "invoice_date": "2024-01-24", "customer_name": "ABC Ltd",
+            "items": [{"item": "Cement", "itemCode": "CEM-1", "qty": "1", "unitOfMeasure": "101",
+                       "unitPrice": "118", "total": "118", "taxRate": "18", "tax": "18",
+                       "goodsCategoryId": "44102906"}]
+        }
+
+        async def run():
+            async with client_for(kind) as client:
+                submitted = await client.post("/api/external/efris/submit-invoice", json=invoice)
+                resubmitted = await client.post("/api/external/efris/submit-invoice", json=invoice)
+                stored = await client.get("/api/external/efris/invoice/INV-NEW")
+                return submitted, resubmitted, stored
+
+        submitted, resubmitted, stored = asyncio.run(run())
+        assert submitted.status_code == 200, submitted.text
+        assert submitted.json()["fiscal_data"]["fdn"] == "3240001"
+        # a second submission of a fiscalized invoice number is refused before reaching EFRIS
+        assert resubmitted.status_code == 409
+        assert resubmitted.json()["detail"]["fdn"] == "3240001"
+        assert len(uploads) == 1
+        assert stored.json()["status"] == "success" and stored.json()["fdn"] == "3240001"
+
+
+@pytest.mark.skipif(not RUN_BENCH, reason="timing benchmark - set ASYNC_BENCH=1")
+class TestMixedLoadBenchmark:
+    """Lookups stay fast while slow listings run, unlike with a blocking session"""
+
+    HEAVY, LIGHT = 8, 40
+
+    def run_load(self, client_for, kind):
+        async def run():
+            async with client_for(kind, invoices=BENCH_ROWS, roundtrip_ms=ROUNDTRIP_MS) as client:
+                await client.get("/api/external/efris/invoice/INV-1")  # warm the API key cache
+
+                async def heavy():
+                    response = await client.get("/api/external/efris/invoices",
+                                                params={"status": "failed", "offset": 1000, "limit": 50})
+                    assert response.status_code == 200
+
+                async def light(i):
+                    await asyncio.sleep(i * 0.005)
+                    started = time.perf_counter()
+                    response = await client.get(f"/api/external/efris/invoice/INV-{i}")
+                    assert response.status_code == 200
+                    return time.perf_counter() - started
+
+                started = time.perf_counter()
+                results = await asyncio.gather(*[heavy() for _ in range(self.HEAVY)],
+                                               *[light(i) for i in range(self.LIGHT)])
+                wall = time.perf_counter() - started
+                latencies = sorted(results[self.HEAVY:])
+                return {"wall_s": round(wall, 2),
+                        "lookup_p50_ms": round(statistics.median(latencies) * 1000, 1),
+                        "lookup_max_ms": round(latencies[-1] * 1000, 1)}
+        return asyncio.run(run())
+
+    def test_async_session_keeps_loop_free(self, client_for):
+        blocking = self.run_load(client_for, "blocking")
+        non_blocking = self.run_load(client_for, "async")
+        print(f"\n[ASYNC DB] {BENCH_ROWS} invoices, {ROUNDTRIP_MS}ms round-trip, "
+              f"{self.HEAVY} slow listings + {self.LIGHT} lookups")
+        print(f"  blocking session: {blocking}")
+        print(f"  async session   : {non_blocking}")
+        assert non_blocking["wall_s"] < blocking["wall_s"]
+        assert non_blocking["lookup_p50_ms"] < blocking["lookup_p50_ms"]
@@ -0,0 +1,256 @@
+"""
+Tests for the chunked bulk upsert (database/bulk.py) and the unique tenant keys
+(migrations/add_unique_tenant_keys.py), plus a 10k-record timing against the old
+per-record SELECT + INSERT/UPDATE loop used by the EFRIS imports
+
+Run tests:
+    pytest tests/test_bulk_upsert.py -v -s
+"""
+
+import pytest
+import sys
+import os
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.bulk import upsert, _upsert_fallback
+from database.models import Base, Company, EFRISGood, EFRISInvoice
+from migrations.add_unique_tenant_keys import UNIQUE_KEYS, upgrade, downgrade
+
+RECORDS = 10_000
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+    session.add(Company(id=2, name="Other Ltd", tin="1000000002"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def count_statements(engine):
+    """Attach a counter of executed SQL statements to an engine"""
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def goods_record(i: int, price: float = 1000.0) -> dict:
+    """Shape of a T127 goods record"""
+    return {
+        "goodsCode": f"G-{i:05d}", "goodsName": f"Item {i}", "commodityCategoryCode": "50202306",
+        "commodityCategoryName": "Cement", "unitPrice": str(price), "currency": "101",
+        "taxRate": "0.18", "haveExciseTax": "102", "stock": "25"
+    }
+
+
+def good_row(company_id: int, record: dict) -> dict:
+    return {
+        "company_id": company_id,
+        "goods_code": record["goodsCode"],
+        "goods_name": record["goodsName"],
+        "commodity_category_code": record["commodityCategoryCode"],
+        "commodity_category_name": record["commodityCategoryName"],
+        "unit_price": float(record["unitPrice"]),
+        "currency": record["currency"],
+        "tax_rate": float(record["taxRate"]),
+        "have_excise_tax": record["haveExciseTax"],
+        "stock": float(record["stock"]),
+        "efris_data": record,
+        "updated_at": datetime.now()
+    }
+
+
+class TestUpsert:
+    """INSERT ... ON CONFLICT DO UPDATE behaviour"""
+
+    def test_inserts_then_updates(self, db):
+        upsert(db, EFRISGood, [good_row(1, goods_record(i)) for i in range(5)], ["company_id", "goods_code"])
+        upsert(db, EFRISGood, [good_row(1, goods_record(i, price=2000)) for i in range(3, 8)],
+               ["company_id", "goods_code"])
+        db.commit()
+
+        assert db.query(EFRISGood).count() == 8
+        prices = dict(db.query(EFRISGood.goods_code, EFRISGood.unit_price))
+        assert prices["G-00000"] == 1000
+        assert prices["G-00004"] == 2000
+        assert db.query(EFRISGood).filter_by(goods_code="G-00004").one().efris_data["unitPrice"] == "2000"
+
+    def test_keys_are_per_company(self, db):
+        upsert(db, EFRISGood, [good_row(1, goods_record(1))], ["company_id", "goods_code"])
+        upsert(db, EFRISGood, [good_row(2, goods_record(1))], ["company_id", "goods_code"])
+        db.commit()
+        assert db.query(EFRISGood).count() == 2
+
+    def test_duplicates_in_one_batch_last_wins(self, db):
+        rows = [good_row(1, goods_record(1, price=p)) for p in (1, 2, 3)]
+        assert upsert(db, EFRISGood, rows, ["company_id", "goods_code"]) == 1
+        db.commit()
+        assert db.query(EFRISGood.unit_price).scalar() == 3
+
+    def test_null_keys_are_always_inserted(self, db):
+        rows = [{"company_id": 1, "invoice_no": None, "status": "failed"} for _ in range(2)]
+        upsert(db, EFRISInvoice, rows, ["company_id", "invoice_no"])
+        upsert(db, EFRISInvoice, rows, ["company_id", "invoice_no"])
+        db.commit()
+        assert db.query(EFRISInvoice).count() == 4
+
+    def test_chunked_statements(self, engine, db):
+        statements = count_statements(engine)
+        upsert(db, EFRISGood, [good_row(1, goods_record(i)) for i in range(10)],
+               ["company_id", "goods_code"], chunk_size=4)
+        assert len([s for s in statements if s.startswith("INSERT")]) == 3
+
+    def test_update_columns_limits_what_changes(self, db):
+        upsert(db, EFRISGood, [good_row(1, goods_record(1))], ["company_id", "goods_code"])
+        changed = good_row(1, goods_record(1, price=5))
+        changed["goods_name"] = "Renamed"
+        upsert(db, EFRISGood, [changed], ["company_id", "goods_code"], update_columns=["unit_price"])
+        db.commit()
+        good = db.query(EFRISGood).one()
+        assert (good.goods_name, good.unit_price) == ("Item 1", 5)
+
+    def test_fallback_matches_on_conflict(self, engine, db):
+        """The portable path (for dialects without ON CONFLICT) gives the same rows"""
+        upsert(db, EFRISGood, [good_row(1, goods_record(i)) for i in range(4)], ["company_id", "goods_code"])
+        rows = [good_row(1, goods_record(i, price=7)) for i in range(2, 6)]
+        statements = count_statements(engine)
+        _upsert_fallback(db, EFRISGood, rows, ["company_id", "goods_code"],
+                         [c for c in rows[0] if c not in ("company_id", "goods_code")], chunk_size=500)
+        db.commit()
+
+        assert len(statements) == 3  # SELECT, INSERT (executemany), UPDATE (executemany)
+        assert db.query(EFRISGood).count() == 6
+        assert db.query(func.sum(EFRISGood.unit_price)).scalar() == 2 * 1000 + 4 * 7
+
+
+class TestUniqueKeys:
+    """The unique indexes and the migration that introduces them"""
+
+    def test_duplicate_invoice_number_rejected(self, db):
+        db.add(EFRISInvoice(company_id=1, invoice_no="3240000000001"))
+        db.add(EFRISInvoice(company_id=1, invoice_no="3240000000001"))
+        with pytest.raises(IntegrityError):
+            db.commit()
+
+    def test_migration_dedupes_and_adds_indexes(self, engine, db):
+        downgrade(engine)
+        db.add_all([
+            EFRISGood(company_id=1, goods_code="CEM-001", goods_name="old"),
+            EFRISGood(company_id=1, goods_code="CEM-001", goods_name="new"),
+            EFRISGood(company_id=2, goods_code="CEM-001", goods_name="other company"),
+            # T106 import copy, then the QB submission that owns the FDN
+            EFRISInvoice(company_id=1, invoice_no="FDN-1", reference_no="1001"),
+            EFRISInvoice(company_id=1, invoice_no="FDN-1", qb_invoice_id="55", status="success", fdn="FDN-1"),
+            EFRISInvoice(company_id=1, invoice_no="", status="failed"),
+            EFRISInvoice(company_id=1, invoice_no="", status="failed"),
+        ])
+        db.commit()
+
+        upgrade(engine)
+        upgrade(engine)  # idempotent
+
+        assert db.query(EFRISGood.goods_name).filter_by(company_id=1).all() == [("new",)]
+        assert db.query(EFRISGood).count() == 2
+        fdn_rows = db.query(EFRISInvoice).filter_by(invoice_no="FDN-1").all()
+        assert [row.qb_invoice_id for row in fdn_rows] == ["55"]
+        assert db.query(EFRISInvoice).filter(EFRISInvoice.invoice_no.is_(None)).count() == 2
+
+        inspector = inspect(engine)
+        for name, replaces, table, _ in UNIQUE_KEYS:
+            indexes = {ix["name"]: ix for ix in inspector.get_indexes(table)}
+            assert indexes[name]["unique"]
+            assert replaces not in indexes
+
+    def test_migration_keeps_fiscalized_invoice_over_later_retry(self, engine, db):
+        downgrade(engine)
+        db.add_all([
+            EFRISInvoice(company_id=1, invoice_no="INV-7", qb_invoice_id="70", status="success", fdn="FDN-7"),
+            EFRISInvoice(company_id=1, invoice_no="INV-7", qb_invoice_id="70", status="failed"),
+            # T106 import copy (fiscalized), then a failed external API retry
+            EFRISInvoice(company_id=1, invoice_no="INV-8", fdn="FDN-8"),
+            EFRISInvoice(company_id=1, invoice_no="INV-8", status="failed"),
+            EFRISInvoice(company_id=1, invoice_no="INV-9", status="failed"),
+            EFRISInvoice(company_id=1, invoice_no="INV-9", status="pending"),
+        ])
+        db.commit()
+
+        upgrade(engine)
+
+        rows = db.query(EFRISInvoice.invoice_no, EFRISInvoice.status, EFRISInvoice.fdn).order_by(
+            EFRISInvoice.invoice_no).all()
+        assert rows == [("INV-7", "success", "FDN-7"), ("INV-8", None, "FDN-8"), ("INV-9", "pending", None)]
+
+
+def legacy_import(db, company_id: int, records):
+    """The loop the import endpoints used before: SELECT per record, then INSERT or UPDATE"""
+    for record in records:
+        existing = db.query(EFRISGood).filter(
+            EFRISGood.company_id == company_id,
+            EFRISGood.goods_code == record.get('goodsCode')
+        ).first()
+        if existing:
+            existing.goods_name = record.get('goodsName')
+            existing.unit_price = float(record.get('unitPrice', 0))
+            existing.stock = float(record.get('stock', 0))
+            existing.efris_data = record
+            existing.updated_at = datetime.now()
+        else:
+            db.add(EFRISGood(**good_row(company_id, record)))
+    db.commit()
+
+
+def bulk_import(db, company_id: int, records):
+    upsert(db, EFRISGood, [good_row(company_id, record) for record in records], ["company_id", "goods_code"])
+    db.commit()
+
+
+def timed_import(tmp_path, name, import_fn) -> dict:
+    """First import (all inserts) then a re-import of the same records (all updates)"""
+    engine = create_engine(f"sqlite:///{tmp_path / name}.db")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+    db.commit()
+    timings = {}
+    for phase, price in (("insert_s", 1000.0), ("update_s", 1500.0)):
+        records = [goods_record(i, price) for i in range(RECORDS)]
+        started = time.perf_counter()
+        import_fn(db, 1, records)
+        timings[phase] = round(time.perf_counter() - started, 2)
+    assert db.query(EFRISGood).count() == RECORDS
+    assert db.query(func.min(EFRISGood.unit_price)).scalar() == 1500.0
+    db.close()
+    engine.dispose()
+    return timings
+
+
+class TestBulkImportTiming:
+    """10k goods: per-record SELECT + INSERT/UPDATE vs chunked upsert"""
+
+    def test_upsert_faster_than_per_record_loop(self, tmp_path):
+        legacy = timed_import(tmp_path, "legacy", legacy_import)
+        bulk = timed_import(tmp_path, "bulk", bulk_import)
+        print(f"\n[BULK UPSERT] {RECORDS} EFRIS goods on SQLite")
+        print(f"  per-record SELECT + INSERT/UPDATE: {legacy}")
+        print(f"  chunked INSERT ... ON CONFLICT   : {bulk}")
+
+        assert bulk["insert_s"] < legacy["insert_s"]
+        assert bulk["update_s"] < legacy["update_s"]
@@ -0,0 +1,176 @@
+"""
+Tests for the per-company, per-day dashboard counters (database/daily_stats.py)
+
+Run tests:
+    pytest tests/test_daily_stats.py -v
+"""
+
+import pytest
+import sys
+import os
+from datetime import date, datetime, timedelta, timezone
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.models import ActivityLog, Base, Company, DailyCompanyStats, Invoice, User
+from database import daily_stats
+from database.daily_stats import (
+    local_day, platform_day_totals, rebuild_daily_stats, reseller_fiscalized_totals
+)
+
+TODAY = local_day()
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        User(id=10, email="reseller@x.ug", hashed_password="x", role="reseller"),
+        User(id=11, email="client1@x.ug", hashed_password="x", role="client", parent_id=10),
+        User(id=12, email="client2@x.ug", hashed_password="x", role="client", parent_id=10),
+        User(id=13, email="direct@x.ug", hashed_password="x", role="client"),
+        Company(id=1, name="Client One", tin="1000000001", owner_id=11),
+        Company(id=2, name="Client Two", tin="1000000002", owner_id=12),
+        Company(id=3, name="Direct", tin="1000000003", owner_id=13),
+    ])
+    session.commit()
+    yield session
+    session.close()
+
+
+def fiscalized(company_id, user_id, reseller_id=None, status="success", amount="1000", created_at=None):
+    return ActivityLog(company_id=company_id, user_id=user_id, reseller_id=reseller_id,
+                       activity_type="invoice_fiscalized", efris_status=status,
+                       details={"total_amount": amount}, created_at=created_at)
+
+
+def count_statements(engine):
+    """Attach a counter of executed SQL statements to an engine"""
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def counters(db):
+    return {(s.company_id, s.day): (s.reseller_id, s.invoices_created, s.invoices_fiscalized,
+                                    s.invoices_failed, s.amount_fiscalized)
+            for s in db.query(DailyCompanyStats)}
+
+
+class TestMaintainedOnWrite:
+    """New rows bump the counters in the same transaction"""
+
+    def test_activity_and_invoices(self, db):
+        db.add_all([
+            fiscalized(1, 11, reseller_id=10, amount="1500.50"),
+            fiscalized(1, 11, reseller_id=10, status="failed", amount="200"),
+            ActivityLog(company_id=1, user_id=11, activity_type="product_synced"),
+            Invoice(company_id=1, qb_invoice_id="1"),
+            Invoice(company_id=3, qb_invoice_id="2"),
+        ])
+        db.commit()
+        db.add(fiscalized(1, 11, reseller_id=10, amount="300"))
+        db.commit()
+
+        assert counters(db) == {
+            (1, TODAY): (10, 1, 3, 1, 2000.5),
+            (3, TODAY): (None, 1, 0, 0, 0),
+        }
+
+    def test_days_follow_the_configured_offset(self, db, monkeypatch):
+        """01:30 EAT is 22:30 UTC the evening before - it counts on the EAT day"""
+        monkeypatch.setattr(daily_stats, "STATS_TZ", timezone(timedelta(hours=3)))
+        night = datetime.combine(TODAY, datetime.min.time()) - timedelta(hours=1, minutes=30)
+        db.add_all([fiscalized(1, 11, reseller_id=10, created_at=night),
+                    fiscalized(1, 11, reseller_id=10, created_at=night - timedelta(hours=3))])
+        db.commit()
+        assert set(counters(db)) == {(1, TODAY), (1, TODAY - timedelta(days=1))}
+
+        db.query(DailyCompanyStats).delete()
+        rebuild_daily_stats(db, since=TODAY)
+        assert set(counters(db)) == {(1, TODAY)}
+        assert platform_day_totals(db, TODAY)["invoices_fiscalized"] == 1
+
+    def test_rolled_back_rows_not_counted(self, db):
+        db.add(fiscalized(1, 11, reseller_id=10))
+        db.flush()
+        db.rollback()
+        assert counters(db) == {}
+
+    def test_table_not_migrated_yet(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(engine, tables=[t for t in Base.metadata.sorted_tables
+                                                 if t.name != "daily_company_stats"])
+        session = sessionmaker(bind=engine)()
+        session.add(Company(id=1, name="A", tin="1"))
+        session.add(Invoice(company_id=1, qb_invoice_id="1"))
+        session.commit()
+        assert session.query(Invoice).count() == 1
+
+
+class TestRebuild:
+    """The rollup recomputes counters from the source tables"""
+
+    def test_matches_on_write_counters(self, db):
+        db.add_all([fiscalized(1, 11, reseller_id=10), fiscalized(2, 12, status="failed"),
+                    Invoice(company_id=2, qb_invoice_id="9")])
+        db.commit()
+        maintained = counters(db)
+        # activity without reseller_id is attributed through the client's parent
+        maintained[(2, TODAY)] = (10,) + maintained[(2, TODAY)][1:]
+
+        db.query(DailyCompanyStats).delete()
+        assert rebuild_daily_stats(db) == 2
+        db.commit()
+        assert counters(db) == maintained
+
+    def test_since_keeps_older_days(self, db):
+        old = datetime.combine(TODAY - timedelta(days=10), datetime.min.time())
+        db.add_all([fiscalized(1, 11, 10, created_at=old), fiscalized(1, 11, 10)])
+        db.commit()
+        db.query(DailyCompanyStats).filter(DailyCompanyStats.day == TODAY).delete()
+        rebuild_daily_stats(db, since=TODAY - timedelta(days=1))
+        db.commit()
+        assert set(counters(db)) == {(1, TODAY - timedelta(days=10)), (1, TODAY)}
+
+
+class TestDashboardReads:
+    """Dashboards read counters with one query, however much history there is"""
+
+    def test_reseller_totals(self, engine, db):
+        month_start = TODAY.replace(day=1)
+        days = [TODAY, TODAY, month_start, month_start - timedelta(days=1), date(2024, 1, 15)]
+        for i, day in enumerate(days):
+            db.add(fiscalized(1 + i % 2, 11 + i % 2, reseller_id=10,
+                              created_at=datetime.combine(day, datetime.min.time()) + timedelta(hours=9)))
+        db.add(fiscalized(3, 13))
+        db.commit()
+
+        statements = count_statements(engine)
+        totals = reseller_fiscalized_totals(db, 10)
+        assert len(statements) == 1
+        expected_month = sum(1 for d in days if d >= month_start)
+        assert totals == {"today": days.count(TODAY), "this_month": expected_month, "total": 5}
+
+    def test_platform_day_totals(self, engine, db):
+        db.add_all([Invoice(company_id=c, qb_invoice_id=str(c)) for c in (1, 2, 3)])
+        db.add(fiscalized(2, 12, status="failed"))
+        db.commit()
+        statements = count_statements(engine)
+        assert platform_day_totals(db) == {
+            "invoices_created": 3, "invoices_fiscalized": 1, "invoices_failed": 1, "amount_fiscalized": 1000
+        }
+        assert len(statements) == 1
+        assert platform_day_totals(db, TODAY - timedelta(days=1))["invoices_created"] == 0
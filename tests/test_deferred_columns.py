@@ -0,0 +1,167 @@
+"""
+Tests for deferred JSON payload columns (database/models.py, group "payloads")
+
+Includes a memory/latency comparison of listing a 50k-invoice tenant with the
+payloads deferred vs loaded (set DEFERRED_BENCH_ROWS to change the size).
+
+Run tests:
+    pytest tests/test_deferred_columns.py -v -s
+"""
+
+import pytest
+import sys
+import os
+import gc
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker, undefer, undefer_group
+from sqlalchemy.pool import StaticPool
+
+from database.models import Base, Company, EFRISGood, EFRISInvoice, Invoice, PurchaseOrder
+
+BENCH_ROWS = int(os.getenv("DEFERRED_BENCH_ROWS", "50000"))
+
+# Roughly the shape (and size) of a stored T109 request/response
+PAYLOAD = {
+    "sellerDetails": {"tin": "1000000001", "legalName": "Acme Ltd", "address": "Plot 1 Kampala Road"},
+    "goodsDetails": [{"item": f"Cement 50kg #{i}", "itemCode": f"CEM-{i:03d}", "qty": "10",
+                      "unitOfMeasure": "102", "unitPrice": "35000", "total": "350000",
+                      "taxRate": "0.18", "tax": "53389.83"} for i in range(6)],
+    "summary": {"netAmount": "296610.17", "taxAmount": "53389.83", "grossAmount": "350000"},
+}
+RESPONSE = {
+    "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
+    "data": {"decrypted_content": {**PAYLOAD, "summary": {**PAYLOAD["summary"], "qrCode": "0" * 600}}},
+}
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+    session.add(EFRISInvoice(company_id=1, invoice_no="INV-1", status="success",
+                             efris_payload=PAYLOAD, efris_response=RESPONSE, efris_data={"a": 1}))
+    session.add(EFRISGood(company_id=1, goods_code="CEM-001", efris_data={"id": "99"}))
+    session.add(Invoice(company_id=1, qb_invoice_id="55", qb_data={"TxnDate": "2026-01-01"}))
+    session.add(PurchaseOrder(company_id=1, qb_po_id="7", qb_data={"VendorRef": {"value": "3"}}))
+    session.commit()
+    session.expunge_all()
+    yield session
+    session.close()
+
+
+def count_statements(engine):
+    """Attach a counter of executed SQL statements to an engine"""
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+class TestDeferredColumns:
+    """Payload columns stay out of plain queries until asked for"""
+
+    @pytest.mark.parametrize("model,columns", [
+        (EFRISInvoice, ["efris_payload", "efris_response", "efris_data"]),
+        (EFRISGood, ["efris_data"]),
+        (Invoice, ["qb_data", "efris_response"]),
+        (PurchaseOrder, ["qb_data", "efris_response"]),
+    ])
+    def test_list_query_skips_payloads(self, engine, db, model, columns):
+        statements = count_statements(engine)
+        db.query(model).all()
+        select_list = statements[0].split(" FROM ")[0]
+        for column in columns:
+            assert f".{column}" not in select_list
+
+    def test_lazy_load_on_access(self, engine, db):
+        invoice = db.query(EFRISInvoice).one()
+        statements = count_statements(engine)
+        assert invoice.efris_response["returnStateInfo"]["returnCode"] == "00"
+        # The whole group comes back in one go
+        assert invoice.efris_payload["summary"]["grossAmount"] == "350000"
+        assert len(statements) == 1
+
+    def test_undefer_loads_with_rows(self, engine, db):
+        statements = count_statements(engine)
+        invoice = db.query(EFRISInvoice).options(undefer(EFRISInvoice.efris_response)).one()
+        assert invoice.efris_response["returnStateInfo"]["returnCode"] == "00"
+        assert len(statements) == 1
+
+    def test_writes_do_not_need_a_load(self, engine, db):
+        good = db.query(EFRISGood).one()
+        statements = count_statements(engine)
+        good.efris_data = {"id": "100"}
+        db.commit()
+        assert not any(s.startswith("SELECT") for s in statements)
+        db.expunge_all()
+        assert db.query(EFRISGood).one().efris_data == {"id": "100"}
+
+
+MEMORY_SAMPLE_ROWS = min(BENCH_ROWS, 10000)  # tracemalloc slows loading ~5x, so sample
+
+
+def list_invoices(session_factory, options, limit=None):
+    """List a tenant's invoices the way the list endpoints do"""
+    db = session_factory()
+    query = db.query(EFRISInvoice).options(*options).filter(EFRISInvoice.company_id == 1)
+    rows = query.limit(limit).all() if limit else query.all()
+    listed = [{"id": inv.id, "invoiceNo": inv.invoice_no, "status": inv.status} for inv in rows]
+    db.close()
+    return listed
+
+
+def measure(session_factory, options) -> dict:
+    gc.collect()
+    started = time.perf_counter()
+    assert len(list_invoices(session_factory, options)) == BENCH_ROWS
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    list_invoices(session_factory, options, limit=MEMORY_SAMPLE_ROWS)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(elapsed, 2),
+        f"peak_mb_per_{MEMORY_SAMPLE_ROWS}_rows": round(peak / 1024 / 1024, 1),
+    }
+
+
+class TestFiftyThousandRowTenant:
+    """Listing a large tenant with payloads deferred vs loaded"""
+
+    def test_deferred_list_is_faster_and_smaller(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'tenant.db'}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(Company.__table__), [{"id": 1, "name": "Acme Ltd", "tin": "1000000001"}])
+            conn.execute(insert(EFRISInvoice.__table__), [
+                {"company_id": 1, "invoice_no": f"INV-{i:06d}", "status": "success",
+                 "efris_payload": PAYLOAD, "efris_response": RESPONSE, "efris_data": PAYLOAD["summary"]}
+                for i in range(BENCH_ROWS)
+            ])
+        factory = sessionmaker(bind=engine)
+
+        loaded = measure(factory, [undefer_group("payloads")])
+        deferred = measure(factory, [])
+        engine.dispose()
+
+        print(f"\n[DEFERRED PAYLOADS] listing {BENCH_ROWS} invoices")
+        print(f"  payloads loaded  : {loaded}")
+        print(f"  payloads deferred: {deferred}")
+
+        memory_key = f"peak_mb_per_{MEMORY_SAMPLE_ROWS}_rows"
+        assert deferred["seconds"] < loaded["seconds"]
+        assert deferred[memory_key] < loaded[memory_key] / 2
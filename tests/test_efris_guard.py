@@ -0,0 +1,194 @@
+"""
+Tests for EFRIS circuit breakers and adaptive concurrency limits (efris_guard.py)
+
+Run tests:
+    pytest tests/test_efris_guard.py -v
+"""
+
+import pytest
+import sys
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from efris_guard import (
+    AdaptiveLimit, CircuitBreaker, EfrisGuard, EfrisUnavailable, GuardedAdapter, CLOSED, OPEN, HALF_OPEN
+)
+
+
+class TestCircuitBreaker:
+    """Opens after consecutive failures, one probe when half open"""
+
+    def test_opens_and_rejects(self):
+        breaker = CircuitBreaker("test:1", failure_threshold=3, reset_seconds=60)
+        for _ in range(3):
+            breaker.before_call()
+            breaker.record(False)
+        assert breaker.state == OPEN
+        with pytest.raises(EfrisUnavailable) as exc:
+            breaker.before_call()
+        assert exc.value.retry_after > 50
+        assert breaker.stats()["rejected"] == 1
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker("test:1", failure_threshold=3)
+        for ok in (False, False, True, False, False):
+            breaker.record(ok)
+        assert breaker.state == CLOSED
+
+    def test_half_open_single_probe(self):
+        breaker = CircuitBreaker("test:1", failure_threshold=1, reset_seconds=0.01)
+        breaker.record(False, breaker.before_call())
+        time.sleep(0.02)
+        probe = breaker.before_call()
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(EfrisUnavailable):
+            breaker.before_call()  # everyone else waits for the probe
+        breaker.record(False, probe)
+        assert breaker.state == OPEN
+
+        time.sleep(0.02)
+        probe = breaker.before_call()
+        breaker.record(True, probe)
+        assert breaker.state == CLOSED
+        breaker.before_call()
+
+    def test_stale_results_do_not_move_half_open_breaker(self):
+        breaker = CircuitBreaker("test:1", failure_threshold=1, reset_seconds=0.01)
+        slow_call = breaker.before_call()  # started while closed, still waiting on EFRIS
+        breaker.record(False, breaker.before_call())
+        time.sleep(0.02)
+        probe = breaker.before_call()
+
+        breaker.record(True, slow_call)  # late success from before the breaker opened
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(EfrisUnavailable):
+            breaker.before_call()  # ... and it didn't free the probe slot either
+        breaker.record(True, probe)
+        assert breaker.state == CLOSED
+
+    def test_call(self):
+        breaker = CircuitBreaker("test:1", failure_threshold=1)
+        with pytest.raises(ValueError):
+            breaker.call(int, "not a number")
+        with pytest.raises(EfrisUnavailable):
+            breaker.call(int, "1")
+
+
+class TestAdaptiveLimit:
+    """Additive increase, multiplicative decrease"""
+
+    def test_rejects_over_limit(self):
+        limit = AdaptiveLimit("test", initial=2)
+        assert limit.acquire() and limit.acquire()
+        assert not limit.acquire()
+        limit.release()
+        assert limit.acquire()
+        assert limit.stats()["rejected"] == 1
+
+    def test_backs_off_on_failure_and_slow_responses(self):
+        limit = AdaptiveLimit("test", initial=20, min_limit=2, backoff=0.5, slow_ms=1000)
+        limit.acquire()
+        limit.release(30.0, ok=False)  # 30s timeout
+        assert limit.stats()["limit"] == 10
+        limit.acquire()
+        limit.release(2.0, ok=True)  # succeeded, but slowly
+        assert limit.stats()["limit"] == 5
+        for _ in range(5):
+            limit.acquire()
+            limit.release(30.0, ok=False)
+        assert limit.stats()["limit"] == 2
+
+    def test_grows_only_when_in_use(self):
+        limit = AdaptiveLimit("test", initial=4, max_limit=6)
+        limit.acquire()
+        limit.release(0.1, ok=True)  # 1 of 4 in flight - not limited
+        assert limit.stats()["limit"] == 4
+        for _ in range(5):
+            held = [limit.acquire() for _ in range(int(limit.limit))]
+            assert all(held)
+            for _ in held:
+                limit.release(0.1, ok=True)
+        assert limit.stats()["limit"] == 6
+
+
+class FlakyEfris(BaseHTTPRequestHandler):
+    """Answers 502 (URA's gateway) or 200; counts requests that reached it"""
+
+    status = 502
+    hits = 0
+
+    def do_POST(self):
+        type(self).hits += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(self.status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGuardedSession:
+    """Breakers are scoped per environment and TIN on real HTTP calls"""
+
+    @pytest.fixture
+    def server(self):
+        FlakyEfris.status, FlakyEfris.hits = 502, 0
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyEfris)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_address[1]}/efrisws/ws/taapp/getInformation"
+        server.shutdown()
+        server.server_close()
+
+    def session(self, guard, environment, tin):
+        session = requests.Session()
+        adapter = GuardedAdapter(environment, tin, guard=guard)
+        session.mount("http://", adapter)
+        return session
+
+    def test_test_environment_outage_does_not_trip_production(self, server):
+        guard = EfrisGuard()  # EFRIS_BREAKER_FAILURES=5
+        test_env = self.session(guard, "test", "1000000001")
+        for _ in range(5):
+            assert test_env.post(server, json={}).status_code == 502
+
+        started = time.perf_counter()
+        with pytest.raises(EfrisUnavailable):
+            test_env.post(server, json={})
+        assert time.perf_counter() - started < 0.05  # shed without touching the network
+        assert FlakyEfris.hits == 5
+
+        FlakyEfris.status = 200
+        production = self.session(guard, "production", "1000000001")
+        other_tin = self.session(guard, "test", "1000000002")
+        assert production.post(server, json={}).status_code == 200
+        assert other_tin.post(server, json={}).status_code == 200
+
+        stats = guard.stats()
+        assert stats["breakers"]["by_state"] == {CLOSED: 2, OPEN: 1, HALF_OPEN: 0}
+        assert list(stats["breakers"]["not_closed"]) == ["test:1000000001"]
+        assert stats["limits"]["test"]["decreases"] == 5
+        assert stats["limits"]["production"]["decreases"] == 0
+
+    def test_reset(self):
+        guard = EfrisGuard()
+        breaker = guard.breaker("test", "1000000001")
+        for _ in range(breaker.failure_threshold):
+            breaker.record(False, breaker.before_call())
+        guard.reset()
+        guard.breaker("test", "1000000001").before_call()
+        assert guard.stats()["breakers"]["by_state"] == {CLOSED: 1, OPEN: 0, HALF_OPEN: 0}
+
+    def test_efris_manager_requests_are_guarded(self):
+        from efris_client import EfrisManager
+        manager = EfrisManager(tin="1000000001", test_mode=True)
+        adapter = manager.session.get_adapter(manager.base_url)
+        assert isinstance(adapter, GuardedAdapter)
+        assert (adapter.environment, adapter.tin) == ("test", "1000000001")
@@ -0,0 +1,186 @@
+"""
+Unit tests for local T109 pre-flight validation (invoice_preflight.py)
+
+Run tests:
+    pytest tests/test_invoice_preflight.py -v
+"""
+
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from invoice_preflight import (
+    CatalogueIndex, PreflightStats, validate_goods_details, get_catalogue_index,
+    invalidate_catalogue, remember_t115_dictionary, get_valid_units
+)
+from database.models import Base, BackgroundJob, Company, EFRISGood
+
+
+def make_item(**overrides):
+    """Build a T109 goodsDetails line with sensible defaults"""
+    item = {
+        "item": "Cement",
+        "itemCode": "CEM-001",
+        "qty": "2",
+        "unitOfMeasure": "103",
+        "unitPrice": "59000.00",
+        "total": "118000.00",
+        "taxRate": "0.18",
+        "tax": "18000.00",
+        "discountFlag": "2",
+        "goodsCategoryId": "30111601",
+    }
+    item.update(overrides)
+    return item
+
+
+@pytest.fixture
+def catalogue():
+    """Complete catalogue with one active and one disabled item"""
+    return CatalogueIndex.from_rows([
+        ("CEM-001", "30111601", {"measureUnit": "103", "pieceMeasureUnit": "101", "statusCode": "101"}),
+        ("OLD-001", "30111601", {"measureUnit": "101", "statusCode": "102"}),
+    ], complete=True)
+
+
+class TestValidateGoodsDetails:
+    """Test the pure validation rules"""
+
+    def test_valid_invoice_has_no_errors(self, catalogue):
+        """A registered item with matching unit and category passes"""
+        assert validate_goods_details([make_item()], catalogue) == []
+
+    def test_piece_unit_is_accepted(self, catalogue):
+        """pieceMeasureUnit from the T130 registration is also valid"""
+        assert validate_goods_details([make_item(unitOfMeasure="101")], catalogue) == []
+
+    def test_unregistered_item_code(self, catalogue):
+        """Unknown itemCode is rejected with a structured error"""
+        errors = validate_goods_details([make_item(itemCode="NOPE")], catalogue)
+        assert [e["code"] for e in errors] == ["ITEM_NOT_REGISTERED"]
+        assert errors[0]["line"] == 1
+        assert errors[0]["itemCode"] == "NOPE"
+
+    def test_partial_catalogue_forwards_unknown_item_code(self, catalogue):
+        """Before a full import, an unknown itemCode may be on a page we never fetched"""
+        partial = CatalogueIndex(catalogue.entries)
+        assert validate_goods_details([make_item(itemCode="NOPE")], partial) == []
+        errors = validate_goods_details([make_item(unitOfMeasure="102")], partial)
+        assert [e["code"] for e in errors] == ["UNIT_MISMATCH"]
+
+    def test_disabled_item(self, catalogue):
+        """Items disabled in EFRIS are rejected"""
+        errors = validate_goods_details([make_item(itemCode="OLD-001", unitOfMeasure="101")], catalogue)
+        assert [e["code"] for e in errors] == ["ITEM_DISABLED"]
+
+    def test_unit_mismatch(self, catalogue):
+        """unitOfMeasure must match the T130 registration"""
+        errors = validate_goods_details([make_item(unitOfMeasure="102")], catalogue)
+        assert [e["code"] for e in errors] == ["UNIT_MISMATCH"]
+        assert errors[0]["field"] == "unitOfMeasure"
+
+    def test_category_mismatch(self, catalogue):
+        """goodsCategoryId must match the registered commodity code"""
+        errors = validate_goods_details([make_item(goodsCategoryId="44102906")], catalogue)
+        assert [e["code"] for e in errors] == ["CATEGORY_MISMATCH"]
+
+    def test_empty_category_is_allowed(self, catalogue):
+        """Empty goodsCategoryId lets EFRIS use the T130 value"""
+        assert validate_goods_details([make_item(goodsCategoryId="")], catalogue) == []
+
+    def test_placeholder_category(self):
+        """Placeholder commodity codes are rejected even without a catalogue"""
+        errors = validate_goods_details([make_item(goodsCategoryId="100000000")])
+        assert [e["code"] for e in errors] == ["CATEGORY_INVALID"]
+
+    def test_empty_catalogue_skips_registration_checks(self):
+        """Without a goods snapshot, registration can't be judged locally"""
+        assert validate_goods_details([make_item(itemCode="ANY")], CatalogueIndex({})) == []
+
+    def test_unit_not_in_t115_dictionary(self):
+        """Unit codes are checked against the cached T115 rateUnit list"""
+        errors = validate_goods_details([make_item(unitOfMeasure="999")], None, frozenset({"101", "103"}))
+        assert [e["code"] for e in errors] == ["UNIT_UNKNOWN"]
+
+    def test_discount_line_with_qty_is_error_1181(self, catalogue):
+        """Discount lines must have empty qty/unit/unitPrice (EFRIS 1181)"""
+        goods = [
+            make_item(discountFlag="1"),
+            make_item(discountFlag="0", qty="2", unitOfMeasure="", unitPrice="", total="-1000.00"),
+        ]
+        errors = validate_goods_details(goods, catalogue)
+        assert [(e["code"], e["field"], e["line"]) for e in errors] == [("1181", "qty", 2)]
+
+    def test_valid_discount_pair(self, catalogue):
+        """Discounted item followed by its discount line passes"""
+        goods = [
+            make_item(discountFlag="1"),
+            make_item(discountFlag="0", qty="", unitOfMeasure="", unitPrice="", total="-1000.00"),
+        ]
+        assert validate_goods_details(goods, catalogue) == []
+
+    def test_orphan_discount_line(self, catalogue):
+        """A discount line must follow a discounted item"""
+        goods = [make_item(discountFlag="0", qty="", unitOfMeasure="", unitPrice="")]
+        errors = validate_goods_details(goods, catalogue)
+        assert [e["code"] for e in errors] == ["DISCOUNT_WITHOUT_ITEM"]
+
+    def test_missing_discount_line(self, catalogue):
+        """discountFlag=1 without a following discount line is rejected"""
+        errors = validate_goods_details([make_item(discountFlag="1")], catalogue)
+        assert [e["code"] for e in errors] == ["DISCOUNT_LINE_MISSING"]
+
+
+class TestPreflightCaches:
+    """Test catalogue and T115 caching"""
+
+    @pytest.fixture
+    def db(self):
+        """In-memory SQLite session with the EFRIS tables"""
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        yield session
+        session.close()
+
+    def test_catalogue_is_built_from_efris_goods(self, db):
+        """Index is built from the EFRISGood snapshot and cached"""
+        db.add(Company(id=1, name="Test Co", tin="1000000000"))
+        db.add(EFRISGood(company_id=1, goods_code="CEM-001", commodity_category_code="30111601",
+                         efris_data={"measureUnit": "103"}))
+        db.commit()
+        invalidate_catalogue(1)
+
+        index = get_catalogue_index(db, 1)
+        assert index.get("CEM-001").measure_unit == "103"
+        assert not index.complete  # only the inline first-page import so far
+        assert get_catalogue_index(db, 1) is index
+
+        db.add(BackgroundJob(company_id=1, job_type="efris_goods_import", status="succeeded"))
+        db.commit()
+        invalidate_catalogue(1)
+        rebuilt = get_catalogue_index(db, 1)
+        assert rebuilt is not index
+        assert rebuilt.complete
+        invalidate_catalogue(1)
+
+    def test_t115_dictionary_cache(self):
+        """rateUnit codes are remembered per environment"""
+        remember_t115_dictionary(True, {"rateUnit": [{"value": "101", "name": "Stick"}]})
+        assert get_valid_units(True) == frozenset({"101"})
+
+    def test_stats_count_round_trips_avoided(self):
+        """Blocked invoices count as avoided round-trips; warn mode doesn't"""
+        stats = PreflightStats()
+        stats.record([{"code": "UNIT_MISMATCH"}])
+        stats.record([])
+        stats.record([{"code": "UNIT_MISMATCH"}], blocked=False)
+        snapshot = stats.snapshot()
+        assert snapshot["checked"] == 3
+        assert snapshot["passed"] == 1
+        assert snapshot["round_trips_avoided"] == 1
+        assert snapshot["errors_by_code"] == {"UNIT_MISMATCH": 2}
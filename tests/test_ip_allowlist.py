@@ -0,0 +1,73 @@
+"""
+Unit tests for compiled IP whitelists (ip_allowlist.py)
+
+Run tests:
+    pytest tests/test_ip_allowlist.py -v
+"""
+
+import pytest
+import sys
+import os
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ip_allowlist import CompiledAllowlist, compile_allowlist, invalid_entries
+from security_utils import is_ip_allowed
+from api_key_cache import ApiKeyAuth
+from database.models import Company
+
+
+class TestCompiledAllowlist:
+    """Test matching rules"""
+
+    def test_empty_allows_everyone(self):
+        assert CompiledAllowlist([]).is_allowed("8.8.8.8")
+        assert compile_allowlist(None).is_allowed("8.8.8.8")
+
+    @pytest.mark.parametrize("entry,allowed,blocked", [
+        ("41.210.5.7", "41.210.5.7", "41.210.5.8"),
+        ("192.168.1.*", "192.168.1.200", "192.168.2.1"),
+        ("10.*.*.*", "10.45.3.2", "11.0.0.1"),
+        ("10.*.0.1", "10.77.0.1", "10.77.0.2"),
+        ("196.43.128.0/20", "196.43.143.255", "196.43.144.0"),
+        ("10.0.0.5/24", "10.0.0.99", "10.0.1.1"),
+        ("2001:db8::/32", "2001:db8:1::42", "2001:db9::1"),
+        ("2c0f:fe38:2101::1", "2c0f:fe38:2101:0::1", "2c0f:fe38:2101::2"),
+        ("0.0.0.0/0", "203.0.113.9", "2001:db8::1"),
+    ])
+    def test_entry_types(self, entry, allowed, blocked):
+        allowlist = CompiledAllowlist([entry])
+        assert allowlist.is_allowed(allowed)
+        assert not allowlist.is_allowed(blocked)
+
+    def test_ipv4_mapped_ipv6_client(self):
+        assert CompiledAllowlist(["192.168.1.0/24"]).is_allowed("::ffff:192.168.1.20")
+
+    def test_unparseable_client_is_blocked(self):
+        assert not CompiledAllowlist(["10.0.0.0/8"]).is_allowed("unknown")
+
+    def test_invalid_entries_are_reported_and_ignored(self):
+        assert invalid_entries(["10.0.0.0/8", "10.0.0.300", "abc", "1.2.*"]) == ["10.0.0.300", "abc", "1.2.*"]
+        allowlist = CompiledAllowlist(["bogus", "10.0.0.1"])
+        assert allowlist.is_allowed("10.0.0.1")
+        assert not allowlist.is_allowed("10.0.0.2")
+
+    def test_legacy_helper_keeps_working(self):
+        assert is_ip_allowed("192.168.1.5", ["192.168.1.*"])
+        assert not is_ip_allowed("192.168.2.5", ["192.168.1.*"])
+        assert is_ip_allowed("1.1.1.1", [])
+
+
+class TestAllowlistCaching:
+    """Test compile-once behaviour"""
+
+    def test_same_value_compiles_once(self):
+        value = json.dumps(["10.0.0.0/8"])
+        assert compile_allowlist(value) is compile_allowlist(value)
+
+    def test_snapshot_carries_compiled_allowlist(self):
+        company = Company(id=1, name="Acme Ltd", tin="1000000001", api_enabled=True, is_active=True,
+                          api_rate_limit=1000, allowed_ips=json.dumps(["41.210.0.0/16"]))
+        auth = ApiKeyAuth.from_company(company)
+        assert auth.ip_allowlist.is_allowed("41.210.3.3")
+        assert not auth.ip_allowlist.is_allowed("41.211.3.3")
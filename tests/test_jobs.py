@@ -0,0 +1,297 @@
+"""
+Tests for the durable background job queue (jobs.py)
+
+Covers claiming, checkpoint / resume after a worker dies, retries with backoff,
+cancellation and the background=true import endpoints (a 10k-item QuickBooks
+sync polled through /jobs/{job_id}).
+
+Run tests:
+    pytest tests/test_jobs.py -v
+"""
+
+import pytest
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import jobs
+from jobs import JobContext, JobWorker, claim_next, enqueue, job_handler, job_summary, cancel
+from database.models import Base, BackgroundJob, Company, Product, User
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        db.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+        db.add(Company(id=2, name="Other Ltd", tin="1000000002"))
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+# Test handlers: count to params["total"] in pages of 10, optionally crashing on a page
+calls = []
+
+
+@job_handler("test_count")
+def count_job(ctx: JobContext) -> dict:
+    done = ctx.checkpoint.get("done", 0)
+    while done < ctx.params["total"]:
+        calls.append(done)
+        if done == ctx.params.get("crash_at"):
+            raise ConnectionError("QuickBooks timed out")
+        done += 10
+        ctx.progress(done, ctx.params["total"], checkpoint={"done": done})
+    return {"count": done}
+
+
+@job_handler("test_always_fails")
+def failing_job(ctx: JobContext) -> dict:
+    raise ConnectionError("EFRIS unreachable")
+
+
+class TestQueue:
+    """Enqueue, claim, resume, retry and cancel"""
+
+    def setup_method(self):
+        calls.clear()
+
+    def test_enqueue_dedupes_active_job(self, factory):
+        with factory() as db:
+            first = enqueue(db, 1, "test_count", {"total": 30})
+            assert enqueue(db, 1, "test_count", {"total": 30}).id == first.id
+            assert enqueue(db, 1, "test_count", {"total": 40}).id != first.id
+            assert enqueue(db, 2, "test_count", {"total": 30}).id != first.id
+            with pytest.raises(ValueError):
+                enqueue(db, 1, "no_such_job")
+
+    def test_worker_runs_job_to_completion(self, factory):
+        with factory() as db:
+            job_id = enqueue(db, 1, "test_count", {"total": 30}).id
+        worker = JobWorker(session_factory=factory, worker_id="w1")
+        assert worker.run_once()
+        assert not worker.run_once()  # nothing else due
+
+        with factory() as db:
+            summary = job_summary(db.get(BackgroundJob, job_id))
+        assert summary["status"] == "succeeded"
+        assert summary["progress"] == {"done": 30, "total": 30, "percent": 100.0}
+        assert summary["result"] == {"count": 30}
+        assert summary["attempts"] == 1
+
+    def test_claim_is_exclusive(self, factory):
+        with factory() as db:
+            enqueue(db, 1, "test_count", {"total": 10})
+            assert claim_next(db, "w1") is not None
+            assert claim_next(db, "w2") is None
+
+    def test_stale_job_resumes_from_checkpoint(self, factory):
+        with factory() as db:
+            job_id = enqueue(db, 1, "test_count", {"total": 50}).id
+            claimed = claim_next(db, "dead-worker")
+            # dead-worker committed two pages, then its process was killed
+            JobContext(db, 1, claimed.params, job=claimed, worker_id="dead-worker").progress(
+                20, 50, checkpoint={"done": 20})
+            db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update(
+                {"heartbeat_at": datetime.utcnow() - timedelta(seconds=jobs.JOB_STALE_SECONDS + 1)})
+            db.commit()
+
+        assert JobWorker(session_factory=factory, worker_id="w2").run_once()
+        assert calls == [20, 30, 40]  # pages before the checkpoint were not fetched again
+        with factory() as db:
+            job = db.get(BackgroundJob, job_id)
+            assert (job.status, job.progress_done, job.attempts) == ("succeeded", 50, 2)
+
+    def test_failure_is_retried_with_backoff_then_resumes(self, factory):
+        with factory() as db:
+            job_id = enqueue(db, 1, "test_count", {"total": 40, "crash_at": 20}).id
+        worker = JobWorker(session_factory=factory, worker_id="w1")
+        assert worker.run_once()
+
+        with factory() as db:
+            job = db.get(BackgroundJob, job_id)
+            assert job.status == "queued"
+            assert job.error == "QuickBooks timed out"
+            assert job.checkpoint == {"done": 20}
+            assert job.run_after > datetime.utcnow() + timedelta(seconds=jobs.JOB_RETRY_BASE_SECONDS * 0.7)
+            assert not worker.run_once()  # not due yet
+            job.run_after = datetime.utcnow()
+            job.params = {"total": 40}  # the transient error has cleared
+            db.commit()
+
+        assert worker.run_once()
+        with factory() as db:
+            job = db.get(BackgroundJob, job_id)
+            assert (job.status, job.progress_done, job.attempts) == ("succeeded", 40, 2)
+
+    def test_gives_up_after_max_attempts(self, factory):
+        with factory() as db:
+            job_id = enqueue(db, 1, "test_always_fails", max_attempts=2).id
+        worker = JobWorker(session_factory=factory, worker_id="w1")
+        for _ in range(2):
+            assert worker.run_once()
+            with factory() as db:
+                db.query(BackgroundJob).update({"run_after": datetime.utcnow()})
+                db.commit()
+
+        with factory() as db:
+            job = db.get(BackgroundJob, job_id)
+            assert (job.status, job.attempts, job.error) == ("failed", 2, "EFRIS unreachable")
+        assert worker.outcomes == {"queued": 1, "failed": 1}
+
+    def test_cancel_stops_running_handler(self, factory):
+        with factory() as db:
+            job = enqueue(db, 1, "test_count", {"total": 50})
+            claimed = claim_next(db, "w1")
+            ctx = JobContext(db, 1, claimed.params, job=claimed, worker_id="w1")
+            ctx.progress(10, 50, checkpoint={"done": 10})
+            with factory() as other:
+                assert cancel(other, other.get(BackgroundJob, job.id))
+                assert not cancel(other, other.get(BackgroundJob, job.id))
+            with pytest.raises(jobs.JobCancelled):
+                ctx.progress(20, 50, checkpoint={"done": 20})
+            db.expire_all()
+            assert db.get(BackgroundJob, job.id).status == "cancelled"
+
+
+class FakeQuickBooks:
+    """get_items paging over ITEMS QuickBooks items"""
+
+    def __init__(self, items):
+        self.items = items
+        self.pages = 0
+
+    def get_items(self, max_results=100, start_position=1):
+        self.pages += 1
+        return self.items[start_position - 1:start_position - 1 + max_results]
+
+
+class TestImportEndpoints:
+    """background=true enqueues, the worker imports, /jobs reports progress"""
+
+    ITEMS = 10_000
+
+    @pytest.fixture
+    def api(self, factory, monkeypatch):
+        api = pytest.importorskip("api_multitenant")
+        httpx = pytest.importorskip("httpx")
+        owner = User(id=1, email="owner@x.ug", hashed_password="x", role="owner")
+        with factory() as db:
+            db.merge(owner)
+            db.commit()
+
+        def get_db():
+            db = factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        qb = FakeQuickBooks([{"Id": str(i), "Name": f"Item {i}", "UnitPrice": i, "Type": "Inventory"}
+                             for i in range(1, self.ITEMS + 1)])
+        api.app.dependency_overrides[api.get_db] = get_db
+        api.app.dependency_overrides[api.get_current_active_user] = lambda: owner
+        monkeypatch.setattr(api, "qb_client", qb)
+        monkeypatch.setattr(api, "QB_IMPORT_PAGE_SIZE", 1000)
+        api.limiter.reset()
+        yield api, httpx, qb
+        api.app.dependency_overrides.clear()
+
+    async def request(self, api, httpx, method, url, **kwargs):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+
+    def test_background_qb_items_import(self, api, factory):
+        api, httpx, qb = api
+        with factory() as db:
+            db.add(Product(company_id=1, qb_item_id="1", qb_name="Old name", efris_status="Registered"))
+            db.commit()
+
+        response = asyncio.run(self.request(api, httpx, "POST", "/api/companies/1/qb-items/import?background=true"))
+        assert response.status_code == 202
+        job = response.json()
+        assert (job["type"], job["status"]) == ("qb_items_import", "queued")
+        assert qb.pages == 0  # nothing fetched inside the request
+
+        # Same request while the job is still queued returns the same job
+        again = asyncio.run(self.request(api, httpx, "POST", "/api/companies/1/qb-items/import?background=true"))
+        assert again.json()["id"] == job["id"]
+
+        assert JobWorker(session_factory=factory, worker_id="w1").run_once()
+        status = asyncio.run(self.request(api, httpx, "GET", f"/api/companies/1/jobs/{job['id']}")).json()
+        assert status["status"] == "succeeded"
+        assert status["progress"]["done"] == self.ITEMS
+        assert status["result"]["message"] == f"Imported {self.ITEMS} items ({self.ITEMS - 1} new, 1 updated)"
+        assert qb.pages == 11  # ten full pages and the empty one that ends the list
+
+        with factory() as db:
+            assert db.query(Product).filter(Product.company_id == 1).count() == self.ITEMS
+            existing = db.query(Product).filter(Product.qb_item_id == "1").one()
+            assert (existing.qb_name, existing.efris_status) == ("Item 1", "Registered")
+
+        listed = asyncio.run(self.request(api, httpx, "GET", "/api/companies/1/jobs?status=succeeded")).json()
+        assert [j["id"] for j in listed] == [job["id"]]
+
+    def test_inline_import_unchanged(self, api, factory):
+        api, httpx, qb = api
+        qb.items = qb.items[:5]
+        response = asyncio.run(self.request(api, httpx, "POST", "/api/companies/1/qb-items/import"))
+        assert response.status_code == 200
+        assert response.json() == {"success": True, "message": "Imported 5 items (5 new, 0 updated)", "count": 5}
+        with factory() as db:
+            assert db.query(BackgroundJob).count() == 0
+
+    def test_job_endpoints_are_tenant_scoped(self, api, factory):
+        api, httpx, _ = api
+        with factory() as db:
+            job_id = enqueue(db, 2, "qb_items_import").id
+
+        missing = asyncio.run(self.request(api, httpx, "GET", f"/api/companies/1/jobs/{job_id}"))
+        assert missing.status_code == 404
+        cancelled = asyncio.run(self.request(api, httpx, "POST", f"/api/companies/2/jobs/{job_id}/cancel"))
+        assert cancelled.json()["status"] == "cancelled"
+        conflict = asyncio.run(self.request(api, httpx, "POST", f"/api/companies/2/jobs/{job_id}/cancel"))
+        assert conflict.status_code == 409
+
+
+class TestStandaloneWorker:
+    """`python run_job_worker.py` runs queued jobs with the handlers the API registers"""
+
+    def test_run_job_worker_once(self, tmp_path):
+        import subprocess
+        db_path = tmp_path / "worker.db"
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            db.add(Company(id=1, name="Acme Ltd", tin="1000000001", efris_test_mode=True))
+            db.commit()
+            # the handler is registered by api_multitenant in the worker process, not here
+            job = BackgroundJob(company_id=1, job_type="qb_items_register", status="queued",
+                                params={"item_ids": ["404"], "default_category_id": "50202306"})
+            db.add(job)
+            db.commit()
+            job_id = job.id
+
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, "run_job_worker.py", "--once"], cwd=repo, capture_output=True, text=True, timeout=120,
+            env={**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", "JOBS_IN_PROCESS_WORKER": "false"}
+        )
+        assert result.returncode == 0, result.stderr
+        assert "Processed 1 job(s): {'succeeded': 1}" in result.stdout
+
+        with factory() as db:
+            job = db.get(BackgroundJob, job_id)
+            assert job.status == "succeeded", job.error
+            assert job.result["failed_items"] == [{"name": "404", "error": "Product not found"}]
+        engine.dispose()
@@ -0,0 +1,156 @@
+"""
+Tests for activity / audit log retention and rollups (database/log_retention.py)
+
+Run tests:
+    pytest tests/test_log_retention.py -v
+"""
+
+import pytest
+import sys
+import os
+import asyncio
+from datetime import date, datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database.log_retention as log_retention
+from database.daily_stats import rebuild_daily_stats
+from database.log_retention import (
+    compact, feed_since, next_month, partition_name, retention_cutoff, rollup_summary, run_retention
+)
+from database.models import ActivityLog, AuditLog, Base, Company, DailyCompanyStats, LogRollup, User
+
+TODAY = date(2026, 3, 15)
+
+
+def at(days_ago: int, hour: int = 9) -> datetime:
+    return datetime.combine(TODAY - timedelta(days=days_ago), datetime.min.time()) + timedelta(hours=hour)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Company(id=1, name="Acme Ltd", tin="1000000001"),
+                     Company(id=2, name="Beta Ltd", tin="1000000002")])
+    session.commit()
+    yield session
+    session.close()
+
+
+def activity(company_id, created_at, activity_type="invoice_fiscalized", status="success"):
+    return ActivityLog(company_id=company_id, activity_type=activity_type, efris_status=status,
+                       details={"total_amount": "100"}, created_at=created_at)
+
+
+def rollups(db):
+    return sorted(((r.log_table, r.day, r.company_id, r.kind, r.status, r.count) for r in db.query(LogRollup)),
+                  key=lambda r: (r[0], r[1], r[2] or 0, r[3], r[4] or ""))
+
+
+class TestCompact:
+    """Rows past retention become daily counts; recent rows are untouched"""
+
+    def test_activity_logs(self, db):
+        db.add_all([activity(1, at(100)), activity(1, at(100, 15)), activity(1, at(100), status="failed"),
+                    activity(2, at(95), "invoice_created", None), activity(1, at(10))])
+        db.commit()
+        result = compact(db, "activity_logs", TODAY - timedelta(days=90))
+        assert result == {"rows": 4, "partitions_dropped": 0}
+        assert rollups(db) == [
+            ("activity_logs", TODAY - timedelta(days=100), 1, "invoice_fiscalized", "failed", 1),
+            ("activity_logs", TODAY - timedelta(days=100), 1, "invoice_fiscalized", "success", 2),
+            ("activity_logs", TODAY - timedelta(days=95), 2, "invoice_created", None, 1),
+        ]
+        assert [a.created_at for a in db.query(ActivityLog)] == [at(10)]
+
+    def test_rerun_adds_nothing(self, db):
+        db.add_all([activity(1, at(100)), activity(1, at(1))])
+        db.commit()
+        cutoff = TODAY - timedelta(days=90)
+        compact(db, "activity_logs", cutoff)
+        assert compact(db, "activity_logs", cutoff)["rows"] == 0
+        assert len(rollups(db)) == 1
+
+    def test_audit_logs_without_company(self, db):
+        db.add_all([AuditLog(action="ip_blocked", ip_address="10.0.0.1", created_at=at(400)),
+                    AuditLog(action="ip_blocked", ip_address="10.0.0.2", created_at=at(400, 23)),
+                    AuditLog(company_id=1, action="login", created_at=at(400))])
+        db.commit()
+        compact(db, "audit_logs", TODAY - timedelta(days=365))
+        assert rollups(db) == [
+            ("audit_logs", TODAY - timedelta(days=400), None, "ip_blocked", None, 2),
+            ("audit_logs", TODAY - timedelta(days=400), 1, "login", None, 1),
+        ]
+        assert db.query(AuditLog).count() == 0
+        assert rollup_summary(db, "audit_logs") == [
+            {"kind": "ip_blocked", "status": None, "count": 2},
+            {"kind": "login", "status": None, "count": 1},
+        ]
+        assert rollup_summary(db, "audit_logs", company_id=1) == [{"kind": "login", "status": None, "count": 1}]
+
+    def test_run_retention_per_table(self, db, monkeypatch):
+        tables = dict(log_retention.LOG_TABLES)
+        tables["audit_logs"] = tables["audit_logs"]._replace(retention_days=0)  # keep forever
+        monkeypatch.setattr(log_retention, "LOG_TABLES", tables)
+        db.add_all([activity(1, at(200)), AuditLog(action="login", created_at=at(2000))])
+        db.commit()
+        results = run_retention(db, TODAY)
+        assert set(results) == {"activity_logs"}
+        assert db.query(ActivityLog).count() == 0
+        assert db.query(AuditLog).count() == 1
+        assert retention_cutoff("audit_logs") is None
+
+
+class TestDailyStatsAfterRetention:
+    """A full rebuild doesn't wipe counters whose activity rows were rolled up"""
+
+    def test_rebuild_keeps_compacted_days(self, db):
+        old, recent = datetime.utcnow() - timedelta(days=200), datetime.utcnow()
+        db.add_all([activity(1, old), activity(1, recent)])
+        db.commit()
+        assert db.query(DailyCompanyStats).count() == 2
+        run_retention(db)
+        rebuild_daily_stats(db)
+        db.commit()
+        assert db.query(DailyCompanyStats).count() == 2
+
+
+class TestPartitionNames:
+    """Monthly partition bounds and names"""
+
+    def test_month_rollover(self):
+        assert next_month(date(2026, 12, 31)) == date(2027, 1, 1)
+        assert next_month(date(2026, 1, 31)) == date(2026, 2, 1)
+        assert partition_name("audit_logs", date(2026, 2, 1)) == "audit_logs_2026_02"
+
+
+class TestFeeds:
+    """Feed endpoints read only the recent window"""
+
+    def test_owner_activity_feed(self, db):
+        api = pytest.importorskip("api_multitenant")
+        old = datetime.utcnow() - timedelta(days=log_retention.LOG_FEED_DAYS + 1)
+        db.add_all([activity(1, old), activity(1, datetime.utcnow())])
+        db.commit()
+        owner = User(id=1, email="owner@x.ug", hashed_password="x", role="owner")
+        feed = asyncio.run(api.get_activity_feed(current_user=owner, db=db))
+        assert len(feed) == 1
+        assert feed_since() > old
+
+    def test_log_rollups_endpoint(self, db):
+        api = pytest.importorskip("api_multitenant")
+        db.add(LogRollup(log_table="activity_logs", day=TODAY, company_id=1,
+                         kind="invoice_fiscalized", status="success", count=7))
+        db.commit()
+        owner = User(id=1, email="owner@x.ug", hashed_password="x", role="owner")
+        response = asyncio.run(api.get_log_rollups(table="activity_logs", company_id=None, since=None,
+                                                   current_user=owner, db=db))
+        assert response["totals"] == [{"kind": "invoice_fiscalized", "status": "success", "count": 7}]
+        with pytest.raises(api.HTTPException):
+            asyncio.run(api.get_log_rollups(table="users", company_id=None, since=None,
+                                            current_user=owner, db=db))
@@ -0,0 +1,204 @@
+"""
+Tests for the background audit / activity log writer (log_writer.py)
+
+Run tests:
+    pytest tests/test_log_writer.py -v
+"""
+
+import pytest
+import sys
+import os
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.requests import Request
+
+import security_utils
+from log_writer import LogWriter
+from database.models import ActivityLog, AuditLog, Base, Company, DailyCompanyStats
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(Company(id=1, name="Acme Ltd", tin="1000000001", allowed_ips='["10.0.0.1"]'))
+        db.commit()
+    return engine
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine)
+
+
+def count_inserts(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statement.startswith("INSERT") and statements.append(statement))
+    return statements
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestBatching:
+    """Rows are written as multi-row INSERTs, by size or by time"""
+
+    def test_flush_in_batches(self, engine, session_factory):
+        writer = LogWriter(session_factory=session_factory, batch_size=500, flush_ms=10000)
+        writer._stop.set()  # no background thread - flush by hand
+        inserts = count_inserts(engine)
+        for i in range(1200):
+            writer.audit(company_id=1, action="login", details=f"login {i}")
+        assert writer.flush() == 1200
+        assert len(inserts) == 3  # one executemany per batch of up to 500
+        with session_factory() as db:
+            assert db.query(AuditLog).count() == 1200
+        assert writer.stats()["avg_batch_size"] == 400.0
+
+    def test_background_thread_writes_after_interval(self, session_factory):
+        writer = LogWriter(session_factory=session_factory, flush_ms=50)
+        for action in ("login", "logout", "login"):
+            writer.audit(company_id=1, action=action)
+        with session_factory() as db:
+            assert wait_for(lambda: db.query(AuditLog).count() == 3)
+        assert writer.stats()["batches"] == 1
+        writer.stop()
+
+    def test_mixed_columns_and_tables(self, session_factory):
+        writer = LogWriter(session_factory=session_factory)
+        writer._stop.set()
+        writer.audit(company_id=1, action="ip_blocked", ip_address="10.9.9.9")
+        writer.audit(action="login", user_agent="curl")
+        writer.activity(company_id=1, activity_type="product_synced", details={"count": 3})
+        assert writer.flush() == 3
+        with session_factory() as db:
+            assert db.query(AuditLog).count() == 2
+            assert db.query(ActivityLog).one().details == {"count": 3}
+
+    def test_stop_writes_remaining(self, session_factory):
+        writer = LogWriter(session_factory=session_factory, flush_ms=60000)
+        writer.audit(company_id=1, action="login")
+        writer.stop()
+        with session_factory() as db:
+            assert db.query(AuditLog).count() == 1
+
+    def test_fiscalized_activity_counted(self, session_factory):
+        writer = LogWriter(session_factory=session_factory)
+        writer._stop.set()
+        writer.activity(company_id=1, activity_type="invoice_fiscalized", efris_status="success",
+                        details={"total_amount": "118"})
+        writer.flush()
+        with session_factory() as db:
+            assert db.query(DailyCompanyStats.invoices_fiscalized, DailyCompanyStats.amount_fiscalized).one() == (1, 118)
+
+
+class TestBackpressure:
+    """A full queue drops rows instead of blocking the request"""
+
+    def test_full_queue_drops(self, session_factory):
+        writer = LogWriter(session_factory=session_factory, max_queue=5)
+        writer._stop.set()
+        results = [writer.audit(action="login") for _ in range(8)]
+        assert results == [True] * 5 + [False] * 3
+        stats = writer.stats()
+        assert (stats["queue_depth"], stats["max_depth"], stats["dropped"]) == (5, 5, 3)
+
+    def test_submit_does_not_wait_for_slow_database(self, engine, session_factory):
+        """Writes stuck on the database don't slow submit() down"""
+        release = threading.Event()
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def stall(conn, cursor, statement, *args):
+            if statement.startswith("INSERT"):
+                release.wait(5)
+
+        writer = LogWriter(session_factory=session_factory, flush_ms=1)
+        started = time.perf_counter()
+        for _ in range(200):
+            writer.audit(action="rate_limit_exceeded")
+        elapsed = time.perf_counter() - started
+        release.set()
+        writer.stop()
+        assert elapsed < 0.5
+        with session_factory() as db:
+            assert db.query(AuditLog).count() == 200
+
+    def test_failed_batch_retried(self, session_factory):
+        calls = []
+
+        def flaky_factory():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("database unavailable")
+            return session_factory()
+
+        writer = LogWriter(session_factory=flaky_factory)
+        writer._stop.set()
+        writer.audit(action="login")
+        writer.audit(action="logout")
+        assert writer.flush() == 0
+        assert writer.stats()["queue_depth"] == 2  # back on the queue
+        assert writer.flush() == 2
+        assert writer.stats()["failed_batches"] == 1
+        with session_factory() as db:
+            assert db.query(AuditLog).count() == 2
+
+    def test_rejected_row_does_not_block_the_queue(self, session_factory):
+        """A row the database refuses is dropped; the rest of its batch is still written"""
+        writer = LogWriter(session_factory=session_factory)
+        writer._stop.set()
+        writer.audit(action=None)  # NOT NULL violation, on every retry
+        for _ in range(20):
+            writer.audit(action="login")
+        assert writer.flush() == 20
+        writer.audit(action="logout")
+        assert writer.flush() == 1
+        stats = writer.stats()
+        assert (stats["queue_depth"], stats["written"], stats["rejected"], stats["failed_batches"]) == (0, 21, 1, 1)
+        with session_factory() as db:
+            assert db.query(AuditLog).count() == 21
+
+
+class TestCallers:
+    """Security checks and ErrorMonitor.log_activity queue their rows"""
+
+    def test_ip_blocked_without_database_access(self, engine, session_factory, monkeypatch):
+        writer = LogWriter(session_factory=session_factory)
+        writer._stop.set()
+        monkeypatch.setattr(security_utils, "log_writer", writer)
+        with session_factory() as db:
+            company = db.get(Company, 1)
+        statements = count_inserts(engine)
+        request = Request({"type": "http", "method": "GET", "path": "/api/external/efris/invoices",
+                           "headers": [], "client": ("41.210.1.10", 50000), "query_string": b""})
+        with pytest.raises(HTTPException) as exc:
+            security_utils.enforce_api_security(request, company, None)
+        assert exc.value.status_code == 403
+        assert statements == []
+        writer.flush()
+        with session_factory() as db:
+            assert db.query(AuditLog.action, AuditLog.ip_address).one() == ("ip_blocked", "41.210.1.10")
+
+    def test_log_activity(self, session_factory, monkeypatch):
+        import log_writer as log_writer_module
+        from monitoring import error_monitor
+        writer = LogWriter(session_factory=session_factory)
+        writer._stop.set()
+        monkeypatch.setattr(log_writer_module, "log_writer", writer)
+        error_monitor.log_activity(5, "company_created", "Created Acme Ltd", company_id=1)
+        writer.flush()
+        with session_factory() as db:
+            row = db.query(ActivityLog).one()
+        assert (row.activity_type, row.details, row.company_id) == ("company_created", {"message": "Created Acme Ltd"}, 1)
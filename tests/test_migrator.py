@@ -0,0 +1,153 @@
+"""
+Tests for the versioned migration runner (database/migrator.py)
+
+Includes a cold-start benchmark: a new worker's engine running create_all (the old
+init_db) against an up-to-date database vs the startup version check. Each statement
+gets MIGRATE_BENCH_ROUNDTRIP_MS in the driver to stand in for a PostgreSQL round-trip.
+
+Run tests:
+    pytest tests/test_migrator.py -v -s
+"""
+
+import pytest
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, inspect, text
+
+from database import migrator
+from database.migrator import SCHEMA_VERSION, current_version, ensure_schema, migrate, pending, stamp
+from database.models import Base
+
+ROUNDTRIP_MS = float(os.getenv("MIGRATE_BENCH_ROUNDTRIP_MS", "2"))
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "efris.db"
+
+
+class TestMigrate:
+    """Pending versions are applied once, in order, and recorded"""
+
+    def test_fresh_database(self, db_path):
+        engine = create_engine(f"sqlite:///{db_path}")
+        applied = migrate(engine)
+        assert [m.version for m in applied] == list(range(1, SCHEMA_VERSION + 1))
+        assert current_version(engine) == SCHEMA_VERSION
+        tables = set(inspect(engine).get_table_names())
+        assert {"companies", "efris_invoices", "daily_company_stats", "log_rollups", "efris_goods_search"} <= tables
+        assert migrate(engine) == []
+
+    def test_existing_unversioned_database(self, db_path):
+        """Databases created by the old create_all at startup catch up on the data migrations"""
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO companies (id, name, tin) VALUES (1, 'Acme Ltd', '1000000001')"))
+        assert current_version(engine) is None
+        migrate(engine)
+        assert current_version(engine) == SCHEMA_VERSION
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT name FROM companies")).scalar() == "Acme Ltd"
+
+    def test_target_and_stamp(self, db_path):
+        engine = create_engine(f"sqlite:///{db_path}")
+        assert [m.version for m in migrate(engine, target=2)] == [1, 2]
+        assert [m.version for m in pending(engine)] == list(range(3, SCHEMA_VERSION + 1))
+        stamp(engine)
+        assert pending(engine) == []
+
+
+class TestStartupCheck:
+    """Workers only read the schema version when the database is current"""
+
+    def test_single_query_when_current(self, db_path):
+        migrate(create_engine(f"sqlite:///{db_path}"))
+        engine = create_engine(f"sqlite:///{db_path}")
+        statements = count_statements(engine)
+        assert ensure_schema(engine) == SCHEMA_VERSION
+        assert len(statements) == 1
+
+    def test_behind_without_startup_migration(self, db_path, caplog):
+        engine = create_engine(f"sqlite:///{db_path}")
+        migrate(engine, target=1)
+        with caplog.at_level("ERROR", logger="efris_api"):
+            assert ensure_schema(engine, migrate_on_startup=False) == 1
+        assert "run python run_migrations.py" in caplog.text
+        assert len(pending(engine)) == SCHEMA_VERSION - 1
+
+    @pytest.mark.parametrize("migrate_on_startup", [True, False])
+    def test_startup_migrates_fresh_database(self, db_path, migrate_on_startup):
+        """A fresh database gets its schema whatever MIGRATE_ON_STARTUP says (plain uvicorn starts)"""
+        engine = create_engine(f"sqlite:///{db_path}")
+        assert ensure_schema(engine, migrate_on_startup=migrate_on_startup) == SCHEMA_VERSION
+        assert "companies" in inspect(engine).get_table_names()
+
+    def test_startup_skips_deploy_only_migrations(self, db_path, caplog):
+        """An existing database is never deduplicated / rewritten by a booting worker"""
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(engine)
+        with caplog.at_level("ERROR", logger="efris_api"):
+            assert ensure_schema(engine, migrate_on_startup=True) == 2
+        assert "add_unique_tenant_keys is deploy-only" in caplog.text
+        assert [m.version for m in pending(engine)] == list(range(3, SCHEMA_VERSION + 1))
+        assert not pending(engine)[0].online
+
+    @pytest.mark.skipif(os.getenv("MIGRATE_ON_STARTUP") is not None, reason="MIGRATE_ON_STARTUP set")
+    def test_startup_migration_is_off_by_default(self, db_path):
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(engine)
+        assert ensure_schema(engine) is None
+        assert "schema_migrations" not in inspect(engine).get_table_names()
+
+    def test_failed_startup_migration_does_not_crash(self, db_path, monkeypatch):
+        engine = create_engine(f"sqlite:///{db_path}")
+        monkeypatch.setattr(migrator, "migrate", lambda engine, **kwargs: 1 / 0)
+        assert ensure_schema(engine, migrate_on_startup=True) is None
+
+
+class TestColdStartBenchmark:
+    """The version check replaces create_all's per-table reflection on worker boot"""
+
+    ROUNDS = 5
+
+    def worker_engine(self, db_path):
+        engine = create_engine(f"sqlite:///{db_path}")
+
+        @event.listens_for(engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.set_trace_callback(lambda statement: time.sleep(ROUNDTRIP_MS / 1000))
+        return engine
+
+    def boot(self, db_path, startup):
+        timings, statements = [], 0
+        for _ in range(self.ROUNDS):
+            engine = self.worker_engine(db_path)  # every spawned worker builds its own engine
+            executed = count_statements(engine)
+            started = time.perf_counter()
+            startup(engine)
+            timings.append(time.perf_counter() - started)
+            statements = len(executed)
+            engine.dispose()
+        return {"avg_ms": round(sum(timings) / len(timings) * 1000, 1), "statements": statements}
+
+    def test_version_check_vs_create_all(self, db_path):
+        migrate(create_engine(f"sqlite:///{db_path}"))
+        create_all = self.boot(db_path, lambda engine: Base.metadata.create_all(bind=engine))
+        version_check = self.boot(db_path, ensure_schema)
+        print(f"\n[MIGRATE] worker startup schema step, {len(Base.metadata.tables)} tables, "
+              f"{ROUNDTRIP_MS}ms per statement")
+        print(f"  create_all   : {create_all}")
+        print(f"  version check: {version_check}")
+        assert version_check["statements"] == 1
+        assert version_check["avg_ms"] < create_all["avg_ms"]
@@ -0,0 +1,309 @@
+"""
+Tests for the outbound EFRIS / QuickBooks pool (executors.FairExecutor)
+
+Includes a load test: /health is polled while 50 slow T109 uploads are in flight, once
+with the uploads in FastAPI's default threadpool (run_in_threadpool, which /health's
+sync dependencies share) and once in the dedicated outbound pool.
+
+Run tests:
+    pytest tests/test_outbound_executor.py -v -s
+"""
+
+import pytest
+import sys
+import os
+import time
+import asyncio
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from executors import BULK, INTERACTIVE, ExecutorSaturated, FairExecutor, bulk_call, call_class, _tenant_settings
+from database.models import Base, Company, User
+
+T109_CALLS = 50
+T109_SECONDS = 1.5  # /health is polled while the first wave is still waiting on EFRIS
+PING_INTERVAL = 0.05  # seconds
+PINGS = 20  # /health is limited to 60/minute
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class TestFairExecutor:
+    """Round-robin between tenants, caps and bookkeeping"""
+
+    def test_other_tenant_not_stuck_behind_backlog(self):
+        executor = FairExecutor("test-fair", max_workers=2, max_pending=100, tenant_max_pending=100)
+        finished = []
+
+        def call(tenant, i):
+            time.sleep(0.02)
+            finished.append((tenant, i))
+
+        async def burst():
+            busy = [executor.run("busy", call, "busy", i) for i in range(20)]
+            tasks = [asyncio.ensure_future(c) for c in busy]
+            await asyncio.sleep(0.01)
+            await executor.run("quiet", call, "quiet", 0)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(burst())
+        executor.shutdown()
+        # served on its next turn, not after the 20 queued calls
+        assert finished.index(("quiet", 0)) <= 3
+        assert executor.stats()["completed"] == 21
+
+    def test_tenant_worker_cap(self):
+        executor = FairExecutor("test-cap", max_workers=4, max_pending=100, tenant_max_pending=100,
+                                tenant_max_workers=1)
+        lock = threading.Lock()
+        running = {"now": 0, "max": 0}
+
+        def call():
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            time.sleep(0.01)
+            with lock:
+                running["now"] -= 1
+
+        async def burst():
+            await asyncio.gather(*[executor.run(1, call) for _ in range(6)])
+
+        asyncio.run(burst())
+        executor.shutdown()
+        assert running["max"] == 1
+
+    def test_rejects_when_tenant_saturated(self):
+        executor = FairExecutor("test-saturated", max_workers=1, max_pending=100, tenant_max_pending=2)
+
+        async def burst():
+            calls = [executor.run(1, time.sleep, 0.05) for _ in range(4)] + [executor.run(2, time.sleep, 0)]
+            return await asyncio.gather(*calls, return_exceptions=True)
+
+        results = asyncio.run(burst())
+        executor.shutdown()
+        assert sum(isinstance(r, ExecutorSaturated) for r in results) == 2
+        assert results[-1] is None  # other tenant unaffected
+        stats = executor.stats()
+        assert (stats["rejected"], stats["queued"], stats["running"]) == (2, 0, 0)
+
+    def test_exception_propagates(self):
+        executor = FairExecutor("test-errors", max_workers=1, max_pending=10, tenant_max_pending=10)
+
+        def fail():
+            raise ValueError("EFRIS unreachable")
+
+        with pytest.raises(ValueError, match="EFRIS unreachable"):
+            asyncio.run(executor.run(1, fail))
+        executor.shutdown()
+
+
+class TestWeightedScheduling:
+    """Interactive before bulk, tenant weights and caps"""
+
+    def test_invoices_not_stuck_behind_reseller_imports(self):
+        # A reseller imports catalogues for 20 companies, then 5 companies submit invoices
+        executor = FairExecutor("test-classes", max_workers=2, max_pending=100, tenant_max_pending=100,
+                                bulk_max_workers=1)
+        finished = []
+
+        @bulk_call
+        def import_page(tenant):
+            time.sleep(0.02)
+            finished.append(("bulk", tenant))
+
+        def upload_invoice(tenant):
+            time.sleep(0.02)
+            finished.append(("interactive", tenant))
+
+        async def burst():
+            imports = [asyncio.ensure_future(executor.run(company, import_page, company)) for company in range(20)]
+            await asyncio.sleep(0.01)
+            await asyncio.gather(*[executor.run(100 + i, upload_invoice, 100 + i) for i in range(5)])
+            await asyncio.gather(*imports)
+
+        asyncio.run(burst())
+        stats = executor.stats()
+        executor.shutdown()
+        # every invoice finished while most of the imports were still queued
+        assert max(i for i, (cls, _) in enumerate(finished) if cls == "interactive") < 10
+        assert stats["classes"][BULK]["completed"] == 20
+        assert stats["classes"][INTERACTIVE]["max_wait_ms"] < stats["classes"][BULK]["max_wait_ms"]
+
+    def test_bulk_worker_cap_keeps_threads_free(self):
+        executor = FairExecutor("test-bulk-cap", max_workers=4, max_pending=100, tenant_max_pending=100,
+                                bulk_max_workers=2)
+        lock = threading.Lock()
+        running = {"now": 0, "max": 0}
+
+        @bulk_call
+        def import_page():
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            time.sleep(0.01)
+            with lock:
+                running["now"] -= 1
+
+        async def burst():
+            await asyncio.gather(*[executor.run(company, import_page) for company in range(12)])
+
+        asyncio.run(burst())
+        executor.shutdown()
+        assert running["max"] == 2
+
+    def test_tenant_weights(self):
+        executor = FairExecutor("test-weights", max_workers=1, max_pending=100, tenant_max_pending=100,
+                                tenant_weights={"reseller": 3})
+        served = []
+        gate = threading.Event()
+
+        async def burst():
+            blocker = asyncio.ensure_future(executor.run("other", gate.wait))
+            await asyncio.sleep(0.01)  # the only worker is busy; queue both tenants behind it
+            calls = [executor.run(tenant, served.append, tenant) for _ in range(20) for tenant in ("reseller", "solo")]
+            tasks = [asyncio.ensure_future(c) for c in calls]
+            await asyncio.sleep(0.01)
+            gate.set()
+            await asyncio.gather(blocker, *tasks)
+
+        asyncio.run(burst())
+        executor.shutdown()
+        assert served[:16].count("reseller") == 12
+
+    def test_tenant_cap_override(self):
+        executor = FairExecutor("test-tenant-caps", max_workers=4, max_pending=100, tenant_max_pending=100,
+                                tenant_max_workers=4)
+        executor.set_tenant_policy(7, max_workers=1)
+        lock = threading.Lock()
+        running = {"now": 0, "max": 0}
+
+        def call():
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            time.sleep(0.01)
+            with lock:
+                running["now"] -= 1
+
+        async def burst():
+            await asyncio.gather(*[executor.run(7, call) for _ in range(6)])
+
+        asyncio.run(burst())
+        executor.shutdown()
+        assert running["max"] == 1
+
+    def test_call_class(self):
+        from efris_client import EfrisManager
+        assert call_class(EfrisManager.upload_invoice) == INTERACTIVE
+        assert call_class(EfrisManager.submit_credit_note_application) == INTERACTIVE
+        assert call_class(EfrisManager.get_goods_and_services) == BULK
+        assert call_class(EfrisManager.upload_goods) == BULK
+        assert call_class(EfrisManager.query_invoices) == BULK
+        assert _tenant_settings("12=4, public-demo=1.5,", float) == {12: 4.0, "public-demo": 1.5}
+
+
+class SlowEfrisManager:
+    """T109 that takes T109_SECONDS, like URA on a bad day"""
+
+    def upload_invoice(self, invoice_data):
+        time.sleep(T109_SECONDS)
+        return {"returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"}}
+
+
+class DefaultThreadpool:
+    """The alternative: offload to starlette's shared default threadpool"""
+
+    async def run(self, tenant, fn, *args, **kwargs):
+        from starlette.concurrency import run_in_threadpool
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+
+class TestHealthDuringSlowEfris:
+    """/health answers promptly while T109 calls wait on EFRIS"""
+
+    @pytest.fixture
+    def api(self, tmp_path, monkeypatch):
+        api = pytest.importorskip("api_multitenant")
+        httpx = pytest.importorskip("httpx")
+        engine = create_engine(f"sqlite:///{tmp_path / 'efris.db'}", pool_size=T109_CALLS + 10,
+                               connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            db.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+            db.commit()
+        owner = User(id=1, email="owner@x.ug", hashed_password="x", role="owner")
+
+        def get_db():
+            db = factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        api.app.dependency_overrides[api.get_db] = get_db
+        api.app.dependency_overrides[api.get_current_active_user] = lambda: owner
+        monkeypatch.setattr(api, "get_efris_manager", lambda company: SlowEfrisManager())
+        api.limiter.reset()
+        yield api, httpx
+        api.app.dependency_overrides.clear()
+        engine.dispose()
+
+    async def load(self, api, httpx) -> dict:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            latencies = []
+
+            async def ping_loop():
+                await asyncio.sleep(0.1)  # let the uploads reach EFRIS first
+                for i in range(PINGS):
+                    due = started + 0.1 + i * PING_INTERVAL
+                    await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                    response = await client.get("/health")
+                    latencies.append((time.perf_counter() - due) * 1000)
+                    assert response.status_code == 200
+
+            started = time.perf_counter()
+            uploads = [client.post("/api/companies/1/upload-invoice", json={"basicInformation": {"invoiceNo": f"INV-{i}"}})
+                       for i in range(T109_CALLS)]
+            results = await asyncio.gather(ping_loop(), *uploads)
+            elapsed = time.perf_counter() - started
+
+        assert all(r.status_code == 200 for r in results[1:])
+        return {
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "max_ms": round(max(latencies), 1),
+            "elapsed_s": round(elapsed, 2),
+        }
+
+    def test_health_latency_with_50_slow_t109_calls(self, api, monkeypatch):
+        api, httpx = api
+        monkeypatch.setattr(api, "outbound_executor", DefaultThreadpool())
+        shared = asyncio.run(self.load(api, httpx))
+
+        api.limiter.reset()
+        pool = FairExecutor("test-outbound", max_workers=25, max_pending=1000, tenant_max_pending=200,
+                            tenant_max_workers=25)
+        monkeypatch.setattr(api, "outbound_executor", pool)
+        dedicated = asyncio.run(self.load(api, httpx))
+        stats = pool.stats()
+        pool.shutdown()
+
+        print(f"\n[OUTBOUND POOL] {T109_CALLS} T109 calls x {T109_SECONDS}s, {PINGS} /health checks")
+        print(f"  default threadpool: {shared}")
+        print(f"  outbound pool     : {dedicated}")
+        print(f"  pool stats        : {stats}")
+
+        # Shared pool: /health's sync dependencies wait for a thread behind the T109 calls
+        assert dedicated["p50_ms"] < 50
+        assert dedicated["max_ms"] < shared["p50_ms"]
+        assert stats["completed"] == T109_CALLS
+        assert stats["max_queued"] == T109_CALLS - 25  # queue depth reported while saturated
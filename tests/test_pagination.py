@@ -0,0 +1,169 @@
+"""
+Tests for keyset (cursor) pagination (database/pagination.py)
+
+Run tests:
+    pytest tests/test_pagination.py -v
+"""
+
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.models import Base, Company, EFRISGood, EFRISInvoice
+from database.pagination import (
+    InvalidCursor, decode_cursor, encode_cursor, estimate_count, keyset_paginate, keyset_query, _explain_sql
+)
+
+START = datetime(2026, 1, 1, 8, 0, 0)
+LISTED = [func.coalesce(EFRISInvoice.issued_date, EFRISInvoice.created_at), EFRISInvoice.id]
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+    session.add(Company(id=2, name="Other Ltd", tin="1000000002"))
+    for i in range(25):
+        # Pairs of invoices share a created_at so the id tie-breaker matters
+        session.add(EFRISInvoice(company_id=1, invoice_no=f"INV-{i:03d}",
+                                 created_at=START + timedelta(minutes=i // 2)))
+        session.add(EFRISInvoice(company_id=2, invoice_no=f"INV-{i:03d}", created_at=START))
+        session.add(EFRISGood(company_id=1, goods_code=f"G-{i:03d}"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def invoices_query(db, company_id=1):
+    return db.query(EFRISInvoice).filter(EFRISInvoice.company_id == company_id)
+
+
+def walk(query, order_by, limit):
+    """Follow next_cursor until the last page"""
+    pages, cursor = [], None
+    for _ in range(100):  # a cursor that doesn't advance would loop forever
+        page = keyset_paginate(query, order_by, cursor, limit)
+        pages.append(page.items)
+        if not page.next_cursor:
+            return pages
+        cursor = page.next_cursor
+    raise AssertionError("next_cursor never ran out")
+
+
+class TestKeysetPaginate:
+    """Page walking and ordering"""
+
+    def test_pages_cover_every_row_once_in_order(self, db):
+        order_by = [EFRISInvoice.created_at, EFRISInvoice.id]
+        pages = walk(invoices_query(db), order_by, limit=10)
+        assert [len(p) for p in pages] == [10, 10, 5]
+
+        walked = [inv.id for page in pages for inv in page]
+        expected = [inv.id for inv in invoices_query(db).order_by(
+            EFRISInvoice.created_at.desc(), EFRISInvoice.id.desc())]
+        assert walked == expected
+
+    def test_nullable_date_with_fallback(self, db):
+        """Backfilled old documents sort by their own date; ties on created_at page cleanly"""
+        db.add(Company(id=3, name="Third Ltd", tin="1000000003"))
+        for i in range(8):  # created_at from the server default: same second, no microseconds
+            db.add(EFRISInvoice(company_id=3, invoice_no=f"NEW-{i}"))
+        for i in range(4):  # imported later, issued a year ago
+            db.add(EFRISInvoice(company_id=3, invoice_no=f"OLD-{i}", issued_date=START - timedelta(days=400 + i)))
+        db.commit()
+
+        pages = walk(invoices_query(db, company_id=3), LISTED, limit=3)
+        walked = [inv.invoice_no for page in pages for inv in page]
+        assert walked == [f"NEW-{i}" for i in reversed(range(8))] + [f"OLD-{i}" for i in range(4)]
+
+    def test_no_limit_returns_everything(self, db):
+        page = keyset_paginate(invoices_query(db), [EFRISInvoice.id])
+        assert len(page.items) == 25
+        assert page.next_cursor is None
+
+    def test_exact_multiple_has_no_empty_last_page(self, db):
+        pages = walk(db.query(EFRISGood), [EFRISGood.id], limit=5)
+        assert [len(p) for p in pages] == [5, 5, 5, 5, 5]
+
+    def test_new_rows_do_not_shift_later_pages(self, db):
+        first = keyset_paginate(invoices_query(db), [EFRISInvoice.id], None, 10)
+        db.add(EFRISInvoice(company_id=1, invoice_no="INV-NEW"))
+        db.commit()
+        second = keyset_paginate(invoices_query(db), [EFRISInvoice.id], first.next_cursor, 10)
+
+        assert second.items[0].id == first.items[-1].id - 2  # company 2 rows are interleaved
+        assert "INV-NEW" not in {inv.invoice_no for inv in second.items}
+
+    def test_ascending(self, db):
+        page = keyset_paginate(db.query(EFRISGood), [EFRISGood.id], None, 3, descending=False)
+        page2 = keyset_paginate(db.query(EFRISGood), [EFRISGood.id], page.next_cursor, 3, descending=False)
+        assert [g.goods_code for g in page.items + page2.items] == [f"G-{i:03d}" for i in range(6)]
+
+
+class TestCursor:
+    """Cursor encoding"""
+
+    def test_round_trip_with_datetimes(self):
+        cursor = encode_cursor([START, 42])
+        assert decode_cursor(cursor, [EFRISInvoice.created_at, EFRISInvoice.id]) == (START, 42)
+
+    @pytest.mark.parametrize("cursor", ["not-base64!!", encode_cursor([1, 2, 3]), encode_cursor(["x", 1])])
+    def test_invalid_cursor(self, cursor):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(cursor, [EFRISInvoice.created_at, EFRISInvoice.id])
+
+
+class TestTotals:
+    """Optional totals"""
+
+    def test_exact_count_on_sqlite(self, db):
+        assert estimate_count(invoices_query(db)) == (25, False)
+        assert estimate_count(invoices_query(db, company_id=2)) == (25, False)
+
+    def test_in_filter(self, db):
+        query = invoices_query(db).filter(EFRISInvoice.invoice_no.in_(["INV-001", "INV-002", "INV-999"]))
+        assert estimate_count(query) == (2, False)
+
+    def test_postgres_explain_expands_in_lists(self, db):
+        from sqlalchemy.dialects import postgresql
+        query = invoices_query(db).filter(EFRISInvoice.invoice_no.in_(["INV-001", "INV-002"]))
+        sql, params = _explain_sql(query, postgresql.psycopg2.dialect())
+        assert "POSTCOMPILE" not in sql
+        assert sql.startswith("EXPLAIN (FORMAT JSON) SELECT")
+        assert sorted(v for v in params.values() if isinstance(v, str)) == ["INV-001", "INV-002"]
+
+
+class TestIndexBacked:
+    """Keyset pages are read straight off the tenant indexes, no sort step"""
+
+    @pytest.mark.parametrize("query_fn,order_by,index_name", [
+        (lambda db: db.query(EFRISGood).filter(EFRISGood.company_id == 1),
+         [EFRISGood.id], "ix_efris_goods_company_keyset"),
+        (lambda db: invoices_query(db),
+         [EFRISInvoice.id], "ix_efris_invoices_company_keyset"),
+        (lambda db: invoices_query(db),
+         [EFRISInvoice.created_at, EFRISInvoice.id], "ix_efris_invoices_company_created"),
+        (lambda db: invoices_query(db), LISTED, "ix_efris_invoices_company_listed"),
+    ])
+    def test_deep_page_plan(self, engine, db, query_fn, order_by, index_name):
+        cursor = encode_cursor([START + timedelta(minutes=5), 10][-len(order_by):])
+        statement = keyset_query(query_fn(db), order_by, cursor).limit(11).statement
+        compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+        with engine.connect() as conn:
+            plan = "\n".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+        assert index_name in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
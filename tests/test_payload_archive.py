@@ -0,0 +1,181 @@
+"""
+Tests for the EFRIS payload archive (database/payload_archive.py) and its backfill
+migration (migrations/archive_efris_payloads.py), including the efris_invoices size
+reduction on a 5k-invoice tenant
+
+Run tests:
+    pytest tests/test_payload_archive.py -v -s
+"""
+
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database.payload_archive as payload_archive
+from database.models import Base, Company, EFRISInvoice, PayloadArchive
+from database.payload_archive import (
+    archive_payload, archived_payloads, efris_payload_of, efris_response_of, load_payload
+)
+from migrations.archive_efris_payloads import backfill, downgrade, table_size_report, upgrade
+
+# Roughly the shape (and size) of a stored T109 request/response
+PAYLOAD = {
+    "sellerDetails": {"tin": "1000000001", "legalName": "Acme Ltd", "address": "Plot 1 Kampala Road"},
+    "goodsDetails": [{"item": f"Cement 50kg #{i}", "itemCode": f"CEM-{i:03d}", "qty": "10",
+                      "unitOfMeasure": "102", "unitPrice": "35000", "total": "350000",
+                      "taxRate": "0.18", "tax": "53389.83"} for i in range(6)],
+    "summary": {"netAmount": "296610.17", "taxAmount": "53389.83", "grossAmount": "350000"},
+}
+RESPONSE = {
+    "returnStateInfo": {"returnCode": "00", "returnMessage": "SUCCESS"},
+    "data": {"decrypted_content": {**PAYLOAD, "summary": {**PAYLOAD["summary"], "qrCode": "0" * 600}}},
+}
+
+
+def invoice_payloads(i: int):
+    payload = {**PAYLOAD, "basicInformation": {"invoiceNo": f"INV-{i:06d}"}}
+    response = {**RESPONSE, "data": {"decrypted_content": {**payload, "qrCode": f"{i:06d}" * 100}}}
+    return payload, response
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+    session.commit()
+    yield session
+    session.close()
+
+
+class TestArchive:
+    """Storing and fetching payloads"""
+
+    def test_round_trip(self, db):
+        digest = archive_payload(db, RESPONSE)
+        db.commit()
+        assert len(digest) == 64
+        assert load_payload(db, digest) == RESPONSE
+
+    def test_compressed(self, db):
+        blob = db.get(PayloadArchive, archive_payload(db, RESPONSE))
+        assert blob.stored_size < blob.raw_size / 3
+
+    def test_identical_payloads_stored_once(self, db):
+        # Key order doesn't matter - the digest is over canonical JSON
+        reordered = dict(reversed(list(RESPONSE.items())))
+        assert archive_payload(db, RESPONSE) == archive_payload(db, reordered)
+        db.commit()
+        assert db.query(PayloadArchive).count() == 1
+
+    def test_none_is_not_archived(self, db):
+        assert archive_payload(db, None) is None
+        assert load_payload(db, None) is None
+        assert db.query(PayloadArchive).count() == 0
+
+    def test_gzip_blobs_readable_whatever_the_default(self, db, monkeypatch):
+        monkeypatch.setattr(payload_archive, "DEFAULT_CODEC", "gzip")
+        digest = archive_payload(db, PAYLOAD)
+        assert db.get(PayloadArchive, digest).codec == "gzip"
+        monkeypatch.undo()
+        assert load_payload(db, digest) == PAYLOAD
+
+
+class TestInvoiceReferences:
+    """efris_invoices keeps digests, payloads are fetched when needed"""
+
+    def test_new_invoice_stores_refs_only(self, engine, db):
+        db.add(EFRISInvoice(company_id=1, invoice_no="INV-1", status="success",
+                            **archived_payloads(db, PAYLOAD, RESPONSE)))
+        db.commit()
+        with engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT efris_payload, efris_response, payload_ref, response_ref FROM efris_invoices"
+            )).one()
+        assert row[0] is None and row[1] is None
+        assert row[2] and row[3]
+
+        db.expunge_all()
+        invoice = db.query(EFRISInvoice).one()
+        assert efris_payload_of(db, invoice) == PAYLOAD
+        assert efris_response_of(db, invoice)["returnStateInfo"]["returnCode"] == "00"
+
+    def test_legacy_inline_rows_still_read(self, db):
+        db.add(EFRISInvoice(company_id=1, invoice_no="INV-1", efris_payload=PAYLOAD, efris_response=RESPONSE))
+        db.commit()
+        invoice = db.query(EFRISInvoice).one()
+        assert efris_payload_of(db, invoice) == PAYLOAD
+        assert efris_response_of(db, invoice) == RESPONSE
+
+    def test_upsert_rows(self, db):
+        from database.bulk import upsert
+        for _ in range(2):  # resubmission
+            upsert(db, EFRISInvoice, [{"company_id": 1, "invoice_no": "INV-1", "status": "success",
+                                       **archived_payloads(db, PAYLOAD, RESPONSE)}],
+                   conflict_columns=["company_id", "invoice_no"])
+        db.commit()
+        assert efris_response_of(db, db.query(EFRISInvoice).one()) == RESPONSE
+        assert db.query(PayloadArchive).count() == 2
+
+
+class TestBackfill:
+    """The migration moves existing inline payloads into the archive"""
+
+    def test_backfill_and_downgrade(self, engine, db):
+        for i in range(7):
+            payload, response = invoice_payloads(i)
+            db.add(EFRISInvoice(company_id=1, invoice_no=f"INV-{i}", efris_payload=payload, efris_response=response))
+        db.add(EFRISInvoice(company_id=1, invoice_no="NO-PAYLOAD"))
+        db.commit()
+
+        assert upgrade(engine) == 7
+        assert backfill(engine, batch_size=3) == 0  # re-run is a no-op
+
+        db.expire_all()
+        invoices = db.query(EFRISInvoice).filter(EFRISInvoice.invoice_no.like("INV-%")).all()
+        assert all(inv.efris_payload is None and inv.payload_ref for inv in invoices)
+        assert efris_payload_of(db, invoices[0]) == invoice_payloads(0)[0]
+
+        downgrade(engine)
+        db.expire_all()
+        restored = db.query(EFRISInvoice).filter_by(invoice_no="INV-3").one()
+        assert restored.efris_response == invoice_payloads(3)[1]
+        assert restored.response_ref is None
+
+    def test_table_size_reduction(self, tmp_path):
+        """5k invoices: efris_invoices before vs after the backfill + VACUUM"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'archive.db'}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(Company.__table__), [{"id": 1, "name": "Acme Ltd", "tin": "1000000001"}])
+            conn.execute(insert(EFRISInvoice.__table__), [
+                {"company_id": 1, "invoice_no": f"INV-{i:06d}", "status": "success",
+                 "efris_payload": invoice_payloads(i)[0], "efris_response": invoice_payloads(i)[1]}
+                for i in range(5000)
+            ])
+        before = table_size_report(engine)
+        upgrade(engine)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+        after = table_size_report(engine)
+        engine.dispose()
+
+        mb = lambda size: round(size / 1024 / 1024, 2)
+        print("\n[PAYLOAD ARCHIVE] 5000 invoices, sizes in MB")
+        print(f"  before: efris_invoices={mb(before['efris_invoices'])} payload_archive={mb(before['payload_archive'])}")
+        print(f"  after : efris_invoices={mb(after['efris_invoices'])} payload_archive={mb(after['payload_archive'])}")
+
+        assert after["efris_invoices"] < before["efris_invoices"] / 5
+        assert after["efris_invoices"] + after["payload_archive"] < before["efris_invoices"]
@@ -0,0 +1,127 @@
+"""
+Query-count regression tests for the owner and reseller portal listings
+
+Each endpoint is called against a small and a large data set; the number of SQL
+statements must not grow with the number of rows returned (no N+1 lookups).
+
+Run tests:
+    pytest tests/test_portal_queries.py -v
+"""
+
+import pytest
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.models import ActivityLog, Base, ClientReferral, Company, User
+
+api = pytest.importorskip("api_multitenant")
+
+OWNER_ID, RESELLER_ID = 1, 2
+
+
+def build_db(clients: int):
+    """Owner, resellers, `clients` clients (half referred, some direct, some without
+    a reseller), each with a company and fiscalization activity"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=OWNER_ID, email="owner@x.ug", hashed_password="x", role="owner"))
+    db.add(User(id=RESELLER_ID, email="reseller@x.ug", hashed_password="x", role="reseller", full_name="Res Ltd"))
+    for i in range(clients // 4):
+        db.add(User(id=10 + i, email=f"r{i}@x.ug", hashed_password="x", role="reseller"))
+    for i in range(clients):
+        user_id, company_id = 100 + i, 100 + i
+        parent = RESELLER_ID if i % 4 else None
+        db.add(User(id=user_id, email=f"c{i}@x.ug", hashed_password="x", role="client",
+                    parent_id=parent, status="pending" if i % 3 == 0 else "active"))
+        db.add(Company(id=company_id, name=f"Client {i}", tin=f"10{i:08d}", owner_id=user_id,
+                       erp_type="custom" if i % 2 else "quickbooks", api_key=f"key-{i}"))
+        if i % 2:
+            db.add(ClientReferral(reseller_id=RESELLER_ID, company_name=f"Client {i}", client_name=f"C{i}",
+                                  client_email=f"c{i}@x.ug", tin=f"10{i:08d}", status="approved",
+                                  created_client_id=user_id, created_company_id=company_id))
+        db.add(ClientReferral(reseller_id=RESELLER_ID, company_name=f"Lead {i}", client_name=f"L{i}",
+                              client_email=f"lead{i}@x.ug", tin=f"20{i:08d}", status="pending"))
+        db.add(ActivityLog(company_id=company_id, user_id=user_id, reseller_id=parent,
+                           activity_type="invoice_fiscalized", efris_status="success",
+                           document_number=f"INV-{i}", details={"total_amount": "100"}))
+    db.commit()
+    return engine, db
+
+
+def count_statements(engine):
+    """Attach a counter of executed SQL statements to an engine"""
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+ENDPOINTS = [
+    ("get_all_clients", OWNER_ID),
+    ("get_pending_clients", OWNER_ID),
+    ("get_all_resellers", OWNER_ID),
+    ("get_activity_feed", OWNER_ID),
+    ("get_reseller_clients", RESELLER_ID),
+    ("get_reseller_client_activity", RESELLER_ID),
+]
+
+
+def run_endpoint(name: str, user_id: int, clients: int):
+    """(statements executed, response) for one call of a portal endpoint"""
+    engine, db = build_db(clients)
+    user = db.get(User, user_id)
+    statements = count_statements(engine)
+    response = asyncio.run(getattr(api, name)(current_user=user, db=db))
+    db.close()
+    return len(statements), response
+
+
+class TestPortalQueryCounts:
+    """Owner/reseller listings run a fixed number of queries"""
+
+    @pytest.mark.parametrize("name,user_id", ENDPOINTS)
+    def test_query_count_independent_of_rows(self, name, user_id):
+        small, _ = run_endpoint(name, user_id, clients=4)
+        large, _ = run_endpoint(name, user_id, clients=40)
+        assert large == small, f"{name}: {small} queries for 4 clients, {large} for 40"
+        assert small <= 4
+
+
+class TestPortalResponses:
+    """The joined queries return the same shape as the per-row lookups did"""
+
+    def test_all_clients(self):
+        _, clients = run_endpoint("get_all_clients", OWNER_ID, clients=4)
+        by_email = {c["email"]: c for c in clients}
+        assert by_email["c0@x.ug"]["reseller_name"] == "Direct"
+        assert by_email["c1@x.ug"]["reseller_name"] == "Res Ltd"
+        assert by_email["c1@x.ug"]["company"]["id"] == 101
+        assert by_email["c1@x.ug"]["api_credentials"]["api_key"] == "key-1"
+        assert "api_credentials" not in by_email["c2@x.ug"]
+
+    def test_reseller_clients(self):
+        _, clients = run_endpoint("get_reseller_clients", RESELLER_ID, clients=4)
+        statuses = [(c["status"], c["referral_id"] is not None) for c in clients]
+        assert statuses.count(("pending", True)) == 4
+        assert statuses.count(("approved", True)) == 2  # clients 1 and 3 were referred
+        assert statuses.count(("approved", False)) == 1  # client 2 is direct
+        assert {c["company_name"] for c in clients if c["status"] == "approved"} == {"Client 1", "Client 2", "Client 3"}
+
+    def test_activity_feeds(self):
+        _, feed = run_endpoint("get_activity_feed", OWNER_ID, clients=4)
+        assert {a["company_name"] for a in feed} == {f"Client {i}" for i in range(4)}
+        _, activity = run_endpoint("get_reseller_client_activity", RESELLER_ID, clients=4)
+        assert {a["company_name"] for a in activity["activities"]} == {"Client 1", "Client 2", "Client 3"}
+        assert activity["total"] == 3
+
+    def test_reseller_client_counts(self):
+        _, resellers = run_endpoint("get_all_resellers", OWNER_ID, clients=8)
+        counts = {r["id"]: r["client_count"] for r in resellers}
+        assert counts == {RESELLER_ID: 6, 10: 0, 11: 0}
@@ -0,0 +1,146 @@
+"""
+Unit tests for the JWT principal cache (principal_cache.py)
+
+Run tests:
+    pytest tests/test_principal_cache.py -v
+"""
+
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import principal_cache as principal_module
+from principal_cache import PrincipalCache
+from database.models import Base, User, Company
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def session_factory(engine):
+    """Reseller 1 with client 2 (company 20), reseller's own company 10, other client 3 (company 30)"""
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add_all([
+        User(id=1, email="reseller@example.com", hashed_password="x", role="reseller"),
+        User(id=2, email="client@example.com", hashed_password="x", role="client", parent_id=1),
+        User(id=3, email="other@example.com", hashed_password="x", role="client"),
+        User(id=4, email="owner@example.com", hashed_password="x", role="owner"),
+    ])
+    db.add_all([
+        Company(id=10, name="Reseller Co", tin="1000000010", owner_id=1),
+        Company(id=20, name="Client Co", tin="1000000020", owner_id=2),
+        Company(id=30, name="Other Co", tin="1000000030", owner_id=3),
+    ])
+    db.commit()
+    db.close()
+    return factory
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Fresh cache wired to the commit hooks"""
+    cache = PrincipalCache(ttl_seconds=60)
+    monkeypatch.setattr(principal_module, "principal_cache", cache)
+    return cache
+
+
+def load(cache, db, email):
+    return cache.get_or_load(email, lambda: db.query(User).filter(User.email == email).first(), db)
+
+
+class TestPrincipal:
+    """Test accessible company sets"""
+
+    def test_reseller_sees_own_and_clients_companies(self, session_factory, cache):
+        db = session_factory()
+        principal = load(cache, db, "reseller@example.com")
+        assert principal.company_ids == {10, 20}
+        assert principal.client_user_ids == {2}
+        assert not principal.can_access(30)
+        db.close()
+
+    def test_client_and_owner(self, session_factory, cache):
+        db = session_factory()
+        assert load(cache, db, "client@example.com").company_ids == {20}
+        owner = load(cache, db, "owner@example.com")
+        assert owner.company_ids is None
+        assert owner.can_access(30)
+        db.close()
+
+    def test_cache_hit_issues_no_queries(self, engine, session_factory, cache):
+        db = session_factory()
+        load(cache, db, "reseller@example.com")
+        db.close()
+
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda conn, cur, stmt, *a: statements.append(stmt))
+        db = session_factory()
+        principal = cache.get_or_load("reseller@example.com", lambda: pytest.fail("loader called"), db)
+        user = principal.attach(db)
+        assert user.email == "reseller@example.com"
+        assert cache.get_by_user_id(1) is principal
+        assert statements == []
+        db.close()
+
+
+class TestInvalidation:
+    """Test commit-driven invalidation"""
+
+    def test_suspend_invalidates_user(self, session_factory, cache):
+        db = session_factory()
+        load(cache, db, "client@example.com")
+        user = db.get(User, 2)
+        user.status = "suspended"
+        db.commit()
+        assert cache.get_by_user_id(2) is None
+        db.close()
+
+    def test_client_reassignment_invalidates_both_resellers(self, session_factory, cache):
+        db = session_factory()
+        db.add(User(id=5, email="reseller2@example.com", hashed_password="x", role="reseller"))
+        db.commit()
+        load(cache, db, "reseller@example.com")
+        load(cache, db, "reseller2@example.com")
+
+        db.get(User, 2).parent_id = 5
+        db.commit()
+        assert cache.get_by_user_id(1) is None
+        assert cache.get_by_user_id(5) is None
+        assert load(cache, db, "reseller2@example.com").company_ids == {20}
+        db.close()
+
+    def test_new_client_company_invalidates_reseller(self, session_factory, cache):
+        db = session_factory()
+        load(cache, db, "reseller@example.com")
+        db.add(Company(id=21, name="Client Co 2", tin="1000000021", owner_id=2))
+        db.commit()
+        assert load(cache, db, "reseller@example.com").company_ids == {10, 20, 21}
+        db.close()
+
+    def test_unrelated_changes_keep_cache(self, session_factory, cache):
+        db = session_factory()
+        principal = load(cache, db, "reseller@example.com")
+        db.get(Company, 20).name = "Renamed Co"
+        db.commit()
+        assert cache.get_by_user_id(1) is principal
+        db.close()
+
+    def test_rollback_does_not_invalidate(self, session_factory, cache):
+        db = session_factory()
+        principal = load(cache, db, "client@example.com")
+        db.get(User, 2).role = "reseller"
+        db.flush()
+        db.rollback()
+        assert cache.get_by_user_id(2) is principal
+        db.close()
@@ -0,0 +1,144 @@
+"""
+Tests for per-request SQL instrumentation (database/query_stats.py)
+
+Run tests:
+    pytest tests/test_query_stats.py -v
+"""
+
+import pytest
+import sys
+import os
+import logging
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import query_stats
+from database.models import Base, Company, User
+from monitoring import performance_monitor
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables and the hooks installed"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    query_stats.install(engine)
+    query_stats.install(engine)  # idempotent
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add_all([Company(id=i, name=f"Company {i}", tin=f"100000000{i}") for i in range(1, 13)])
+    session.commit()
+    yield session
+    session.close()
+
+
+def warnings_from(caplog):
+    return [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+
+
+class TestRequestScope:
+    """Statements are attributed to the open request only"""
+
+    def test_counts_and_time(self, db):
+        with query_stats.request_scope("/companies") as stats:
+            db.query(Company).count()
+            db.execute(text("SELECT 1"))
+        db.execute(text("SELECT 2"))  # after the request
+        assert stats.count == 2
+        assert stats.seconds > 0
+        assert stats.headers()["X-DB-Query-Count"] == "2"
+        assert stats.headers()["Server-Timing"].startswith("db;dur=")
+
+    def test_outside_request(self, db):
+        assert query_stats.current() is None
+        query_stats.attribute_company(1)  # no-op
+        db.query(Company).count()
+
+    def test_company_attribution(self, db):
+        with query_stats.request_scope("/x") as stats:
+            query_stats.attribute_company(7)
+        assert stats.context() == {"route": "/x", "company_id": 7}
+
+    def test_failed_statement(self, db):
+        with query_stats.request_scope("/x") as stats:
+            with pytest.raises(Exception):
+                db.execute(text("SELECT * FROM missing_table"))
+            db.rollback()
+            db.execute(text("SELECT 1"))
+        assert stats.count == 1
+
+
+class TestReports:
+    """Slow and repeated statements are logged with the route and company"""
+
+    def test_repeated_statement_flagged(self, db, caplog):
+        with caplog.at_level(logging.WARNING, logger="efris_api"):
+            with query_stats.request_scope("GET /api/owner/clients") as stats:
+                query_stats.attribute_company(3)
+                for company_id in range(1, 13):  # per-row lookups
+                    db.query(Company).filter(Company.id == company_id).first()
+                db.query(User).count()
+        assert list(stats.repeated().values()) == [12]
+        messages = warnings_from(caplog)
+        assert len(messages) == 1
+        assert "x12, possible N+1" in messages[0]
+        assert "GET /api/owner/clients" in messages[0] and "'company_id': 3" in messages[0]
+
+    def test_below_threshold_not_flagged(self, db, caplog):
+        with caplog.at_level(logging.WARNING, logger="efris_api"):
+            with query_stats.request_scope("/x"):
+                for company_id in range(1, query_stats.SQL_REPEAT_THRESHOLD):
+                    db.query(Company).filter(Company.id == company_id).first()
+        assert warnings_from(caplog) == []
+
+    def test_slow_query(self, db, caplog, monkeypatch):
+        monkeypatch.setattr(performance_monitor, "slow_query_threshold", 0.0)
+        with caplog.at_level(logging.WARNING, logger="efris_api"):
+            with query_stats.request_scope("/slow") as stats:
+                db.execute(text("SELECT 1"))
+        assert [s["statement"] for s in stats.slow] == ["SELECT 1"]
+        assert any(m.startswith("SLOW QUERY") and "/slow" in m for m in warnings_from(caplog))
+
+
+class TestMiddleware:
+    """The app reports the totals per request"""
+
+    def test_response_headers_and_route(self, db, caplog, monkeypatch):
+        api = pytest.importorskip("api_multitenant")
+        from fastapi.testclient import TestClient
+        owner = User(id=1, email="owner@x.ug", hashed_password="x", role="owner")
+        db.add(owner)
+        db.commit()
+        api.app.dependency_overrides[api.get_db] = lambda: db
+        api.app.dependency_overrides[api.get_current_active_user] = lambda: owner
+        monkeypatch.setattr(query_stats, "SQL_REPEAT_THRESHOLD", 1)
+        try:
+            with caplog.at_level(logging.WARNING, logger="efris_api"):
+                response = TestClient(api.app).get("/api/companies/5")
+        finally:
+            api.app.dependency_overrides.clear()
+        assert int(response.headers["X-DB-Query-Count"]) >= 1
+        assert "db;dur=" in response.headers["Server-Timing"]
+        # reported against the route template and the company from the path
+        assert any("GET /api/companies/{company_id}" in m and "'company_id': 5" in m
+                   for m in warnings_from(caplog))
+
+    def test_replica_engines_instrumented(self, tmp_path):
+        """Reads served by a replica are counted too"""
+        import subprocess
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        check = ("import api_multitenant as api; from database import query_stats; "
+                 "assert api.replica_engines and all(e in query_stats._installed for e in api.replica_engines)")
+        result = subprocess.run(
+            [sys.executable, "-c", check], cwd=repo, capture_output=True, text=True, timeout=120,
+            env={**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'primary.db'}",
+                 "DATABASE_REPLICA_URLS": f"sqlite:///{tmp_path / 'replica.db'}", "JOBS_IN_PROCESS_WORKER": "false"}
+        )
+        assert result.returncode == 0, result.stderr
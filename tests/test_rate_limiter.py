@@ -0,0 +1,198 @@
+"""
+Unit tests for the sliding-window API rate limiter (rate_limiter.py)
+
+Run tests:
+    pytest tests/test_rate_limiter.py -v
+"""
+
+import pytest
+import sys
+import os
+import threading
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.requests import Request
+
+import security_utils
+from cache_utils import TTLCache
+from rate_limiter import RateLimitResult, SlidingWindowRateLimiter
+from api_key_cache import ApiUsageRecorder
+from log_writer import LogWriter
+from database.models import Base, Company, AuditLog
+
+DAY = 24 * 3600
+
+
+def make_request(ip="41.210.1.10"):
+    """Minimal ASGI request as seen by the API-key dependency"""
+    return Request({"type": "http", "method": "POST", "path": "/api/external/efris/submit-invoice",
+                    "headers": [], "client": (ip, 50000), "query_string": b""})
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def session_factory(engine):
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(Company(id=1, name="Acme Ltd", tin="1000000001", api_key="efris_test_key",
+                   api_enabled=True, is_active=True, api_rate_limit=3))
+    db.commit()
+    db.close()
+    return factory
+
+
+class TestSlidingWindow:
+    """Test window accounting in the memory backend"""
+
+    def test_allows_up_to_limit(self):
+        limiter = SlidingWindowRateLimiter(bucket_seconds=60)
+        results = [limiter.hit(1, 3, now=1000.0) for _ in range(4)]
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert [r.remaining for r in results] == [2, 1, 0, 0]
+
+    def test_companies_are_independent(self):
+        limiter = SlidingWindowRateLimiter(bucket_seconds=60)
+        limiter.hit(1, 1, now=1000.0)
+        assert not limiter.hit(1, 1, now=1000.0).allowed
+        assert limiter.hit(2, 1, now=1000.0).allowed
+
+    def test_old_buckets_slide_out(self):
+        """Calls free up as their bucket leaves the 24h window - no midnight reset needed"""
+        limiter = SlidingWindowRateLimiter(bucket_seconds=600)
+        limiter.hit(1, 2, now=0.0)
+        limiter.hit(1, 2, now=3600.0)
+        blocked = limiter.hit(1, 2, now=DAY - 1)
+        assert not blocked.allowed
+        assert blocked.reset_at == DAY
+        assert blocked.headers()["Retry-After"]
+
+        assert limiter.hit(1, 2, now=DAY + 1).allowed
+        assert not limiter.hit(1, 2, now=DAY + 2).allowed
+
+    def test_seed_counts_persisted_calls(self):
+        """After a restart the day's recorded calls still count"""
+        limiter = SlidingWindowRateLimiter(bucket_seconds=60)
+        assert limiter.hit(1, 5, seed=lambda: 4, now=1000.0).remaining == 0
+        assert not limiter.hit(1, 5, seed=lambda: 4, now=1000.0).allowed
+
+    def test_headers(self):
+        limiter = SlidingWindowRateLimiter(bucket_seconds=60)
+        headers = limiter.hit(1, 10, now=0.0).headers()
+        assert headers == {"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "9",
+                           "X-RateLimit-Reset": "1970-01-02T00:00:00Z"}
+
+    def test_allowed_calls_are_reported(self):
+        counted = []
+        limiter = SlidingWindowRateLimiter(bucket_seconds=60, on_allowed=counted.append)
+        for _ in range(3):
+            limiter.hit(7, 2, now=0.0)
+        assert counted == [7, 7]
+
+
+class TestEnforceApiSecurity:
+    """Test the external API check end to end"""
+
+    def test_no_database_writes_on_allowed_requests(self, engine, session_factory, monkeypatch):
+        """Allowed requests don't read or write the companies row"""
+        monkeypatch.setattr(security_utils, "api_rate_limiter", SlidingWindowRateLimiter(bucket_seconds=60))
+        db = session_factory()
+        company = db.get(Company, 1)
+
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda conn, cur, stmt, *a: statements.append(stmt))
+        request = make_request()
+        headers = security_utils.enforce_api_security(request, company, db)
+
+        assert statements == []
+        assert headers["X-RateLimit-Remaining"] == "2"
+        assert request.state.rate_limit_headers == headers
+        db.close()
+
+    def test_limit_exceeded_returns_429_with_headers(self, session_factory, monkeypatch):
+        monkeypatch.setattr(security_utils, "api_rate_limiter", SlidingWindowRateLimiter(bucket_seconds=60))
+        monkeypatch.setattr(security_utils, "_rate_limit_audited", TTLCache(ttl_seconds=60))
+        writer = LogWriter(session_factory=session_factory)
+        monkeypatch.setattr(security_utils, "log_writer", writer)
+        db = session_factory()
+        company = db.get(Company, 1)
+        for _ in range(3):
+            security_utils.enforce_api_security(make_request(), company, db)
+
+        with pytest.raises(HTTPException) as exc:
+            security_utils.enforce_api_security(make_request(), company, db)
+        assert exc.value.status_code == 429
+        assert exc.value.headers["X-RateLimit-Remaining"] == "0"
+        assert "Retry-After" in exc.value.headers
+
+        # Repeated rejections are audited once
+        with pytest.raises(HTTPException):
+            security_utils.enforce_api_security(make_request(), company, db)
+        writer.stop()  # joins the background thread and writes what is left
+        assert db.query(AuditLog).filter(AuditLog.action == "rate_limit_exceeded").count() == 1
+        db.close()
+
+    def test_concurrent_rejections_audited_once(self, monkeypatch):
+        monkeypatch.setattr(security_utils, "_rate_limit_audited", TTLCache(ttl_seconds=60))
+        audited = []
+        monkeypatch.setattr(security_utils.log_writer, "audit", lambda **values: audited.append(values))
+        company = Company(id=1, name="Acme Ltd", tin="1000000001")
+        result = RateLimitResult(False, 3, 0, 60)
+        threads = [threading.Thread(target=security_utils.log_rate_limit_exceeded, args=(company, "10.0.0.1", result))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(audited) == 1
+
+
+class TestCallCountFlush:
+    """Test background aggregation into companies.api_calls_today"""
+
+    def test_calls_are_added_to_todays_counter(self, session_factory):
+        db = session_factory()
+        company = db.get(Company, 1)
+        company.api_calls_today = 10
+        company.api_last_reset = datetime.now()
+        db.commit()
+        db.close()
+
+        recorder = ApiUsageRecorder(session_factory=session_factory, interval=3600)
+        for _ in range(5):
+            recorder.add_calls(1)
+        assert recorder.flush() == 1
+
+        db = session_factory()
+        assert db.get(Company, 1).api_calls_today == 15
+        db.close()
+        recorder.stop()
+
+    def test_counter_restarts_on_a_new_day(self, session_factory):
+        db = session_factory()
+        company = db.get(Company, 1)
+        company.api_calls_today = 900
+        company.api_last_reset = datetime.now() - timedelta(days=1)
+        db.commit()
+        db.close()
+
+        recorder = ApiUsageRecorder(session_factory=session_factory, interval=3600)
+        recorder.add_calls(1, 2)
+        recorder.flush()
+
+        db = session_factory()
+        company = db.get(Company, 1)
+        assert company.api_calls_today == 2
+        assert company.api_last_reset.date() == datetime.now().date()
+        db.close()
+        recorder.stop()
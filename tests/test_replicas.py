@@ -0,0 +1,170 @@
+"""
+Tests for read-replica routing (database/replicas.py, get_read_db)
+
+Run tests:
+    pytest tests/test_replicas.py -v
+"""
+
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database.connection as connection
+from database.bulk import upsert
+from database.models import Base, Company, EFRISGood, EFRISInvoice, User
+from database.replicas import ReadOnlySessionError, ReplicaRouter, RecentWrites, recent_writes
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def engines(tmp_path):
+    primary, replica, replica2 = (make_engine(tmp_path / f"{name}.db") for name in ("primary", "r1", "r2"))
+    for engine, name in ((primary, "Primary"), (replica, "Replica"), (replica2, "Replica")):
+        with sessionmaker(bind=engine)() as db:
+            db.add(Company(id=1, name=f"{name} copy", tin="1000000001"))
+            db.commit()
+    return primary, replica, replica2
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Drive the shared write tracker with a fake clock"""
+    clock = FakeClock()
+    monkeypatch.setattr(recent_writes, "clock", clock)
+    monkeypatch.setattr(recent_writes, "_written_at", {})
+    return clock
+
+
+class StaticLagRouter(ReplicaRouter):
+    """Router with scripted lag values instead of querying pg_last_xact_replay_timestamp()"""
+
+    def __init__(self, *args, lags=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lags = lags or {}
+        self.measured = 0
+
+    def measure_lag(self, replica):
+        self.measured += 1
+        return self.lags.get(replica, 0.0)
+
+
+class TestRouting:
+    """Fresh replicas serve reads; anything doubtful goes to the primary"""
+
+    def test_no_replicas(self, engines):
+        primary = engines[0]
+        router = ReplicaRouter(primary, [], writes=RecentWrites())
+        assert router.engine_for_read(1) is primary
+
+    def test_round_robin(self, engines, clock):
+        primary, replica, replica2 = engines
+        router = StaticLagRouter(primary, [replica, replica2])
+        assert [router.engine_for_read() for _ in range(4)] == [replica, replica2, replica, replica2]
+
+    def test_lagging_replica_skipped(self, engines, clock):
+        primary, replica, replica2 = engines
+        router = StaticLagRouter(primary, [replica, replica2], max_lag=5, lags={replica: 30.0})
+        assert {router.engine_for_read() for _ in range(4)} == {replica2}
+        router.lags[replica2] = None  # down
+        router._lag.clear()
+        assert router.engine_for_read() is primary
+        assert router.stats()["reads"] == {"replica": 4, "primary_replica_lagging": 1}
+
+    def test_lag_measured_once_per_interval(self, engines, clock):
+        primary, replica, _ = engines
+        router = StaticLagRouter(primary, [replica], check_interval=10)
+        for _ in range(5):
+            router.engine_for_read()
+        clock.now += 11
+        router.engine_for_read()
+        assert router.measured == 2
+
+    def test_unreachable_replica(self, engines, clock, tmp_path):
+        primary = engines[0]
+        missing = create_engine(f"sqlite:///{tmp_path / 'no' / 'such' / 'dir.db'}")
+        router = ReplicaRouter(primary, [missing])
+        assert router.lag(missing) is None
+        assert router.engine_for_read() is primary
+
+
+class TestReadYourWrites:
+    """A company written moments ago is read from the primary"""
+
+    def test_orm_commit(self, engines, clock):
+        primary, replica, _ = engines
+        router = StaticLagRouter(primary, [replica], max_lag=5)
+        with sessionmaker(bind=primary)() as db:
+            db.add(EFRISInvoice(company_id=1, invoice_no="INV-1"))
+            db.commit()
+        assert router.engine_for_read(1) is primary
+        assert router.engine_for_read(2) is replica
+        clock.now += 6
+        assert router.engine_for_read(1) is replica
+
+    def test_bulk_upsert(self, engines, clock):
+        primary, replica, _ = engines
+        router = StaticLagRouter(primary, [replica])
+        with sessionmaker(bind=primary)() as db:
+            upsert(db, EFRISGood, [{"company_id": 1, "goods_code": "G1", "goods_name": "Cement"}],
+                   ["company_id", "goods_code"])
+            db.commit()
+        assert router.engine_for_read(1) is primary
+
+    def test_rolled_back_write_not_sticky(self, engines, clock):
+        primary, replica, _ = engines
+        router = StaticLagRouter(primary, [replica])
+        with sessionmaker(bind=primary)() as db:
+            db.add(EFRISInvoice(company_id=1, invoice_no="INV-1"))
+            db.flush()
+            db.rollback()
+        assert router.engine_for_read(1) is replica
+
+
+class TestReadSessions:
+    """get_read_db sessions can't write and are routed by the request's company"""
+
+    def test_read_only(self, engines, monkeypatch):
+        monkeypatch.setattr(connection, "replica_router", ReplicaRouter(engines[0], [], writes=RecentWrites()))
+        db = connection.read_session(1)
+        db.add(EFRISInvoice(company_id=1, invoice_no="INV-1"))
+        with pytest.raises(ReadOnlySessionError):
+            db.commit()
+        db.close()
+
+    def test_list_endpoint_reads_replica(self, engines, clock, monkeypatch):
+        api = pytest.importorskip("api_multitenant")
+        from fastapi.testclient import TestClient
+        primary, replica, _ = engines
+        with replica.begin() as conn:  # replicated row, not a write by this worker
+            conn.execute(EFRISInvoice.__table__.insert(), {"company_id": 1, "invoice_no": "ON-REPLICA"})
+        monkeypatch.setattr(connection, "replica_router", StaticLagRouter(primary, [replica]))
+        owner = User(id=1, email="owner@x.ug", hashed_password="x", role="owner")
+        api.app.dependency_overrides[api.get_current_active_user] = lambda: owner
+        try:
+            client = TestClient(api.app)
+            from_replica = client.get("/api/companies/1/efris-invoices").json()
+            with sessionmaker(bind=primary)() as db:
+                db.add(EFRISInvoice(company_id=1, invoice_no="JUST-SUBMITTED"))
+                db.commit()
+            from_primary = client.get("/api/companies/1/efris-invoices").json()
+        finally:
+            api.app.dependency_overrides.clear()
+        assert [i["invoiceNo"] for i in from_replica] == ["ON-REPLICA"]
+        assert [i["invoiceNo"] for i in from_primary] == ["JUST-SUBMITTED"]
@@ -0,0 +1,201 @@
+"""
+Tests for indexed search (database/search.py, migrations/add_search_indexes.py)
+
+Includes a latency comparison of FTS5 vs the old LIKE scan on a large goods table
+(set SEARCH_BENCH_ROWS to change the size, e.g. 1000000).
+
+Run tests:
+    pytest tests/test_search.py -v -s
+"""
+
+import pytest
+import sys
+import os
+import random
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database.search as search
+from database.bulk import upsert
+from database.models import Base, Company, CreditMemo, EFRISGood, EFRISInvoice, Invoice, Product, PurchaseOrder
+from database.pagination import keyset_paginate
+from database.search import SEARCH_FIELDS, search_keys, search_query
+from migrations.add_search_indexes import downgrade, upgrade
+
+BENCH_ROWS = int(os.getenv("SEARCH_BENCH_ROWS", "200000"))
+
+
+@pytest.fixture
+def engine():
+    """Shared in-memory SQLite engine with all tables"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+    session.add(Company(id=2, name="Other Ltd", tin="1000000002"))
+    session.add_all([
+        EFRISGood(company_id=1, goods_code="CEM-001", goods_name="Portland Cement 50kg"),
+        EFRISGood(company_id=1, goods_code="STL-010", goods_name="Steel bar 10mm"),
+        EFRISGood(company_id=1, goods_code="PNT-100", goods_name="Paint 100% acrylic"),
+        EFRISGood(company_id=1, goods_code="MIX-002", goods_name="Sand and cement mix"),
+        EFRISGood(company_id=2, goods_code="CEM-001", goods_name="Cement (other company)"),
+        EFRISInvoice(company_id=1, invoice_no="324000123456", buyer_legal_name="Kampala Hardware Ltd",
+                     reference_no="INV-1001"),
+        EFRISInvoice(company_id=1, invoice_no="324000999999", buyer_business_name="Jinja Builders"),
+    ])
+    session.commit()
+    yield session
+    session.close()
+
+
+def goods(db, term, company_id=1):
+    query = db.query(EFRISGood).filter(EFRISGood.company_id == company_id)
+    return [g.goods_code for g in search_query(query, EFRISGood, term)]
+
+
+@pytest.fixture(params=["like", "fts5"])
+def backend(request, engine, db):
+    """Run a test against the LIKE fallback and against the FTS5 indexes"""
+    if request.param == "fts5":
+        upgrade(engine)
+    search._backends.pop(engine, None)
+    return request.param
+
+
+class TestSearch:
+    """Same matches whichever backend answers"""
+
+    def test_substring_case_insensitive(self, db, backend):
+        assert set(goods(db, "cement")) == {"CEM-001", "MIX-002"}
+        assert goods(db, "stl-0") == ["STL-010"]
+
+    def test_tenant_scoped(self, db, backend):
+        assert goods(db, "other company", company_id=2) == ["CEM-001"]
+        assert goods(db, "other company") == []
+
+    def test_wildcards_are_literal(self, db, backend):
+        assert goods(db, "100%") == ["PNT-100"]
+        assert goods(db, "c_m") == []
+
+    def test_short_terms(self, db, backend):
+        assert set(goods(db, "mm")) == {"STL-010"}
+
+    def test_invoice_fields(self, db, backend):
+        query = db.query(EFRISInvoice).filter(EFRISInvoice.company_id == 1)
+        for term, expected in [("hardware", "324000123456"), ("jinja", "324000999999"),
+                               ("inv-1001", "324000123456"), ("0999", "324000999999")]:
+            assert [inv.invoice_no for inv in search_query(query, EFRISInvoice, term)] == [expected]
+
+    def test_pages_follow_the_ranking(self, db, backend):
+        """Search results page by cursor in the same order as the unpaged ranking"""
+        db.add_all([EFRISGood(company_id=1, goods_code=f"CEM-1{i:02d}", goods_name="Cement " + "x" * i)
+                    for i in range(7)])
+        db.commit()
+        query, keys = search_keys(db.query(EFRISGood).filter(EFRISGood.company_id == 1), EFRISGood, "cement")
+        walked, cursor = [], None
+        for _ in range(10):
+            page = keyset_paginate(query, keys, cursor, 3)
+            walked += [g.goods_code for g in page.items]
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        assert walked == goods(db, "cement")
+        assert len(walked) == 9
+
+    @pytest.mark.parametrize("model", [Product, Invoice, PurchaseOrder, CreditMemo])
+    def test_qb_lists(self, db, backend, model):
+        query = db.query(model).filter(model.company_id == 1)
+        assert search_query(query, model, "anything").all() == []
+        assert set(SEARCH_FIELDS[model.__tablename__]) <= set(model.__table__.columns.keys())
+
+
+class TestFts5Index:
+    """The SQLite FTS5 tables follow the base tables"""
+
+    @pytest.fixture(autouse=True)
+    def indexed(self, engine, db):
+        upgrade(engine)
+        upgrade(engine)  # idempotent
+        search._backends.pop(engine, None)
+
+    def test_ranked_best_match_first(self, db):
+        db.add(EFRISGood(company_id=1, goods_code="CEM-002", goods_name="Cement"))
+        db.commit()
+        assert goods(db, "cement")[0] == "CEM-002"
+
+    def test_triggers_follow_writes(self, db):
+        good = db.query(EFRISGood).filter_by(goods_code="STL-010").one()
+        good.goods_name = "Rebar 12mm"
+        db.add(EFRISGood(company_id=1, goods_code="NEW-1", goods_name="Roofing sheet"))
+        db.delete(db.query(EFRISGood).filter_by(goods_code="PNT-100").one())
+        db.commit()
+        assert goods(db, "steel") == []
+        assert goods(db, "rebar") == ["STL-010"]
+        assert goods(db, "roofing") == ["NEW-1"]
+        assert goods(db, "acrylic") == []
+
+    def test_bulk_upsert_kept_in_sync(self, db):
+        upsert(db, EFRISGood, [{"company_id": 1, "goods_code": "CEM-001", "goods_name": "Tororo cement"}],
+               ["company_id", "goods_code"])
+        db.commit()
+        assert goods(db, "tororo") == ["CEM-001"]
+
+    def test_downgrade_falls_back_to_like(self, engine, db):
+        downgrade(engine)
+        search._backends.pop(engine, None)
+        assert set(goods(db, "cement")) == {"CEM-001", "MIX-002"}
+
+
+WORDS = ["cement", "steel", "paint", "nails", "roofing", "sheet", "timber", "tile", "pipe", "wire",
+         "bolt", "glass", "sand", "brick", "valve", "hinge", "gutter", "primer", "grout", "mesh"]
+
+
+class TestLargeTableLatency:
+    """Selective searches on a large goods table: FTS5 vs LIKE scan"""
+
+    def test_fts5_faster_than_like(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+        Base.metadata.create_all(engine)
+        rnd = random.Random(7)
+        with engine.begin() as conn:
+            conn.execute(insert(Company.__table__), [{"id": 1, "name": "Acme Ltd", "tin": "1000000001"}])
+            for start in range(0, BENCH_ROWS, 50000):
+                conn.execute(insert(EFRISGood.__table__), [
+                    {"company_id": 1, "goods_code": f"G-{i:07d}",
+                     "goods_name": f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {rnd.randint(1, 999)}kg"}
+                    for i in range(start, min(BENCH_ROWS, start + 50000))
+                ])
+        upgrade(engine)
+        db = sessionmaker(bind=engine)()
+        terms = [f"G-{BENCH_ROWS // 3:07d}", "gutter mesh 12", "primer grout 4"]
+
+        def timed(term):
+            query = db.query(EFRISGood).filter(EFRISGood.company_id == 1)
+            started = time.perf_counter()
+            rows = search_query(query, EFRISGood, term).limit(50).all()
+            return round((time.perf_counter() - started) * 1000, 1), len(rows)
+
+        search._backends.pop(engine, None)
+        indexed = {term: timed(term) for term in terms}
+        search._backends[engine]["fts"] = set()
+        scanned = {term: timed(term) for term in terms}
+        db.close()
+        engine.dispose()
+
+        print(f"\n[SEARCH] {BENCH_ROWS} goods, (ms, results)")
+        print(f"  FTS5 trigram: {indexed}")
+        print(f"  LIKE scan   : {scanned}")
+
+        for term in terms:
+            assert indexed[term][1] == scanned[term][1]
+            assert indexed[term][0] < scanned[term][0]
+            assert indexed[term][0] < 50
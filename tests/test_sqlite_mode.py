@@ -0,0 +1,179 @@
+"""
+Tests for tuned SQLite mode (database/sqlite_mode.py)
+
+Includes a concurrency benchmark: writer threads committing invoice + activity log
+transactions while readers stream the activity feed, once with the current engine setup
+(rollback journal, busy handler polling) and once with configure_sqlite (set
+SQLITE_BENCH_WRITERS / SQLITE_BENCH_TRANSACTIONS to change the load).
+
+Run tests:
+    pytest tests/test_sqlite_mode.py -v -s
+"""
+
+import sys
+import os
+import statistics
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from database.models import ActivityLog, Base, Company, Invoice
+from database.sqlite_mode import WriterQueue, configure_sqlite
+
+BENCH_WRITERS = int(os.getenv("SQLITE_BENCH_WRITERS", "24"))
+BENCH_TRANSACTIONS = int(os.getenv("SQLITE_BENCH_TRANSACTIONS", "50"))
+
+
+def make_engine(path, tuned: bool):
+    # same pool settings as database/connection.py
+    engine = create_engine(f"sqlite:///{path}", pool_size=20, max_overflow=10, pool_pre_ping=True)
+    queue = configure_sqlite(engine) if tuned else None
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(Company(id=1, name="Acme Ltd", tin="1000000001"))
+        db.commit()
+    return engine, queue
+
+
+class TestPragmas:
+    """Every pooled connection gets the tuned settings"""
+
+    def test_applied(self, tmp_path):
+        engine, _ = make_engine(tmp_path / "tuned.db", tuned=True)
+        with engine.connect() as conn:
+            pragma = lambda name: conn.execute(text(f"PRAGMA {name}")).scalar()
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == 5000
+            assert pragma("cache_size") < 0
+            assert pragma("temp_store") == 2  # MEMORY
+
+    def test_async_engine_without_queue(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'a.db'}")
+        assert configure_sqlite(engine, writer_queue=False) is None
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+
+
+class TestWriterQueue:
+    """Write transactions take the slot on their first write and give it back at checkin"""
+
+    def test_released_after_commit_and_rollback(self, tmp_path):
+        engine, queue = make_engine(tmp_path / "q.db", tuned=True)
+        Session = sessionmaker(bind=engine)
+        seeded = queue.stats()["writes"]
+        with Session() as db:
+            db.get(Company, 1)
+            assert not queue._lock.locked()  # reads don't queue
+            db.add(Invoice(company_id=1, qb_invoice_id="1"))
+            db.flush()
+            assert queue._lock.locked()
+            db.commit()
+            assert not queue._lock.locked()
+        with Session() as db:
+            db.add(Invoice(company_id=1, qb_invoice_id="2"))
+            db.flush()
+            db.rollback()
+        assert not queue._lock.locked()
+        assert queue.stats()["writes"] == seeded + 2
+
+    def test_writers_serialized(self, tmp_path):
+        engine, queue = make_engine(tmp_path / "s.db", tuned=True)
+        Session = sessionmaker(bind=engine)
+        active, overlap = [0], []
+
+        def write(n):
+            with Session() as db:
+                db.add(Invoice(company_id=1, qb_invoice_id=str(n)))
+                db.flush()
+                active[0] += 1
+                overlap.append(active[0])
+                time.sleep(0.01)
+                active[0] -= 1
+                db.commit()
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        assert max(overlap) == 1
+        with Session() as db:
+            assert db.query(Invoice).count() == 8
+
+    def test_same_thread_does_not_wait_on_itself(self):
+        """A second connection writing on the slot owner's thread is left to busy_timeout"""
+        queue = WriterQueue(timeout=1)
+        assert queue.acquire() is True
+        started = time.perf_counter()
+        assert queue.acquire() is False
+        assert time.perf_counter() - started < 0.1
+        queue.release()
+        assert queue.stats()["timeouts"] == 0
+
+    def test_timeout(self):
+        queue = WriterQueue(timeout=0.05)
+        holder = threading.Thread(target=queue.acquire)
+        holder.start()
+        holder.join()
+        assert queue.acquire() is False
+        assert queue.stats()["timeouts"] == 1
+
+
+class TestConcurrencyBenchmark:
+    """Tuned mode commits the same load without "database is locked" and with a shorter tail"""
+
+    def run_load(self, path, tuned: bool):
+        engine, _ = make_engine(path, tuned)
+        Session = sessionmaker(bind=engine, autoflush=False)
+        errors, latencies = [], []
+
+        def writer(t):
+            for i in range(BENCH_TRANSACTIONS):
+                db = Session()
+                started = time.perf_counter()
+                try:
+                    db.get(Company, 1)
+                    db.add(Invoice(company_id=1, qb_invoice_id=f"{t}-{i}"))
+                    db.add(ActivityLog(company_id=1, activity_type="invoice_fiscalized",
+                                       efris_status="success", details={"total_amount": "118"}))
+                    db.flush()
+                    time.sleep(0.005)  # request work between the first write and commit
+                    db.commit()
+                    latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors.append(str(e)[:80])
+                    db.rollback()
+                finally:
+                    db.close()
+
+        def reader():
+            for _ in range(30):
+                with Session() as db:
+                    for n, _row in enumerate(db.query(ActivityLog).yield_per(20)):
+                        if n % 20 == 0:
+                            time.sleep(0.002)
+
+        threads = ([threading.Thread(target=writer, args=(t,)) for t in range(BENCH_WRITERS)] +
+                   [threading.Thread(target=reader) for _ in range(6)])
+        started = time.perf_counter()
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        wall = time.perf_counter() - started
+        engine.dispose()
+        latencies.sort()
+        return {"wall_s": round(wall, 2),
+                "commits_per_s": round(len(latencies) / wall, 1),
+                "errors": len(errors),
+                "p50_ms": round(statistics.median(latencies) * 1000, 1),
+                "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1)}
+
+    def test_tuned_vs_default(self, tmp_path):
+        default = self.run_load(tmp_path / "default.db", tuned=False)
+        tuned = self.run_load(tmp_path / "tuned.db", tuned=True)
+        print(f"\n[SQLITE] {BENCH_WRITERS} writers x {BENCH_TRANSACTIONS} transactions + 6 feed readers")
+        print(f"  default: {default}")
+        print(f"  tuned  : {tuned}")
+        assert tuned["errors"] == 0
+        assert tuned["p99_ms"] < default["p99_ms"]
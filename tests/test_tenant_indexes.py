@@ -0,0 +1,149 @@
+"""
+EXPLAIN-based checks that hot tenant-scoped queries use the composite indexes
+(models.py __table_args__ / migrations/add_tenant_indexes.py, add_unique_tenant_keys.py)
+
+Runs against SQLite by default; set TEST_POSTGRES_URL to also check PostgreSQL plans.
+
+Run tests:
+    pytest tests/test_tenant_indexes.py -v
+"""
+
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text, select
+from sqlalchemy.orm import sessionmaker
+
+from database.models import (
+    Base, Company, User, Product, EFRISGood, EFRISInvoice, ActivityLog, AuditLog, CompanyUser
+)
+from migrations.add_tenant_indexes import TENANT_INDEXES, upgrade, downgrade
+from migrations.add_unique_tenant_keys import UNIQUE_KEYS
+
+
+# (expected index, query) - shapes taken from the API endpoints
+HOT_QUERIES = [
+    ("uq_efris_goods_company_goods_code",
+     select(EFRISGood).where(EFRISGood.company_id == 1, EFRISGood.goods_code == "CEM-001")),
+    ("uq_efris_invoices_company_invoice_no",
+     select(EFRISInvoice).where(EFRISInvoice.company_id == 1, EFRISInvoice.invoice_no == "INV-1")),
+    ("ix_efris_invoices_company_qb_number_fdn",
+     select(EFRISInvoice).where(EFRISInvoice.company_id == 1, EFRISInvoice.qb_invoice_number == "1001",
+                                EFRISInvoice.fdn.is_(None))),
+    ("ix_efris_invoices_company_qb_invoice_id",
+     select(EFRISInvoice).where(EFRISInvoice.company_id == 1, EFRISInvoice.qb_invoice_id == "55")),
+    ("ix_efris_invoices_company_created",
+     select(EFRISInvoice).where(EFRISInvoice.company_id == 1)
+     .order_by(EFRISInvoice.created_at.desc()).limit(50)),
+    ("ix_products_company_qb_item_id",
+     select(Product).where(Product.company_id == 1, Product.qb_item_id == "17")),
+    ("ix_activity_logs_user_type_created",
+     select(ActivityLog).where(ActivityLog.user_id == 2,
+                               ActivityLog.activity_type == "invoice_fiscalized",
+                               ActivityLog.created_at >= datetime(2026, 1, 1))),
+    ("ix_activity_logs_created",
+     select(ActivityLog).order_by(ActivityLog.created_at.desc()).limit(50)),
+    ("ix_audit_logs_company_created",
+     select(AuditLog).where(AuditLog.company_id == 1).order_by(AuditLog.created_at.desc()).limit(100)),
+    ("ix_companies_owner_id",
+     select(Company.id).where(Company.owner_id == 2)),
+    ("ix_company_users_user_company",
+     select(CompanyUser).where(CompanyUser.user_id == 2)),
+]
+
+
+def seed(engine):
+    """A few rows per table so the planner has something to look at"""
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=2, email="client@example.com", hashed_password="x", role="client"))
+    for company_id in range(1, 4):
+        db.add(Company(id=company_id, name=f"Co {company_id}", tin=f"100000000{company_id}", owner_id=2))
+        for i in range(20):
+            db.add(EFRISGood(company_id=company_id, goods_code=f"G-{i}"))
+            db.add(EFRISInvoice(company_id=company_id, invoice_no=f"INV-{i}", qb_invoice_id=str(i),
+                                qb_invoice_number=str(1000 + i)))
+            db.add(Product(company_id=company_id, qb_item_id=str(i)))
+            db.add(ActivityLog(company_id=company_id, user_id=2, activity_type="invoice_fiscalized"))
+            db.add(AuditLog(company_id=company_id, action="login"))
+    db.commit()
+    db.close()
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def sqlite_plan(engine, query) -> str:
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'indexes.db'}")
+    Base.metadata.create_all(engine)
+    seed(engine)
+    yield engine
+    engine.dispose()
+
+
+class TestIndexDefinitions:
+    """Models and migration declare the same indexes"""
+
+    def test_models_match_migration(self):
+        declared = {
+            (index.name, table.name, tuple(col.name for col in index.columns))
+            for table in Base.metadata.tables.values()
+            for index in table.indexes
+        }
+        for name, table, columns in TENANT_INDEXES:
+            assert (name, table, tuple(columns)) in declared
+        for name, _, table, columns in UNIQUE_KEYS:
+            assert (name, table, tuple(columns)) in declared
+
+    def test_migration_upgrade_and_downgrade(self, sqlite_engine):
+        downgrade(sqlite_engine)
+        names = {ix["name"] for table in ("efris_invoices", "activity_logs")
+                 for ix in inspect(sqlite_engine).get_indexes(table)}
+        assert "ix_efris_invoices_company_qb_invoice_id" not in names
+
+        upgrade(sqlite_engine)
+        upgrade(sqlite_engine)  # idempotent
+        inspector = inspect(sqlite_engine)
+        for name, table, _ in TENANT_INDEXES:
+            assert name in {ix["name"] for ix in inspector.get_indexes(table)}
+
+
+class TestSqlitePlans:
+    """EXPLAIN QUERY PLAN shows each hot query using its index"""
+
+    @pytest.mark.parametrize("index_name,query", HOT_QUERIES, ids=[name for name, _ in HOT_QUERIES])
+    def test_hot_query_uses_index(self, sqlite_engine, index_name, query):
+        plan = sqlite_plan(sqlite_engine, query)
+        assert index_name in plan, plan
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set")
+class TestPostgresPlans:
+    """EXPLAIN on PostgreSQL (seq scans disabled so tiny test tables still show index choice)"""
+
+    @pytest.fixture
+    def pg_engine(self):
+        engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        seed(engine)
+        yield engine
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+    @pytest.mark.parametrize("index_name,query", HOT_QUERIES, ids=[name for name, _ in HOT_QUERIES])
+    def test_hot_query_uses_index(self, pg_engine, index_name, query):
+        compiled = query.compile(pg_engine, compile_kwargs={"literal_binds": True})
+        with pg_engine.connect() as conn:
+            conn.execute(text("SET enable_seqscan = off"))
+            plan = "\n".join(row[0] for row in conn.execute(text(f"EXPLAIN {compiled}")))
+        assert index_name in plan, plan